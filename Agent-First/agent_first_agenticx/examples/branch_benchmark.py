@@ -0,0 +1,88 @@
+"""
+分支性能基准：在 1M 行的 main 上创建 10k 个 what-if 分支
+
+测量：
+1. 分支创建（fork）延迟
+2. 分支上单行写入延迟
+3. 10k 个分支相对 main 的额外内存
+
+运行：
+    python examples/branch_benchmark.py [--rows 1000000] [--branches 10000]
+"""
+
+import argparse
+import asyncio
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.append('..')
+sys.path.append('.')
+
+from storage.branch_manager import BranchManager
+
+
+def _percentile(samples, pct):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * pct))]
+
+
+async def run(num_rows: int, num_branches: int):
+    branch_mgr = BranchManager()
+    main = branch_mgr.get_branch("main")
+
+    print(f"构建 main: {num_rows:,} 行...")
+    start = time.perf_counter()
+    main.data_snapshot = await branch_mgr.cow_engine.copy_on_write({
+        "orders": [
+            {"order_id": i, "product_id": i % 1000, "price": 9.99, "qty": 1}
+            for i in range(num_rows)
+        ]
+    })
+    print(f"  耗时 {time.perf_counter() - start:.2f}s")
+    live = branch_mgr.get_stats()["memory"]["branches"]["main"]["live_bytes"]
+    print(f"  表数据 {live / 1024 / 1024:.1f} MiB（列式页，约 {live / num_rows:.0f} 字节/行）")
+
+    tracemalloc.start()
+    baseline, _ = tracemalloc.get_traced_memory()
+
+    fork_times = []
+    write_times = []
+    branches = []
+    for i in range(num_branches):
+        t0 = time.perf_counter()
+        branch = await branch_mgr.create_branch("main")
+        t1 = time.perf_counter()
+        row = random.randrange(num_rows)
+        await branch.update("orders", {"order_id": row, "product_id": 0, "price": 8.99, "qty": 2}, row=row)
+        t2 = time.perf_counter()
+        fork_times.append(t1 - t0)
+        write_times.append(t2 - t1)
+        branches.append(branch)
+
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    extra = current - baseline
+    print(f"\n{num_branches:,} 个分支（每个分支写 1 行）:")
+    print(f"  fork  p50={_percentile(fork_times, 0.5) * 1e6:.1f}µs  p99={_percentile(fork_times, 0.99) * 1e6:.1f}µs")
+    print(f"  write p50={_percentile(write_times, 0.5) * 1e6:.1f}µs  p99={_percentile(write_times, 0.99) * 1e6:.1f}µs")
+    print(f"  额外内存 {extra / 1024 / 1024:.1f} MiB（平均每分支 {extra / num_branches / 1024:.1f} KiB）")
+    print("  （每个分支只复制被写入的页和根到页的路径，其余与 main 共享）")
+
+    # 父分支数据不受子分支写入影响
+    assert len(main.data_snapshot["orders"]) == num_rows
+    assert main.data_snapshot["orders"][0]["qty"] == 1
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--branches", type=int, default=10_000)
+    args = parser.parse_args()
+    asyncio.run(run(args.rows, args.branches))
+
+
+if __name__ == "__main__":
+    main()
@@ -2,13 +2,26 @@
 Memory 扩展 - 基于 AgenticX SemanticMemory
 """
 
-from .agentic_memory import AgenticMemoryStore
+from .agentic_memory import AgenticMemoryStore, ProbeMatch
+from .dependency import DependencyIndex
+from .disk_tier import DiskCache
+from .embedding import EmbeddingPipeline, HashingEmbedder
 from .query_cache import QueryCache
 from .redundancy import RedundancyDetector
+from .result_store import ResultStore, StoredResult
+from .vector_index import IVFFlatIndex
 
 __all__ = [
     "AgenticMemoryStore",
+    "ProbeMatch",
+    "DependencyIndex",
+    "DiskCache",
+    "EmbeddingPipeline",
+    "HashingEmbedder",
     "QueryCache",
     "RedundancyDetector",
+    "ResultStore",
+    "StoredResult",
+    "IVFFlatIndex",
 ]
 
@@ -4,8 +4,31 @@ Agentic Memory Store - 扩展 AgenticX 的 SemanticMemory
 添加 Probe 查询缓存和冗余检测功能
 """
 
-from typing import Any, Dict, List, Optional
-from agenticx.memory import SemanticMemory, SearchResult
+import os
+import pickle
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence
+from agenticx.memory import SemanticMemory
+
+from .dependency import DependencyIndex
+from .disk_tier import DiskCache
+from .result_store import ResultStore, StoredResult
+from .vector_index import IVFFlatIndex
+
+
+class ProbeMatch:
+    """相似 Probe 的检索结果"""
+    
+    __slots__ = ("record_id", "content", "score", "metadata")
+    
+    def __init__(self, record_id: str, content: str, score: float, metadata: Dict[str, Any]):
+        self.record_id = record_id
+        self.content = content
+        self.score = score
+        self.metadata = metadata
+    
+    def __repr__(self) -> str:
+        return f"ProbeMatch({self.content!r}, score={self.score:.3f})"
 
 
 class AgenticMemoryStore(SemanticMemory):
@@ -16,18 +39,74 @@ class AgenticMemoryStore(SemanticMemory):
     - Probe 查询结果缓存
     - 语义相似查询检测（利用 80-90% 冗余）
     - 跨查询计算共享
+    - 可选的磁盘层：Probe 缓存同时落盘，重启后用 warm_start 按热度恢复
+    - 可选的本地向量索引：提供 embedder 时相似 Probe 在进程内的 IVF-Flat 索引中检索，
+      不再经过 SemanticMemory.search
+    - 可选的结果存储：完整结果写入本地内容寻址存储，记录中只保留引用和前 10 行预览
+    - SQL 指纹索引：生成的 SQL 规范化后精确匹配，措辞不同但 SQL 相同的 Probe 直接命中
+    - 按表索引：列出读同一张表的缓存 Probe，供调用方判断能否由其结果推导新查询
+    - 可选的依赖跟踪：记录每个 Probe 读取的分支、版本和表，关联 BranchManager 后
+      分支写入只失效读过被修改表的 Probe
     """
     
-    def __init__(self, tenant_id: str, agent_id: str, **kwargs):
+    def __init__(
+        self,
+        tenant_id: str,
+        agent_id: str,
+        disk_cache: Optional[DiskCache] = None,
+        embedder: Optional[Callable[[str], Awaitable[Sequence[float]]]] = None,
+        probe_index: Optional[IVFFlatIndex] = None,
+        result_store: Optional[ResultStore] = None,
+        branch_manager: Any = None,
+        **kwargs
+    ):
+        """
+        Args:
+            tenant_id: 租户 ID
+            agent_id: Agent ID
+            disk_cache: Probe 缓存的磁盘层；为 None 时只保存在内存
+            embedder: 异步函数，文本 -> 向量，例如 EmbeddingPipeline()（本地哈希向量化，带缓存和微批）；
+                为 None 时使用 SemanticMemory.search
+            probe_index: Probe 向量索引，可在多个租户的 store 之间共享（按租户过滤）；
+                为 None 且提供了 embedder 时按第一个向量的维度自动创建
+            result_store: 完整结果的存储；为 None 时只缓存前 10 行
+            branch_manager: 订阅其写入通知的 BranchManager；响应 metadata 中带有
+                branch_id / branch_version 的 Probe 在所读的表被写入时失效
+        """
         super().__init__(tenant_id, agent_id, **kwargs)
+        self.disk_cache = disk_cache
+        self.embedder = embedder
+        self.probe_index = probe_index
+        self.result_store = result_store
+        # 记录 ID -> (查询文本, metadata)，本地向量索引或指纹索引命中时据此构造结果
+        self._probe_records: Dict[str, tuple] = {}
+        # SQL 指纹键 -> 记录 ID
+        self._sql_index: Dict[str, str] = {}
+        # 表名 -> 记录 ID（按写入顺序）
+        self._table_index: Dict[str, Dict[str, None]] = {}
+        # 记录 ID 的数据依赖；失效的记录从本地索引移除，并从 SemanticMemory 的检索结果中排除
+        self.dependencies = DependencyIndex(self.remove_probe, branch_manager)
+        self._removed: set = set()
         self.probe_cache_count = 0
         self.cache_hit_count = 0
+        self.restored_count = 0
+        self.fingerprint_hit_count = 0
+    
+    @staticmethod
+    def _probe_cache_key(natural_query: str, stage: Any, precision: Any, context: Any) -> tuple:
+        """磁盘层的键：规范化的查询、阶段、精度和上下文"""
+        return (
+            " ".join(natural_query.casefold().split()),
+            str(getattr(stage, "value", stage)),
+            str(getattr(precision, "value", precision)),
+            str(context or "")
+        )
     
     async def cache_probe_result(
         self,
         probe_request: Dict[str, Any],
         probe_response: Dict[str, Any]
-    ) -> str:
+    ) -> Optional[str]:
         """
         缓存 Probe 查询结果
         
@@ -36,40 +115,226 @@ class AgenticMemoryStore(SemanticMemory):
             probe_response: Probe 响应
             
         Returns:
-            str: 记录 ID
+            str: 记录 ID；结果读取之后所读的表已被修改时不缓存，返回 None
         """
+        cache_key = self._probe_cache_key(
+            probe_request["natural_query"],
+            probe_request.get("stage"),
+            probe_request.get("precision"),
+            probe_request.get("context")
+        )
+        metadata = {
+            "cache_key": cache_key,
+            
+            # 请求信息
+            "sql_query": probe_request.get("sql_query"),
+            "stage": probe_request.get("stage"),
+            "precision": probe_request.get("precision"),
+            "context": probe_request.get("context"),
+            "sql_fingerprint": probe_request.get("sql_fingerprint"),
+            "sql_table": probe_request.get("sql_table"),
+            "max_rows": probe_request.get("max_rows"),
+            
+            # 响应信息
+            "success": probe_response.get("success"),
+            "execution_time": probe_response.get("execution_time"),
+            "rows_returned": probe_response.get("rows_returned"),
+            "confidence": probe_response.get("confidence"),
+            
+            # 数据预览（前10条），有结果存储时完整数据按 result_ref 读取
+            "response_data": (probe_response.get("data") or [])[:10]
+        }
+        # 读取的数据：(分支, 版本, 表)
+        response_metadata = probe_response.get("metadata") or {}
+        branch_id = response_metadata.get("branch_id")
+        version = response_metadata.get("branch_version")
+        if branch_id is not None and version is not None and metadata["sql_table"]:
+            metadata["reads"] = (branch_id, version, (metadata["sql_table"],))
+            if not self.dependencies.is_current(*metadata["reads"]):
+                return None
+        
+        if self.result_store is not None and probe_response.get("data"):
+            metadata["result_ref"] = self.result_store.put(probe_response["data"])
+        
+        record_id = await self._store_probe(probe_request["natural_query"], metadata)
+        if record_id is None:
+            return None
+        if self.disk_cache is not None:
+            self.disk_cache.put(cache_key, {"content": probe_request["natural_query"], "metadata": metadata})
+        
+        self.probe_cache_count += 1
+        return record_id
+    
+    async def warm_start(self, budget_seconds: float = 0.5, limit: Optional[int] = None) -> int:
+        """
+        从磁盘层按热度恢复 Probe 缓存
+        
+        Args:
+            budget_seconds: 时间预算（秒），超时后停止
+            limit: 最多恢复的条目数
+            
+        Returns:
+            int: 恢复的条目数
+        """
+        if self.disk_cache is None:
+            return 0
+        deadline = time.perf_counter() + budget_seconds
+        restored = 0
+        stale = []
+        for entry in self.disk_cache.hottest(limit):
+            if time.perf_counter() >= deadline:
+                break
+            record = entry.value
+            if await self._store_probe(record["content"], record["metadata"]) is None:
+                stale.append(entry.key)
+                continue
+            restored += 1
+        # 落盘之后所读的表已被修改的条目，迭代结束后再删除，避免分页读取时跳过条目
+        for key in stale:
+            self.disk_cache.delete(key)
+        self.restored_count += restored
+        return restored
+    
+    async def _store_probe(self, content: str, metadata: Dict[str, Any]) -> Optional[str]:
+        """
+        写入 SemanticMemory，有 embedder 时同时写入本地向量索引，并登记到指纹索引、按表索引和依赖索引
+        
+        Returns:
+            记录 ID；所读的表在读取之后已被修改时不写入，返回 None
+        """
+        reads = metadata.get("reads")
+        if reads is not None and not self.dependencies.is_current(*reads):
+            return None
+        
         # 使用 SemanticMemory 的 add_knowledge 方法
         record_id = await self.add_knowledge(
-            content=probe_request["natural_query"],
+            content=content,
             knowledge_type="probe_result",
             category="query_cache",
-            metadata={
-                # 请求信息
-                "sql_query": probe_request.get("sql_query"),
-                "stage": probe_request.get("stage"),
-                "precision": probe_request.get("precision"),
-                "context": probe_request.get("context"),
-                
-                # 响应信息
-                "success": probe_response.get("success"),
-                "execution_time": probe_response.get("execution_time"),
-                "rows_returned": probe_response.get("rows_returned"),
-                "confidence": probe_response.get("confidence"),
-                
-                # 完整数据（可选，根据数据大小决定）
-                "response_data": probe_response.get("data", [])[:10]  # 只缓存前10条
-            }
+            metadata=metadata
         )
-        
-        self.probe_cache_count += 1
+        if self.embedder is not None:
+            vector = await self.embedder(content)
+            if self.probe_index is None:
+                self.probe_index = IVFFlatIndex(len(vector))
+            self.probe_index.add(record_id, vector, tenant=self.tenant_id)
+        if not self._register_probe(record_id, content, metadata):
+            # 等待写入期间表被修改
+            self.remove_probe(record_id)
+            return None
         return record_id
     
+    def _register_probe(self, record_id: str, content: str, metadata: Dict[str, Any]) -> bool:
+        """登记到本地索引；记录所读的表已被修改时返回 False"""
+        reads = metadata.get("reads")
+        if reads is not None and not self.dependencies.add(record_id, *reads):
+            return False
+        self._probe_records[record_id] = (content, metadata)
+        if metadata.get("sql_fingerprint"):
+            self._sql_index[metadata["sql_fingerprint"]] = record_id
+        if metadata.get("sql_table"):
+            self._table_index.setdefault(metadata["sql_table"], {})[record_id] = None
+        return True
+    
+    def open_probe_result(self, metadata: Dict[str, Any]) -> Optional[StoredResult]:
+        """
+        打开缓存记录对应的完整结果（逐行惰性读取）
+        
+        Args:
+            metadata: 缓存记录的 metadata（例如 ProbeMatch.metadata）
+            
+        Returns:
+            StoredResult；没有结果存储或记录没有完整结果时返回 None
+        """
+        ref = metadata.get("result_ref")
+        if self.result_store is None or ref is None:
+            return None
+        return self.result_store.open(ref)
+    
+    def remove_probe(self, record_id: str) -> bool:
+        """从本地索引中移除 Probe，并从 SemanticMemory 的检索结果中排除（之后不会再作为缓存结果返回）"""
+        self._removed.add(record_id)
+        self.dependencies.discard(record_id)
+        record = self._probe_records.pop(record_id, None)
+        if record is not None:
+            fingerprint = record[1].get("sql_fingerprint")
+            if fingerprint and self._sql_index.get(fingerprint) == record_id:
+                del self._sql_index[fingerprint]
+            records = self._table_index.get(record[1].get("sql_table"))
+            if records is not None:
+                records.pop(record_id, None)
+        return self.probe_index is not None and self.probe_index.remove(record_id)
+    
+    def save_probe_index(self, path: str):
+        """保存本地向量索引（path）及对应的 Probe 记录（path + ".records"）"""
+        if self.probe_index is None:
+            return
+        self.probe_index.save(path)
+        tmp_path = path + ".records.tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(self._probe_records, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path + ".records")
+    
+    def load_probe_index(self, path: str) -> bool:
+        """加载 save_probe_index 保存的索引；文件不存在时返回 False"""
+        if not os.path.exists(path) or not os.path.exists(path + ".records"):
+            return False
+        self.probe_index = IVFFlatIndex.load(path)
+        with open(path + ".records", "rb") as f:
+            records = pickle.load(f)
+        self._probe_records, self._sql_index, self._table_index = {}, {}, {}
+        self.dependencies.clear()
+        for record_id, (content, metadata) in records.items():
+            if not self._register_probe(record_id, content, metadata):
+                # 保存之后所读的表已被修改
+                self.remove_probe(record_id)
+        return True
+    
+    def find_probe_by_fingerprint(self, fingerprint: str) -> Optional[ProbeMatch]:
+        """
+        按 SQL 指纹精确查找 Probe（不经过向量检索）
+        
+        Args:
+            fingerprint: 缓存时 probe_request["sql_fingerprint"] 的值
+            
+        Returns:
+            ProbeMatch（score 为 1.0）；没有时返回 None
+        """
+        record_id = self._sql_index.get(fingerprint)
+        if record_id is None:
+            return None
+        content, metadata = self._probe_records[record_id]
+        self.cache_hit_count += 1
+        self.fingerprint_hit_count += 1
+        if self.disk_cache is not None and metadata.get("cache_key") is not None:
+            self.disk_cache.touch(metadata["cache_key"])
+        return ProbeMatch(record_id, content, 1.0, metadata)
+    
+    def find_probes_by_table(self, table: str, limit: int = 16) -> List[ProbeMatch]:
+        """
+        列出读取某张表的缓存 Probe（最近写入的在前）
+        
+        Args:
+            table: 表名（SQL 中原样的写法，即 probe_request["sql_table"]）
+            limit: 最大返回数量
+            
+        Returns:
+            List[ProbeMatch]: score 均为 1.0
+        """
+        matches = []
+        for record_id in reversed(self._table_index.get(table, {})):
+            content, metadata = self._probe_records[record_id]
+            matches.append(ProbeMatch(record_id, content, 1.0, metadata))
+            if len(matches) >= limit:
+                break
+        return matches
+    
     async def find_similar_probes(
         self,
         natural_query: str,
         threshold: float = 0.8,
         limit: int = 5
-    ) -> List[SearchResult]:
+    ) -> List[ProbeMatch]:
         """
         查找相似的 Probe 查询（利用语义相似度）
         
@@ -81,18 +346,39 @@ class AgenticMemoryStore(SemanticMemory):
             limit: 最大返回数量
             
         Returns:
-            List[SearchResult]: 相似查询列表
+            List[ProbeMatch]: 相似查询列表，按相似度从高到低
         """
-        # 使用 SemanticMemory 的 search 方法
-        results = await self.search(
-            query=natural_query,
-            limit=limit,
-            metadata_filter={"knowledge_type": "probe_result"},
-            min_score=threshold
-        )
+        if self.embedder is not None and self.probe_index is not None:
+            # 本地向量索引，只返回本租户的 Probe
+            vector = await self.embedder(natural_query)
+            hits = self.probe_index.search(vector, k=limit, tenant=self.tenant_id, min_score=threshold)
+            results = []
+            for record_id, score in hits:
+                record = self._probe_records.get(record_id)
+                if record is not None:
+                    content, metadata = record
+                    results.append(ProbeMatch(record_id, content, score, metadata))
+        else:
+            # 使用 SemanticMemory 的 search 方法
+            results = [
+                ProbeMatch(result.record.id, result.record.content, result.score, result.record.metadata)
+                for result in await self.search(
+                    query=natural_query,
+                    limit=limit,
+                    metadata_filter={"knowledge_type": "probe_result"},
+                    min_score=threshold
+                )
+                if result.record.id not in self._removed
+            ]
         
         if results:
             self.cache_hit_count += 1
+            if self.disk_cache is not None:
+                # 命中计入磁盘层的热度，下次启动时优先恢复
+                for result in results:
+                    cache_key = result.metadata.get("cache_key")
+                    if cache_key is not None:
+                        self.disk_cache.touch(cache_key)
         
         return results
     
@@ -111,7 +397,12 @@ class AgenticMemoryStore(SemanticMemory):
                 if self.probe_cache_count > 0 else 0
             ),
             "estimated_redundancy": f"{(self.cache_hit_count / self.probe_cache_count * 100):.1f}%"
-                if self.probe_cache_count > 0 else "0%"
+                if self.probe_cache_count > 0 else "0%",
+            "fingerprint_hits": self.fingerprint_hit_count,
+            "restored_from_disk": self.restored_count,
+            "dependencies": self.dependencies.get_stats(),
+            "probe_index": self.probe_index.get_stats() if self.probe_index is not None else None,
+            "disk_cache": self.disk_cache.get_stats() if self.disk_cache is not None else None
         }
     
     async def find_related_tables(
@@ -0,0 +1,153 @@
+"""
+缓存条目的数据依赖与精确失效
+
+每个缓存条目登记它读取的 (分支, 表) 以及读取时的分支版本号；反向索引 (分支, 表) -> 条目。
+BranchManager 的写入通知到达时，只失效读过被修改的表、且读取版本早于这次写入的条目，
+其他条目不受影响，TTL 可以设得很长。
+
+关联了 BranchManager 时，登记前还会检查读取版本之后这些表是否已被修改
+（比较历史版本与当前快照中的表对象，未修改的表在版本之间共享同一个对象）：
+结果计算完成前发生的写入、重启后从磁盘恢复的旧条目都能识别出来。
+"""
+
+from typing import Any, Callable, Dict, Hashable, Iterable, Optional, Tuple
+
+
+class DependencyIndex:
+    """
+    缓存键 -> 读取的 (分支, 表, 版本)，以及 (分支, 表) -> 缓存键 的反向索引
+
+    用法：
+        index = DependencyIndex(cache.delete, branch_manager)
+        index.add(key, "main", version, ["orders"])
+    """
+
+    def __init__(self, invalidate: Callable[[Hashable], Any], branch_manager: Any = None):
+        """
+        Args:
+            invalidate: 条目失效时的回调 invalidate(key)
+            branch_manager: 关联的 BranchManager；为 None 时之后可调用 attach
+        """
+        self.invalidate = invalidate
+        self.branch_manager = None
+        # 缓存键 -> (分支, 版本, 表)
+        self._entries: Dict[Hashable, Tuple[str, int, Tuple[str, ...]]] = {}
+        # (分支, 表) -> 缓存键 -> 读取版本
+        self._readers: Dict[Tuple[str, str], Dict[Hashable, int]] = {}
+
+        self.invalidations = 0
+        self.rejected = 0
+        if branch_manager is not None:
+            self.attach(branch_manager)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._entries
+
+    def attach(self, branch_manager: Any):
+        """订阅 BranchManager 的写入通知"""
+        self.detach()
+        self.branch_manager = branch_manager
+        branch_manager.add_write_listener(self.on_write)
+
+    def detach(self):
+        if self.branch_manager is not None:
+            self.branch_manager.remove_write_listener(self.on_write)
+            self.branch_manager = None
+
+    def is_current(self, branch_id: str, version: int, tables: Iterable[str]) -> bool:
+        """
+        在 version 读到的这些表现在是否仍未修改
+
+        没有关联 BranchManager 时无法检查，返回 True。
+        """
+        if self.branch_manager is None:
+            return True
+        branch = self.branch_manager.get_branch(branch_id)
+        if branch is None:
+            return False
+        if version == branch.version:
+            return True
+        try:
+            snapshot = branch.version_at(version).snapshot
+        except ValueError:
+            # 版本不存在或已超出保留范围，无法证明未修改
+            return False
+        current = branch.data_snapshot
+        return all(snapshot.get(table) is current.get(table) for table in tables)
+
+    def add(self, key: Hashable, branch_id: str, version: int, tables: Iterable[str]) -> bool:
+        """
+        登记条目的依赖（替换之前的登记）
+
+        Args:
+            key: 缓存键
+            branch_id: 读取的分支
+            version: 读取时的分支版本号（Branch.query 结果中的 version）
+            tables: 读取的表
+
+        Returns:
+            bool: 是否登记；读取版本之后这些表已被修改时不登记，返回 False
+        """
+        tables = tuple(dict.fromkeys(tables))
+        self.discard(key)
+        if not self.is_current(branch_id, version, tables):
+            self.rejected += 1
+            return False
+        self._entries[key] = (branch_id, version, tables)
+        for table in tables:
+            self._readers.setdefault((branch_id, table), {})[key] = version
+        return True
+
+    def discard(self, key: Hashable) -> bool:
+        """移除条目的依赖（条目被删除或淘汰时调用），不触发失效回调"""
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return False
+        branch_id, _, tables = entry
+        for table in tables:
+            readers = self._readers.get((branch_id, table))
+            if readers is not None:
+                readers.pop(key, None)
+                if not readers:
+                    del self._readers[(branch_id, table)]
+        return True
+
+    def on_write(self, branch_id: str, version: Optional[int], tables: Optional[Tuple[str, ...]]) -> int:
+        """
+        写入通知（BranchManager.add_write_listener 的回调）
+
+        Args:
+            branch_id: 被写入的分支
+            version: 写入后的版本号；为 None 时分支已删除
+            tables: 内容变化的表；为 None 时分支上的所有表
+
+        Returns:
+            int: 失效的条目数
+        """
+        if tables is None:
+            tables = [table for branch, table in self._readers if branch == branch_id]
+        stale = {}
+        for table in tables:
+            for key, read_version in self._readers.get((branch_id, table), {}).items():
+                if version is None or read_version < version:
+                    stale[key] = None
+        for key in stale:
+            self.discard(key)
+            self.invalidate(key)
+        self.invalidations += len(stale)
+        return len(stale)
+
+    def clear(self):
+        self._entries.clear()
+        self._readers.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "entries": len(self._entries),
+            "tables": len(self._readers),
+            "invalidations": self.invalidations,
+            "rejected": self.rejected,
+        }
@@ -0,0 +1,470 @@
+"""
+缓存的磁盘层（L2）
+
+- 基于 SQLite（WAL 模式），进程重启后缓存仍在，部署后不必从冷缓存开始
+- 值使用紧凑的二进制格式：[版本 1 字节][标志 1 字节][负载]，
+  行列表（字段相同的 dict 列表）按列存放，键名只存一次；较大的负载用 zlib 压缩
+- 读取时先只取元数据，值在第一次访问时才读出并解码（惰性加载）
+- 记录每个键的命中次数，hottest 按热度返回，用于启动时预热内存层
+- 写入（put / delete / 命中计数）先进入内存中的待写队列，由后台线程按批在一个事务中写入：
+  调用方（例如事件循环）上不做磁盘写入和提交；读取先查待写队列，写入后立即可见
+"""
+
+import atexit
+import os
+import pickle
+import sqlite3
+import struct
+import threading
+import time
+import zlib
+from typing import Any, Dict, Hashable, Iterator, List, Optional, Tuple
+
+
+_FORMAT_VERSION = 1
+_HEADER = struct.Struct("<BB")
+# 标志位
+_COMPRESSED = 0x01
+_COLUMNAR = 0x02
+
+# 负载超过该字节数时尝试压缩，压缩后至少节省 1/8 才采用
+_COMPRESS_THRESHOLD = 256
+# 键的 pickle 协议固定，保证不同 Python 版本写入的键相同
+_KEY_PROTOCOL = 4
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key BLOB PRIMARY KEY,
+    value BLOB NOT NULL,
+    metadata BLOB,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    expires_at REAL,
+    hits INTEGER NOT NULL DEFAULT 0,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_heat ON entries (hits DESC, last_access DESC);
+"""
+
+
+def _uniform_rows(value: Any) -> Optional[Tuple[str, ...]]:
+    """value 是字段相同的 dict 列表时返回字段名"""
+    if not isinstance(value, list) or len(value) < 2 or not isinstance(value[0], dict):
+        return None
+    keys = tuple(value[0])
+    for row in value:
+        if not isinstance(row, dict) or len(row) != len(keys) or tuple(row) != keys:
+            return None
+    return keys
+
+
+def _to_columns(rows: List[Dict], keys: Tuple[str, ...]) -> Tuple[Tuple[str, ...], List[List[Any]]]:
+    return keys, [[row[key] for row in rows] for key in keys]
+
+
+def _from_columns(packed: Tuple[Tuple[str, ...], List[List[Any]]]) -> List[Dict]:
+    keys, columns = packed
+    return [dict(zip(keys, values)) for values in zip(*columns)]
+
+
+def encode_value(value: Any) -> bytes:
+    """
+    编码缓存值
+
+    值本身或 dict 值中的字段是行列表时按列存放（记录哪些字段做了转换），
+    其余部分直接 pickle。
+    """
+    flags = 0
+    columnar: Optional[List[Any]] = None
+    keys = _uniform_rows(value)
+    if keys is not None:
+        columnar = [None]
+        value = _to_columns(value, keys)
+    elif isinstance(value, dict):
+        packed = None
+        for field, item in value.items():
+            keys = _uniform_rows(item)
+            if keys is None:
+                continue
+            if packed is None:
+                packed = dict(value)
+                columnar = []
+            packed[field] = _to_columns(item, keys)
+            columnar.append(field)
+        if packed is not None:
+            value = packed
+    if columnar is not None:
+        flags |= _COLUMNAR
+        value = (columnar, value)
+
+    payload = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+    if len(payload) > _COMPRESS_THRESHOLD:
+        compressed = zlib.compress(payload, 1)
+        if len(compressed) <= len(payload) - len(payload) // 8:
+            payload = compressed
+            flags |= _COMPRESSED
+    return _HEADER.pack(_FORMAT_VERSION, flags) + payload
+
+
+def decode_value(blob: bytes) -> Any:
+    """解码 encode_value 的结果"""
+    version, flags = _HEADER.unpack_from(blob, 0)
+    if version != _FORMAT_VERSION:
+        raise ValueError(f"不支持的缓存值格式版本: {version}")
+    payload = memoryview(blob)[_HEADER.size:]
+    if flags & _COMPRESSED:
+        payload = zlib.decompress(payload)
+    value = pickle.loads(payload)
+    if flags & _COLUMNAR:
+        columnar, value = value
+        if columnar == [None]:
+            return _from_columns(value)
+        for field in columnar:
+            value[field] = _from_columns(value[field])
+    return value
+
+
+def _encode_key(key: Hashable) -> bytes:
+    return pickle.dumps(key, protocol=_KEY_PROTOCOL)
+
+
+class DiskEntry:
+    """磁盘层的条目，value 在第一次访问时才从磁盘读出"""
+
+    __slots__ = ("key", "metadata", "created_at", "expires_at", "size", "hits", "_store", "_value", "_loaded")
+
+    def __init__(
+        self,
+        store: "DiskCache",
+        key: Hashable,
+        metadata: Dict,
+        created_at: float,
+        expires_at: Optional[float],
+        size: int,
+        hits: int
+    ):
+        self._store = store
+        self.key = key
+        self.metadata = metadata
+        self.created_at = created_at
+        self.expires_at = expires_at
+        self.size = size
+        self.hits = hits
+        self._value = None
+        self._loaded = False
+
+    @property
+    def value(self) -> Any:
+        if not self._loaded:
+            self._value = self._store.load(self.key)
+            self._loaded = True
+        return self._value
+
+
+class DiskCache:
+    """
+    基于 SQLite 的持久缓存层
+
+    时间均为 Unix 时间（time.time()），跨进程有效；expires_at 为 None 表示不过期。
+    put / delete 只在调用方编码并放入待写队列，后台写线程用独立的连接按批写入
+    （一个事务一次提交）；命中计数先在内存中累积，每 flush_every 次交给写线程。
+    flush / close 等待队列全部写完。
+    """
+
+    def __init__(self, path: str, max_bytes: int = 1024 * 1024 * 1024, flush_every: int = 256):
+        """
+        Args:
+            path: 数据库文件路径
+            max_bytes: 编码后值的总字节数上限，超出时删除最冷的条目
+            flush_every: 累积多少次命中后写回磁盘
+        """
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.flush_every = flush_every
+        # 保护待写队列和读连接；写线程的连接由 _write_lock 保护（先取 _write_lock 再取 _lock）
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._conn = self._connect()
+        self._writer_conn = self._connect()
+        self._writer_conn.executescript(_SCHEMA)
+        self.total_bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        # 编码后的键 -> 待写入的行（None 表示删除），写入提交后移除
+        self._pending: Dict[bytes, Optional[Tuple[Any, ...]]] = {}
+        # 编码后的键 -> 尚未写回的命中次数
+        self._pending_hits: Dict[bytes, int] = {}
+        self._pending_count = 0
+        self._flush_requested = False
+        self._closing = False
+
+        self.reads = 0
+        self.loads = 0
+        self.writes = 0
+        self.evictions = 0
+
+        self._writer = threading.Thread(target=self._write_loop, name="disk-cache-writer", daemon=True)
+        self._writer.start()
+        # 未显式 close 时，退出前写完队列
+        atexit.register(self.close)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def __len__(self) -> int:
+        self.flush()
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def __contains__(self, key: Hashable) -> bool:
+        """是否有未过期的条目（不计命中，不影响热度）"""
+        row = self._lookup(_encode_key(key))
+        return row is not None and (row[2] is None or row[2] > time.time())
+
+    def put(
+        self,
+        key: Hashable,
+        value: Any,
+        metadata: Optional[Dict] = None,
+        expires_at: Optional[float] = None,
+        created_at: Optional[float] = None
+    ) -> int:
+        """
+        写入（或覆盖）条目，保留已有的命中次数
+
+        Returns:
+            int: 编码后的字节数
+        """
+        blob = encode_value(value)
+        now = time.time()
+        meta = pickle.dumps(metadata or {}, protocol=pickle.HIGHEST_PROTOCOL)
+        self._enqueue(_encode_key(key), (blob, meta, len(blob), created_at or now, expires_at, now))
+        return len(blob)
+
+    def get(self, key: Hashable, now: Optional[float] = None) -> Optional[DiskEntry]:
+        """
+        读取条目的元数据（不读值）并记录一次命中，过期的条目被删除并返回 None
+        """
+        now = time.time() if now is None else now
+        encoded_key = _encode_key(key)
+        row = self._lookup(encoded_key)
+        if row is None:
+            return None
+        metadata, created_at, expires_at, size, hits = row
+        if expires_at is not None and expires_at <= now:
+            self._enqueue(encoded_key, None)
+            return None
+        with self._lock:
+            self.reads += 1
+            self._touch(encoded_key)
+        return DiskEntry(self, key, pickle.loads(metadata), created_at, expires_at, size, hits)
+
+    def load(self, key: Hashable) -> Any:
+        """读出并解码值；条目已不存在时抛出 KeyError"""
+        encoded_key = _encode_key(key)
+        with self._lock:
+            if encoded_key in self._pending:
+                pending = self._pending[encoded_key]
+                blob = None if pending is None else pending[0]
+            else:
+                row = self._conn.execute("SELECT value FROM entries WHERE key = ?", (encoded_key,)).fetchone()
+                blob = None if row is None else row[0]
+        if blob is None:
+            raise KeyError(key)
+        self.loads += 1
+        return decode_value(blob)
+
+    def touch(self, key: Hashable):
+        """记录一次命中（例如内存层命中），用于热度排序"""
+        with self._lock:
+            self._touch(_encode_key(key))
+
+    def delete(self, key: Hashable) -> bool:
+        """删除条目，返回是否存在"""
+        encoded_key = _encode_key(key)
+        if self._lookup(encoded_key) is None:
+            return False
+        self._enqueue(encoded_key, None)
+        return True
+
+    def clear(self):
+        with self._write_lock, self._lock:
+            self._pending.clear()
+            self._pending_hits.clear()
+            self._pending_count = 0
+            self._writer_conn.execute("DELETE FROM entries")
+            self.total_bytes = 0
+
+    def hottest(self, limit: Optional[int] = None, now: Optional[float] = None) -> Iterator[DiskEntry]:
+        """
+        按热度（命中次数，其次最近访问）从高到低返回未过期的条目，值惰性加载
+
+        结果按批读取，调用方可以随时停止迭代。
+        """
+        now = time.time() if now is None else now
+        self.flush()
+        with self._write_lock:
+            self._purge_expired(now)
+        offset = 0
+        while limit is None or offset < limit:
+            batch = 64 if limit is None else min(64, limit - offset)
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT key, metadata, created_at, expires_at, size, hits FROM entries "
+                    "ORDER BY hits DESC, last_access DESC LIMIT ? OFFSET ?",
+                    (batch, offset)
+                ).fetchall()
+            for encoded_key, metadata, created_at, expires_at, size, hits in rows:
+                yield DiskEntry(self, pickle.loads(encoded_key), pickle.loads(metadata), created_at, expires_at, size, hits)
+            if len(rows) < batch:
+                return
+            offset += batch
+
+    def flush(self):
+        """等待待写队列和累积的命中次数写回磁盘"""
+        with self._lock:
+            self._flush_requested = True
+            self._changed.notify_all()
+            while self._writer.is_alive() and (self._pending or self._pending_hits or self._flush_requested):
+                self._changed.wait()
+
+    def close(self):
+        atexit.unregister(self.close)
+        self.flush()
+        with self._lock:
+            self._closing = True
+            self._changed.notify_all()
+        self._writer.join()
+        self._conn.close()
+        self._writer_conn.close()
+
+    def _lookup(self, encoded_key: bytes) -> Optional[Tuple[Any, ...]]:
+        """(metadata, created_at, expires_at, size, hits)，待写队列优先"""
+        with self._lock:
+            if encoded_key in self._pending:
+                pending = self._pending[encoded_key]
+                if pending is None:
+                    return None
+                _, meta, size, created_at, expires_at, _ = pending
+                return meta, created_at, expires_at, size, 0
+            return self._conn.execute(
+                "SELECT metadata, created_at, expires_at, size, hits FROM entries WHERE key = ?",
+                (encoded_key,)
+            ).fetchone()
+
+    def _enqueue(self, encoded_key: bytes, row: Optional[Tuple[Any, ...]]):
+        with self._lock:
+            # 重新插入到末尾：同一个键只保留最后一次写入
+            self._pending.pop(encoded_key, None)
+            self._pending[encoded_key] = row
+            if row is None:
+                self._pending_hits.pop(encoded_key, None)
+            self._changed.notify_all()
+
+    def _touch(self, encoded_key: bytes):
+        self._pending_hits[encoded_key] = self._pending_hits.get(encoded_key, 0) + 1
+        self._pending_count += 1
+        if self._pending_count >= self.flush_every:
+            self._changed.notify_all()
+
+    def _write_loop(self):
+        """写线程：取出当前的待写队列，在一个事务中写入"""
+        while True:
+            with self._lock:
+                while not (
+                    self._closing or self._pending or self._flush_requested
+                    or self._pending_count >= self.flush_every
+                ):
+                    self._changed.wait()
+                if self._closing and not self._pending and not self._pending_hits:
+                    return
+            with self._write_lock:
+                with self._lock:
+                    batch = dict(self._pending)
+                    hits = self._pending_hits
+                    self._pending_hits = {}
+                    self._pending_count = 0
+                    self._flush_requested = False
+                try:
+                    if batch or hits:
+                        self._write(batch, hits)
+                except sqlite3.Error:
+                    # 缓存层的写入失败只丢弃这一批
+                    if self._writer_conn.in_transaction:
+                        self._writer_conn.execute("ROLLBACK")
+                    self.total_bytes = self._writer_conn.execute(
+                        "SELECT COALESCE(SUM(size), 0) FROM entries"
+                    ).fetchone()[0]
+                with self._lock:
+                    for encoded_key, row in batch.items():
+                        if encoded_key in self._pending and self._pending[encoded_key] is row:
+                            del self._pending[encoded_key]
+                    self._changed.notify_all()
+
+    def _write(self, batch: Dict[bytes, Optional[Tuple[Any, ...]]], hits: Dict[bytes, int]):
+        conn = self._writer_conn
+        now = time.time()
+        conn.execute("BEGIN")
+        for encoded_key, row in batch.items():
+            previous = conn.execute("SELECT size FROM entries WHERE key = ?", (encoded_key,)).fetchone()
+            if previous is not None:
+                self.total_bytes -= previous[0]
+            if row is None:
+                conn.execute("DELETE FROM entries WHERE key = ?", (encoded_key,))
+                continue
+            conn.execute(
+                "INSERT INTO entries (key, value, metadata, size, created_at, expires_at, hits, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?, 0, ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = excluded.value, metadata = excluded.metadata, "
+                "size = excluded.size, created_at = excluded.created_at, expires_at = excluded.expires_at, "
+                "last_access = excluded.last_access",
+                (encoded_key, *row)
+            )
+            self.total_bytes += row[2]
+            self.writes += 1
+        if hits:
+            conn.executemany(
+                "UPDATE entries SET hits = hits + ?, last_access = ? WHERE key = ?",
+                [(count, now, encoded_key) for encoded_key, count in hits.items()]
+            )
+        if self.total_bytes > self.max_bytes:
+            self._shrink(now)
+        conn.execute("COMMIT")
+
+    def _purge_expired(self, now: float):
+        conn = self._writer_conn
+        conn.execute("DELETE FROM entries WHERE expires_at IS NOT NULL AND expires_at <= ?", (now,))
+        self.total_bytes = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+
+    def _shrink(self, now: float):
+        """先删过期条目，仍超限时从最冷的条目开始删到上限的 90%"""
+        self._purge_expired(now)
+        target = self.max_bytes - self.max_bytes // 10
+        if self.total_bytes <= target:
+            return
+        victims = []
+        for encoded_key, size in self._writer_conn.execute(
+            "SELECT key, size FROM entries ORDER BY hits ASC, last_access ASC"
+        ):
+            victims.append((encoded_key,))
+            self.total_bytes -= size
+            if self.total_bytes <= target:
+                break
+        self._writer_conn.executemany("DELETE FROM entries WHERE key = ?", victims)
+        self.evictions += len(victims)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "path": self.path,
+            "entries": len(self),
+            "bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+            "reads": self.reads,
+            "loads": self.loads,
+            "writes": self.writes,
+            "evictions": self.evictions,
+        }
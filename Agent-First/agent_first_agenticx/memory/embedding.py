@@ -0,0 +1,190 @@
+"""
+Probe 文本的向量化
+
+- HashingEmbedder: 本地 CPU 向量化（特征哈希），字符 3-gram 与词 1/2-gram 带符号地哈希到固定维度，
+  不需要模型和网络
+- EmbeddingPipeline: 在任意后端之前加一层
+  - 内容哈希缓存：按规范化文本的哈希缓存向量，每个不同的查询只向量化一次
+  - 微批：同一时间窗口内的并发请求合并成一次 embed_batch 调用，相同文本共用一个结果
+"""
+
+import asyncio
+import hashlib
+import inspect
+import math
+import zlib
+from collections import OrderedDict
+from itertools import islice
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from .minhash import char_shingles, normalize, word_shingles
+
+
+class HashingEmbedder:
+    """
+    特征哈希向量化
+
+    每个特征按 CRC32 取桶和符号，词频取 1 + log(tf)，结果 L2 归一化。
+    字符 gram 容忍拼写差异，词 gram 区分语义相近但用词不同的查询。
+    """
+
+    def __init__(self, dim: int = 256, word_weight: float = 2.0):
+        """
+        Args:
+            dim: 向量维度
+            word_weight: 词特征相对字符特征的权重
+        """
+        self.dim = dim
+        self.word_weight = word_weight
+
+    def _features(self, text: str) -> Dict[int, float]:
+        text = normalize(text)
+        weights: Dict[int, float] = {}
+        for features, weight in ((char_shingles(text), 1.0), (word_shingles(text), self.word_weight)):
+            for feature in features:
+                h = zlib.crc32(feature.encode("utf-8"))
+                # 低位取桶，最高位取符号，抵消哈希冲突带来的偏差
+                bucket = h % self.dim
+                weights[bucket] = weights.get(bucket, 0.0) + (weight if h >> 31 else -weight)
+        return weights
+
+    def embed(self, text: str) -> np.ndarray:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for bucket, value in self._features(text).items():
+            vector[bucket] = math.copysign(1.0 + math.log(abs(value)), value) if value else 0.0
+        norm = float(np.linalg.norm(vector))
+        return vector / norm if norm > 0 else vector
+
+    def embed_batch(self, texts: Sequence[str]) -> np.ndarray:
+        """批量向量化，返回 (len(texts), dim) 的数组"""
+        if not texts:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        return np.stack([self.embed(text) for text in texts])
+
+
+def content_key(text: str) -> bytes:
+    """规范化文本的内容哈希（缓存键）"""
+    return hashlib.blake2b(normalize(text).encode("utf-8"), digest_size=16).digest()
+
+
+class EmbeddingPipeline:
+    """
+    带缓存和微批的向量化入口
+
+    可直接作为 AgenticMemoryStore 的 embedder：`await pipeline(text)`。
+    后端需提供 embed_batch(texts)，返回向量序列（同步或异步均可）。
+    """
+
+    def __init__(
+        self,
+        backend: Any = None,
+        cache_size: int = 100000,
+        max_batch: int = 64,
+        max_delay: float = 0.002
+    ):
+        """
+        Args:
+            backend: 向量化后端，默认 HashingEmbedder()
+            cache_size: 缓存的向量数上限（LRU）
+            max_batch: 单批最多的文本数，攒满时立即发送
+            max_delay: 第一个请求到达后最多等待多久（秒）再发送
+        """
+        self.backend = backend if backend is not None else HashingEmbedder()
+        self.cache_size = cache_size
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._cache: "OrderedDict[bytes, np.ndarray]" = OrderedDict()
+        # 等待发送的批：内容哈希 -> (文本, future)
+        self._pending: Dict[bytes, tuple] = {}
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+
+        self.requests = 0
+        self.cache_hits = 0
+        self.coalesced = 0
+        self.batches = 0
+        self.embedded = 0
+
+    async def __call__(self, text: str) -> np.ndarray:
+        return await self.embed(text)
+
+    async def embed(self, text: str) -> np.ndarray:
+        """向量化单个文本（命中缓存时不调用后端）"""
+        self.requests += 1
+        key = content_key(text)
+        vector = self._cache.get(key)
+        if vector is not None:
+            self._cache.move_to_end(key)
+            self.cache_hits += 1
+            return vector
+
+        pending = self._pending.get(key)
+        if pending is not None:
+            # 同一文本已在当前批中
+            self.coalesced += 1
+            return await asyncio.shield(pending[1])
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        # 所有等待者都已取消时，避免未读取的异常告警
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self._pending[key] = (text, future)
+        if len(self._pending) >= self.max_batch:
+            self._schedule_flush(loop, 0)
+        elif self._flush_handle is None:
+            self._schedule_flush(loop, self.max_delay)
+        return await asyncio.shield(future)
+
+    async def embed_many(self, texts: Sequence[str]) -> List[np.ndarray]:
+        """向量化多个文本，与其他并发请求一起分批"""
+        return list(await asyncio.gather(*(self.embed(text) for text in texts)))
+
+    def _schedule_flush(self, loop: asyncio.AbstractEventLoop, delay: float):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+        self._flush_handle = loop.call_later(delay, lambda: loop.create_task(self._flush()))
+
+    async def _flush(self):
+        self._flush_handle = None
+        if not self._pending:
+            return
+        keys = list(islice(self._pending, self.max_batch))
+        batch = {key: self._pending.pop(key) for key in keys}
+        if self._pending:
+            # 超过 max_batch 的部分放到下一批
+            self._schedule_flush(asyncio.get_running_loop(), 0)
+        texts = [batch[key][0] for key in keys]
+        self.batches += 1
+        try:
+            vectors = self.backend.embed_batch(texts)
+            if inspect.isawaitable(vectors):
+                vectors = await vectors
+            if len(vectors) != len(texts):
+                raise ValueError(f"向量化后端返回 {len(vectors)} 个向量，期望 {len(texts)} 个")
+        except Exception as e:
+            for _, future in batch.values():
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        self.embedded += len(texts)
+        for key, vector in zip(keys, vectors):
+            vector = np.asarray(vector, dtype=np.float32)
+            self._cache[key] = vector
+            future = batch[key][1]
+            if not future.done():
+                future.set_result(vector)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "cache_hits": self.cache_hits,
+            "coalesced": self.coalesced,
+            "batches": self.batches,
+            "embedded": self.embedded,
+            "cached_vectors": len(self._cache),
+            "avg_batch_size": self.embedded / self.batches if self.batches else 0.0,
+        }
@@ -0,0 +1,318 @@
+"""
+缓存淘汰策略与过期时间轮
+
+- LRUPolicy / LFUPolicy / ARCPolicy: 淘汰顺序，插入和命中均为 O(1)
+- TimerWheel: 哈希时间轮，按过期时刻分桶，推进时只处理到期的桶
+- approximate_size: 值的近似内存占用（容器按抽样估算）
+"""
+
+import sys
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Iterable, List, Optional, Set
+
+
+class EvictionPolicy:
+    """
+    淘汰策略接口
+
+    缓存在插入、命中、删除时通知策略，需要腾出空间时调用 evict 取得被淘汰的键。
+    """
+
+    name = "base"
+
+    def insert(self, key: Hashable):
+        """新键写入缓存"""
+        raise NotImplementedError
+
+    def access(self, key: Hashable):
+        """已有的键被读取或覆盖写入"""
+        raise NotImplementedError
+
+    def remove(self, key: Hashable):
+        """键被显式删除或过期（不是被淘汰）"""
+        raise NotImplementedError
+
+    def evict(self) -> Optional[Hashable]:
+        """选出并移除一个被淘汰的键；为空时返回 None"""
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+
+class LRUPolicy(EvictionPolicy):
+    """最近最少使用"""
+
+    name = "lru"
+
+    def __init__(self):
+        self._order: "OrderedDict[Hashable, None]" = OrderedDict()
+
+    def insert(self, key: Hashable):
+        self._order[key] = None
+
+    def access(self, key: Hashable):
+        self._order.move_to_end(key)
+
+    def remove(self, key: Hashable):
+        self._order.pop(key, None)
+
+    def evict(self) -> Optional[Hashable]:
+        if not self._order:
+            return None
+        return self._order.popitem(last=False)[0]
+
+    def clear(self):
+        self._order.clear()
+
+
+class LFUPolicy(EvictionPolicy):
+    """
+    最不经常使用（频次相同时淘汰最久未用的）
+
+    按频次分桶：插入、命中 O(1)；淘汰后最小频次的桶被取空时才重新求最小频次。
+    """
+
+    name = "lfu"
+
+    def __init__(self):
+        self._frequency: Dict[Hashable, int] = {}
+        # 频次 -> 该频次的键（按最近使用排序）
+        self._buckets: Dict[int, "OrderedDict[Hashable, None]"] = {}
+        self._min_frequency = 0
+
+    def _unlink(self, key: Hashable) -> int:
+        frequency = self._frequency.pop(key)
+        bucket = self._buckets[frequency]
+        del bucket[key]
+        if not bucket:
+            del self._buckets[frequency]
+        return frequency
+
+    def _link(self, key: Hashable, frequency: int):
+        self._frequency[key] = frequency
+        bucket = self._buckets.get(frequency)
+        if bucket is None:
+            bucket = self._buckets[frequency] = OrderedDict()
+        bucket[key] = None
+
+    def insert(self, key: Hashable):
+        self._link(key, 1)
+        self._min_frequency = 1
+
+    def access(self, key: Hashable):
+        frequency = self._unlink(key)
+        if frequency == self._min_frequency and frequency not in self._buckets:
+            self._min_frequency = frequency + 1
+        self._link(key, frequency + 1)
+
+    def remove(self, key: Hashable):
+        if key in self._frequency:
+            self._unlink(key)
+            if self._buckets and self._min_frequency not in self._buckets:
+                self._min_frequency = min(self._buckets)
+
+    def evict(self) -> Optional[Hashable]:
+        if not self._frequency:
+            return None
+        bucket = self._buckets[self._min_frequency]
+        key = next(iter(bucket))
+        self._unlink(key)
+        if self._buckets and self._min_frequency not in self._buckets:
+            # 只在淘汰 / 删除时发生，桶数量为不同频次的个数
+            self._min_frequency = min(self._buckets)
+        return key
+
+    def clear(self):
+        self._frequency.clear()
+        self._buckets.clear()
+        self._min_frequency = 0
+
+
+class ARCPolicy(EvictionPolicy):
+    """
+    自适应替换缓存（ARC）
+
+    T1 为只访问过一次的键，T2 为访问过多次的键；B1 / B2 记录最近从 T1 / T2
+    淘汰的键（只有键，没有值）。被淘汰的键再次写入时命中 B1 说明应给新键更多空间，
+    命中 B2 说明应保护常用键，据此调整目标 p（T1 应占的条目数）。
+    缓存按字节限额，容量 c 取当前驻留的条目数。
+    """
+
+    name = "arc"
+
+    def __init__(self):
+        self._t1: "OrderedDict[Hashable, None]" = OrderedDict()
+        self._t2: "OrderedDict[Hashable, None]" = OrderedDict()
+        self._b1: "OrderedDict[Hashable, None]" = OrderedDict()
+        self._b2: "OrderedDict[Hashable, None]" = OrderedDict()
+        self.p = 0.0
+
+    def _capacity(self) -> int:
+        return max(len(self._t1) + len(self._t2), 1)
+
+    def insert(self, key: Hashable):
+        capacity = self._capacity()
+        if key in self._b1:
+            self.p = min(capacity, self.p + max(len(self._b2) / len(self._b1), 1))
+            del self._b1[key]
+            self._t2[key] = None
+        elif key in self._b2:
+            self.p = max(0.0, self.p - max(len(self._b1) / len(self._b2), 1))
+            del self._b2[key]
+            self._t2[key] = None
+        else:
+            self._t1[key] = None
+        self._trim_ghosts()
+
+    def access(self, key: Hashable):
+        if key in self._t1:
+            del self._t1[key]
+        else:
+            del self._t2[key]
+        self._t2[key] = None
+
+    def remove(self, key: Hashable):
+        if key in self._t1:
+            del self._t1[key]
+        else:
+            self._t2.pop(key, None)
+
+    def evict(self) -> Optional[Hashable]:
+        if self._t1 and (len(self._t1) > self.p or not self._t2):
+            key = self._t1.popitem(last=False)[0]
+            self._b1[key] = None
+        elif self._t2:
+            key = self._t2.popitem(last=False)[0]
+            self._b2[key] = None
+        else:
+            return None
+        self._trim_ghosts()
+        return key
+
+    def _trim_ghosts(self):
+        capacity = self._capacity()
+        while self._b1 and len(self._t1) + len(self._b1) > capacity:
+            self._b1.popitem(last=False)
+        while self._b2 and len(self._b1) + len(self._b2) > capacity:
+            self._b2.popitem(last=False)
+
+    def clear(self):
+        for keys in (self._t1, self._t2, self._b1, self._b2):
+            keys.clear()
+        self.p = 0.0
+
+
+POLICIES = {policy.name: policy for policy in (LRUPolicy, LFUPolicy, ARCPolicy)}
+
+
+def make_policy(policy: Any) -> EvictionPolicy:
+    """按名称（"lru" / "lfu" / "arc"）创建策略；已是策略对象时原样返回"""
+    if isinstance(policy, EvictionPolicy):
+        return policy
+    if policy not in POLICIES:
+        raise ValueError(f"未知的淘汰策略: {policy}（可选 {', '.join(POLICIES)}）")
+    return POLICIES[policy]()
+
+
+class TimerWheel:
+    """
+    哈希时间轮
+
+    时间按 tick 切分，到期时刻落在第 t 个 tick 的键放进 t % slots 号桶。
+    advance 逐个处理经过的 tick 对应的桶，只取出已到期的键（同一桶中更晚一圈的键留下）。
+    槽数 * tick 不小于常用 TTL 时，每个键只被访问一次，摊还 O(1)。
+    """
+
+    def __init__(self, tick: float = 1.0, slots: int = 4096, now: float = 0.0):
+        """
+        Args:
+            tick: 每格的时长（秒），过期的精度
+            slots: 槽数
+            now: 当前时刻
+        """
+        self.tick = tick
+        self._slots: List[Set[Hashable]] = [set() for _ in range(slots)]
+        # 键 -> 到期 tick
+        self._deadlines: Dict[Hashable, int] = {}
+        self._current = int(now // tick)
+
+    def __len__(self) -> int:
+        return len(self._deadlines)
+
+    def schedule(self, key: Hashable, expires_at: float):
+        """登记（或改期）键的到期时刻"""
+        self.cancel(key)
+        # 向上取整：不早于 expires_at 过期
+        deadline = max(-int(-expires_at // self.tick), self._current + 1)
+        self._deadlines[key] = deadline
+        self._slots[deadline % len(self._slots)].add(key)
+
+    def cancel(self, key: Hashable):
+        deadline = self._deadlines.pop(key, None)
+        if deadline is not None:
+            self._slots[deadline % len(self._slots)].discard(key)
+
+    def advance(self, now: float) -> List[Hashable]:
+        """推进到 now，返回期间到期的键"""
+        target = int(now // self.tick)
+        if target <= self._current:
+            return []
+        expired = []
+        # 跨度超过一圈时每个桶只需处理一次
+        start = max(self._current + 1, target - len(self._slots) + 1)
+        for tick in range(start, target + 1):
+            slot = self._slots[tick % len(self._slots)]
+            if not slot:
+                continue
+            due = [key for key in slot if self._deadlines[key] <= target]
+            for key in due:
+                slot.discard(key)
+                del self._deadlines[key]
+            expired.extend(due)
+        self._current = target
+        return expired
+
+    def clear(self):
+        for slot in self._slots:
+            slot.clear()
+        self._deadlines.clear()
+
+
+# 容器超过该长度时按抽样估算
+_SAMPLE_SIZE = 32
+
+
+def approximate_size(value: Any, _depth: int = 0) -> int:
+    """
+    值的近似内存占用（字节）
+
+    递归累加容器元素的 sys.getsizeof；长容器只抽样前 _SAMPLE_SIZE 个元素再按长度外推，
+    深度超过 4 层的部分只计对象本身。
+    """
+    size = sys.getsizeof(value)
+    if _depth >= 4 or isinstance(value, (str, bytes, bytearray, int, float, bool)) or value is None:
+        return size
+
+    if isinstance(value, dict):
+        items: Iterable[Any] = value.items()
+        length = len(value)
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        items = value
+        length = len(value)
+    else:
+        return size
+    if not length:
+        return size
+
+    sample = 0
+    count = 0
+    for item in items:
+        if isinstance(item, tuple) and isinstance(value, dict):
+            sample += approximate_size(item[0], _depth + 1) + approximate_size(item[1], _depth + 1)
+        else:
+            sample += approximate_size(item, _depth + 1)
+        count += 1
+        if count == _SAMPLE_SIZE:
+            break
+    return size + sample * length // count
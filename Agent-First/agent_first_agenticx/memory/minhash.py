@@ -0,0 +1,137 @@
+"""
+MinHash / LSH 近似重复检索
+
+- shingle: 文本的字符 3-gram（char_shingles）与词 1/2-gram（word_shingles）
+- MinHash 签名：num_perm 个形如 (a * h + b) mod p 的随机哈希在 shingle 集合上的最小值，
+  两个签名相同位置相等的比例是 Jaccard 相似度的无偏估计
+- LSH：签名切成 bands 段，任意一段完全相同的文档成为候选；
+  Jaccard 为 s 的两个文档成为候选的概率为 1 - (1 - s^r)^b（r 为每段行数）
+"""
+
+import zlib
+from typing import Dict, Hashable, List, Set
+
+import numpy as np
+
+
+# 梅森素数 2^31 - 1：a、b、h 都先取模到 [0, p)，a * h + b < 2^62 不会溢出 uint64。
+# 模数须远小于 a * h 的取值范围，取模才会打乱顺序；模数过大时各个哈希
+# 近似保持 h 的大小顺序，最小值几乎总落在同一个 shingle 上
+_PRIME = np.uint64((1 << 31) - 1)
+_CHAR_GRAM = 3
+
+
+def normalize(text: str) -> str:
+    """小写并合并空白"""
+    return " ".join(text.lower().split())
+
+
+def char_shingles(text: str) -> Set[str]:
+    """文本（已规范化）的字符 3-gram"""
+    if len(text) <= _CHAR_GRAM:
+        return {text}
+    return {text[i:i + _CHAR_GRAM] for i in range(len(text) - _CHAR_GRAM + 1)}
+
+
+def word_shingles(text: str) -> Set[str]:
+    """文本（已规范化）的词 1-gram 和 2-gram"""
+    words = text.split()
+    result = set(words)
+    result.update(a + " " + b for a, b in zip(words, words[1:]))
+    return result
+
+
+class MinHashLSH:
+    """
+    基于 MinHash 的 LSH 索引
+
+    插入和查询的代价与文档长度成正比，与索引大小无关（桶的大小除外）。
+    """
+
+    def __init__(self, num_perm: int = 64, bands: int = 16, seed: int = 1):
+        """
+        Args:
+            num_perm: 签名长度
+            bands: 分段数，须整除 num_perm；段越多召回越高、候选越多
+            seed: 随机哈希的种子
+        """
+        if num_perm % bands:
+            raise ValueError(f"bands ({bands}) 必须整除 num_perm ({num_perm})")
+        rng = np.random.RandomState(seed)
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self._a = rng.randint(1, int(_PRIME), size=num_perm).astype(np.uint64)
+        self._b = rng.randint(0, int(_PRIME), size=num_perm).astype(np.uint64)
+        # 每段一个桶表：段内签名的字节 -> 文档键
+        self._tables: List[Dict[bytes, Set[Hashable]]] = [{} for _ in range(bands)]
+        self._signatures: Dict[Hashable, np.ndarray] = {}
+
+    def __len__(self) -> int:
+        return len(self._signatures)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._signatures
+
+    @property
+    def threshold(self) -> float:
+        """成为候选的概率为 1/2 时的近似 Jaccard 相似度"""
+        return (1.0 / self.bands) ** (1.0 / self.rows)
+
+    def signature(self, shingles: Set[str]) -> np.ndarray:
+        """shingle 集合的 MinHash 签名（空集合的签名为全最大值）"""
+        if not shingles:
+            return np.full(self.num_perm, _PRIME, dtype=np.uint64)
+        hashes = np.fromiter(
+            (zlib.crc32(shingle.encode("utf-8")) for shingle in shingles),
+            dtype=np.uint64,
+            count=len(shingles)
+        ) % _PRIME
+        permuted = (self._a[:, None] * hashes[None, :] + self._b[:, None]) % _PRIME
+        return permuted.min(axis=1)
+
+    def _band_keys(self, signature: np.ndarray) -> List[bytes]:
+        rows = self.rows
+        return [signature[i * rows:(i + 1) * rows].tobytes() for i in range(self.bands)]
+
+    def insert(self, key: Hashable, shingles: Set[str]):
+        """索引文档；键已存在时先移除旧签名"""
+        if key in self._signatures:
+            self.remove(key)
+        signature = self.signature(shingles)
+        self._signatures[key] = signature
+        for table, band in zip(self._tables, self._band_keys(signature)):
+            bucket = table.get(band)
+            if bucket is None:
+                bucket = table[band] = set()
+            bucket.add(key)
+
+    def remove(self, key: Hashable) -> bool:
+        """移除文档，返回是否存在"""
+        signature = self._signatures.pop(key, None)
+        if signature is None:
+            return False
+        for table, band in zip(self._tables, self._band_keys(signature)):
+            bucket = table[band]
+            bucket.discard(key)
+            if not bucket:
+                del table[band]
+        return True
+
+    def query(self, shingles: Set[str]) -> Set[Hashable]:
+        """与 shingle 集合至少有一段签名相同的文档"""
+        candidates: Set[Hashable] = set()
+        for table, band in zip(self._tables, self._band_keys(self.signature(shingles))):
+            bucket = table.get(band)
+            if bucket:
+                candidates.update(bucket)
+        return candidates
+
+    def jaccard(self, shingles: Set[str], key: Hashable) -> float:
+        """shingle 集合与已索引文档的 Jaccard 相似度估计"""
+        return float(np.mean(self.signature(shingles) == self._signatures[key]))
+
+    def clear(self):
+        for table in self._tables:
+            table.clear()
+        self._signatures.clear()
@@ -2,38 +2,336 @@
 查询缓存管理
 """
 
-from typing import Dict, Any, Optional
-from datetime import datetime, timedelta
+import time
+from typing import Dict, Any, Callable, Hashable, Iterable, Optional, Tuple, Union
+
+from .dependency import DependencyIndex
+from .disk_tier import DiskCache
+from .eviction import EvictionPolicy, TimerWheel, approximate_size, make_policy
+
+
+class CacheEntry:
+    """缓存条目"""
+    
+    __slots__ = ("value", "metadata", "created_at", "expires_at", "size")
+    
+    def __init__(self, value: Any, metadata: Dict, created_at: float, expires_at: float, size: int):
+        self.value = value
+        self.metadata = metadata
+        self.created_at = created_at
+        self.expires_at = expires_at
+        self.size = size
 
 
 class QueryCache:
-    """简单的查询缓存管理器"""
-    
-    def __init__(self, ttl_seconds: int = 3600):
-        self.cache = {}
-        self.ttl = timedelta(seconds=ttl_seconds)
-    
-    def set(self, key: str, value: Any, metadata: Optional[Dict] = None):
-        """设置缓存"""
-        self.cache[key] = {
-            "value": value,
-            "metadata": metadata or {},
-            "created_at": datetime.now()
-        }
+    """
+    有界的查询缓存
+    
+    - 按值的近似字节数限额，超出时按淘汰策略（LRU / LFU / ARC）逐个淘汰
+    - 过期由时间轮在每次读写时顺带推进，摊还 O(1)，不依赖对同一个键的读取
+    - 可选的磁盘层（L2，DiskCache）：写入同时落盘，内存未命中时从磁盘读取并提升到内存；
+      启动时在限定时间内把磁盘上最热的键预热到内存
+    - 可选的数据依赖：写入时登记读取的 (分支, 版本, 表)，关联 BranchManager 后
+      分支写入只失效读过被修改表的条目（见 DependencyIndex）
+    - 命中、未命中、淘汰、过期计数见 get_stats
+    """
+    
+    def __init__(
+        self,
+        ttl_seconds: int = 3600,
+        max_bytes: int = 64 * 1024 * 1024,
+        policy: Union[str, EvictionPolicy] = "lru",
+        tick_seconds: float = 1.0,
+        clock: Callable[[], float] = time.monotonic,
+        l2: Optional[DiskCache] = None,
+        warm_start_seconds: float = 0.5,
+        branch_manager: Any = None
+    ):
+        """
+        Args:
+            ttl_seconds: 默认存活时间（秒）
+            max_bytes: 缓存值的总字节数上限（按 approximate_size 估算）
+            policy: 淘汰策略，"lru" / "lfu" / "arc" 或 EvictionPolicy 实例
+            tick_seconds: 过期检查的精度（时间轮每格时长）
+            clock: 单调时钟（秒），测试时可替换
+            l2: 磁盘层；为 None 时只有内存层
+            warm_start_seconds: 启动预热的时间预算（秒），0 表示不预热
+            branch_manager: 订阅其写入通知的 BranchManager；为 None 时登记的依赖只在
+                之后调用 dependencies.attach 时生效
+        """
+        self.cache: Dict[Hashable, CacheEntry] = {}
+        self.ttl = ttl_seconds
+        self.max_bytes = max_bytes
+        self.policy = make_policy(policy)
+        self.clock = clock
+        # 槽数覆盖默认 TTL，每个条目在时间轮中只被扫描一次
+        slots = max(64, min(int(ttl_seconds / tick_seconds) + 1, 1 << 16))
+        self._wheel = TimerWheel(tick_seconds, slots, clock())
+        self.total_bytes = 0
+        
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.rejections = 0
+        
+        self.dependencies = DependencyIndex(self._invalidate, branch_manager)
+        
+        self.l2 = l2
+        self.l2_hits = 0
+        self.warmed = 0
+        if l2 is not None and warm_start_seconds > 0:
+            self.warm_start(warm_start_seconds)
     
-    def get(self, key: str) -> Optional[Any]:
+    def __len__(self) -> int:
+        return len(self.cache)
+    
+    def __contains__(self, key: Hashable) -> bool:
+        entry = self.cache.get(key)
+        if entry is not None and entry.expires_at > self.clock():
+            return True
+        # 只检查是否存在，不计命中
+        return self.l2 is not None and key in self.l2
+    
+    def set(
+        self,
+        key: Hashable,
+        value: Any,
+        metadata: Optional[Dict] = None,
+        ttl_seconds: Optional[float] = None,
+        reads: Optional[Tuple[str, int, Iterable[str]]] = None
+    ) -> bool:
+        """
+        设置缓存
+        
+        Args:
+            key: 键
+            value: 值
+            metadata: 附加信息
+            ttl_seconds: 该条目的存活时间，默认使用构造时的 ttl_seconds
+            reads: 值读取的数据 (分支 ID, 读取时的版本号, 表)；这些表之后被写入时条目失效
+        
+        Returns:
+            bool: 是否写入内存层（单个值超过 max_bytes 时不进入内存，有磁盘层时仍会落盘；
+                读取之后表已被修改时不写入）
+        """
+        now = self.clock()
+        self._expire(now)
+        ttl = self.ttl if ttl_seconds is None else ttl_seconds
+        metadata = metadata or {}
+        if reads is not None:
+            branch_id, version, tables = reads
+            reads = (branch_id, version, tuple(tables))
+            if not self.dependencies.add(key, *reads):
+                # 值计算完成前表已被修改，旧值同样过期
+                self.delete(key)
+                return False
+            # 随条目落盘，从磁盘层恢复时重新登记
+            metadata = {**metadata, "reads": reads}
+        else:
+            self.dependencies.discard(key)
+        if self.l2 is not None:
+            wall = time.time()
+            self.l2.put(key, value, metadata, expires_at=wall + ttl, created_at=wall)
+        return self._admit(key, value, metadata, now, now + ttl)
+    
+    def _admit(self, key: Hashable, value: Any, metadata: Dict, now: float, expires_at: float) -> bool:
+        """放入内存层，超出字节限额时按策略淘汰"""
+        size = approximate_size(value)
+        if size > self.max_bytes:
+            self.rejections += 1
+            self._delete_local(key)
+            if self.l2 is None:
+                self.dependencies.discard(key)
+            return False
+        
+        previous = self.cache.get(key)
+        if previous is not None:
+            self.total_bytes -= previous.size
+            self.policy.access(key)
+        else:
+            self.policy.insert(key)
+        
+        self.cache[key] = CacheEntry(value, metadata, now, expires_at, size)
+        self.total_bytes += size
+        self._wheel.schedule(key, expires_at)
+        
+        while self.total_bytes > self.max_bytes:
+            victim = self.policy.evict()
+            if victim is None:
+                break
+            self._discard(victim)
+            self.evictions += 1
+        return True
+    
+    def get(self, key: Hashable) -> Optional[Any]:
         """获取缓存"""
-        if key not in self.cache:
-            return None
+        entry = self.get_entry(key)
+        return None if entry is None else entry.value
+    
+    def get_entry(self, key: Hashable) -> Optional[CacheEntry]:
+        """获取缓存条目（含 metadata）；过期或不存在时返回 None"""
+        now = self.clock()
+        self._expire(now)
+        entry = self.cache.get(key)
+        if entry is None or entry.expires_at <= now:
+            if entry is not None:
+                # 时间轮精度之内已过期的条目
+                self._delete_local(key)
+                self.expirations += 1
+            entry = self._load_from_l2(key, now)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.l2_hits += 1
+        else:
+            self.policy.access(key)
+            if self.l2 is not None:
+                self.l2.touch(key)
         
-        entry = self.cache[key]
-        if datetime.now() - entry["created_at"] > self.ttl:
-            del self.cache[key]
+        self.hits += 1
+        return entry
+    
+    def _load_from_l2(self, key: Hashable, now: float) -> Optional[CacheEntry]:
+        """从磁盘层读取并提升到内存层；值超过内存限额时直接返回不缓存"""
+        if self.l2 is None:
+            return None
+        disk_entry = self.l2.get(key)
+        if disk_entry is None:
+            return None
+        reads = disk_entry.metadata.get("reads")
+        if reads is not None and key not in self.dependencies and not self.dependencies.add(key, *reads):
+            # 落盘之后表已被修改
+            self.l2.delete(key)
             return None
+        expires_at = self._from_wall(disk_entry.expires_at, now)
+        value = disk_entry.value
+        if self._admit(key, value, disk_entry.metadata, now, expires_at):
+            return self.cache[key]
+        return CacheEntry(value, disk_entry.metadata, now, expires_at, disk_entry.size)
+    
+    def _from_wall(self, expires_at: Optional[float], now: float) -> float:
+        """磁盘层的 Unix 过期时刻换算为本地时钟"""
+        if expires_at is None:
+            return now + self.ttl
+        return now + (expires_at - time.time())
+    
+    def warm_start(self, budget_seconds: float = 0.5) -> int:
+        """
+        按热度从磁盘层预热内存层
+        
+        在时间预算内从最热的键开始读取，内存层放满时停止（不淘汰已有的条目）。
+        
+        Args:
+            budget_seconds: 时间预算（秒）
+        
+        Returns:
+            int: 预热的条目数
+        """
+        if self.l2 is None:
+            return 0
+        deadline = time.perf_counter() + budget_seconds
+        now = self.clock()
+        loaded = []
+        stale = []
+        total = self.total_bytes
+        for disk_entry in self.l2.hottest():
+            if time.perf_counter() >= deadline:
+                break
+            if disk_entry.key in self.cache:
+                continue
+            reads = disk_entry.metadata.get("reads")
+            if reads is not None and not self.dependencies.is_current(*reads):
+                stale.append(disk_entry.key)
+                continue
+            value = disk_entry.value
+            size = approximate_size(value)
+            if total + size > self.max_bytes:
+                break
+            total += size
+            loaded.append((disk_entry, value))
         
-        return entry["value"]
+        # 从冷到热插入，淘汰顺序中最热的键最后被淘汰
+        for disk_entry, value in reversed(loaded):
+            self._admit(disk_entry.key, value, disk_entry.metadata, now, self._from_wall(disk_entry.expires_at, now))
+            reads = disk_entry.metadata.get("reads")
+            if reads is not None:
+                self.dependencies.add(disk_entry.key, *reads)
+        # 迭代结束后再删除，避免分页读取时跳过条目
+        for key in stale:
+            self.l2.delete(key)
+        self.warmed += len(loaded)
+        return len(loaded)
+    
+    def delete(self, key: Hashable) -> bool:
+        """删除缓存（含磁盘层），返回键是否存在"""
+        self.dependencies.discard(key)
+        found = self._delete_local(key)
+        if self.l2 is not None:
+            found = self.l2.delete(key) or found
+        return found
+    
+    def _delete_local(self, key: Hashable) -> bool:
+        if key not in self.cache:
+            return False
+        self.policy.remove(key)
+        self._discard(key)
+        return True
     
     def clear(self):
-        """清空缓存"""
+        """清空缓存（含磁盘层）"""
         self.cache.clear()
-
+        self.policy.clear()
+        self._wheel.clear()
+        self.dependencies.clear()
+        self.total_bytes = 0
+        if self.l2 is not None:
+            self.l2.clear()
+    
+    def close(self):
+        """写回磁盘层的命中计数并关闭（同时取消写入通知的订阅）"""
+        self.dependencies.detach()
+        if self.l2 is not None:
+            self.l2.close()
+    
+    def _invalidate(self, key: Hashable):
+        """读过的表被写入（DependencyIndex 的回调）"""
+        self.delete(key)
+    
+    def _discard(self, key: Hashable):
+        entry = self.cache.pop(key)
+        self.total_bytes -= entry.size
+        self._wheel.cancel(key)
+        if self.l2 is None:
+            # 有磁盘层时条目仍在磁盘上，依赖保留
+            self.dependencies.discard(key)
+    
+    def _expire(self, now: float):
+        for key in self._wheel.advance(now):
+            self.policy.remove(key)
+            entry = self.cache.pop(key)
+            self.total_bytes -= entry.size
+            self.expirations += 1
+            if self.l2 is None:
+                self.dependencies.discard(key)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """缓存统计"""
+        self._expire(self.clock())
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.cache),
+            "bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+            "policy": self.policy.name,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "rejections": self.rejections,
+            "l2_hits": self.l2_hits,
+            "warmed": self.warmed,
+            "l2": self.l2.get_stats() if self.l2 is not None else None,
+            "dependencies": self.dependencies.get_stats(),
+        }
@@ -2,58 +2,183 @@
 冗余检测器 - 识别相似查询
 """
 
-from typing import List
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
 from difflib import SequenceMatcher
 
+from .minhash import MinHashLSH, char_shingles, normalize, word_shingles
+
 
 class RedundancyDetector:
     """
     检测查询冗余
     
     Agent 的查询有 80-90% 的冗余，我们可以识别并共享计算
+    
+    历史查询（按小写文本去重）按字符 shingle 和词 shingle 各建一个 MinHash/LSH 索引，
+    查找时只对两个索引的候选并集用 SequenceMatcher 精确打分，代价与历史规模基本无关。
+    
+    每个查询在 add_query 时判定一次是否冗余（与之前的某个查询相似），冗余率按计数增量维护：
+    全部历史、最近 window_size 个查询、最近 window_seconds 秒三种口径，读取均为 O(1)。
     """
     
-    def __init__(self, similarity_threshold: float = 0.8):
+    def __init__(
+        self,
+        similarity_threshold: float = 0.8,
+        num_perm: int = 64,
+        bands: int = 32,
+        window_size: int = 1000,
+        window_seconds: float = 300.0,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        """
+        Args:
+            similarity_threshold: 相似度阈值（SequenceMatcher.ratio）
+            num_perm: MinHash 签名长度
+            bands: LSH 分段数；默认每段 2 行，shingle Jaccard 为 0.3 的查询成为候选的概率约 0.95
+                （ratio 达到 0.8 的查询对，少量字符改动后 Jaccard 常在 0.3 左右）
+            window_size: 按条数统计的窗口大小
+            window_seconds: 按时间统计的窗口长度（秒）
+            clock: 单调时钟（秒），测试时可替换
+        """
         self.threshold = similarity_threshold
         self.query_history = []
+        # 字符 shingle 容忍拼写差异，词 shingle 容忍词序和增删词
+        self._char_index = MinHashLSH(num_perm=num_perm, bands=bands)
+        self._word_index = MinHashLSH(num_perm=num_perm, bands=bands, seed=2)
+        # 文档 ID（首次出现的顺序）<-> 小写文本
+        self._doc_ids: Dict[str, int] = {}
+        self._docs: List[str] = []
+        # 每个文档的原始写法及出现次数
+        self._variants: List[Dict[str, int]] = []
+        
+        self.window_size = window_size
+        self.window_seconds = window_seconds
+        self.clock = clock
+        self.redundant_count = 0
+        # 最近 window_size 个查询的冗余标记
+        self._recent: Deque[bool] = deque()
+        self._recent_redundant = 0
+        # 最近 window_seconds 秒内的 (时刻, 冗余标记)
+        self._timed: Deque[Tuple[float, bool]] = deque()
+        self._timed_redundant = 0
     
-    def add_query(self, query: str):
-        """添加查询到历史"""
+    def add_query(self, query: str) -> bool:
+        """
+        添加查询到历史
+        
+        Returns:
+            bool: 该查询是否冗余（与之前的某个查询相似度达到阈值）
+        """
+        text = query.lower()
+        doc_id = self._doc_ids.get(text)
+        redundant = doc_id is not None or self._has_similar(text)
+        self._record(redundant)
+        
         self.query_history.append(query)
+        if doc_id is None:
+            doc_id = self._doc_ids[text] = len(self._docs)
+            self._docs.append(text)
+            self._variants.append({})
+            normalized = normalize(text)
+            self._char_index.insert(doc_id, char_shingles(normalized))
+            self._word_index.insert(doc_id, word_shingles(normalized))
+        variants = self._variants[doc_id]
+        variants[query] = variants.get(query, 0) + 1
+        return redundant
     
     def find_similar(self, query: str) -> List[tuple]:
         """
         查找相似查询
         
         Returns:
-            List[tuple]: [(相似查询, 相似度得分)]
+            List[tuple]: [(相似查询, 相似度得分)]，同一查询在历史中出现多次时重复列出
         """
-        similar = []
+        text = query.lower()
+        scored = []
+        for doc_id in self._candidates(text):
+            similarity = self._score(text, self._docs[doc_id])
+            if similarity is not None:
+                scored.append((similarity, doc_id))
         
-        for hist_query in self.query_history:
-            similarity = self._calculate_similarity(query, hist_query)
-            if similarity >= self.threshold:
-                similar.append((hist_query, similarity))
-        
-        # 按相似度排序
-        similar.sort(key=lambda x: x[1], reverse=True)
+        # 按相似度排序，相同时按首次出现的顺序
+        scored.sort(key=lambda x: (-x[0], x[1]))
+        similar = []
+        for similarity, doc_id in scored:
+            for hist_query, count in self._variants[doc_id].items():
+                similar.extend([(hist_query, similarity)] * count)
         return similar
     
-    def _calculate_similarity(self, query1: str, query2: str) -> float:
-        """计算两个查询的相似度"""
-        return SequenceMatcher(None, query1.lower(), query2.lower()).ratio()
+    def _has_similar(self, text: str) -> bool:
+        """历史中是否有相似度达到阈值的查询（找到一个即返回）"""
+        for doc_id in self._candidates(text):
+            if self._score(text, self._docs[doc_id]) is not None:
+                return True
+        return False
     
-    def get_redundancy_rate(self) -> float:
-        """计算冗余率"""
-        if len(self.query_history) < 2:
-            return 0.0
+    def _record(self, redundant: bool):
+        if redundant:
+            self.redundant_count += 1
         
-        redundant_count = 0
-        for i, query in enumerate(self.query_history):
-            for other_query in self.query_history[:i]:
-                if self._calculate_similarity(query, other_query) >= self.threshold:
-                    redundant_count += 1
-                    break
+        self._recent.append(redundant)
+        self._recent_redundant += redundant
+        if len(self._recent) > self.window_size:
+            self._recent_redundant -= self._recent.popleft()
         
-        return redundant_count / len(self.query_history)
-
+        self._timed.append((self.clock(), redundant))
+        self._timed_redundant += redundant
+        self._trim_timed()
+    
+    def _trim_timed(self):
+        """移出时间窗口之外的记录（每条只移出一次，摊还 O(1)）"""
+        cutoff = self.clock() - self.window_seconds
+        timed = self._timed
+        while timed and timed[0][0] <= cutoff:
+            self._timed_redundant -= timed.popleft()[1]
+    
+    def _candidates(self, text: str) -> set:
+        normalized = normalize(text)
+        candidates = self._char_index.query(char_shingles(normalized))
+        candidates |= self._word_index.query(word_shingles(normalized))
+        return candidates
+    
+    def _score(self, text: str, other: str):
+        """相似度达到阈值时返回 ratio，否则返回 None（先用两个上界快速排除）"""
+        matcher = SequenceMatcher(None, text, other)
+        if matcher.real_quick_ratio() < self.threshold or matcher.quick_ratio() < self.threshold:
+            return None
+        similarity = matcher.ratio()
+        return similarity if similarity >= self.threshold else None
+    
+    def get_redundancy_rate(self, window: Optional[str] = None) -> float:
+        """
+        冗余率
+        
+        Args:
+            window: None 为全部历史，"count" 为最近 window_size 个查询，"time" 为最近 window_seconds 秒
+        """
+        if window is None:
+            total, redundant = len(self.query_history), self.redundant_count
+        elif window == "count":
+            total, redundant = len(self._recent), self._recent_redundant
+        elif window == "time":
+            self._trim_timed()
+            total, redundant = len(self._timed), self._timed_redundant
+        else:
+            raise ValueError(f"未知的窗口类型: {window}（可选 count / time）")
+        return redundant / total if total else 0.0
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """冗余统计（全部历史与两个窗口）"""
+        self._trim_timed()
+        return {
+            "total_queries": len(self.query_history),
+            "distinct_queries": len(self._docs),
+            "redundant_queries": self.redundant_count,
+            "redundancy_rate": self.get_redundancy_rate(),
+            "window_queries": len(self._recent),
+            "window_redundancy_rate": self.get_redundancy_rate("count"),
+            "recent_queries": len(self._timed),
+            "recent_redundancy_rate": self.get_redundancy_rate("time"),
+        }
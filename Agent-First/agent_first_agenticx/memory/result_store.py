@@ -0,0 +1,159 @@
+"""
+Probe 完整结果的本地存储
+
+- 内容寻址：对象按内容哈希（BLAKE2b）命名，相同内容只存一份
+- 结果按 chunk_rows 行切块，每块用 disk_tier.encode_value 编码（按列存放 + zlib 压缩）；
+  清单对象记录行数、列名和各块的哈希，结果的引用就是清单的哈希
+- 读取时按块解码、逐行产出，只在需要时读取后面的块
+"""
+
+import hashlib
+import os
+from itertools import islice
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set
+
+from .disk_tier import decode_value, encode_value
+
+
+class StoredResult:
+    """一个已存储的结果，迭代时按块惰性读取"""
+
+    __slots__ = ("ref", "row_count", "columns", "_store", "_chunks")
+
+    def __init__(self, store: "ResultStore", ref: str, manifest: Dict[str, Any]):
+        self._store = store
+        self.ref = ref
+        self.row_count = manifest["rows"]
+        self.columns = manifest["columns"]
+        self._chunks = manifest["chunks"]
+
+    def __len__(self) -> int:
+        return self.row_count
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        for digest in self._chunks:
+            yield from decode_value(self._store._read(digest))
+
+    def head(self, n: int) -> List[Dict[str, Any]]:
+        """前 n 行（只读取需要的块）"""
+        return list(islice(self, n))
+
+    def to_list(self) -> List[Dict[str, Any]]:
+        return list(self)
+
+
+class ResultStore:
+    """
+    内容寻址的结果存储
+
+    目录结构：<directory>/<哈希前两位>/<哈希其余部分>，写入先写临时文件再 rename。
+    """
+
+    def __init__(self, directory: str, chunk_rows: int = 1024):
+        """
+        Args:
+            directory: 存储目录
+            chunk_rows: 每块的行数
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.chunk_rows = chunk_rows
+
+        self.writes = 0
+        self.deduplicated = 0
+        self.reads = 0
+
+    def _path(self, digest: str) -> str:
+        return os.path.join(self.directory, digest[:2], digest[2:])
+
+    def _write(self, blob: bytes) -> str:
+        digest = hashlib.blake2b(blob, digest_size=20).hexdigest()
+        path = self._path(digest)
+        if os.path.exists(path):
+            self.deduplicated += 1
+            return digest
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(blob)
+        os.replace(tmp_path, path)
+        self.writes += 1
+        return digest
+
+    def _read(self, digest: str) -> bytes:
+        self.reads += 1
+        with open(self._path(digest), "rb") as f:
+            return f.read()
+
+    def __contains__(self, ref: str) -> bool:
+        return os.path.exists(self._path(ref))
+
+    def put(self, rows: Iterable[Dict[str, Any]]) -> str:
+        """
+        存储结果（可以是迭代器，按块写入）
+
+        Returns:
+            str: 结果的引用（清单的哈希）
+        """
+        rows = iter(rows)
+        chunks = []
+        count = 0
+        columns: Optional[List[str]] = None
+        while True:
+            chunk = list(islice(rows, self.chunk_rows))
+            if not chunk:
+                break
+            if columns is None and isinstance(chunk[0], dict):
+                columns = list(chunk[0])
+            chunks.append(self._write(encode_value(chunk)))
+            count += len(chunk)
+        manifest = {"rows": count, "columns": columns or [], "chunks": chunks}
+        return self._write(encode_value(manifest))
+
+    def open(self, ref: str) -> Optional[StoredResult]:
+        """打开结果；不存在时返回 None（只读取清单）"""
+        if ref not in self:
+            return None
+        return StoredResult(self, ref, decode_value(self._read(ref)))
+
+    def gc(self, live_refs: Iterable[str]) -> int:
+        """
+        删除不被 live_refs 中任何结果引用的对象
+
+        Returns:
+            int: 删除的对象数
+        """
+        live: Set[str] = set()
+        for ref in live_refs:
+            if ref in self:
+                live.add(ref)
+                live.update(decode_value(self._read(ref))["chunks"])
+        removed = 0
+        for prefix in os.listdir(self.directory):
+            folder = os.path.join(self.directory, prefix)
+            if not os.path.isdir(folder):
+                continue
+            for name in os.listdir(folder):
+                if name.endswith(".tmp") or prefix + name in live:
+                    continue
+                os.remove(os.path.join(folder, name))
+                removed += 1
+        return removed
+
+    def get_stats(self) -> Dict[str, Any]:
+        objects = 0
+        size = 0
+        for prefix in os.listdir(self.directory):
+            folder = os.path.join(self.directory, prefix)
+            if os.path.isdir(folder):
+                for name in os.listdir(folder):
+                    objects += 1
+                    size += os.path.getsize(os.path.join(folder, name))
+        return {
+            "directory": self.directory,
+            "objects": objects,
+            "bytes": size,
+            "writes": self.writes,
+            "deduplicated": self.deduplicated,
+            "reads": self.reads,
+        }
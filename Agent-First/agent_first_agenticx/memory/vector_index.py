@@ -0,0 +1,331 @@
+"""
+进程内近似最近邻索引（IVF-Flat）
+
+- 向量归一化后按内积（余弦相似度）检索
+- 向量按最近的聚类中心分到倒排列表，查询只扫描最近的 nprobe 个列表
+- 数量较少时不分列表（精确检索）；规模每增长 4 倍重新训练一次聚类中心，摊还 O(1)
+- 支持增量插入、删除（列表内与末尾交换，O(1)）、按租户过滤，以及整体保存 / 加载
+"""
+
+import math
+import os
+import pickle
+from typing import Any, Dict, Hashable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+class _InvertedList:
+    """一个倒排列表：连续存放的向量（容量按倍数增长）及对应的键、租户编号"""
+
+    __slots__ = ("vectors", "tenants", "keys", "size")
+
+    def __init__(self, dim: int, capacity: int = 16):
+        self.vectors = np.empty((capacity, dim), dtype=np.float32)
+        self.tenants = np.empty(capacity, dtype=np.int32)
+        self.keys: List[Hashable] = []
+        self.size = 0
+
+    def append(self, vector: np.ndarray, key: Hashable, tenant: int) -> int:
+        if self.size == len(self.vectors):
+            capacity = max(16, len(self.vectors) * 2)
+            vectors = np.empty((capacity, self.vectors.shape[1]), dtype=np.float32)
+            vectors[:self.size] = self.vectors[:self.size]
+            tenants = np.empty(capacity, dtype=np.int32)
+            tenants[:self.size] = self.tenants[:self.size]
+            self.vectors, self.tenants = vectors, tenants
+        position = self.size
+        self.vectors[position] = vector
+        self.tenants[position] = tenant
+        self.keys.append(key)
+        self.size += 1
+        return position
+
+    def remove(self, position: int) -> Optional[Hashable]:
+        """删除一个位置，末尾的元素移过来填补；返回被移动的键（删除的就是末尾时为 None）"""
+        last = self.size - 1
+        moved = None
+        if position != last:
+            self.vectors[position] = self.vectors[last]
+            self.tenants[position] = self.tenants[last]
+            moved = self.keys[position] = self.keys[last]
+        self.keys.pop()
+        self.size = last
+        return moved
+
+
+class IVFFlatIndex:
+    """
+    IVF-Flat 向量索引
+
+    键可以是任意可哈希（可 pickle）的对象；没有租户的向量用 tenant=None 插入，
+    查询时 tenant=None 表示不过滤。
+    """
+
+    def __init__(
+        self,
+        dim: int,
+        nprobe: int = 8,
+        train_threshold: int = 4096,
+        max_lists: int = 4096,
+        auto_train: bool = True,
+        seed: int = 0
+    ):
+        """
+        Args:
+            dim: 向量维度
+            nprobe: 每次查询扫描的倒排列表数
+            train_threshold: 向量数达到该值后才分列表（之前为精确检索）
+            max_lists: 倒排列表数上限（列表数取 4 * sqrt(n)）
+            auto_train: 规模增长 4 倍时是否在 add 中自动重新训练
+            seed: 聚类的随机种子
+        """
+        self.dim = dim
+        self.nprobe = nprobe
+        self.train_threshold = train_threshold
+        self.max_lists = max_lists
+        self.auto_train = auto_train
+        self._rng = np.random.RandomState(seed)
+        self._centroids: Optional[np.ndarray] = None
+        self._lists: List[_InvertedList] = [_InvertedList(dim)]
+        # 键 -> (列表号, 列表内位置)
+        self._locations: Dict[Hashable, Tuple[int, int]] = {}
+        self._tenant_codes: Dict[Any, int] = {None: 0}
+        self._trained_size = 0
+
+    def __len__(self) -> int:
+        return len(self._locations)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._locations
+
+    @property
+    def nlist(self) -> int:
+        return len(self._lists)
+
+    def _normalize(self, vector: Sequence[float]) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32).reshape(-1)
+        if vector.shape[0] != self.dim:
+            raise ValueError(f"向量维度不匹配: {vector.shape[0]}（索引为 {self.dim}）")
+        norm = float(np.linalg.norm(vector))
+        return vector / norm if norm > 0 else vector
+
+    def _assign(self, vector: np.ndarray) -> int:
+        if self._centroids is None:
+            return 0
+        return int(np.argmax(self._centroids @ vector))
+
+    def add(self, key: Hashable, vector: Sequence[float], tenant: Any = None):
+        """插入向量；键已存在时替换"""
+        vector = self._normalize(vector)
+        if key in self._locations:
+            self.remove(key)
+        code = self._tenant_codes.get(tenant)
+        if code is None:
+            code = self._tenant_codes[tenant] = len(self._tenant_codes)
+        list_no = self._assign(vector)
+        position = self._lists[list_no].append(vector, key, code)
+        self._locations[key] = (list_no, position)
+
+        size = len(self._locations)
+        if self.auto_train and size >= self.train_threshold and size >= 4 * self._trained_size:
+            self.train()
+
+    def remove(self, key: Hashable) -> bool:
+        """删除向量，返回键是否存在"""
+        location = self._locations.pop(key, None)
+        if location is None:
+            return False
+        list_no, position = location
+        moved = self._lists[list_no].remove(position)
+        if moved is not None:
+            self._locations[moved] = (list_no, position)
+        return True
+
+    def search(
+        self,
+        vector: Sequence[float],
+        k: int = 5,
+        tenant: Any = None,
+        min_score: float = -1.0,
+        nprobe: Optional[int] = None
+    ) -> List[Tuple[Hashable, float]]:
+        """
+        查找最相似的 k 个向量
+
+        Args:
+            vector: 查询向量
+            k: 返回数量
+            tenant: 只返回该租户的向量；None 表示不过滤
+            min_score: 最低余弦相似度
+            nprobe: 扫描的列表数，默认使用构造时的 nprobe。
+                按租户过滤后找到的向量不足 k 个时最多再扫描到 4 倍
+
+        Returns:
+            List[(键, 相似度)]，按相似度从高到低
+        """
+        query = self._normalize(vector)
+        code = None
+        if tenant is not None:
+            code = self._tenant_codes.get(tenant)
+            if code is None:
+                return []
+        nprobe = nprobe or self.nprobe
+        if self._centroids is None:
+            order: Sequence[int] = [0]
+        else:
+            # 最多扫描 4 * nprobe 个列表，只对这些中心排序
+            similarity = self._centroids @ query
+            limit = min(4 * nprobe, len(similarity))
+            order = np.argpartition(-similarity, limit - 1)[:limit]
+            order = order[np.argsort(-similarity[order])]
+
+        best_scores: List[np.ndarray] = []
+        best_keys: List[Tuple[_InvertedList, np.ndarray]] = []
+        seen = 0
+        for probed, list_no in enumerate(order):
+            if probed >= nprobe and (code is None or seen >= k or probed >= 4 * nprobe):
+                break
+            inverted = self._lists[list_no]
+            if not inverted.size:
+                continue
+            scores = inverted.vectors[:inverted.size] @ query
+            mask = scores >= min_score
+            if code is not None:
+                tenant_mask = inverted.tenants[:inverted.size] == code
+                seen += int(np.count_nonzero(tenant_mask))
+                mask &= tenant_mask
+            positions = np.flatnonzero(mask)
+            if not len(positions):
+                continue
+            if len(positions) > k:
+                positions = positions[np.argpartition(-scores[positions], k - 1)[:k]]
+            best_scores.append(scores[positions])
+            best_keys.append((inverted, positions))
+
+        if not best_scores:
+            return []
+        scores = np.concatenate(best_scores)
+        owners = [(inverted, position) for inverted, positions in best_keys for position in positions]
+        top = np.argsort(-scores, kind="stable")[:k]
+        return [(owners[i][0].keys[owners[i][1]], float(scores[i])) for i in top]
+
+    def train(self, iterations: int = 8):
+        """
+        用当前的全部向量训练聚类中心（球面 k-means），并把向量重新分到列表
+
+        列表数取 4 * sqrt(n)，不超过 max_lists；向量数不足 train_threshold 时退回单个列表。
+        """
+        size = len(self._locations)
+        self._trained_size = size
+        vectors, tenants, keys = self._gather()
+        nlist = min(self.max_lists, int(4 * math.sqrt(size)))
+        if size < self.train_threshold or nlist < 2:
+            self._centroids = None
+            assignment = np.zeros(size, dtype=np.int64)
+            nlist = 1
+        else:
+            # 每个中心约 32 个样本足以收敛到可用的划分
+            sample_size = min(size, nlist * 32)
+            sample = vectors[self._rng.choice(size, sample_size, replace=False)]
+            centroids = sample[self._rng.choice(sample_size, nlist, replace=False)].copy()
+            for _ in range(iterations):
+                labels = np.argmax(sample @ centroids.T, axis=1)
+                counts = np.bincount(labels, minlength=nlist)
+                # 按中心排序后分段求和
+                starts = np.cumsum(counts) - counts
+                empty = counts == 0
+                sums = np.zeros_like(centroids)
+                sums[~empty] = np.add.reduceat(sample[np.argsort(labels, kind="stable")], starts[~empty])
+                if empty.any():
+                    # 空的中心重新从样本中取点
+                    sums[empty] = sample[self._rng.choice(sample_size, int(empty.sum()), replace=False)]
+                norms = np.linalg.norm(sums, axis=1, keepdims=True)
+                centroids = sums / np.maximum(norms, 1e-12)
+            self._centroids = centroids.astype(np.float32)
+            assignment = np.empty(size, dtype=np.int64)
+            for start in range(0, size, 65536):
+                chunk = vectors[start:start + 65536]
+                assignment[start:start + len(chunk)] = np.argmax(chunk @ self._centroids.T, axis=1)
+        self._rebuild(vectors, tenants, keys, assignment, nlist)
+
+    def _gather(self) -> Tuple[np.ndarray, np.ndarray, List[Hashable]]:
+        vectors = np.concatenate([inverted.vectors[:inverted.size] for inverted in self._lists])
+        tenants = np.concatenate([inverted.tenants[:inverted.size] for inverted in self._lists])
+        keys = [key for inverted in self._lists for key in inverted.keys]
+        return vectors, tenants, keys
+
+    def _rebuild(self, vectors: np.ndarray, tenants: np.ndarray, keys: List[Hashable], assignment: np.ndarray, nlist: int):
+        order = np.argsort(assignment, kind="stable")
+        bounds = np.searchsorted(assignment[order], np.arange(nlist + 1))
+        lists = []
+        locations = {}
+        for list_no in range(nlist):
+            members = order[bounds[list_no]:bounds[list_no + 1]]
+            inverted = _InvertedList(self.dim, max(16, len(members) + len(members) // 4))
+            inverted.vectors[:len(members)] = vectors[members]
+            inverted.tenants[:len(members)] = tenants[members]
+            inverted.keys = [keys[i] for i in members]
+            inverted.size = len(members)
+            for position, key in enumerate(inverted.keys):
+                locations[key] = (list_no, position)
+            lists.append(inverted)
+        self._lists = lists
+        self._locations = locations
+
+    def save(self, path: str):
+        """原子地保存索引（先写临时文件再 rename）"""
+        vectors, tenants, keys = self._gather()
+        state = {
+            "dim": self.dim,
+            "nprobe": self.nprobe,
+            "train_threshold": self.train_threshold,
+            "max_lists": self.max_lists,
+            "auto_train": self.auto_train,
+            "centroids": self._centroids,
+            "vectors": vectors,
+            "tenants": tenants,
+            "keys": keys,
+            "assignment": np.concatenate([
+                np.full(inverted.size, list_no, dtype=np.int64) for list_no, inverted in enumerate(self._lists)
+            ]),
+            "tenant_codes": self._tenant_codes,
+            "trained_size": self._trained_size,
+        }
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "IVFFlatIndex":
+        """加载 save 保存的索引"""
+        with open(path, "rb") as f:
+            state = pickle.load(f)
+        index = cls(
+            state["dim"],
+            nprobe=state["nprobe"],
+            train_threshold=state["train_threshold"],
+            max_lists=state["max_lists"],
+            auto_train=state["auto_train"]
+        )
+        index._centroids = state["centroids"]
+        index._tenant_codes = state["tenant_codes"]
+        index._trained_size = state["trained_size"]
+        nlist = 1 if index._centroids is None else len(index._centroids)
+        index._rebuild(state["vectors"], state["tenants"], state["keys"], state["assignment"], nlist)
+        return index
+
+    def get_stats(self) -> Dict[str, Any]:
+        sizes = [inverted.size for inverted in self._lists]
+        return {
+            "vectors": len(self._locations),
+            "dim": self.dim,
+            "nlist": len(self._lists),
+            "nprobe": self.nprobe,
+            "max_list_size": max(sizes) if sizes else 0,
+            "tenants": len(self._tenant_codes) - 1,
+            "trained_size": self._trained_size,
+        }
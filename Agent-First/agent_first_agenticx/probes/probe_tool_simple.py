@@ -7,6 +7,15 @@ Probe Query Tool - 简化版本
 import time
 from typing import Any, Dict, Optional
 from .models import ProbeRequest, ProbeResponse, QueryStage, PrecisionLevel
+from .single_flight import SingleFlight, probe_key
+
+try:
+    from ..storage.fingerprint import fingerprint_sql
+    from ..storage.subsumption import derive_query, derive_result
+except ImportError:
+    # probes 作为顶层包导入时（demo.py、examples）
+    from storage.fingerprint import fingerprint_sql
+    from storage.subsumption import derive_query, derive_result
 
 
 class ProbeQueryTool:
@@ -30,6 +39,9 @@ class ProbeQueryTool:
         self.llm_provider = llm_provider
         self.query_count = 0
         self.cache_hits = 0
+        self.derived_hits = 0
+        # 进行中的 Probe，按规范化的请求合并
+        self._in_flight = SingleFlight()
     
     async def aexecute(
         self,
@@ -62,32 +74,17 @@ class ProbeQueryTool:
         )
         
         try:
-            # 1. 检查语义缓存
-            if self.memory_store:
-                cached = await self._check_semantic_cache(probe_request)
-                if cached:
-                    self.cache_hits += 1
-                    cached.was_cached = True
-                    cached.execution_time = time.time() - start_time
-                    return cached.model_dump()
-            
-            # 2. 根据阶段优化查询
-            probe_request = self._optimize_for_stage(probe_request)
-            
-            # 3. 执行查询
-            response = await self._execute_query(probe_request)
-            
-            # 4. 生成建议
-            response = self._generate_suggestions(response, probe_request)
-            
-            # 5. 缓存结果
-            if self.memory_store and response.success:
-                await self._cache_result(probe_request, response)
+            # 相同的 Probe 正在执行时等待同一个结果
+            key = probe_key(natural_query, probe_request.stage.value, probe_request.precision.value, context)
+            response, shared = await self._in_flight.do(key, lambda: self._run_probe(probe_request))
             
-            self.query_count += 1
-            response.execution_time = time.time() - start_time
-            
-            return response.model_dump()
+            update = {
+                "request_id": probe_request.request_id,
+                "execution_time": time.time() - start_time
+            }
+            if shared:
+                update["metadata"] = {**response.metadata, "coalesced": True}
+            return response.model_copy(update=update).model_dump()
             
         except Exception as e:
             # 错误处理
@@ -101,6 +98,35 @@ class ProbeQueryTool:
                 suggestions=self._generate_error_suggestions(e)
             ).model_dump()
     
+    async def _run_probe(self, probe_request: ProbeRequest) -> ProbeResponse:
+        """Probe 的完整执行流程"""
+        # 1. 检查语义缓存
+        if self.memory_store:
+            cached = await self._check_semantic_cache(probe_request)
+            if cached:
+                self.cache_hits += 1
+                cached.was_cached = True
+                return cached
+        
+        # 指纹键按优化前的精度计算，与查找时一致
+        sql_key = self._sql_cache_key(probe_request)
+        
+        # 2. 根据阶段优化查询
+        probe_request = self._optimize_for_stage(probe_request)
+        
+        # 3. 执行查询
+        response = await self._execute_query(probe_request)
+        
+        # 4. 生成建议
+        response = self._generate_suggestions(response, probe_request)
+        
+        # 5. 缓存结果
+        if self.memory_store and response.success:
+            await self._cache_result(probe_request, response, sql_key)
+        
+        self.query_count += 1
+        return response
+    
     def execute(self, **kwargs) -> Dict[str, Any]:
         """同步执行"""
         import asyncio
@@ -117,16 +143,132 @@ class ProbeQueryTool:
         if not self.memory_store:
             return None
         
+        # 已有 SQL 时先按指纹精确匹配，再尝试由缓存的超集结果推导，都不需要向量检索
+        cached = await self._check_sql_cache(request) or await self._check_derived_cache(request)
+        if cached:
+            return cached
+        
         similar_queries = await self.memory_store.find_similar_probes(
             request.natural_query,
             threshold=0.8
         )
         
-        if similar_queries:
-            return similar_queries[0]
+        if not similar_queries:
+            return None
         
+        match = similar_queries[0]
+        return self._response_from_cache(request, match, {
+            "cache_hit": "semantic",
+            "similarity": match.score,
+            "cached_query": match.content
+        })
+    
+    def _sql_cache_key(self, request: ProbeRequest) -> Optional[str]:
+        """SQL 指纹键：规范化 SQL 的指纹 + 阶段 + 精度 + 行数上限；没有 SQL 时为 None"""
+        if not request.sql_query:
+            return None
+        fingerprint = fingerprint_sql(request.sql_query)
+        if fingerprint is None:
+            return None
+        return f"{fingerprint.digest}:{request.stage.value}:{request.precision.value}:{request.max_rows}"
+    
+    def _sql_table(self, request: ProbeRequest) -> Optional[str]:
+        """SQL 读取的表；无法解析时为 None"""
+        fingerprint = fingerprint_sql(request.sql_query) if request.sql_query else None
+        if fingerprint is None or fingerprint.query is None:
+            return None
+        return fingerprint.query.table
+    
+    async def _check_sql_cache(self, request: ProbeRequest) -> Optional[ProbeResponse]:
+        """按 SQL 指纹精确匹配缓存（关键字大小写、空白、谓词顺序不同的 SQL 视为相同）"""
+        sql_key = self._sql_cache_key(request)
+        if sql_key is None:
+            return None
+        match = self.memory_store.find_probe_by_fingerprint(sql_key)
+        if match is None:
+            return None
+        return self._response_from_cache(request, match, {
+            "cache_hit": "fingerprint",
+            "similarity": 1.0,
+            "cached_query": match.content
+        })
+    
+    async def _check_derived_cache(self, request: ProbeRequest) -> Optional[ProbeResponse]:
+        """由读同一张表的缓存结果在本地计算（更严格的条件、更小的 LIMIT、更粗的分组）"""
+        fingerprint = fingerprint_sql(request.sql_query) if request.sql_query else None
+        if fingerprint is None or fingerprint.query is None:
+            return None
+        
+        for match in self.memory_store.find_probes_by_table(fingerprint.query.table):
+            metadata = match.metadata
+            cached_precision = metadata.get("precision")
+            cached_precision = getattr(cached_precision, "value", cached_precision)
+            if not metadata.get("success", True) or \
+                    cached_precision not in (PrecisionLevel.EXACT.value, request.precision.value):
+                continue
+            rows_returned = metadata.get("rows_returned") or 0
+            if metadata.get("max_rows") and rows_returned >= metadata["max_rows"]:
+                # 结果可能被 max_rows 截断
+                continue
+            cached = fingerprint_sql(metadata.get("sql_query") or "")
+            if cached is None or cached.query is None:
+                continue
+            
+            # 需要完整结果：优先读结果存储，预览只在包含全部行时可用
+            stored = self.memory_store.open_probe_result(metadata)
+            if stored is not None:
+                rows, columns = stored, stored.columns
+            else:
+                rows = metadata.get("response_data") or []
+                if len(rows) < rows_returned:
+                    continue
+                columns = list(rows[0]) if rows else []
+            query = derive_query(cached, fingerprint, rows_returned, columns)
+            if query is None:
+                continue
+            
+            result = derive_result(query, rows)
+            self.derived_hits += 1
+            return ProbeResponse(
+                request_id=request.request_id,
+                success=True,
+                data=result.rows,
+                executed_sql=request.sql_query,
+                rows_returned=len(result.rows),
+                rows_scanned=result.rows_scanned,
+                actual_precision=PrecisionLevel(cached_precision),
+                confidence=metadata.get("confidence", 1.0),
+                is_approximate=cached_precision != PrecisionLevel.EXACT.value,
+                metadata={
+                    "cache_hit": "derived",
+                    "cached_query": match.content,
+                    "cached_sql": metadata.get("sql_query")
+                }
+            )
         return None
     
+    def _response_from_cache(
+        self,
+        request: ProbeRequest,
+        match,
+        cache_metadata: Dict[str, Any]
+    ) -> ProbeResponse:
+        """用缓存记录构造响应；有完整结果时从结果存储读取，否则只有前 10 行预览"""
+        metadata = match.metadata
+        stored = self.memory_store.open_probe_result(metadata)
+        data = stored.to_list() if stored is not None else metadata.get("response_data") or []
+        rows_returned = metadata.get("rows_returned") or len(data)
+        return ProbeResponse(
+            request_id=request.request_id,
+            success=metadata.get("success", True),
+            data=data,
+            executed_sql=metadata.get("sql_query"),
+            rows_returned=rows_returned,
+            confidence=metadata.get("confidence", 1.0),
+            is_approximate=len(data) < rows_returned,
+            metadata=cache_metadata
+        )
+    
     def _optimize_for_stage(self, request: ProbeRequest) -> ProbeRequest:
         """根据查询阶段优化请求"""
         if request.stage == QueryStage.METADATA_EXPLORATION:
@@ -187,13 +329,17 @@ class ProbeQueryTool:
         """生成错误建议"""
         return ["查询执行失败，请检查查询语句和数据库连接"]
     
-    async def _cache_result(self, request: ProbeRequest, response: ProbeResponse):
+    async def _cache_result(self, request: ProbeRequest, response: ProbeResponse, sql_key: Optional[str] = None):
         """缓存查询结果"""
         if not self.memory_store:
             return
         
         await self.memory_store.cache_probe_result(
-            probe_request=request.model_dump(),
+            probe_request={
+                **request.model_dump(),
+                "sql_fingerprint": sql_key,
+                "sql_table": self._sql_table(request)
+            },
             probe_response=response.model_dump()
         )
     
@@ -203,6 +349,9 @@ class ProbeQueryTool:
             "total_queries": self.query_count,
             "cache_hits": self.cache_hits,
             "cache_hit_rate": self.cache_hits / self.query_count if self.query_count > 0 else 0,
-            "redundancy_savings": f"{(self.cache_hits / self.query_count * 100):.1f}%" if self.query_count > 0 else "0%"
+            "redundancy_savings": f"{(self.cache_hits / self.query_count * 100):.1f}%" if self.query_count > 0 else "0%",
+            "derived_hits": self.derived_hits,
+            "coalesced_requests": self._in_flight.coalesced,
+            "in_flight": len(self._in_flight)
         }
 
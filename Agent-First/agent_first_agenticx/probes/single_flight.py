@@ -0,0 +1,100 @@
+"""
+并发请求合并（single-flight）
+
+同一个键的并发调用只执行一次：第一个调用方启动执行，之后到达的调用方
+等待同一个结果。执行结束（成功或异常）后键被移除，之后的调用重新执行
+（结果复用由缓存负责）。
+
+- 异常传播给所有等待的调用方
+- 单个调用方被取消只影响它自己；所有调用方都取消后执行本身被取消
+"""
+
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+
+class _Call:
+    """一次进行中的执行"""
+
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """按键合并并发的异步调用"""
+
+    def __init__(self):
+        self._calls: Dict[Hashable, _Call] = {}
+        self.executions = 0
+        self.coalesced = 0
+
+    def __len__(self) -> int:
+        """进行中的执行数"""
+        return len(self._calls)
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """
+        执行 fn()，同一键已有进行中的执行时等待其结果
+
+        Args:
+            key: 合并键
+            fn: 无参协程函数，只有第一个调用方的 fn 被执行
+
+        Returns:
+            (结果, 是否等待了其他调用方启动的执行)
+
+        Raises:
+            执行抛出的异常（所有等待者都会收到）
+        """
+        call = self._calls.get(key)
+        shared = call is not None
+        if shared:
+            self.coalesced += 1
+        else:
+            call = self._calls[key] = _Call(asyncio.ensure_future(fn()))
+            call.task.add_done_callback(lambda task: self._forget(key, task))
+            self.executions += 1
+
+        call.waiters += 1
+        try:
+            # shield：调用方被取消时不取消共享的执行
+            return await asyncio.shield(call.task), shared
+        finally:
+            call.waiters -= 1
+            if not call.waiters and not call.task.done():
+                # 所有调用方都已取消，结果不再有人需要；立即移除，之后的调用重新执行
+                self._forget(key, call.task)
+                call.task.cancel()
+
+    def _forget(self, key: Hashable, task: asyncio.Task):
+        call: Optional[_Call] = self._calls.get(key)
+        if call is not None and call.task is task:
+            del self._calls[key]
+        if task.done() and not task.cancelled():
+            # 标记异常已被读取（调用方都已离开时避免 "never retrieved" 警告）
+            task.exception()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "in_flight": len(self._calls),
+            "executions": self.executions,
+            "coalesced": self.coalesced,
+        }
+
+
+def probe_key(natural_query: str, stage: str, precision: str, context: str = "") -> Tuple[str, str, str, str]:
+    """
+    Probe 请求的合并键
+
+    自然语言查询和上下文忽略大小写和多余空白；阶段和精度区分，
+    因为它们决定了执行计划和结果精度。
+    """
+    return (
+        " ".join(natural_query.casefold().split()),
+        str(stage),
+        str(precision),
+        " ".join(context.casefold().split()),
+    )
@@ -4,9 +4,15 @@ Storage 扩展 - Git 式分支管理
 
 from .branch_manager import BranchManager
 from .cow_engine import CopyOnWriteEngine
+from .fingerprint import SQLFingerprint, fingerprint_sql
+from .subsumption import derive_query, derive_result
 
 __all__ = [
     "BranchManager",
     "CopyOnWriteEngine",
+    "SQLFingerprint",
+    "fingerprint_sql",
+    "derive_query",
+    "derive_result",
 ]
 
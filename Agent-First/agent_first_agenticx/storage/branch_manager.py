@@ -4,45 +4,641 @@ Git 式分支管理器 - 扩展 AgenticX Storage
 支持大规模并行的 what-if 探索
 """
 
-from typing import Any, Dict, Optional
+import asyncio
+import bisect
+import gc
+import inspect
+import multiprocessing
+import os
+import threading
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple, Union
 from datetime import datetime
 from .cow_engine import CopyOnWriteEngine
+from .persistent import MISSING, PersistentMap, PersistentVector, diff_vectors
+from .registry import BranchRegistry
+from .wal import WriteAheadLog, load_checkpoint, write_checkpoint
 
 
 class Branch:
     """数据分支"""
     
-    def __init__(self, branch_id: str, parent: Optional[str], name: str):
+    def __init__(
+        self,
+        branch_id: str,
+        parent: Optional[str],
+        name: str,
+        snapshot: Optional[PersistentMap] = None,
+        views: Optional[Dict[str, Any]] = None
+    ):
+        """
+        Args:
+            branch_id: 分支 ID
+            parent: 父分支 ID
+            name: 分支名称
+            snapshot: 分叉时父分支的快照（同时作为当前快照和合并基准），默认为空
+            views: 分叉时父分支的视图
+        """
         self.id = branch_id
         self.parent = parent
         self.name = name
         self.created_at = datetime.now()
-        self.data_snapshot = {}
+        # 快照节点的引用计数，由 BranchManager 注入；替换快照时 retain 新根、release 旧根
+        self.cow_engine: Optional[CopyOnWriteEngine] = None
+        if snapshot is None:
+            snapshot = PersistentMap()
+        # 表名 -> PersistentVector，与父分支结构共享
+        self._data_snapshot = snapshot
+        # 分叉时父分支的快照（三路合并的默认基准）
+        self._base_snapshot = snapshot
+        # 目标分支 ID -> 上次合并后的 MergeBase
+        self.merge_bases: Dict[str, "MergeBase"] = {}
+        # 视图名 -> MaterializedView；分叉时子分支共享父分支的视图对象
+        # （字典本身不原地修改，历史版本可以直接引用）
+        self.views: Dict[str, Any] = views if views is not None else {}
+        # 当前版本号（已应用的操作数）及其生效时间（None 表示 created_at）
+        self.version = 0
+        self.version_time: Optional[datetime] = None
+        # 历史版本（按版本号递增，不含当前版本），快照与当前版本结构共享
+        self.versions: List["Version"] = []
+        # 最多保留的历史版本数，None 表示不限
+        self.max_versions: Optional[int] = None
         self.operations = []
+        # 操作日志回调 (branch_id, operation)：同步分配序号，返回落盘时完成的 Future；由 BranchManager 注入
+        self.journal: Optional[Callable[[str, Dict[str, Any]], Optional[Awaitable[None]]]] = None
+        # 写入回调 (branch_id, 新版本号, 内容变化的表)，由 BranchManager 注入
+        self.on_write: Optional[Callable[[str, Optional[int], Optional[Tuple[str, ...]]], None]] = None
+    
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["journal"] = None
+        state["cow_engine"] = None
+        state["on_write"] = None
+        return state
+    
+    @property
+    def data_snapshot(self) -> PersistentMap:
+        return self._data_snapshot
+    
+    @data_snapshot.setter
+    def data_snapshot(self, snapshot: PersistentMap):
+        if self.cow_engine is not None:
+            self.cow_engine.replace(self._data_snapshot, snapshot)
+        self._data_snapshot = snapshot
+    
+    @property
+    def base_snapshot(self) -> PersistentMap:
+        return self._base_snapshot
     
-    async def update(self, table: str, data: Dict[str, Any]):
-        """在分支上更新数据"""
-        if table not in self.data_snapshot:
-            self.data_snapshot[table] = []
+    @base_snapshot.setter
+    def base_snapshot(self, snapshot: PersistentMap):
+        if self.cow_engine is not None:
+            self.cow_engine.replace(self._base_snapshot, snapshot)
+        self._base_snapshot = snapshot
+    
+    def snapshot_roots(self) -> List[PersistentMap]:
+        """分支持有的全部快照根（当前快照放在最后）"""
+        roots = [self._base_snapshot]
+        for merge_base in self.merge_bases.values():
+            roots.append(merge_base.source_snapshot)
+            roots.append(merge_base.target_snapshot)
+        roots.extend(version.snapshot for version in self.versions)
+        roots.append(self._data_snapshot)
+        return roots
+    
+    def version_at(self, as_of: Union[int, datetime]) -> "Version":
+        """
+        查找某个时刻的版本
+        
+        Args:
+            as_of: 版本号（应用了多少条操作之后），或时间点（该时刻最新的版本）
+            
+        Returns:
+            Version: 包括当前版本
+            
+        Raises:
+            ValueError: 版本不存在或已超出保留范围
+        """
+        current = Version(self.version, self.version_time or self.created_at, self.data_snapshot, self.views)
+        if isinstance(as_of, datetime):
+            if as_of >= current.timestamp:
+                return current
+            # 版本生效时间单调递增
+            index = bisect.bisect_right([version.timestamp for version in self.versions], as_of)
+            if not index:
+                raise ValueError(f"{as_of} 早于最早保留的版本")
+            return self.versions[index - 1]
         
-        self.data_snapshot[table].append(data)
-        self.operations.append({
+        if as_of == self.version:
+            return current
+        first = self.versions[0].seq if self.versions else self.version
+        if not first <= as_of < self.version:
+            raise ValueError(f"版本不存在或已不再保留: {as_of}")
+        # 版本号连续，直接按偏移定位
+        return self.versions[as_of - first]
+    
+    def _commit(self, snapshot: PersistentMap, views: Dict[str, Any], timestamp: Optional[datetime]):
+        """把当前状态存为历史版本，切换到新快照和视图"""
+        previous = Version(self.version, self.version_time or self.created_at, self.data_snapshot, self.views)
+        if self.cow_engine is not None:
+            # 历史版本持有旧快照，替换快照时旧快照不会被释放
+            self.cow_engine.retain(previous.snapshot)
+        self.versions.append(previous)
+        self.version += 1
+        self.version_time = max(previous.timestamp, timestamp or datetime.now())
+        self.views = views
+        self.data_snapshot = snapshot
+        
+        if self.max_versions is not None and len(self.versions) > self.max_versions:
+            expired = self.versions[:len(self.versions) - self.max_versions]
+            del self.versions[:len(expired)]
+            if self.cow_engine is not None:
+                for version in expired:
+                    self.cow_engine.release(version.snapshot)
+    
+    async def update(
+        self,
+        table: str,
+        data: Dict[str, Any],
+        row: Optional[int] = None
+    ):
+        """
+        在分支上更新数据
+        
+        Args:
+            table: 表名
+            data: 行数据
+            row: 要替换的行号；为 None 时追加新行
+        """
+        operation = {
             "type": "update",
             "table": table,
             "data": data,
             "timestamp": datetime.now()
-        })
+        }
+        if row is not None:
+            operation["row"] = row
+        
+        self.apply_operation(operation)
+        await self._record(operation)
+    
+    async def update_many(
+        self,
+        table: str,
+        data: Union[Mapping, Iterable[Dict[str, Any]]]
+    ):
+        """
+        批量追加行（导入 CSV、场景增量等）
+        
+        整批一次性写入：只产生一个新版本、只记录一条操作，
+        视图按整批向量化更新。data 为列数组时直接按列编码成页，不构造逐行字典。
+        传入的数组会被操作日志引用，调用后不应再原地修改。
+        
+        Args:
+            table: 表名
+            data: 列名 -> 等长的列数组（list / NumPy 数组），或行的可迭代对象
+            
+        Raises:
+            ValueError: 各列长度不一致
+        """
+        operation = {"type": "bulk_append", "table": table}
+        if isinstance(data, Mapping):
+            columns = dict(data)
+            lengths = {len(column) for column in columns.values()}
+            if len(lengths) > 1:
+                raise ValueError(f"各列长度不一致: {table}")
+            operation["columns"] = columns
+            operation["count"] = lengths.pop() if lengths else 0
+        else:
+            operation["rows"] = list(data)
+            operation["count"] = len(operation["rows"])
+        operation["timestamp"] = datetime.now()
+        
+        self.apply_operation(operation)
+        await self._record(operation)
+    
+    async def apply_changes(
+        self,
+        changes: Dict[str, Dict[str, Any]],
+        source: Optional[str] = None
+    ):
+        """
+        批量写入（合并使用）
+        
+        所有表的修改一次性替换快照，只记录一条操作。
+        
+        Args:
+            changes: {表名: {"updates": {行号: 行}, "appends": [行, ...]}}
+            source: 变更来源分支
+        """
+        operation = self.changes_operation(changes, source)
+        self.apply_operation(operation)
+        await self._record(operation)
+    
+    @staticmethod
+    def changes_operation(changes: Dict[str, Dict[str, Any]], source: Optional[str] = None) -> Dict[str, Any]:
+        """apply_changes 记录的操作"""
+        return {
+            "type": "merge",
+            "source": source,
+            "changes": changes,
+            "timestamp": datetime.now()
+        }
+    
+    async def create_view(self, name: str, sql: str):
+        """
+        注册增量物化视图
+        
+        视图在当前数据上计算一次，之后每次写入只按变化的行更新；
+        之后分叉出的子分支继承该视图。query 遇到语义相同的 SQL 时直接读取视图。
+        直接赋值 data_snapshot 不会更新视图。
+        
+        Args:
+            name: 视图名（已存在时替换）
+            sql: 聚合查询（COUNT / SUM / AVG / MIN / MAX，可带 GROUP BY）
+            
+        Raises:
+            ValueError: SQL 不是聚合查询或无法解析
+        """
+        operation = {
+            "type": "create_view",
+            "name": name,
+            "sql": sql,
+            "timestamp": datetime.now()
+        }
+        
+        self.apply_operation(operation)
+        await self._record(operation)
+    
+    async def drop_view(self, name: str):
+        """删除物化视图"""
+        if name not in self.views:
+            raise ValueError(f"视图不存在: {name}")
+        operation = {
+            "type": "drop_view",
+            "name": name,
+            "timestamp": datetime.now()
+        }
+        
+        self.apply_operation(operation)
+        await self._record(operation)
+    
+    async def revert(self, as_of: Union[int, datetime]):
+        """
+        把分支恢复到某个历史版本（数据和视图）
+        
+        恢复本身记为一条新操作，之后的版本仍然保留，可以再次恢复；
+        历史版本与当前快照结构共享，代价为 O(1)。
+        
+        Args:
+            as_of: 版本号或时间点
+            
+        Raises:
+            ValueError: 版本不存在或已超出保留范围
+        """
+        operation = {
+            "type": "revert",
+            "version": self.version_at(as_of).seq,
+            "timestamp": datetime.now()
+        }
+        
+        self.apply_operation(operation)
+        await self._record(operation)
     
-    async def query(self, sql: str) -> Dict[str, Any]:
-        """在分支上查询数据"""
-        # 简化实现
+    async def apply_operations(self, operations: List[Dict[str, Any]]):
+        """应用并记录一批已有的操作（例如 BranchManager.map 在工作进程中产生的）"""
+        pending = []
+        for operation in operations:
+            # 每条操作应用后立即提交日志（同步分配序号），最后一起等待同一次组提交
+            self.apply_operation(operation)
+            pending.append(self._submit(operation))
+        await asyncio.gather(*(waiter for waiter in pending if waiter is not None))
+    
+    def apply_operation(self, operation: Dict[str, Any]):
+        """
+        把一条操作应用到快照（同步，不记录日志；恢复时直接重放）
+        """
+        if self.views:
+            from .views import row_changes
+        
+        snapshot = self.data_snapshot
+        views = self.views
+        # 表名 -> (被替换的旧行, 写入的新行)，只在有视图时收集
+        changed: Dict[str, Tuple[List[Any], List[Any]]] = {}
+        # 批量追加：表名 -> (新行的求值环境, 行数)，视图整批向量化更新
+        appended: Dict[str, Tuple[Any, int]] = {}
+        if operation["type"] == "update":
+            table = operation["table"]
+            rows = snapshot.get(table)
+            if rows is None:
+                rows = PersistentVector()
+            # 路径复制：只产生新路径，父分支看到的数据不变
+            if operation.get("row") is None:
+                new_rows = rows.append(operation["data"])
+                updates, appends = {}, (operation["data"],)
+            else:
+                new_rows = rows.set(operation["row"], operation["data"])
+                updates, appends = {operation["row"]: operation["data"]}, ()
+            if self.views:
+                changed[table] = row_changes(rows, updates, appends)
+            snapshot = snapshot.set(table, new_rows)
+        
+        elif operation["type"] == "merge":
+            for table, change in operation["changes"].items():
+                rows = snapshot.get(table)
+                if rows is None:
+                    rows = PersistentVector()
+                updates = change.get("updates", {})
+                appends = change.get("appends", ())
+                new_rows = rows.update_many(updates, appends)
+                if self.views:
+                    changed[table] = row_changes(rows, updates, appends)
+                snapshot = snapshot.set(table, new_rows)
+        
+        elif operation["type"] == "bulk_append":
+            from .query_engine import _ArrayEnv, _ListEnv
+            
+            table = operation["table"]
+            rows = snapshot.get(table)
+            if rows is None:
+                rows = PersistentVector()
+            transient = rows.transient()
+            if "columns" in operation:
+                columns = operation["columns"]
+                transient.extend_columns(list(columns), list(columns.values()), operation["count"])
+                env = _ArrayEnv(columns, operation["count"])
+            else:
+                transient.extend(operation["rows"])
+                env = _ListEnv(operation["rows"])
+            if self.views:
+                appended[table] = (env, operation["count"])
+            snapshot = snapshot.set(table, transient.persistent())
+        
+        elif operation["type"] == "create_view":
+            from .views import MaterializedView
+            
+            views = {
+                **views,
+                operation["name"]: MaterializedView.build(operation["name"], operation["sql"], snapshot)
+            }
+        
+        elif operation["type"] == "drop_view":
+            views = {name: view for name, view in views.items() if name != operation["name"]}
+        
+        elif operation["type"] == "revert":
+            version = self.version_at(operation["version"])
+            snapshot, views = version.snapshot, version.views
+        
+        else:
+            raise ValueError(f"未知的操作类型: {operation['type']}")
+        
+        # 先算出全部视图的新状态（可能因类型不符失败），再替换快照
+        if changed:
+            views = {
+                name: view.apply(*changed[view.table]) if view.table in changed else view
+                for name, view in views.items()
+            }
+        if appended:
+            views = {
+                name: view.extend(*appended[view.table]) if view.table in appended else view
+                for name, view in views.items()
+            }
+        previous = self.data_snapshot
+        self._commit(snapshot, views, operation.get("timestamp"))
+        if self.on_write is not None:
+            tables = _changed_tables(previous, snapshot)
+            if tables:
+                self.on_write(self.id, self.version, tables)
+    
+    async def _record(self, operation: Dict[str, Any]):
+        """记录操作；配置了 WAL 时等待其落盘"""
+        waiter = self._submit(operation)
+        if waiter is not None:
+            await asyncio.shield(waiter)
+    
+    def _submit(self, operation: Dict[str, Any]) -> Optional[Awaitable[None]]:
+        """
+        记录操作并提交日志（同步，必须紧跟在 apply_operation 之后、让出事件循环之前调用）
+        
+        Returns:
+            落盘时完成的 Future；未配置 WAL 时为 None
+        """
+        self.operations.append(operation)
+        if self.journal is not None:
+            return self.journal(self.id, operation)
+        return None
+    
+    def table_digests(self) -> Dict[str, str]:
+        """
+        各表的 Merkle 根摘要
+        
+        内容相同的表摘要相同；摘要缓存在共享节点上，写入后只重新计算被复制的路径。
+        """
+        return {table: rows.digest() for table, rows in self.data_snapshot.items()}
+    
+    async def query(self, sql: str, as_of: Union[int, datetime, None] = None) -> Dict[str, Any]:
+        """
+        在分支上查询数据
+        
+        在进程内用向量化引擎执行 SQL 子集（见 query_engine），
+        只返回查询结果，不回传整个快照。
+        
+        Args:
+            sql: SQL 语句
+            as_of: 读取历史版本（版本号或时间点），默认读取当前版本
+        """
+        from .query_engine import execute_query
+        
+        try:
+            version = self.version_at(self.version if as_of is None else as_of)
+        except ValueError as e:
+            return {
+                "success": False,
+                "error": str(e),
+                "branch_id": self.id
+            }
+        
+        if version.views:
+            from .views import match_view
+            
+            # 与某个物化视图语义相同的查询直接读取视图，不扫描表
+            view = match_view(version.views.values(), sql)
+            if view is not None:
+                return {
+                    "success": True,
+                    **view.result().to_dict(),
+                    "view": view.name,
+                    "version": version.seq,
+                    "branch_id": self.id
+                }
+        
+        try:
+            result = execute_query(sql, version.snapshot)
+        except ValueError as e:
+            return {
+                "success": False,
+                "error": str(e),
+                "branch_id": self.id
+            }
+        
         return {
             "success": True,
-            "data": self.data_snapshot,
+            **result.to_dict(),
+            "version": version.seq,
             "branch_id": self.id
         }
 
 
+def _changed_tables(old: PersistentMap, new: PersistentMap) -> Tuple[str, ...]:
+    """两个快照之间被替换的表（未修改的表在快照之间共享同一个对象）"""
+    return tuple(
+        table for table in set(old) | set(new)
+        if old.get(table) is not new.get(table)
+    )
+
+
+class Version:
+    """
+    分支的一个版本
+    
+    - seq: 版本号（分支创建后应用了多少条操作）
+    - timestamp: 生效时间
+    - snapshot / views: 该版本的数据快照和物化视图（不可变，与其他版本结构共享）
+    """
+    
+    def __init__(
+        self,
+        seq: int,
+        timestamp: datetime,
+        snapshot: PersistentMap,
+        views: Dict[str, Any]
+    ):
+        self.seq = seq
+        self.timestamp = timestamp
+        self.snapshot = snapshot
+        self.views = views
+
+
+# fork 出的工作进程通过继承的内存读取父分支快照和视图，不经过 pickle
+_shared_snapshot: Optional[PersistentMap] = None
+_shared_views: Dict[str, Any] = {}
+
+
+async def _apply_scenario(
+    fn: Callable[[Branch, Any], Any],
+    scenario: Any,
+    snapshot: PersistentMap,
+    views: Optional[Dict[str, Any]] = None
+) -> Tuple[Any, List[Dict[str, Any]]]:
+    """在一个临时分支上执行场景函数，返回 (结果, 产生的操作)"""
+    branch = Branch("scenario", None, "scenario")
+    branch.data_snapshot = snapshot
+    branch.base_snapshot = snapshot
+    branch.views = views or {}
+    result = fn(branch, scenario)
+    if inspect.isawaitable(result):
+        result = await result
+    return result, branch.operations
+
+
+def _run_scenario(fn: Callable[[Branch, Any], Any], scenario: Any):
+    """工作进程入口"""
+    return asyncio.run(_apply_scenario(fn, scenario, _shared_snapshot, _shared_views))
+
+
+def _run_attached_scenario(
+    fn: Callable[[Branch, Any], Any],
+    scenario: Any,
+    shared: "SharedSnapshot",
+    views: Dict[str, Any]
+):
+    """工作进程入口（非 fork 启动）：挂载共享内存中导出的快照"""
+    from .shared import attach
+    return asyncio.run(_apply_scenario(fn, scenario, attach(shared), views))
+
+
+def _add_moved(
+    moved: Dict[str, List[Tuple[int, int, int]]],
+    extra: Dict[str, List[Tuple[int, int, int]]]
+):
+    """把行号对应并入 moved，偏移相同且重叠或相邻的区间合并为一段"""
+    for table, ranges in extra.items():
+        merged = []
+        for start, target_start, count in sorted(set(moved.get(table, [])) | set(ranges)):
+            if merged:
+                last_start, last_target, last_count = merged[-1]
+                if target_start - start == last_target - last_start and start <= last_start + last_count:
+                    merged[-1] = (last_start, last_target, max(last_count, start + count - last_start))
+                    continue
+            merged.append((start, target_start, count))
+        moved[table] = merged
+
+
+def _fork_moved(branch) -> Dict[str, List[Tuple[int, int, int]]]:
+    """子分支与父分支的行号对应：分叉时已有的行位置相同"""
+    return {table: [(0, 0, len(rows))] for table, rows in branch.base_snapshot.items() if len(rows)}
+
+
+def _compose_moved(
+    first: Dict[str, List[Tuple[int, int, int]]],
+    second: Dict[str, List[Tuple[int, int, int]]]
+) -> Dict[str, List[Tuple[int, int, int]]]:
+    """复合两段行号对应：first 为 a -> b，second 为 b -> c，得到 a -> c"""
+    composed = {}
+    for table, ranges in first.items():
+        following = second.get(table)
+        if not following:
+            continue
+        result = []
+        for a_start, b_start, count in ranges:
+            for c_from, c_start, c_count in following:
+                low = max(b_start, c_from)
+                high = min(b_start + count, c_from + c_count)
+                if low < high:
+                    result.append((a_start + low - b_start, c_start + low - c_from, high - low))
+        if result:
+            composed[table] = result
+    return composed
+
+
+class MergeBase:
+    """
+    一对 (源分支, 目标分支) 的三路合并基准
+    
+    - source_snapshot / target_snapshot: 上次合并（首次为分叉点）时两侧的快照
+    - moved: 两个分支之间互相合并过去的新增行的对应位置（两个方向都记录）
+      {表名: [(源起始行号, 目标起始行号, 行数), ...]}
+    - merged_at: 合并时间；在此之后分叉出的子分支可以沿用该基准
+    """
+    
+    def __init__(
+        self,
+        source_snapshot: PersistentMap,
+        target_snapshot: PersistentMap,
+        moved: Optional[Dict[str, List[Tuple[int, int, int]]]] = None,
+        merged_at: Optional[datetime] = None
+    ):
+        self.source_snapshot = source_snapshot
+        self.target_snapshot = target_snapshot
+        self.moved = moved or {}
+        self.merged_at = merged_at or datetime.now()
+    
+    def to_target(self, table: str, index: int) -> Optional[int]:
+        """把源分支行号换算为目标分支行号；不是合并过来（或合并过去）的行返回 None"""
+        for source_start, target_start, count in self.moved.get(table, ()):
+            if source_start <= index < source_start + count:
+                return target_start + index - source_start
+        return None
+    
+    def reversed_moved(self) -> Dict[str, List[Tuple[int, int, int]]]:
+        """反方向（目标分支合并到源分支）的行号对应"""
+        return {
+            table: [(target_start, source_start, count) for source_start, target_start, count in ranges]
+            for table, ranges in self.moved.items()
+        }
+
+
 class BranchManager:
     """
     分支管理器
@@ -52,13 +648,301 @@ class BranchManager:
     - 并行探索
     - 快速回滚
     - 分支合并
+    - 持久化（可选）：WAL + 定期检查点，重启后自动恢复
+    - 快照节点引用计数：回滚的分支独占的数据立即释放
+    - 时间旅行：按版本号或时间点读取历史版本、部分回滚（多版本快照结构共享，不重放日志）
+    - 共享内存导出：其他进程零拷贝挂载分支快照，重新导出只写变化的页
+    - 写入通知：分支内容变化（写入、合并、恢复、删除分支）时回调监听者，供缓存按表精确失效
     """
     
-    def __init__(self, storage=None):
+    def __init__(
+        self,
+        storage=None,
+        log_dir: Optional[str] = None,
+        checkpoint_interval: int = 100_000,
+        commit_delay: float = 0.0,
+        max_versions: Optional[int] = 1000,
+        shards: int = 64
+    ):
+        """
+        Args:
+            storage: AgenticX 存储后端
+            log_dir: WAL 和检查点目录；为 None 时只在内存中保存
+            checkpoint_interval: 每写入多少条日志做一次检查点
+            commit_delay: WAL 组提交等待窗口（秒）
+            max_versions: 每个分支保留的历史版本数（时间旅行读取 / 恢复），None 表示不限
+            shards: 分支注册表的分片数（2 的幂）
+        """
         self.storage = storage
-        self.branches = {"main": Branch("main", None, "main")}
+        self.max_versions = max_versions
         self.cow_engine = CopyOnWriteEngine()
-        self.branch_counter = 0
+        # 分支 ID -> 分支（分片加锁，ID 分配与登记在同一段同步代码中完成）
+        self.branches = BranchRegistry(shards)
+        # 父分支 ID -> 子分支 ID；目标分支 ID -> 记录了以它为目标的合并基准的源分支
+        self._children: Dict[str, set] = {}
+        self._merge_sources: Dict[str, set] = {}
+        # 保护分支之间的索引（_children / _merge_sources）
+        self._lock = threading.Lock()
+        # 写入监听者 (branch_id, 新版本号, 内容变化的表)；分支被删除时版本号和表均为 None
+        self._write_listeners: List[Callable[[str, Optional[int], Optional[Tuple[str, ...]]], Any]] = []
+        
+        self.checkpoint_interval = checkpoint_interval
+        self.wal: Optional[WriteAheadLog] = None
+        self._records_since_checkpoint = 0
+        self._checkpoint_task: Optional[asyncio.Task] = None
+        # 共享内存导出（首次 export_branch 时创建）
+        self._exporter = None
+        if log_dir:
+            self.wal = WriteAheadLog(log_dir, commit_delay=commit_delay)
+        
+        self._add_branch(Branch("main", None, "main"))
+        if self.wal is not None:
+            self._recover()
+    
+    @property
+    def branch_counter(self) -> int:
+        """已分配的最大分支编号"""
+        return self.branches.counter
+    
+    def _add_branch(self, branch: Branch):
+        """登记分支：注入引用计数和日志回调，并 retain 它持有的快照"""
+        self._add_branches([branch])
+    
+    def _add_branches(self, branches: List[Branch]):
+        """批量登记分支（同步完成，登记前后不让出事件循环）"""
+        journal = self._journal if self.wal is not None else None
+        with self._lock:
+            for branch in branches:
+                branch.cow_engine = self.cow_engine
+                branch.max_versions = self.max_versions
+                branch.journal = journal
+                branch.on_write = self._notify_write
+                for root in branch.snapshot_roots():
+                    self.cow_engine.retain(root)
+                for target in branch.merge_bases:
+                    self._merge_sources.setdefault(target, set()).add(branch.id)
+                if branch.parent:
+                    self._children.setdefault(branch.parent, set()).add(branch.id)
+            self.branches.add_many([(branch.id, branch) for branch in branches])
+    
+    def _remove_branch(self, branch_id: str):
+        """注销分支并 release 它持有的快照，独占的数据立即释放（分支对象随之清空）"""
+        with self._lock:
+            branch = self.branches.pop(branch_id, None)
+            if branch is None:
+                return
+            for root in branch.snapshot_roots():
+                self.cow_engine.release(root)
+            branch.cow_engine = None
+            branch.on_write = None
+            if branch.parent in self._children:
+                self._children[branch.parent].discard(branch_id)
+            for target in branch.merge_bases:
+                self._merge_sources.get(target, set()).discard(branch_id)
+            
+            # 其他分支以它为目标的合并基准已无用
+            for source in self._merge_sources.pop(branch_id, ()):
+                merge_base = self.branches[source].merge_bases.pop(branch_id)
+                self.cow_engine.release(merge_base.source_snapshot)
+                self.cow_engine.release(merge_base.target_snapshot)
+            
+            # 调用方可能仍持有分支对象：不再引用历史版本、合并基准和快照，
+            # 计入 freed_bytes 的数据在没有其他持有者时随即被回收
+            branch.versions = []
+            branch.merge_bases = {}
+            branch.operations = []
+            branch._base_snapshot = branch._data_snapshot = PersistentMap()
+        
+        # 分支上读到的所有结果都不再有效
+        self._notify_write(branch_id, None, None)
+    
+    def add_write_listener(self, listener: Callable[[str, Optional[int], Optional[Tuple[str, ...]]], Any]):
+        """
+        注册写入监听者
+        
+        每次分支内容变化后同步调用 listener(branch_id, 新版本号, 内容变化的表)，
+        覆盖 Branch.update / update_many / apply_changes（merge）/ revert 以及 map 的结果写回；
+        分支被删除（rollback 不指定版本）时调用 listener(branch_id, None, None)。
+        直接赋值 data_snapshot 不会通知。
+        """
+        self._write_listeners.append(listener)
+    
+    def remove_write_listener(self, listener: Callable[[str, Optional[int], Optional[Tuple[str, ...]]], Any]):
+        """注销写入监听者"""
+        if listener in self._write_listeners:
+            self._write_listeners.remove(listener)
+    
+    def _notify_write(self, branch_id: str, version: Optional[int], tables: Optional[Tuple[str, ...]]):
+        for listener in list(self._write_listeners):
+            listener(branch_id, version, tables)
+    
+    def _set_merge_base(self, source_branch: Branch, target: str, merge_base: "MergeBase"):
+        self.cow_engine.retain(merge_base.source_snapshot)
+        self.cow_engine.retain(merge_base.target_snapshot)
+        with self._lock:
+            previous = source_branch.merge_bases.get(target)
+            source_branch.merge_bases[target] = merge_base
+            self._merge_sources.setdefault(target, set()).add(source_branch.id)
+        if previous is not None:
+            self.cow_engine.release(previous.source_snapshot)
+            self.cow_engine.release(previous.target_snapshot)
+    
+    # ------------------------------------------------------------------
+    # 持久化
+    # ------------------------------------------------------------------
+    
+    def _journal(self, branch_id: str, operation: Dict[str, Any]) -> Optional[asyncio.Future]:
+        return self._submit_log({"kind": "operation", "branch": branch_id, "operation": operation})
+    
+    async def _log(self, record: Dict[str, Any]):
+        waiter = self._submit_log(record)
+        if waiter is not None:
+            await asyncio.shield(waiter)
+    
+    def _submit_log(self, record: Dict[str, Any]) -> Optional[asyncio.Future]:
+        """
+        同步提交一条日志记录，返回落盘时完成的 Future（未配置 WAL 时为 None）
+        
+        内存修改与提交之间不能让出事件循环：检查点同步捕获状态并取当时的最大序号，
+        先修改、后分配序号的记录会在恢复时被重复应用。
+        """
+        if self.wal is None:
+            return None
+        waiter = self.wal.submit(record)
+        self._records_since_checkpoint += 1
+        if (self._records_since_checkpoint >= self.checkpoint_interval
+                and (self._checkpoint_task is None or self._checkpoint_task.done())):
+            self._checkpoint_task = asyncio.ensure_future(self.checkpoint())
+        return waiter
+    
+    async def checkpoint(self):
+        """
+        写检查点并删除已被覆盖的日志段
+        
+        快照是不可变的持久化结构，捕获引用即得到一致的状态，
+        序列化和写盘在线程池中进行，不阻塞事件循环。
+        """
+        if self.wal is None:
+            return
+        
+        # 同步捕获状态：此刻内存状态恰好包含序号 <= seq 的所有记录
+        branches = {}
+        pinned = []
+        for branch_id, branch in self.branches.items():
+            pinned.extend(branch.snapshot_roots())
+            branch_state = branch.__getstate__()
+            # 操作列表和合并基准会继续变化，检查点保存当时的副本
+            branch_state["operations"] = list(branch.operations)
+            branch_state["merge_bases"] = dict(branch.merge_bases)
+            branch_state["versions"] = list(branch.versions)
+            branches[branch_id] = branch_state
+        state = {"branch_counter": self.branch_counter, "branches": branches}
+        seq = self.wal.rotate()
+        self._records_since_checkpoint = 0
+        
+        # 写盘期间分支可能继续写入或被回滚，先 retain 捕获的快照，避免其被释放
+        for root in pinned:
+            self.cow_engine.retain(root)
+        try:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, write_checkpoint, self.wal.directory, seq, state)
+        finally:
+            for root in pinned:
+                self.cow_engine.release(root)
+        self.wal.remove_segments_through(seq)
+    
+    def _recover(self):
+        """加载检查点（mmap），再重放其后的日志尾部"""
+        seq = 0
+        loaded = load_checkpoint(self.wal.directory)
+        if loaded is not None:
+            seq, state = loaded
+            self.branches.advance(state["branch_counter"])
+            for branch_id in list(self.branches):
+                self._remove_branch(branch_id)
+            for branch_state in state["branches"].values():
+                # 先按构造函数填充默认值，兼容旧检查点中没有的字段
+                branch = Branch(branch_state["id"], branch_state["parent"], branch_state["name"])
+                branch.__dict__.update(branch_state)
+                self._add_branch(branch)
+        
+        for record in self.wal.read(after_seq=seq):
+            self._replay(record)
+        self.wal.last_seq = max(self.wal.last_seq, seq)
+    
+    def _replay(self, record: Dict[str, Any]):
+        kind = record["kind"]
+        if kind == "operation":
+            branch = self.branches[record["branch"]]
+            branch.apply_operation(record["operation"])
+            branch.operations.append(record["operation"])
+        elif kind == "create_branch":
+            parent = self.branches[record["parent"]]
+            branch = Branch(record["id"], record["parent"], record["name"], parent.data_snapshot, parent.views)
+            branch.created_at = record["created_at"]
+            self._add_branch(branch)
+            self.branches.advance(record["counter"])
+        elif kind == "rollback":
+            self._remove_branch(record["id"])
+        elif kind == "merge_base":
+            source = self.branches[record["source"]]
+            target = self.branches[record["target"]]
+            self._set_merge_base(source, target.id, MergeBase(
+                source.data_snapshot,
+                target.data_snapshot,
+                record["moved"],
+                record["merged_at"]
+            ))
+    
+    def close(self):
+        """关闭 WAL（写出尚未落盘的记录），删除共享内存导出"""
+        if self.wal is not None:
+            self.wal.close()
+        if self._exporter is not None:
+            self._exporter.close()
+            self._exporter = None
+    
+    # ------------------------------------------------------------------
+    # 共享内存导出
+    # ------------------------------------------------------------------
+    
+    def export_branch(
+        self,
+        branch_id: str,
+        as_of: Union[int, datetime, None] = None
+    ) -> "SharedSnapshot":
+        """
+        把分支快照导出到共享内存，供其他进程用 storage.shared.attach 零拷贝挂载
+        
+        页按 Merkle 摘要去重：分支之间共享的页、以及上次导出后未修改的页不会重写。
+        不再需要时调用 release_export。
+        
+        Args:
+            branch_id: 分支 ID
+            as_of: 导出历史版本（版本号或时间点），默认当前版本
+            
+        Returns:
+            SharedSnapshot: 可 pickle 的导出描述（目录和页文件名）
+        """
+        from .shared import SnapshotExporter
+        
+        if branch_id not in self.branches:
+            raise ValueError(f"分支不存在: {branch_id}")
+        branch = self.branches[branch_id]
+        if self._exporter is None:
+            self._exporter = SnapshotExporter()
+        return self._exporter.export(
+            branch.version_at(branch.version if as_of is None else as_of).snapshot
+        )
+    
+    def release_export(self, shared: "SharedSnapshot"):
+        """释放一次导出，不再被任何导出引用的页文件被删除"""
+        if self._exporter is not None:
+            self._exporter.release(shared)
+    
+    # ------------------------------------------------------------------
+    # 分支操作
+    # ------------------------------------------------------------------
     
     async def create_branch(
         self,
@@ -75,58 +959,562 @@ class BranchManager:
         Returns:
             Branch: 新分支
         """
+        parent_branch = self.branches.get(parent)
+        if parent_branch is None:
+            raise ValueError(f"父分支不存在: {parent}")
+        
+        # 分配 ID 到登记完成之间没有 await，并发的协程和线程不会拿到相同的 ID
+        # 或看到分配了 ID 却尚未登记的分支
+        counter = self.branches.allocate()
+        # 共享父分支的持久化快照（O(1)，写入时才路径复制）；
+        # 视图不可变，子分支共享父分支的视图，写入时各自产生新版本
+        new_branch = Branch(
+            f"branch_{counter}",
+            parent,
+            name or f"branch-{counter}",
+            parent_branch.data_snapshot,
+            parent_branch.views
+        )
+        self._add_branch(new_branch)
+        
+        if self.wal is not None:
+            await self._log({
+                "kind": "create_branch",
+                "id": new_branch.id,
+                "parent": parent,
+                "name": new_branch.name,
+                "created_at": new_branch.created_at,
+                "counter": counter
+            })
+        
+        return new_branch
+    
+    async def fork_many(
+        self,
+        parent: str = "main",
+        count: Optional[int] = None,
+        names: Optional[List[str]] = None
+    ) -> List[Branch]:
+        """
+        从同一父分支批量创建分支
+        
+        所有分支共享父分支当前的快照；配置了 WAL 时创建记录一起组提交。
+        
+        Args:
+            parent: 父分支
+            count: 分支数量
+            names: 分支名称（给出时 count 取其长度）
+            
+        Returns:
+            List[Branch]: 新分支
+        """
+        parent_branch = self.branches.get(parent)
+        if parent_branch is None:
+            raise ValueError(f"父分支不存在: {parent}")
+        if names is None:
+            names = [None] * (count or 0)
+        
+        # 一次分配一段连续 ID，整批同步登记
+        snapshot = parent_branch.data_snapshot
+        views = parent_branch.views
+        first = self.branches.allocate(len(names))
+        branches = [
+            Branch(f"branch_{counter}", parent, name or f"branch-{counter}", snapshot, views)
+            for counter, name in enumerate(names, first)
+        ]
+        self._add_branches(branches)
+        
+        if self.wal is not None:
+            # 登记后立即提交创建记录，一起等待同一次组提交
+            await asyncio.gather(*[self._submit_log({
+                "kind": "create_branch",
+                "id": branch.id,
+                "parent": parent,
+                "name": branch.name,
+                "created_at": branch.created_at,
+                "counter": counter
+            }) for counter, branch in enumerate(branches, first)])
+        return branches
+    
+    async def map(
+        self,
+        fn: Callable[[Branch, Any], Any],
+        scenarios: Iterable[Any],
+        parent: str = "main",
+        processes: Optional[int] = None,
+        keep_branches: bool = True
+    ) -> List[Dict[str, Any]]:
+        """
+        并行执行 what-if 场景
+        
+        每个场景在父分支快照的一个分叉上执行 fn(branch, scenario)
+        （可以是协程函数，通常先 update 再 query），场景分布到进程池中执行。
+        工作进程以 fork 方式启动，直接读取继承来的父分支快照，不 pickle 快照；
+        fork 前冻结 GC，避免回收器扫描共享对象时触发写时复制。
+        
+        fn 和 scenario 需要可 pickle（模块级函数）；不支持 fork 的平台上
+        父分支快照先导出到共享内存（export_branch），spawn 出的工作进程挂载后读取。
+        
+        Args:
+            fn: 场景函数
+            scenarios: 场景参数
+            parent: 父分支
+            processes: 进程数，默认 CPU 核数
+            keep_branches: 是否把成功场景的修改保留为真实分支
+            
+        Returns:
+            List[Dict]: 与 scenarios 一一对应的
+                {"success", "result" 或 "error", "branch_id"}
+        """
+        global _shared_snapshot, _shared_views
+        
         if parent not in self.branches:
             raise ValueError(f"父分支不存在: {parent}")
+        scenarios = list(scenarios)
+        if not scenarios:
+            return []
         
-        # 生成分支 ID
-        self.branch_counter += 1
-        branch_id = f"branch_{self.branch_counter}"
-        branch_name = name or f"branch-{self.branch_counter}"
+        snapshot = self.branches[parent].data_snapshot
+        views = self.branches[parent].views
+        processes = min(processes or os.cpu_count() or 1, len(scenarios))
         
-        # 创建分支（写时复制，不立即复制数据）
-        new_branch = Branch(branch_id, parent, branch_name)
+        if processes > 1 and "fork" in multiprocessing.get_all_start_methods():
+            _shared_snapshot, _shared_views = snapshot, views
+            gc.freeze()
+            try:
+                loop = asyncio.get_running_loop()
+                with ProcessPoolExecutor(
+                    max_workers=processes,
+                    mp_context=multiprocessing.get_context("fork")
+                ) as pool:
+                    outcomes = await asyncio.gather(
+                        *(loop.run_in_executor(pool, _run_scenario, fn, scenario)
+                          for scenario in scenarios),
+                        return_exceptions=True
+                    )
+            finally:
+                gc.unfreeze()
+                _shared_snapshot, _shared_views = None, {}
+        elif processes > 1:
+            shared = self.export_branch(parent)
+            try:
+                loop = asyncio.get_running_loop()
+                with ProcessPoolExecutor(
+                    max_workers=processes,
+                    mp_context=multiprocessing.get_context("spawn")
+                ) as pool:
+                    outcomes = await asyncio.gather(
+                        *(loop.run_in_executor(pool, _run_attached_scenario, fn, scenario, shared, views)
+                          for scenario in scenarios),
+                        return_exceptions=True
+                    )
+            finally:
+                self.release_export(shared)
+        else:
+            outcomes = []
+            for scenario in scenarios:
+                try:
+                    outcomes.append(await _apply_scenario(fn, scenario, snapshot, views))
+                except Exception as e:
+                    outcomes.append(e)
         
-        # 复制父分支的数据引用（COW）
-        parent_branch = self.branches[parent]
-        new_branch.data_snapshot = await self.cow_engine.copy_on_write(
-            parent_branch.data_snapshot
+        succeeded = [outcome for outcome in outcomes if not isinstance(outcome, BaseException)]
+        branches = iter(
+            await self.fork_many(parent, len(succeeded)) if keep_branches else ()
         )
         
-        self.branches[branch_id] = new_branch
+        results = []
+        pending = []
+        for outcome in outcomes:
+            if isinstance(outcome, BaseException):
+                results.append({"success": False, "error": str(outcome), "branch_id": None})
+                continue
+            result, operations = outcome
+            branch_id = None
+            if keep_branches:
+                branch = next(branches)
+                pending.append(branch.apply_operations(operations))
+                branch_id = branch.id
+            results.append({"success": True, "result": result, "branch_id": branch_id})
         
-        return new_branch
+        await asyncio.gather(*pending)
+        return results
     
-    async def merge(self, source: str, target: str = "main"):
+    async def merge(
+        self,
+        source: str,
+        target: str = "main",
+        strategy: str = "abort"
+    ) -> Dict[str, Any]:
         """
-        合并分支
+        合并分支（三路合并）
+        
+        以公共祖先处的快照为基准，只比较两侧自分叉（或上次合并）以来变化的行，
+        代价与变化行数成正比，与分支历史长度无关；重复合并不会重复应用，
+        两个分支来回合并时，从目标分支合并过来的行也不会再合并回去。
+        
+        分叉点已有的行视为同一行：两侧都改成不同的值即为冲突。
+        源分支新增的行追加到目标分支末尾。
         
         Args:
             source: 源分支
             target: 目标分支
+            strategy: 冲突处理策略
+                - "abort": 有冲突时不做任何修改
+                - "source": 以源分支为准
+                - "target": 保留目标分支的值
+                
+        Returns:
+            Dict: {"success", "applied_rows", "conflicts"}
         """
         if source not in self.branches or target not in self.branches:
             raise ValueError("分支不存在")
+        if strategy not in ("abort", "source", "target"):
+            raise ValueError(f"未知的冲突处理策略: {strategy}")
         
         source_branch = self.branches[source]
         target_branch = self.branches[target]
+        base = self._merge_base(source_branch, target_branch)
+        
+        changes = {}
+        # 表名 -> 追加到目标分支的源分支行号
+        appended = {}
+        conflicts = []
+        for table, source_rows in source_branch.data_snapshot.items():
+            base_rows = base.source_snapshot.get(table, PersistentVector())
+            if source_rows.same_content(base_rows):
+                # 整表未变化（结构共享或 Merkle 摘要相同），直接跳过
+                continue
+            target_rows = target_branch.data_snapshot.get(table, PersistentVector())
+            target_base = base.target_snapshot.get(table, PersistentVector())
+            target_changes = None
+            
+            updates = {}
+            appends = []
+            for index, old, new in diff_vectors(base_rows, source_rows):
+                position = base.to_target(table, index)
+                if position is None:
+                    if index >= len(base_rows):
+                        appends.append((index, new))
+                        continue
+                    position = index
+                if position >= len(target_rows):
+                    appends.append((index, new))
+                    continue
+                if target_rows[position] == new:
+                    # 目标分支已有相同的值（例如这一行是从目标分支合并过来的）
+                    continue
+                
+                if target_changes is None:
+                    target_changes = {
+                        i: value
+                        for i, _, value in diff_vectors(target_base, target_rows)
+                        if i < len(target_base)
+                    }
+                theirs = target_changes.get(position, MISSING)
+                if theirs is not MISSING and theirs != new:
+                    conflicts.append({
+                        "table": table,
+                        "row": position,
+                        "base": old,
+                        "source": new,
+                        "target": theirs
+                    })
+                    if strategy != "source":
+                        continue
+                updates[position] = new
+            
+            if updates or appends:
+                changes[table] = {"updates": updates, "appends": [new for _, new in appends]}
+                appended[table] = [index for index, _ in appends]
+        
+        if conflicts and strategy == "abort":
+            return {"success": False, "applied_rows": 0, "conflicts": conflicts}
         
-        # 应用源分支的所有操作到目标分支
-        for operation in source_branch.operations:
-            if operation["type"] == "update":
-                await target_branch.update(
-                    operation["table"],
-                    operation["data"]
-                )
+        # 记录源分支新增行在目标分支中的位置，供之后两个方向的合并换算
+        moved = {table: list(ranges) for table, ranges in base.moved.items()}
+        for table, indices in appended.items():
+            target_length = len(target_branch.data_snapshot.get(table, PersistentVector()))
+            start = 0
+            for i in range(1, len(indices) + 1):
+                if i == len(indices) or indices[i] != indices[i - 1] + 1:
+                    moved.setdefault(table, []).append((indices[start], target_length + start, i - start))
+                    start = i
+        
+        # 写入目标分支、记录合并基准和提交日志在同一段同步代码中完成：
+        # 等待落盘期间源分支或目标分支上的新写入不会被当作已合并
+        # （恢复时按日志顺序重放，合并基准同样取记录处两侧的快照）
+        pending = []
+        if changes:
+            operation = Branch.changes_operation(changes, source)
+            target_branch.apply_operation(operation)
+            pending.append(target_branch._submit(operation))
+        merge_base = MergeBase(
+            source_branch.data_snapshot,
+            target_branch.data_snapshot,
+            moved
+        )
+        self._set_merge_base(source_branch, target, merge_base)
+        pending.append(self._submit_log({
+            "kind": "merge_base",
+            "source": source,
+            "target": target,
+            "moved": moved,
+            "merged_at": merge_base.merged_at
+        }))
+        await asyncio.gather(*(waiter for waiter in pending if waiter is not None))
+        
+        return {
+            "success": True,
+            "applied_rows": sum(
+                len(change["updates"]) + len(change["appends"])
+                for change in changes.values()
+            ),
+            "conflicts": conflicts
+        }
     
-    async def rollback(self, branch_id: str):
+    def diff(
+        self,
+        a: str,
+        b: str,
+        a_as_of: Union[int, datetime, None] = None,
+        b_as_of: Union[int, datetime, None] = None
+    ) -> Dict[str, Any]:
+        """
+        比较两个分支（或同一分支的两个版本）的数据
+        
+        按表逐层比较 Merkle 树：共享或摘要相同的子树直接跳过，
+        代价与差异行数成正比，与表大小无关。
+        
+        Args:
+            a: 分支 ID
+            b: 分支 ID
+            a_as_of: a 的历史版本（版本号或时间点），默认当前版本
+            b_as_of: b 的历史版本，默认当前版本
+            
+        Returns:
+            Dict: {"tables": {表名: [{"row", "a", "b"}, ...]}, "changed_rows"}；
+                某一侧没有该行（或该表）时对应值为 None
+        """
+        if a not in self.branches or b not in self.branches:
+            raise ValueError("分支不存在")
+        
+        branch_a, branch_b = self.branches[a], self.branches[b]
+        snapshot_a = branch_a.version_at(branch_a.version if a_as_of is None else a_as_of).snapshot
+        snapshot_b = branch_b.version_at(branch_b.version if b_as_of is None else b_as_of).snapshot
+        empty = PersistentVector()
+        
+        tables = {}
+        for table in {*snapshot_a.keys(), *snapshot_b.keys()}:
+            rows_a = snapshot_a.get(table, empty)
+            rows_b = snapshot_b.get(table, empty)
+            if rows_a.same_content(rows_b):
+                continue
+            changes = [
+                {
+                    "row": index,
+                    "a": None if old is MISSING else old,
+                    "b": None if new is MISSING else new
+                }
+                for index, old, new in diff_vectors(rows_a, rows_b)
+            ]
+            if changes:
+                tables[table] = changes
+        
+        return {
+            "tables": tables,
+            "changed_rows": sum(len(changes) for changes in tables.values())
+        }
+    
+    def _merge_base(self, source_branch: Branch, target_branch: Branch) -> MergeBase:
+        """
+        计算合并基准
+        
+        源分支一侧取最近一次同方向合并（源分支或其祖先 -> 目标分支或其祖先）记录的基准，
+        没有时取最近公共祖先处的分叉点快照；反方向合并的记录不能作为源分支一侧的基准
+        （当时源分支尚未合并出去的修改也在其中），但提供：
+        - 从目标分支合并过来的行的位置，这些行不会再被当作源分支的新增行合并回去
+        - 更近的目标分支快照：源分支已包含目标分支在那之前的全部修改，不再视为冲突
+        经由第三个分支（合并或分叉）到达目标分支的行同样换算到目标分支中的位置
+        （见 _transitive_moved）。
+        """
+        if source_branch is target_branch:
+            raise ValueError("不能把分支合并到自身")
+        
+        source_chain = self._ancestors(source_branch)
+        target_chain = self._ancestors(target_branch)
+        
+        # 记录在祖先上的基准只在链上更低的分支都在合并之后才分叉时可以沿用
+        forward = None
+        backward = None
+        for source_node, source_below in source_chain:
+            for target_node, target_below in target_chain:
+                if source_node is target_node:
+                    continue
+                for merge_base, reverse in (
+                    (source_node.merge_bases.get(target_node.id), False),
+                    (target_node.merge_bases.get(source_node.id), True)
+                ):
+                    if merge_base is None:
+                        continue
+                    if source_below is not None and source_below.created_at < merge_base.merged_at:
+                        continue
+                    if target_below is not None and target_below.created_at < merge_base.merged_at:
+                        continue
+                    latest = backward if reverse else forward
+                    if latest is None or merge_base.merged_at > latest.merged_at:
+                        if reverse:
+                            backward = merge_base
+                        else:
+                            forward = merge_base
+        
+        if forward is None:
+            target_ids = {node.id: below for node, below in target_chain}
+            for node, below in source_chain:
+                if node.id in target_ids:
+                    # 两侧都在公共祖先之下时，以较早分叉的一侧为准（另一侧分叉时已包含它）
+                    forks = [child for child in (below, target_ids[node.id]) if child is not None]
+                    fork_child = min(forks, key=lambda child: child.created_at)
+                    forward = MergeBase(fork_child.base_snapshot, fork_child.base_snapshot, merged_at=fork_child.created_at)
+                    break
+            else:
+                raise ValueError(f"找不到公共祖先: {source_branch.id} / {target_branch.id}")
+        
+        moved = {table: list(ranges) for table, ranges in forward.moved.items()}
+        target_snapshot = forward.target_snapshot
+        if backward is not None:
+            _add_moved(moved, backward.reversed_moved())
+            if backward.merged_at > forward.merged_at:
+                target_snapshot = backward.source_snapshot
+        _add_moved(moved, self._transitive_moved(source_branch, target_branch))
+        return MergeBase(forward.source_snapshot, target_snapshot, moved, forward.merged_at)
+    
+    def _transitive_moved(
+        self,
+        source_branch: Branch,
+        target_branch: Branch,
+        max_hops: int = 4
+    ) -> Dict[str, List[Tuple[int, int, int]]]:
+        """
+        经由其他分支得到的行号对应
+        
+        例如 b -> c、c -> main 之后，b 合并到 c 的行已经随 c 到达 main：
+        把两次合并记录的行号对应逐段复合，得到这些行在 main 中的位置，
+        b -> main 时不再当作新增行重复追加。子分支分叉时已有的行与父分支同一位置的行
+        对应，同样参与复合。
+        按合并记录逐层向外搜索，经过的分支得到新的对应时继续向外复合。
+        
+        Args:
+            source_branch: 源分支
+            target_branch: 目标分支
+            max_hops: 最多经过的合并记录（或分叉）数
+        
+        Returns:
+            Dict: {表名: [(源起始行号, 目标起始行号, 行数), ...]}
+        """
+        # 目标分支的祖先 -> 目标分支
+        into_target = {}
+        mapping = None
+        node = target_branch
+        while node.parent and node.parent in self.branches:
+            step = _fork_moved(node)
+            mapping = step if mapping is None else _compose_moved(step, mapping)
+            if not mapping:
+                break
+            into_target[node.parent] = mapping
+            node = self.branches[node.parent]
+        
+        moved = {}
+        known = {}  # 分支 -> 已知的源分支到该分支的行号对应
+        frontier = {source_branch.id: None}  # 本层新得到的对应（None 表示源分支自身）
+        for _ in range(max_hops):
+            reached = {}
+            for node_id, mapping in frontier.items():
+                for neighbor, ranges in self._moved_edges(node_id):
+                    if neighbor == source_branch.id:
+                        continue
+                    composed = ranges if mapping is None else _compose_moved(mapping, ranges)
+                    if not composed:
+                        continue
+                    if neighbor == target_branch.id:
+                        _add_moved(moved, composed)
+                        continue
+                    if neighbor in into_target:
+                        _add_moved(moved, _compose_moved(composed, into_target[neighbor]))
+                    # 不同路径带来的行不同：对应有增加时继续向外复合
+                    previous = known.get(neighbor, {})
+                    updated = dict(previous)
+                    _add_moved(updated, composed)
+                    if updated != previous:
+                        known[neighbor] = updated
+                        _add_moved(reached.setdefault(neighbor, {}), composed)
+            if not reached:
+                break
+            frontier = reached
+        return moved
+    
+    def _moved_edges(self, branch_id: str) -> List[Tuple[str, Dict[str, List[Tuple[int, int, int]]]]]:
+        """与该分支有行号对应的分支（合并记录的两个方向、父分支和子分支），及从该分支出发的对应"""
+        branch = self.branches.get(branch_id)
+        if branch is None:
+            return []
+        edges = [(target, merge_base.moved) for target, merge_base in branch.merge_bases.items()]
+        with self._lock:
+            sources = list(self._merge_sources.get(branch_id, ()))
+            children = list(self._children.get(branch_id, ()))
+        for source in sources:
+            source_branch = self.branches.get(source)
+            merge_base = source_branch.merge_bases.get(branch_id) if source_branch is not None else None
+            if merge_base is not None:
+                edges.append((source, merge_base.reversed_moved()))
+        if branch.parent and branch.parent in self.branches:
+            edges.append((branch.parent, _fork_moved(branch)))
+        for child_id in children:
+            # 只有参与过合并的子分支能把行带到别处
+            child = self.branches.get(child_id)
+            if child is not None and (child.merge_bases or child_id in self._merge_sources):
+                edges.append((child_id, _fork_moved(child)))
+        return edges
+    
+    def _ancestors(self, branch: Branch) -> List[Tuple[Branch, Optional[Branch]]]:
+        chain = []
+        below = None
+        node = branch
+        while node is not None:
+            chain.append((node, below))
+            below = node
+            node = self.branches.get(node.parent) if node.parent else None
+        return chain
+    
+    async def rollback(self, branch_id: str, to: Union[int, datetime, None] = None):
         """
         回滚分支
         
+        - 不指定 to：删除分支（连同其所有子孙分支），被回滚的分支独占的页和节点
+          立即释放，与其他分支共享的部分不受影响；分支对象不再持有历史版本和快照
+          （需要保留的数据先取出 data_snapshot 或 version_at 的结果）
+        - 指定 to：部分回滚，把分支的数据和视图恢复到该版本（见 Branch.revert）
+        
         Args:
             branch_id: 分支 ID
+            to: 版本号或时间点
         """
-        if branch_id in self.branches:
-            del self.branches[branch_id]
+        if branch_id not in self.branches:
+            return
+        if to is not None:
+            await self.branches[branch_id].revert(to)
+            return
+        
+        subtree = [branch_id]
+        for current in subtree:
+            subtree.extend(self._children.get(current, ()))
+        
+        # 先回滚子孙，再回滚自身
+        pending = []
+        for current in reversed(subtree):
+            self._remove_branch(current)
+            pending.append(self._submit_log({"kind": "rollback", "id": current}))
+        await asyncio.gather(*(waiter for waiter in pending if waiter is not None))
     
     def get_branch(self, branch_id: str) -> Optional[Branch]:
         """获取分支"""
@@ -145,10 +1533,34 @@ class BranchManager:
         ]
     
     def get_stats(self) -> Dict[str, Any]:
-        """获取统计信息"""
+        """
+        获取统计信息
+        
+        memory.branches 中每个分支的：
+        - live_bytes: 当前快照可达的数据量（含共享部分）
+        - shared_bytes: 其中与其他分支共享的部分
+        - reclaimable_bytes: 回滚该分支可立即释放的数据量
+        """
+        memory = {}
+        for branch in self.branches.values():
+            live = self.cow_engine.subtree_bytes(branch.data_snapshot)
+            # 当前快照放在最后，分支内共享的节点计入当前快照的独占部分
+            freed = self.cow_engine.exclusive_bytes(branch.snapshot_roots())
+            memory[branch.id] = {
+                "live_bytes": live,
+                "shared_bytes": max(live - freed[-1], 0),
+                "reclaimable_bytes": sum(freed)
+            }
+        
         return {
             "total_branches": len(self.branches),
             "active_branches": len([b for b in self.branches.values() if b.parent]),
-            "total_operations": sum(len(b.operations) for b in self.branches.values())
+            "total_operations": sum(len(b.operations) for b in self.branches.values()),
+            "memory": {
+                **self.cow_engine.get_stats(),
+                "branches": memory
+            },
+            "shared_memory": self._exporter.get_stats() if self._exporter is not None else None,
+            "registry": self.branches.get_stats()
         }
 
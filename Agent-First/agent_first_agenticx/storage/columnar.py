@@ -0,0 +1,513 @@
+"""
+列式页存储 - 分支表的物理格式
+
+PersistentVector 的每一页行数据以列的形式存放：
+- 整数 / 浮点 / 布尔列：array('q' / 'd' / 'b')，每个值 8 / 8 / 1 字节
+- 字符串列：字典编码（页内字典 + 紧凑的编码数组）
+- 其他类型或类型混杂的列：Python 列表
+- None 和缺失的键用可选的状态数组标记，只在出现时分配
+
+按行读取返回 Row 视图（__slots__，实现 Mapping 接口），与原来的 dict 行兼容；
+写入时只复制被修改页的列数组（内存拷贝），不会逐行重建字典。
+"""
+
+from array import array
+from collections.abc import Mapping, Sequence
+from operator import itemgetter
+from typing import Any, Dict, Iterator, List, Optional
+
+
+class _Absent:
+    """行中没有该键"""
+
+    __slots__ = ()
+
+    def __repr__(self) -> str:
+        return "ABSENT"
+
+    def __reduce__(self):
+        # 反序列化后仍是同一个单例
+        return "ABSENT"
+
+
+ABSENT = _Absent()
+
+# 状态数组取值
+_PRESENT = 0
+_NULL = 1
+_MISSING_KEY = 2
+
+_STATE_OF = {type(None): _NULL, _Absent: _MISSING_KEY}
+_TYPECODES = {int: "q", float: "d", bool: "b"}
+_KINDS = {int: "int", float: "float", bool: "bool", str: "str"}
+_NUMERIC_KINDS = frozenset(("int", "float", "bool"))
+
+
+def _code_typecode(size: int) -> str:
+    """能容纳 size 个字典项的最小编码类型"""
+    if size <= 1 << 8:
+        return "B"
+    if size <= 1 << 16:
+        return "H"
+    return "L"
+
+
+def _copy_data(data: Any) -> array:
+    """复制列数组；共享内存中的列（只读 memoryview）复制为 array"""
+    if type(data) is array:
+        return data[:]
+    copied = array(data.format)
+    copied.frombytes(data.cast("B"))
+    return copied
+
+
+class Column:
+    """
+    一页中的一列
+
+    - kind: "int" / "float" / "bool" / "str" / "object"
+    - data: 数值列为 array；字符串列为字典编码 array；object 列为 list（含 ABSENT）。
+      从共享内存挂载的页（见 shared）中为同格式的只读 memoryview
+    - dictionary: 字符串列的字典
+    - state: None，或每行一个字节的状态（0 有值 / 1 None / 2 缺失）
+    """
+
+    __slots__ = ("kind", "data", "dictionary", "state", "_lookup")
+
+    def __init__(
+        self,
+        kind: str,
+        data: Any,
+        dictionary: Optional[List[str]] = None,
+        state: Optional[bytearray] = None
+    ):
+        self.kind = kind
+        self.data = data
+        self.dictionary = dictionary
+        self.state = state
+        self._lookup = None
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    def get(self, index: int) -> Any:
+        """第 index 行的值；缺失时返回 ABSENT"""
+        state = self.state
+        if state is not None and state[index]:
+            return None if state[index] == _NULL else ABSENT
+        kind = self.kind
+        if kind == "str":
+            return self.dictionary[self.data[index]]
+        if kind == "bool":
+            return bool(self.data[index])
+        return self.data[index]
+
+    def to_list(self) -> List[Any]:
+        """解码为 Python 值列表（缺失为 ABSENT）"""
+        kind = self.kind
+        if kind == "object":
+            return list(self.data)
+        if kind == "str":
+            dictionary = self.dictionary
+            values = [dictionary[code] for code in self.data]
+        elif kind == "bool":
+            values = [bool(value) for value in self.data]
+        else:
+            values = self.data.tolist()
+        if self.state is not None:
+            for i, flag in enumerate(self.state):
+                if flag:
+                    values[i] = None if flag == _NULL else ABSENT
+        return values
+
+    def nbytes(self) -> int:
+        """列占用的近似字节数"""
+        if self.kind == "object":
+            return len(self.data) * 8
+        size = self.data.itemsize * len(self.data)
+        if self.dictionary is not None:
+            size += len(self.dictionary) * 8
+        if self.state is not None:
+            size += len(self.state)
+        return size
+
+    def updated(self, changes: Dict[int, Any], appends: List[Any]) -> "Column":
+        """
+        返回修改后的新列（原列不变）
+
+        新值与列类型一致时只复制数组再赋值；否则整列重新编码。
+        """
+        if not appends and all(
+            type(current) is type(value) and current == value
+            for current, value in ((self.get(index), value) for index, value in changes.items())
+        ):
+            # 该列的值没有变化，新页直接共享原列
+            return self
+
+        if self.kind == "object":
+            data = list(self.data)
+            for index, value in changes.items():
+                data[index] = value
+            data.extend(appends)
+            return Column("object", data)
+
+        column = self._updated_in_kind(changes, appends)
+        if column is not None:
+            return column
+        values = self.to_list()
+        for index, value in changes.items():
+            values[index] = value
+        values.extend(appends)
+        return encode_column(values)
+
+    def _updated_in_kind(self, changes: Dict[int, Any], appends: List[Any]) -> Optional["Column"]:
+        kind = self.kind
+        data = _copy_data(self.data)
+        state = bytearray(self.state) if self.state is not None else None
+        dictionary = self.dictionary
+        lookup = None
+        if kind == "str":
+            lookup = self._lookup
+            if lookup is None:
+                lookup = self._lookup = {value: code for code, value in enumerate(dictionary)}
+            py_type = str
+        else:
+            py_type = {"int": int, "float": float, "bool": bool}[kind]
+
+        if appends:
+            data.extend([0] * len(appends))
+            if state is not None:
+                state.extend(bytes(len(appends)))
+        base = len(self.data)
+        items = list(changes.items())
+        items.extend((base + i, value) for i, value in enumerate(appends))
+
+        for index, value in items:
+            flag = _STATE_OF.get(type(value), _PRESENT)
+            if flag:
+                if state is None:
+                    state = bytearray(len(data))
+                state[index] = flag
+                data[index] = 0
+                continue
+            if type(value) is not py_type:
+                return None
+            if state is not None:
+                state[index] = _PRESENT
+            if kind == "str":
+                code = lookup.get(value)
+                if code is None:
+                    if dictionary is self.dictionary:
+                        dictionary = list(dictionary)
+                        lookup = dict(lookup)
+                    code = lookup[value] = len(dictionary)
+                    dictionary.append(value)
+                    if len(dictionary) > 1 << (8 * data.itemsize):
+                        return None
+                data[index] = code
+            else:
+                try:
+                    data[index] = value
+                except OverflowError:
+                    return None
+
+        if state is not None and not any(state):
+            state = None
+        column = Column(kind, data, dictionary, state)
+        if kind == "str":
+            column._lookup = lookup
+        return column
+
+
+def encode_column(values: List[Any]) -> Column:
+    """按值的类型选择列编码（值中可以包含 None 和 ABSENT）"""
+    types = set(map(type, values))
+    has_null = bool(types & _STATE_OF.keys())
+    types -= _STATE_OF.keys()
+
+    if len(types) == 1:
+        py_type = next(iter(types))
+        kind = _KINDS.get(py_type)
+        if kind is not None:
+            state = None
+            filled = values
+            if has_null:
+                state = bytearray(_STATE_OF.get(t, _PRESENT) for t in map(type, values))
+                fill = "" if py_type is str else py_type()
+                filled = [fill if flag else value for flag, value in zip(state, values)]
+
+            if kind == "str":
+                dictionary = list(dict.fromkeys(filled))
+                lookup = {value: code for code, value in enumerate(dictionary)}
+                codes = array(_code_typecode(len(dictionary)), map(lookup.__getitem__, filled))
+                column = Column(kind, codes, dictionary, state)
+                column._lookup = lookup
+                return column
+
+            try:
+                return Column(kind, array(_TYPECODES[py_type], filled), None, state)
+            except OverflowError:
+                pass
+
+    return Column("object", list(values))
+
+
+# NumPy dtype.kind -> (转换后的 dtype, array 类型码, 列类型)
+_ARRAY_KINDS = {"i": ("int64", "q", "int"), "f": ("float64", "d", "float"), "b": ("bool", "b", "bool")}
+
+
+def encode_array(values: Any) -> Column:
+    """
+    编码一段列数组（批量导入使用）
+
+    NumPy 的整数 / 浮点 / 布尔数组按缓冲区直接拷贝进 array，不逐个转换为 Python 对象；
+    其他数组和序列按 encode_column 处理。两种方式对相同的值产生相同的列。
+    """
+    dtype = getattr(values, "dtype", None)
+    if dtype is not None:
+        kind = _ARRAY_KINDS.get(dtype.kind)
+        if kind is None and dtype.kind == "u" and dtype.itemsize < 8:
+            kind = _ARRAY_KINDS["i"]
+        if kind is None:
+            return encode_column(values.tolist())
+        data = array(kind[1])
+        data.frombytes(values.astype(kind[0], copy=False).tobytes())
+        return Column(kind[2], data)
+    return encode_column(list(values))
+
+
+class ColumnBlock(Sequence):
+    """
+    一页行数据的列式存储（不可变）
+
+    names 为各列名（按首次出现的顺序），行的键集合可以不同，缺失的键不会出现在行视图中。
+    """
+
+    __slots__ = ("names", "columns", "length", "_positions")
+
+    def __init__(self, names: List[str], columns: List[Column], length: int):
+        self.names = names
+        self.columns = columns
+        self.length = length
+        self._positions = {name: i for i, name in enumerate(names)}
+
+    @classmethod
+    def from_rows(cls, rows: List[Any]) -> Optional["ColumnBlock"]:
+        """把一组 Mapping 行编码为列；存在非 Mapping 行时返回 None"""
+        if not rows:
+            return cls([], [], 0)
+
+        # 常见情况：键完全相同的 dict 行，用 itemgetter + zip 在 C 层完成转置
+        first = rows[0]
+        if type(first) is dict and first:
+            keys = first.keys()
+            if all(type(row) is dict and row.keys() == keys for row in rows):
+                names = list(first)
+                if len(names) == 1:
+                    values = [[row[names[0]] for row in rows]]
+                else:
+                    values = zip(*map(itemgetter(*names), rows))
+                return cls(names, [encode_column(list(column)) for column in values], len(rows))
+
+        names: Dict[str, None] = {}
+        for row in rows:
+            if type(row) is dict:
+                names.update(dict.fromkeys(row))
+            elif isinstance(row, Mapping):
+                names.update(dict.fromkeys(row.keys()))
+            else:
+                return None
+        names = list(names)
+        columns = [encode_column([row.get(name, ABSENT) for row in rows]) for name in names]
+        return cls(names, columns, len(rows))
+
+    @classmethod
+    def from_columns(cls, names: List[str], columns: List[Any]) -> "ColumnBlock":
+        """由等长的列数组（list / NumPy 数组）直接构建，不经过逐行字典"""
+        return cls(list(names), [encode_array(column) for column in columns], len(columns[0]) if columns else 0)
+
+    def __len__(self) -> int:
+        return self.length
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [Row(self, i) for i in range(*index.indices(self.length))]
+        if index < 0:
+            index += self.length
+        if not 0 <= index < self.length:
+            raise IndexError("ColumnBlock index out of range")
+        return Row(self, index)
+
+    def __iter__(self) -> Iterator["Row"]:
+        for i in range(self.length):
+            yield Row(self, i)
+
+    def __repr__(self) -> str:
+        return f"ColumnBlock(rows={self.length}, columns={self.names})"
+
+    def column(self, name: str) -> Optional[Column]:
+        position = self._positions.get(name)
+        return None if position is None else self.columns[position]
+
+    def nbytes(self) -> int:
+        """列数据占用的近似字节数"""
+        return sum(column.nbytes() for column in self.columns) + len(self.names) * 8
+
+    def digest_into(self, h):
+        """
+        把页内容写入哈希对象（Merkle 摘要使用）
+
+        摘要只取决于行的内容，与页的构造方式无关：原地修改过的列可能留有不再使用的字典项、
+        全为 NULL 时仍是数值列、object 列中的值可能已经类型一致，都按 encode_column
+        的规范编码哈希；列按列名排序，整列缺失的列不参与。
+        """
+        for name, column in sorted(zip(self.names, self.columns), key=lambda item: repr(item[0])):
+            state = column.state
+            if column.kind == "object" or (state is not None and all(state)):
+                values = column.to_list()
+                if all(value is ABSENT for value in values):
+                    continue
+                column = encode_column(values)
+            if column.kind in _NUMERIC_KINDS:
+                h.update(repr(name).encode())
+                h.update(column.kind.encode())
+                h.update(column.data.tobytes())
+                if column.state is not None:
+                    h.update(column.state)
+            elif column.kind == "str":
+                # 字典按首次出现的顺序重新编码：不再使用的字典项、NULL 位置上的编码不参与
+                codes, state = column.data, column.state
+                if state is not None:
+                    codes = [0 if flag else code for code, flag in zip(codes, state)]
+                    used = list(dict.fromkeys(code for code, flag in zip(codes, state) if not flag))
+                else:
+                    used = list(dict.fromkeys(codes))
+                typecode = _code_typecode(len(used))
+                if state is not None or used != list(range(len(column.dictionary))) \
+                        or (codes.typecode if type(codes) is array else codes.format) != typecode:
+                    lookup = [0] * len(column.dictionary)
+                    for canonical, code in enumerate(used):
+                        lookup[code] = canonical
+                    codes = array(typecode, map(lookup.__getitem__, codes))
+                h.update(repr(name).encode())
+                h.update(b"str")
+                h.update(repr([column.dictionary[code] for code in used]).encode())
+                h.update(codes.tobytes())
+                if state is not None:
+                    h.update(state)
+            else:
+                h.update(repr(name).encode())
+                h.update(b"object")
+                h.update(repr(column.data).encode())
+
+    def changed_indices(self, other: "ColumnBlock") -> Optional[List[int]]:
+        """
+        与另一页逐列比较，返回内容不同的行偏移（只比较两页共有的行数）
+
+        整列相同（同一对象或数组逐字节相等）的列直接跳过。列名不一致时返回 None。
+        """
+        if self.names != other.names:
+            return None
+        length = min(self.length, other.length)
+        changed = set()
+        for a, b in zip(self.columns, other.columns):
+            if a is b:
+                continue
+            if (a.kind == b.kind != "object" and a.state == b.state
+                    and (a.dictionary is b.dictionary or a.dictionary == b.dictionary)
+                    and a.data == b.data):
+                continue
+            for i, (x, y) in enumerate(zip(a.to_list()[:length], b.to_list()[:length])):
+                # NaN 与 NaN 视为相同
+                if x is not y and x != y and (x == x or y == y):
+                    changed.add(i)
+        return sorted(changed)
+
+    def with_changes(self, changes: Dict[int, Any], appends: List[Any]) -> Optional["ColumnBlock"]:
+        """
+        返回替换 / 追加若干行后的新页
+
+        Args:
+            changes: {页内偏移: 新行}
+            appends: 追加的行
+
+        Returns:
+            新的 ColumnBlock；新行中存在非 Mapping 值时返回 None
+        """
+        new_rows = list(changes.values()) + list(appends)
+        for row in new_rows:
+            if not isinstance(row, Mapping):
+                return None
+
+        positions = self._positions
+        if any(name not in positions for row in new_rows for name in row.keys()):
+            # 出现新列：整页重新编码
+            rows = list(self)
+            for index, row in changes.items():
+                rows[index] = row
+            rows.extend(appends)
+            return ColumnBlock.from_rows(rows)
+
+        columns = [
+            column.updated(
+                {index: row.get(name, ABSENT) for index, row in changes.items()},
+                [row.get(name, ABSENT) for row in appends]
+            )
+            for name, column in zip(self.names, self.columns)
+        ]
+        return ColumnBlock(self.names, columns, self.length + len(appends))
+
+
+class Row(Mapping):
+    """列式页中一行的只读视图"""
+
+    __slots__ = ("_block", "_index")
+
+    def __init__(self, block: ColumnBlock, index: int):
+        self._block = block
+        self._index = index
+
+    def __getitem__(self, key: str) -> Any:
+        column = self._block.column(key)
+        if column is None:
+            raise KeyError(key)
+        value = column.get(self._index)
+        if value is ABSENT:
+            raise KeyError(key)
+        return value
+
+    def get(self, key: str, default: Any = None) -> Any:
+        column = self._block.column(key)
+        if column is None:
+            return default
+        value = column.get(self._index)
+        return default if value is ABSENT else value
+
+    def __iter__(self) -> Iterator[str]:
+        index = self._index
+        for name, column in zip(self._block.names, self._block.columns):
+            if column.get(index) is not ABSENT:
+                yield name
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, Row) and other._block is self._block and other._index == self._index:
+            return True
+        if not isinstance(other, Mapping):
+            return NotImplemented
+        return dict(self) == dict(other)
+
+    def __ne__(self, other) -> bool:
+        result = self.__eq__(other)
+        return result if result is NotImplemented else not result
+
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        return repr(dict(self))
+
+    def __reduce__(self):
+        # 序列化（WAL、进程间传递）时转为普通 dict，不携带整页
+        return dict, (dict(self),)
@@ -2,35 +2,270 @@
 写时复制（Copy-On-Write）引擎
 """
 
-from typing import Any, Dict
+import operator
+import sys
+import threading
+from typing import Any, Dict, Iterable, List, Tuple, Union
 import copy
 
+from .columnar import ColumnBlock
+from .persistent import (
+    PersistentMap,
+    PersistentVector,
+    TransientVector,
+    _BitmapNode,
+    _CollisionNode,
+    _Node,
+    _Page,
+)
+
+
+# 按精确类型判断（PersistentMap 等继承自 collections.abc，isinstance 较慢）
+_TRACKED_TYPES = frozenset((PersistentMap, PersistentVector, _BitmapNode, _CollisionNode, _Node, _Page))
+
+
+def _children(obj) -> List[Any]:
+    """持久化结构中一个节点直接引用的子节点"""
+    kind = type(obj)
+    if kind is _Node:
+        return obj.children
+    if kind is PersistentMap or kind is PersistentVector:
+        return [obj._root]
+    if kind is _BitmapNode:
+        return [entry[1] if type(entry) is tuple else entry for entry in obj.entries]
+    if kind is _CollisionNode:
+        return [value for _, value in obj.pairs]
+    return []
+
+
+def _own_bytes(obj, base=None) -> Tuple[int, int]:
+    """
+    节点自身占用的近似字节数
+
+    路径复制出的页与 base（被替换的旧页）共享一部分数据：列式页共享未变化的列，
+    列表页（按首行估算每行大小）共享未变化的行对象。
+    所以返回 (含全部数据的大小, 只计新引入部分的大小)。
+    """
+    size = sys.getsizeof(obj)
+    new_size = None
+    if isinstance(obj, _Page) and type(obj.rows) is ColumnBlock:
+        block = obj.rows
+        size += block.nbytes()
+        if type(base) is _Page and type(base.rows) is ColumnBlock:
+            shared = {id(column) for column in base.rows.columns}
+            new_size = size - sum(
+                column.nbytes() for column in block.columns if id(column) in shared
+            )
+    elif isinstance(obj, _Page):
+        rows = obj.rows
+        size += sys.getsizeof(rows)
+        if rows:
+            sample = rows[0]
+            per_row = sys.getsizeof(sample)
+            if isinstance(sample, dict):
+                per_row += sum(sys.getsizeof(value) for value in sample.values())
+            new_size = size
+            size += per_row * len(rows)
+            new_rows = len(rows)
+            if type(base) is _Page:
+                shared = min(len(rows), len(base.rows))
+                new_rows -= shared - sum(map(operator.is_not, rows, base.rows))
+            new_size += per_row * new_rows
+    elif isinstance(obj, _Node):
+        size += sys.getsizeof(obj.children)
+    elif isinstance(obj, _BitmapNode):
+        size += sys.getsizeof(obj.entries)
+    elif isinstance(obj, _CollisionNode):
+        size += sys.getsizeof(obj.pairs)
+    return size, size if new_size is None else new_size
+
 
 class CopyOnWriteEngine:
     """
     写时复制引擎
-    
-    用于高效创建数据分支，只在写入时才真正复制数据
+
+    用于高效创建数据分支，只在写入时才真正复制数据。
+
+    引用计数：持久化结构的每个节点（页、前缀树节点、HAMT 节点）记录有多少个
+    父节点或分支根引用它。分支写入时新根 retain、旧根 release；计数归零的节点
+    立即从引擎中移除并计入已释放字节数。节点本身不可变、可能仍被外部持有
+    （捕获的快照、时间旅行读到的历史版本），所以不会被原地清空，
+    没有其他引用时由 Python 回收。
+    计数在锁内增减，多个线程可以同时在不同分支上写入或创建分支。
     """
-    
+
     def __init__(self):
-        self.reference_counts = {}
-    
-    async def copy_on_write(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        # id(节点) -> 引用计数
+        self.reference_counts: Dict[int, int] = {}
+        # id(节点) -> [节点, 独占字节数, 自身字节数, 子树字节数]；持有节点保证 id 不被复用
+        # 独占字节数不含与被复制的旧页共享的行；子树字节数按需计算后缓存
+        self._chunks: Dict[int, List[Any]] = {}
+        self.tracked_bytes = 0
+        self.freed_bytes = 0
+        self._lock = threading.Lock()
+
+    async def copy_on_write(
+        self,
+        data: Union[PersistentMap, Dict[str, Any]]
+    ) -> PersistentMap:
         """
         写时复制
-        
+
         Args:
-            data: 原始数据
-            
+            data: 原始数据（PersistentMap 或 表名 -> 行列表 的 dict）
+
         Returns:
-            Dict: 数据引用（浅拷贝）
+            PersistentMap: 与原始数据结构共享的快照
         """
-        # 简化实现：创建浅拷贝
-        # 实际应该实现真正的 COW 机制
-        return {k: v for k, v in data.items()}
-    
+        # 持久化快照不可变，直接共享根节点即可（O(1)）
+        if isinstance(data, PersistentMap):
+            return data
+
+        snapshot = PersistentMap()
+        for table, rows in data.items():
+            if isinstance(rows, TransientVector):
+                rows = rows.persistent()
+            elif not isinstance(rows, PersistentVector):
+                rows = PersistentVector.from_iterable(rows)
+            snapshot = snapshot.set(table, rows)
+        return snapshot
+
     def materialize(self, data_ref: Any) -> Any:
-        """实例化数据（当需要修改时）"""
+        """
+        实例化数据（当需要修改时）
+
+        快照返回 表名 -> TransientVector 的可写工作副本：不做任何预先复制，
+        写入某页时只复制该页并重新挂接到页表，其余页与原快照共享。
+        修改完成后用 copy_on_write 生成新快照。其他对象仍按深拷贝处理。
+
+        Args:
+            data_ref: PersistentMap、PersistentVector 或任意对象
+        """
+        if isinstance(data_ref, PersistentMap):
+            return {table: rows.transient() for table, rows in data_ref.items()}
+        if isinstance(data_ref, PersistentVector):
+            return data_ref.transient()
         return copy.deepcopy(data_ref)
 
+    # ------------------------------------------------------------------
+    # 引用计数
+    # ------------------------------------------------------------------
+
+    def retain(self, root: Any, base: Any = None):
+        """
+        增加一个对 root 的引用
+
+        首次被引用的节点会递归 retain 其子节点；已跟踪的子树只加一次计数，
+        所以一次写入只访问新复制出的路径。
+
+        Args:
+            root: 快照根
+            base: root 由其路径复制而来的旧快照（可选），用于只计入新引入的行
+        """
+        with self._lock:
+            counts = self.reference_counts
+            stack = [(root, base)]
+            while stack:
+                obj, counterpart = stack.pop()
+                kind = type(obj)
+                if kind not in _TRACKED_TYPES:
+                    continue
+                key = id(obj)
+                count = counts.get(key)
+                if count:
+                    counts[key] = count + 1
+                    continue
+
+                counts[key] = 1
+                size, own = _own_bytes(obj, counterpart)
+                self._chunks[key] = [obj, own, size, None]
+                self.tracked_bytes += own
+
+                # 已跟踪的子节点只加计数；新节点与旧快照同一位置的子节点配对
+                # （HAMT 节点需位图一致才能按下标对应）
+                base_children = ()
+                if type(counterpart) is kind and (
+                    kind is not _BitmapNode or counterpart.bitmap == obj.bitmap
+                ):
+                    base_children = _children(counterpart)
+                for i, child in enumerate(_children(obj)):
+                    child_key = id(child)
+                    count = counts.get(child_key)
+                    if count:
+                        counts[child_key] = count + 1
+                    else:
+                        stack.append((child, base_children[i] if i < len(base_children) else None))
+
+    def release(self, root: Any):
+        """释放一个对 root 的引用；计数归零的节点连同其独占的子树从引擎中移除（节点本身不修改）"""
+        with self._lock:
+            stack = [root]
+            while stack:
+                obj = stack.pop()
+                key = id(obj)
+                count = self.reference_counts.get(key)
+                if count is None:
+                    # 未被跟踪（例如直接赋值的快照），不影响子节点计数
+                    continue
+                if count > 1:
+                    self.reference_counts[key] = count - 1
+                    continue
+
+                del self.reference_counts[key]
+                own = self._chunks.pop(key)[1]
+                self.tracked_bytes -= own
+                self.freed_bytes += own
+                stack.extend(_children(obj))
+
+    def replace(self, old: Any, new: Any):
+        """用 new 替换一个对 old 的引用（先 retain 再 release，共享部分不受影响）"""
+        if old is new:
+            return
+        if new is not None:
+            self.retain(new, old)
+        if old is not None:
+            self.release(old)
+
+    def subtree_bytes(self, root: Any) -> int:
+        """root 可达的全部数据字节数（含与其他分支共享的部分）"""
+        chunk = self._chunks.get(id(root))
+        if chunk is None:
+            return 0
+        if chunk[3] is None:
+            # 节点不可变，子树大小计算一次后缓存；只有新路径上的节点需要重新累计
+            chunk[3] = chunk[2] + sum(self.subtree_bytes(child) for child in _children(root))
+        return chunk[3]
+
+    def exclusive_bytes(self, roots: Iterable[Any]) -> List[int]:
+        """
+        依次释放 roots 时每个根能回收的字节数（不真正释放）
+
+        模拟 release：只沿计数会归零的节点向下，代价与独占部分成正比。
+        多个根共享的节点计入最后释放它的根。
+        """
+        pending: Dict[int, int] = {}
+        result = []
+        for root in roots:
+            total = 0
+            stack = [root]
+            while stack:
+                obj = stack.pop()
+                key = id(obj)
+                count = pending.get(key, self.reference_counts.get(key))
+                if count is None:
+                    continue
+                pending[key] = count - 1
+                if count == 1:
+                    total += self._chunks[key][1]
+                    stack.extend(_children(obj))
+            result.append(total)
+        return result
+
+    def get_stats(self) -> Dict[str, Any]:
+        """引擎统计信息"""
+        return {
+            "tracked_chunks": len(self.reference_counts),
+            "shared_chunks": sum(1 for count in self.reference_counts.values() if count > 1),
+            "tracked_bytes": self.tracked_bytes,
+            "freed_bytes": self.freed_bytes,
+        }
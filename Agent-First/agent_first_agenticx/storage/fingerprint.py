@@ -0,0 +1,224 @@
+"""
+SQL 指纹 - 语义相同的 SQL 得到相同的键
+
+规范化规则：
+- 关键字和函数名大小写不敏感；表名和列名保持原样（查询引擎按名称精确查找，Price 与 price 是不同的列）
+- ORDER BY / HAVING 中的别名和序号替换为对应的 SELECT 表达式
+- AND / OR 展开嵌套、去重并排序；= / != / + / * 的操作数排序；
+  常量在左的比较翻转为列在左（5 < x → x > 5）；NOT NOT x → x；IN 列表去重排序
+- 常量替换为占位符 ?，按出现顺序收集为参数（LIMIT / OFFSET 也是参数）
+
+模板和参数都相同才是同一个查询；只有常量不同的查询结果不同，
+其中可由缓存结果算出的（更严格的条件、更小的 LIMIT）见 subsumption.derive_query。
+无法按 SQL 子集解析时退化为词法规范化（关键字大小写、空白、常量占位），不调整谓词顺序，
+保留标识符的表名前缀。
+"""
+
+import hashlib
+from functools import lru_cache
+from dataclasses import dataclass, replace
+from typing import Any, List, Optional, Tuple
+
+from .query_engine import (
+    Aggregate, Between, BinaryOp, BoolOp, Column, InList, IsNull, Like, Literal, Not, Query,
+    _resolve_aliases, parse_sql, render, tokenize
+)
+
+
+# 子集之外、只在词法退化时出现的关键字
+_EXTRA_KEYWORDS = {
+    "JOIN", "INNER", "LEFT", "RIGHT", "FULL", "OUTER", "CROSS", "NATURAL", "ON", "USING",
+    "UNION", "INTERSECT", "EXCEPT", "ALL", "WITH", "EXISTS", "ANY", "CASE", "WHEN", "THEN",
+    "ELSE", "END", "CAST", "OVER", "PARTITION", "WINDOW", "FILTER", "INTERVAL",
+}
+_FLIPPED = {"<": ">", "<=": ">=", ">": "<", ">=": "<=", "=": "=", "!=": "!="}
+_COMMUTATIVE = ("=", "!=", "+", "*")
+
+
+@dataclass(frozen=True)
+class SQLFingerprint:
+    """
+    SQL 指纹
+
+    Attributes:
+        template: 常量替换为 ? 的规范化 SQL
+        params: 按出现顺序的常量
+        outputs: 输出列名，SELECT * 时为空
+        query: 规范化后的语法树；词法退化时为 None
+    """
+    template: str
+    params: Tuple[Any, ...]
+    outputs: Tuple[str, ...] = ()
+    query: Optional[Query] = None
+
+    @property
+    def digest(self) -> str:
+        """模板、参数和输出列名的哈希，用作精确匹配的缓存键"""
+        text = repr((self.template, self.params, self.outputs))
+        return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def _value_key(value: Any) -> Tuple[str, Any]:
+    # 不同类型的值之间也能排序
+    return (type(value).__name__, value if value is not None else 0)
+
+
+def _template(expr, params: List[Any]) -> str:
+    """与 render 相同的结构，常量输出为 ? 并追加到 params"""
+    if isinstance(expr, Column):
+        return expr.name
+    if isinstance(expr, Literal):
+        params.append(expr.value)
+        return "?"
+    if isinstance(expr, Aggregate):
+        arg = "*" if expr.arg is None else _template(expr.arg, params)
+        return f"{expr.func.lower()}({'distinct ' if expr.distinct else ''}{arg})"
+    if isinstance(expr, BinaryOp):
+        return f"({_template(expr.left, params)} {expr.op} {_template(expr.right, params)})"
+    if isinstance(expr, BoolOp):
+        return "(" + f" {expr.op} ".join(_template(item, params) for item in expr.items) + ")"
+    if isinstance(expr, Not):
+        return f"NOT {_template(expr.expr, params)}"
+    if isinstance(expr, InList):
+        # IN 列表整体是一个参数，长度不同的列表共用模板
+        params.append(expr.values)
+        return f"{_template(expr.expr, params)} {'NOT ' if expr.negated else ''}IN (?)"
+    if isinstance(expr, Between):
+        return (f"{_template(expr.expr, params)} {'NOT ' if expr.negated else ''}BETWEEN "
+                f"{_template(expr.low, params)} AND {_template(expr.high, params)}")
+    if isinstance(expr, Like):
+        params.append(expr.pattern)
+        return f"{_template(expr.expr, params)} {'NOT ' if expr.negated else ''}LIKE ?"
+    if isinstance(expr, IsNull):
+        return f"{_template(expr.expr, params)} IS {'NOT ' if expr.negated else ''}NULL"
+    raise TypeError(f"未知表达式: {expr!r}")
+
+
+def _sort_key(expr) -> Tuple[str, str]:
+    params: List[Any] = []
+    return _template(expr, params), repr(params)
+
+
+def canonicalize(expr):
+    """表达式的规范形式（见模块说明）"""
+    if expr is None or isinstance(expr, Literal):
+        return expr
+    if isinstance(expr, Column):
+        return expr
+    if isinstance(expr, Aggregate):
+        return replace(expr, arg=canonicalize(expr.arg))
+    if isinstance(expr, BinaryOp):
+        left, right = canonicalize(expr.left), canonicalize(expr.right)
+        op = expr.op
+        if op in _FLIPPED and isinstance(left, Literal) and not isinstance(right, Literal):
+            left, right, op = right, left, _FLIPPED[op]
+        elif op in _COMMUTATIVE and not isinstance(right, Literal) and _sort_key(right) < _sort_key(left):
+            left, right = right, left
+        return BinaryOp(op, left, right)
+    if isinstance(expr, BoolOp):
+        items = []
+        for item in map(canonicalize, expr.items):
+            # (a AND b) AND c → a AND b AND c
+            items.extend(item.items if isinstance(item, BoolOp) and item.op == expr.op else (item,))
+        unique = {}
+        for item in items:
+            unique.setdefault(_sort_key(item), item)
+        if len(unique) == 1:
+            return next(iter(unique.values()))
+        return BoolOp(expr.op, tuple(unique[key] for key in sorted(unique)))
+    if isinstance(expr, Not):
+        inner = canonicalize(expr.expr)
+        return inner.expr if isinstance(inner, Not) else Not(inner)
+    if isinstance(expr, InList):
+        values = tuple(sorted(set(expr.values), key=_value_key))
+        return InList(canonicalize(expr.expr), values, expr.negated)
+    if isinstance(expr, Between):
+        return Between(canonicalize(expr.expr), canonicalize(expr.low), canonicalize(expr.high), expr.negated)
+    if isinstance(expr, (Like, IsNull)):
+        return replace(expr, expr=canonicalize(expr.expr))
+    raise TypeError(f"未知表达式: {expr!r}")
+
+
+def canonical_query(query: Query) -> Query:
+    """
+    查询的规范形式：各子句中的表达式规范化，ORDER BY / HAVING 不再引用别名
+    （输出列的顺序和别名不变）
+    """
+    return Query(
+        table=query.table,
+        items=tuple(replace(item, expr=canonicalize(item.expr)) for item in query.items),
+        where=canonicalize(query.where),
+        group_by=tuple(canonicalize(expr) for expr in query.group_by),
+        having=canonicalize(_resolve_aliases(query.having, query)) if query.having is not None else None,
+        order_by=tuple(
+            (canonicalize(_resolve_aliases(expr, query)), descending) for expr, descending in query.order_by
+        ),
+        limit=query.limit,
+        offset=query.offset,
+    )
+
+
+def _fingerprint_query(query: Query) -> SQLFingerprint:
+    canonical = canonical_query(query)
+    params: List[Any] = []
+    parts = ["SELECT"]
+    if canonical.items:
+        parts.append(", ".join(
+            _template(item.expr, params) + (f" AS {item.alias}" if item.alias else "")
+            for item in canonical.items
+        ))
+    else:
+        parts.append("*")
+    parts.append(f"FROM {canonical.table}")
+    if canonical.where is not None:
+        parts.append("WHERE " + _template(canonical.where, params))
+    if canonical.group_by:
+        parts.append("GROUP BY " + ", ".join(_template(expr, params) for expr in canonical.group_by))
+    if canonical.having is not None:
+        parts.append("HAVING " + _template(canonical.having, params))
+    if canonical.order_by:
+        parts.append("ORDER BY " + ", ".join(
+            _template(expr, params) + (" DESC" if descending else "") for expr, descending in canonical.order_by
+        ))
+    if canonical.limit is not None:
+        parts.append("LIMIT ?")
+        params.append(canonical.limit)
+    if canonical.offset:
+        parts.append("OFFSET ?")
+        params.append(canonical.offset)
+    # 输出列名取自原查询（别名或原样的表达式）
+    outputs = tuple(item.alias or render(item.expr) for item in query.items)
+    return SQLFingerprint(" ".join(parts), tuple(params), outputs, canonical)
+
+
+def _fingerprint_tokens(sql: str) -> SQLFingerprint:
+    params: List[Any] = []
+    words = []
+    # 退化的通常是多表查询，保留表名前缀：t.x = u.y 与 u.x = t.y 不同
+    for kind, value in tokenize(sql, strip_qualifiers=False):
+        if kind in ("number", "string"):
+            params.append(value)
+            words.append("?")
+        elif kind == "ident" and value.upper() in _EXTRA_KEYWORDS:
+            words.append(value.upper())
+        elif not (kind == "op" and value == ";"):
+            words.append(str(value))
+    return SQLFingerprint(" ".join(words), tuple(params))
+
+
+@lru_cache(maxsize=4096)
+def fingerprint_sql(sql: str) -> Optional[SQLFingerprint]:
+    """
+    计算 SQL 指纹（结果不可变，按 SQL 文本缓存）
+
+    Returns:
+        SQLFingerprint；连词法分析都无法完成时返回 None
+    """
+    try:
+        return _fingerprint_query(parse_sql(sql))
+    except ValueError:
+        pass
+    try:
+        return _fingerprint_tokens(sql)
+    except ValueError:
+        return None
@@ -0,0 +1,755 @@
+"""
+持久化数据结构 - 分支快照的结构共享基础
+
+- PersistentMap: HAMT（哈希数组映射前缀树），表名 -> 表数据
+- PersistentVector: 路径复制前缀树，按页（page）存放行
+
+所有写操作都返回新对象，旧版本保持不变；新旧版本之间共享未修改的节点。
+因此创建分支只需持有同一个根引用（O(1)），单次写入只复制一条路径（O(log n)）。
+
+表数据以列式页存放（见 columnar）：每页的行编码为类型化的列数组，
+按行读取得到兼容 dict 的 Row 视图；非 Mapping 的值仍按普通列表存放。
+
+PersistentVector 的节点同时构成 Merkle 树：页的摘要是行内容的哈希，内部节点的
+摘要是子节点摘要的哈希。摘要按需计算并缓存在不可变节点上，分支之间共享，
+写入后只有被复制的路径需要重新计算。
+"""
+
+import hashlib
+from collections.abc import Mapping, Sequence
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from .columnar import ColumnBlock
+
+
+# 前缀树每层 32 路分支
+BRANCH_BITS = 5
+BRANCH_FACTOR = 1 << BRANCH_BITS
+BRANCH_MASK = BRANCH_FACTOR - 1
+
+# 每页行数：叶子页较大，便于批量扫描；写入时只复制被修改的页
+PAGE_BITS = 10
+PAGE_SIZE = 1 << PAGE_BITS
+PAGE_MASK = PAGE_SIZE - 1
+
+DIGEST_SIZE = 16
+
+
+class _Missing:
+    """值不存在的占位符"""
+
+    __slots__ = ()
+
+    def __repr__(self) -> str:
+        return "MISSING"
+
+
+MISSING = _Missing()
+
+
+class _Node:
+    """
+    前缀树内部节点
+
+    columns 为查询引擎的列缓存，digest 为 Merkle 摘要；节点不可变，缓存可以共享。
+    """
+
+    __slots__ = ("children", "columns", "digest")
+
+    def __init__(self, children: List[Any]):
+        self.children = children
+        self.columns = None
+        self.digest = None
+
+    def __getstate__(self):
+        # 缓存可以重建，不参与序列化
+        return self.children
+
+    def __setstate__(self, state):
+        self.children = state
+        self.columns = None
+        self.digest = None
+
+
+class _Page:
+    """叶子页：一段连续的行（ColumnBlock，或非 Mapping 值时的列表）"""
+
+    __slots__ = ("rows", "columns", "digest")
+
+    def __init__(self, rows: List[Any]):
+        self.rows = rows
+        self.columns = None
+        self.digest = None
+
+    def __getstate__(self):
+        return self.rows
+
+    def __setstate__(self, state):
+        self.rows = state
+        self.columns = None
+        self.digest = None
+
+
+def _digest(node) -> bytes:
+    """
+    计算（并缓存）Merkle 摘要
+
+    页按行的 repr 哈希：内容相同但构造方式不同的页摘要一致；
+    键顺序不同的等值行会得到不同摘要，只会让比较多下探一层，不会误判相等。
+    """
+    if node.digest is None:
+        if type(node) is _Page:
+            h = hashlib.blake2b(b"P", digest_size=DIGEST_SIZE)
+            if type(node.rows) is ColumnBlock:
+                node.rows.digest_into(h)
+            else:
+                h.update(repr(node.rows).encode())
+            node.digest = h.digest()
+        else:
+            h = hashlib.blake2b(b"N", digest_size=DIGEST_SIZE)
+            for child in node.children:
+                h.update(_digest(child))
+            node.digest = h.digest()
+    return node.digest
+
+
+def _make_page(rows: List[Any]) -> _Page:
+    """新建页：行都是 Mapping 时按列编码"""
+    block = ColumnBlock.from_rows(rows)
+    return _Page(rows if block is None else block)
+
+
+def _page_with(page: _Page, changes: Dict[int, Any], appends: List[Any]) -> _Page:
+    """返回替换 / 追加若干行后的新页（原页不变）"""
+    rows = page.rows
+    if type(rows) is ColumnBlock:
+        block = rows.with_changes(changes, appends)
+        if block is not None:
+            return _Page(block)
+    rows = list(rows)
+    for offset, value in changes.items():
+        rows[offset] = value
+    rows.extend(appends)
+    return _make_page(rows)
+
+
+def _same_content(a, b) -> bool:
+    """不触发计算：同一对象，或两侧都已缓存且相等的摘要"""
+    return a is b or (a.digest is not None and a.digest == b.digest)
+
+
+_EMPTY_ROOT = _Node([])
+
+
+class PersistentVector(Sequence):
+    """
+    持久化向量（路径复制前缀树）
+
+    叶子为最多 PAGE_SIZE 行的页，内部节点 32 路分支。
+    读取 O(log32 n)，append / set 只复制根到目标页的一条路径。
+    """
+
+    __slots__ = ("_count", "_shift", "_root")
+
+    def __init__(self, count: int = 0, shift: int = 0, root: _Node = _EMPTY_ROOT):
+        self._count = count
+        self._shift = shift
+        self._root = root
+
+    @classmethod
+    def from_iterable(cls, rows: Iterable[Any]) -> "PersistentVector":
+        """批量构建（O(n)，不做逐行路径复制）"""
+        pages = []
+        buffer = []
+        for row in rows:
+            buffer.append(row)
+            if len(buffer) == PAGE_SIZE:
+                pages.append(_make_page(buffer))
+                buffer = []
+        if buffer:
+            pages.append(_make_page(buffer))
+        return cls.from_pages(pages)
+
+    @classmethod
+    def from_pages(cls, pages: List[_Page]) -> "PersistentVector":
+        """由已有的页构建（除最后一页外每页都需要恰好 PAGE_SIZE 行）"""
+        count = sum(len(page.rows) for page in pages)
+        if not pages:
+            return cls()
+
+        # 自底向上逐层打包
+        shift = 0
+        level = [_Node(pages[i:i + BRANCH_FACTOR]) for i in range(0, len(pages), BRANCH_FACTOR)]
+        while len(level) > 1:
+            shift += BRANCH_BITS
+            level = [_Node(level[i:i + BRANCH_FACTOR]) for i in range(0, len(level), BRANCH_FACTOR)]
+        return cls(count, shift, level[0])
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._get(i) for i in range(*index.indices(self._count))]
+        return self._get(self._normalize(index))
+
+    def __iter__(self) -> Iterator[Any]:
+        for page in self.pages():
+            yield from page.rows
+
+    def __repr__(self) -> str:
+        return f"PersistentVector(len={self._count})"
+
+    def _normalize(self, index: int) -> int:
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError("PersistentVector index out of range")
+        return index
+
+    def _page_for(self, page_index: int) -> _Page:
+        node = self._root
+        for shift in range(self._shift, 0, -BRANCH_BITS):
+            node = node.children[(page_index >> shift) & BRANCH_MASK]
+        return node.children[page_index & BRANCH_MASK]
+
+    def _get(self, index: int) -> Any:
+        return self._page_for(index >> PAGE_BITS).rows[index & PAGE_MASK]
+
+    def segments(self) -> Iterator[_Node]:
+        """按顺序遍历最底层内部节点（每个最多 32 页，即一个扫描段）"""
+        stack = [(self._root, self._shift)]
+        while stack:
+            node, shift = stack.pop()
+            if shift == 0:
+                yield node
+            else:
+                stack.extend((child, shift - BRANCH_BITS) for child in reversed(node.children))
+
+    def pages(self) -> Iterator[_Page]:
+        """按顺序遍历所有叶子页"""
+        for segment in self.segments():
+            yield from segment.children
+
+    def set(self, index: int, value: Any) -> "PersistentVector":
+        """返回替换第 index 行后的新向量"""
+        index = self._normalize(index)
+        page_index = index >> PAGE_BITS
+        page = _page_with(self._page_for(page_index), {index & PAGE_MASK: value}, [])
+        root = _assoc_page(self._root, self._shift, page_index, page)
+        return PersistentVector(self._count, self._shift, root)
+
+    def append(self, value: Any) -> "PersistentVector":
+        """返回追加一行后的新向量"""
+        page_index = self._count >> PAGE_BITS
+        if self._count & PAGE_MASK:
+            page = _page_with(self._page_for(page_index), {}, [value])
+        else:
+            page = _make_page([value])
+
+        root, shift = self._root, self._shift
+        # 根节点已满时增加一层
+        if page_index == 1 << (shift + BRANCH_BITS):
+            root = _Node([root])
+            shift += BRANCH_BITS
+        root = _assoc_page(root, shift, page_index, page)
+        return PersistentVector(self._count + 1, shift, root)
+
+    def extend(self, values: Iterable[Any]) -> "PersistentVector":
+        """逐行追加（批量场景请优先使用 from_iterable）"""
+        vector = self
+        for value in values:
+            vector = vector.append(value)
+        return vector
+
+    def digest(self) -> str:
+        """
+        整个向量的 Merkle 根摘要（十六进制）
+
+        首次计算需要哈希全部页；此后共享的子树直接复用缓存，
+        路径复制出的新版本只重新哈希被复制的页和路径。
+        """
+        h = hashlib.blake2b(digest_size=DIGEST_SIZE)
+        h.update(self._count.to_bytes(8, "little"))
+        h.update(_digest(self._root))
+        return h.hexdigest()
+
+    def same_content(self, other: "PersistentVector") -> bool:
+        """
+        快速判断两个版本内容相同（不触发哈希计算）
+
+        共享同一根节点，或两侧的 Merkle 摘要都已计算且相等时返回 True；
+        返回 False 不代表内容一定不同。
+        """
+        return self._count == other._count and _same_content(self._root, other._root)
+
+    def to_list(self) -> List[Any]:
+        return list(self)
+
+    def update_many(
+        self,
+        updates: Dict[int, Any],
+        appends: Iterable[Any] = ()
+    ) -> "PersistentVector":
+        """
+        批量写入：按页分组替换行，再追加新行
+
+        每个被修改的页只复制一次，适合合并等一次性写入大量行的场景。
+        """
+        transient = self.transient()
+        for index, value in updates.items():
+            transient.set(index, value)
+        transient.extend(appends)
+        return transient.persistent()
+
+    def transient(self) -> "TransientVector":
+        """可写的工作副本（见 TransientVector），原向量不变"""
+        return TransientVector(self)
+
+
+class TransientVector:
+    """
+    PersistentVector 的可写工作副本（按页写时复制）
+
+    每页在第一次被写入时归该副本所有：之后对该页的写入只记入页的待写集合，
+    不再复制。persistent() 时每个被写过的页只复制一次（列式页只复制变化的列），
+    并重新挂接到页表中；挂接过程新建的内部节点同样归副本所有，
+    多个页共用的路径只复制一次。未被写入的页与原向量共享。
+    """
+
+    __slots__ = ("_base", "_count", "_pages")
+
+    def __init__(self, base: PersistentVector):
+        self._base = base
+        self._count = len(base)
+        # 页号 -> [原页（新页为 None）, {页内偏移: 新行}, 追加的行]
+        self._pages: Dict[int, List[Any]] = {}
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __getitem__(self, index: int) -> Any:
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError("TransientVector index out of range")
+        entry = self._pages.get(index >> PAGE_BITS)
+        if entry is None:
+            return self._base._get(index)
+        page, changes, appends = entry
+        offset = index & PAGE_MASK
+        base_length = len(page.rows) if page is not None else 0
+        if offset >= base_length:
+            return appends[offset - base_length]
+        value = changes.get(offset, MISSING)
+        return page.rows[offset] if value is MISSING else value
+
+    def _own(self, page_index: int) -> List[Any]:
+        entry = self._pages.get(page_index)
+        if entry is None:
+            page = None
+            if page_index << PAGE_BITS < len(self._base):
+                page = self._base._page_for(page_index)
+            entry = self._pages[page_index] = [page, {}, []]
+        return entry
+
+    def set(self, index: int, value: Any):
+        """替换第 index 行"""
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError("TransientVector index out of range")
+        page, changes, appends = self._own(index >> PAGE_BITS)
+        offset = index & PAGE_MASK
+        base_length = len(page.rows) if page is not None else 0
+        if offset >= base_length:
+            appends[offset - base_length] = value
+        else:
+            changes[offset] = value
+
+    def append(self, value: Any):
+        """追加一行"""
+        self._own(self._count >> PAGE_BITS)[2].append(value)
+        self._count += 1
+
+    def extend(self, values: Iterable[Any]):
+        """追加多行（按页整段追加）"""
+        values = values if isinstance(values, list) else list(values)
+        start = 0
+        while start < len(values):
+            room = PAGE_SIZE - (self._count & PAGE_MASK)
+            chunk = values[start:start + room]
+            self._own(self._count >> PAGE_BITS)[2].extend(chunk)
+            self._count += len(chunk)
+            start += len(chunk)
+
+    def extend_columns(self, names: List[str], columns: List[Any], length: int):
+        """
+        按列追加 length 行（columns 为与 names 对应的等长列数组）
+
+        只有补满当前未满的页时逐行构造（少于 PAGE_SIZE 行），
+        其余每页直接由列切片编码为列式页。
+        """
+        start = min((-self._count) & PAGE_MASK, length)
+        if start:
+            heads = [column[:start] for column in columns]
+            heads = [head.tolist() if hasattr(head, "tolist") else list(head) for head in heads]
+            self.extend([dict(zip(names, values)) for values in zip(*heads)])
+        while start < length:
+            stop = min(start + PAGE_SIZE, length)
+            block = ColumnBlock.from_columns(names, [column[start:stop] for column in columns])
+            # 新页作为该页的原页登记，之后的写入照常记入待写集合
+            self._pages[self._count >> PAGE_BITS] = [_Page(block), {}, []]
+            self._count += stop - start
+            start = stop
+
+    def persistent(self) -> PersistentVector:
+        """生成新的 PersistentVector；之后不应再写入该副本"""
+        base = self._base
+        root, shift = base._root, base._shift
+        owned = set()
+        for page_index in sorted(self._pages):
+            page, changes, appends = self._pages[page_index]
+            if page is None:
+                page = _make_page(appends)
+            elif changes or appends:
+                page = _page_with(page, changes, appends)
+            # 根节点已满时增加一层
+            if page_index == 1 << (shift + BRANCH_BITS):
+                root = _Node([root])
+                owned.add(id(root))
+                shift += BRANCH_BITS
+            root = _assoc_page(root, shift, page_index, page, owned)
+        self._pages = {}
+        return PersistentVector(self._count, shift, root)
+
+
+def diff_vectors(
+    base: PersistentVector,
+    other: PersistentVector
+) -> Iterator[Tuple[int, Any, Any]]:
+    """
+    结构化比较两个版本
+
+    两边共享的子树、以及 Merkle 摘要已计算且相等的子树直接跳过，
+    只沿不同的路径向下，代价与变化量成正比。
+
+    Yields:
+        (行号, 旧值, 新值)；某一侧没有该行时为 MISSING
+    """
+    shift = max(base._shift, other._shift)
+    yield from _diff_nodes(_lift(base, shift), _lift(other, shift), shift, 0)
+
+
+def _lift(vector: PersistentVector, shift: int) -> _Node:
+    """把较矮的树包装到指定高度，便于与较高的树逐层对齐"""
+    root = vector._root
+    for _ in range(vector._shift, shift, BRANCH_BITS):
+        root = _Node([root])
+    return root
+
+
+def _diff_nodes(a: _Node, b: _Node, shift: int, first_page: int) -> Iterator[Tuple[int, Any, Any]]:
+    if _same_content(a, b):
+        return
+    for i in range(max(len(a.children), len(b.children))):
+        x = a.children[i] if i < len(a.children) else None
+        y = b.children[i] if i < len(b.children) else None
+        if x is y or (x is not None and y is not None and _same_content(x, y)):
+            continue
+        if shift:
+            yield from _diff_nodes(
+                x or _EMPTY_ROOT, y or _EMPTY_ROOT,
+                shift - BRANCH_BITS, first_page + (i << shift)
+            )
+            continue
+
+        old_rows = x.rows if x is not None else []
+        new_rows = y.rows if y is not None else []
+        row_base = (first_page + i) << PAGE_BITS
+        for j in _changed_offsets(old_rows, new_rows):
+            old = old_rows[j] if j < len(old_rows) else MISSING
+            new = new_rows[j] if j < len(new_rows) else MISSING
+            if old is not new and old != new:
+                yield row_base + j, old, new
+
+
+def _changed_offsets(old_rows, new_rows) -> Iterable[int]:
+    """两页中可能不同的行偏移；列式页先逐列比较，避免为每行构造视图"""
+    shared = min(len(old_rows), len(new_rows))
+    tail = range(shared, max(len(old_rows), len(new_rows)))
+    if type(old_rows) is ColumnBlock and type(new_rows) is ColumnBlock:
+        changed = old_rows.changed_indices(new_rows)
+        if changed is not None:
+            return changed + list(tail)
+    return range(shared + len(tail))
+
+
+def _assoc_page(
+    node: _Node,
+    shift: int,
+    page_index: int,
+    page: _Page,
+    owned: Optional[set] = None
+) -> _Node:
+    """
+    路径复制：返回把第 page_index 页替换（或追加）为 page 后的新节点
+
+    Args:
+        owned: 可原地修改的节点 id 集合（TransientVector 本次新建的节点）；
+            复制出的节点也加入其中，同一路径上的后续页直接原地挂接
+    """
+    if owned is not None and id(node) in owned:
+        result = node
+        children = node.children
+    else:
+        children = list(node.children)
+        result = _Node(children)
+        if owned is not None:
+            owned.add(id(result))
+
+    idx = (page_index >> shift) & BRANCH_MASK
+    if shift == 0:
+        child = page
+    else:
+        sub = children[idx] if idx < len(children) else _EMPTY_ROOT
+        child = _assoc_page(sub, shift - BRANCH_BITS, page_index, page, owned)
+
+    if idx == len(children):
+        children.append(child)
+    else:
+        children[idx] = child
+    return result
+
+
+# ----------------------------------------------------------------------------
+# HAMT
+# ----------------------------------------------------------------------------
+
+_HASH_BITS = 32
+_HASH_MASK = (1 << _HASH_BITS) - 1
+
+
+class _BitmapNode:
+    """HAMT 位图节点：entries 中每项是 (key, value) 或子节点"""
+
+    __slots__ = ("bitmap", "entries")
+
+    def __init__(self, bitmap: int, entries: List[Any]):
+        self.bitmap = bitmap
+        self.entries = entries
+
+
+class _CollisionNode:
+    """哈希完全冲突时的线性节点"""
+
+    __slots__ = ("pairs",)
+
+    def __init__(self, pairs: List[Tuple[Any, Any]]):
+        self.pairs = pairs
+
+
+_EMPTY_HAMT = _BitmapNode(0, [])
+
+
+def _bit_index(bitmap: int, bit: int) -> int:
+    return bin(bitmap & (bit - 1)).count("1")
+
+
+def _hamt_get(node, key, key_hash: int, shift: int, default):
+    while True:
+        if isinstance(node, _CollisionNode):
+            for k, v in node.pairs:
+                if k == key:
+                    return v
+            return default
+
+        bit = 1 << ((key_hash >> shift) & BRANCH_MASK)
+        if not node.bitmap & bit:
+            return default
+        entry = node.entries[_bit_index(node.bitmap, bit)]
+        if isinstance(entry, tuple):
+            return entry[1] if entry[0] == key else default
+        node = entry
+        shift += BRANCH_BITS
+
+
+def _hamt_merge_pairs(shift: int, pair1, hash1: int, pair2, hash2: int):
+    """为两个落在同一槽位的键值对构建子节点"""
+    if shift >= _HASH_BITS:
+        return _CollisionNode([pair1, pair2])
+    idx1 = (hash1 >> shift) & BRANCH_MASK
+    idx2 = (hash2 >> shift) & BRANCH_MASK
+    if idx1 == idx2:
+        child = _hamt_merge_pairs(shift + BRANCH_BITS, pair1, hash1, pair2, hash2)
+        return _BitmapNode(1 << idx1, [child])
+    entries = [pair1, pair2] if idx1 < idx2 else [pair2, pair1]
+    return _BitmapNode((1 << idx1) | (1 << idx2), entries)
+
+
+def _hamt_set(node, key, value, key_hash: int, shift: int) -> Tuple[Any, bool]:
+    """返回 (新节点, 是否新增键)"""
+    if isinstance(node, _CollisionNode):
+        pairs = [p for p in node.pairs if p[0] != key]
+        added = len(pairs) == len(node.pairs)
+        pairs.append((key, value))
+        return _CollisionNode(pairs), added
+
+    bit = 1 << ((key_hash >> shift) & BRANCH_MASK)
+    idx = _bit_index(node.bitmap, bit)
+    entries = list(node.entries)
+
+    if not node.bitmap & bit:
+        entries.insert(idx, (key, value))
+        return _BitmapNode(node.bitmap | bit, entries), True
+
+    entry = entries[idx]
+    if isinstance(entry, tuple):
+        if entry[0] == key:
+            entries[idx] = (key, value)
+            return _BitmapNode(node.bitmap, entries), False
+        entries[idx] = _hamt_merge_pairs(
+            shift + BRANCH_BITS,
+            entry, hash(entry[0]) & _HASH_MASK,
+            (key, value), key_hash
+        )
+        return _BitmapNode(node.bitmap, entries), True
+
+    child, added = _hamt_set(entry, key, value, key_hash, shift + BRANCH_BITS)
+    entries[idx] = child
+    return _BitmapNode(node.bitmap, entries), added
+
+
+def _hamt_delete(node, key, key_hash: int, shift: int):
+    """返回删除后的新节点；键不存在时返回原节点"""
+    if isinstance(node, _CollisionNode):
+        pairs = [p for p in node.pairs if p[0] != key]
+        if len(pairs) == len(node.pairs):
+            return node
+        return _CollisionNode(pairs)
+
+    bit = 1 << ((key_hash >> shift) & BRANCH_MASK)
+    if not node.bitmap & bit:
+        return node
+    idx = _bit_index(node.bitmap, bit)
+    entry = node.entries[idx]
+
+    if isinstance(entry, tuple):
+        if entry[0] != key:
+            return node
+        entries = node.entries[:idx] + node.entries[idx + 1:]
+        return _BitmapNode(node.bitmap & ~bit, entries)
+
+    child = _hamt_delete(entry, key, key_hash, shift + BRANCH_BITS)
+    if child is entry:
+        return node
+    entries = list(node.entries)
+    remaining = child.pairs if isinstance(child, _CollisionNode) else child.entries
+    if not remaining:
+        del entries[idx]
+        return _BitmapNode(node.bitmap & ~bit, entries)
+    # 只剩一个键值对的子节点上提，保持树紧凑
+    if len(remaining) == 1 and isinstance(remaining[0], tuple):
+        entries[idx] = remaining[0]
+    else:
+        entries[idx] = child
+    return _BitmapNode(node.bitmap, entries)
+
+
+def _hamt_build(items: List[Tuple[int, Tuple[Any, Any]]], shift: int):
+    """由 (哈希, 键值对) 批量自顶向下构建节点，结构与逐个 _hamt_set 的结果相同"""
+    if shift >= _HASH_BITS:
+        return _CollisionNode([pair for _, pair in items])
+    buckets: Dict[int, List[Tuple[int, Tuple[Any, Any]]]] = {}
+    for item in items:
+        buckets.setdefault((item[0] >> shift) & BRANCH_MASK, []).append(item)
+    bitmap = 0
+    entries = []
+    for idx in sorted(buckets):
+        bucket = buckets[idx]
+        bitmap |= 1 << idx
+        entries.append(bucket[0][1] if len(bucket) == 1 else _hamt_build(bucket, shift + BRANCH_BITS))
+    return _BitmapNode(bitmap, entries)
+
+
+def _hamt_items(node) -> Iterator[Tuple[Any, Any]]:
+    if isinstance(node, _CollisionNode):
+        yield from node.pairs
+        return
+    for entry in node.entries:
+        if isinstance(entry, tuple):
+            yield entry
+        else:
+            yield from _hamt_items(entry)
+
+
+class PersistentMap(Mapping):
+    """
+    持久化映射（HAMT）
+
+    set / delete 返回新映射，只复制从根到目标槽位的路径（O(log32 n)）。
+    """
+
+    __slots__ = ("_count", "_root")
+
+    def __init__(self, count: int = 0, root=_EMPTY_HAMT):
+        self._count = count
+        self._root = root
+
+    @classmethod
+    def from_dict(cls, data: Dict[Any, Any]) -> "PersistentMap":
+        """批量构建（O(n)，不做逐个路径复制）"""
+        if not data:
+            return cls()
+        items = [(hash(key) & _HASH_MASK, (key, value)) for key, value in data.items()]
+        return cls(len(items), _hamt_build(items, 0))
+
+    def __reduce__(self):
+        # 节点布局取决于 hash()，而 str 等类型的哈希每个进程不同（PYTHONHASHSEED），
+        # 按键值对序列化，加载时用当前进程的哈希重建
+        return (type(self).from_dict, (dict(_hamt_items(self._root)),))
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __getitem__(self, key):
+        missing = MISSING
+        value = _hamt_get(self._root, key, hash(key) & _HASH_MASK, 0, missing)
+        if value is missing:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key) -> bool:
+        return _hamt_get(self._root, key, hash(key) & _HASH_MASK, 0, MISSING) is not MISSING
+
+    def get(self, key, default=None):
+        return _hamt_get(self._root, key, hash(key) & _HASH_MASK, 0, default)
+
+    def __iter__(self) -> Iterator[Any]:
+        for key, _ in _hamt_items(self._root):
+            yield key
+
+    def items(self):
+        return list(_hamt_items(self._root))
+
+    def __repr__(self) -> str:
+        return f"PersistentMap({dict(_hamt_items(self._root))!r})"
+
+    def set(self, key, value) -> "PersistentMap":
+        """返回设置 key 后的新映射"""
+        root, added = _hamt_set(self._root, key, value, hash(key) & _HASH_MASK, 0)
+        return PersistentMap(self._count + (1 if added else 0), root)
+
+    def delete(self, key) -> "PersistentMap":
+        """返回删除 key 后的新映射"""
+        root = _hamt_delete(self._root, key, hash(key) & _HASH_MASK, 0)
+        if root is self._root:
+            return self
+        return PersistentMap(self._count - 1, root)
+
+    def to_dict(self) -> Dict[Any, Any]:
+        """导出为普通 dict（表数据转为 list）"""
+        return {
+            key: value.to_list() if isinstance(value, PersistentVector) else value
+            for key, value in _hamt_items(self._root)
+        }
@@ -0,0 +1,1253 @@
+"""
+分支内存查询引擎 - 基于 NumPy 的向量化执行
+
+支持的 SQL 子集：
+    SELECT <* | 列 | 表达式 | 聚合> [AS 别名], ...
+    FROM <表>
+    [WHERE <条件>]
+    [GROUP BY <表达式 | 别名 | 序号>, ...]
+    [HAVING <条件>]
+    [ORDER BY <表达式 | 别名 | 序号> [ASC|DESC], ...]
+    [LIMIT <n> [OFFSET <m>]]
+
+聚合函数：COUNT / SUM / AVG / MIN / MAX（支持 DISTINCT）
+条件：比较运算、AND / OR / NOT、IN、BETWEEN、LIKE、IS [NOT] NULL、四则运算（NULL 按 SQL 三值逻辑处理）
+
+执行按扫描段进行：列数组缓存在持久化前缀树的页和段节点上。
+这些节点在分支之间共享且不可变，因此父分支未修改的数据在所有子分支中
+只转换一次，之后的扫描直接读取共享数组，不做复制。
+"""
+
+import operator
+import re
+from dataclasses import dataclass, replace
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .columnar import ABSENT, ColumnBlock
+from .persistent import PAGE_BITS, PAGE_MASK, PersistentMap, PersistentVector
+
+
+# ----------------------------------------------------------------------------
+# 语法树
+# ----------------------------------------------------------------------------
+
+@dataclass(frozen=True)
+class Column:
+    name: str
+
+
+@dataclass(frozen=True)
+class Literal:
+    value: Any
+
+
+@dataclass(frozen=True)
+class BinaryOp:
+    op: str
+    left: Any
+    right: Any
+
+
+@dataclass(frozen=True)
+class BoolOp:
+    op: str  # "AND" / "OR"
+    items: Tuple[Any, ...]
+
+
+@dataclass(frozen=True)
+class Not:
+    expr: Any
+
+
+@dataclass(frozen=True)
+class InList:
+    expr: Any
+    values: Tuple[Any, ...]
+    negated: bool = False
+
+
+@dataclass(frozen=True)
+class Between:
+    expr: Any
+    low: Any
+    high: Any
+    negated: bool = False
+
+
+@dataclass(frozen=True)
+class Like:
+    expr: Any
+    pattern: str
+    negated: bool = False
+
+
+@dataclass(frozen=True)
+class IsNull:
+    expr: Any
+    negated: bool = False
+
+
+@dataclass(frozen=True)
+class Aggregate:
+    func: str  # COUNT / SUM / AVG / MIN / MAX
+    arg: Any = None  # None 表示 COUNT(*)
+    distinct: bool = False
+
+
+@dataclass(frozen=True)
+class SelectItem:
+    expr: Any
+    alias: Optional[str] = None
+
+
+@dataclass(frozen=True)
+class Query:
+    table: str
+    items: Tuple[SelectItem, ...]  # 空元组表示 SELECT *
+    where: Any = None
+    group_by: Tuple[Any, ...] = ()
+    having: Any = None
+    order_by: Tuple[Tuple[Any, bool], ...] = ()  # (表达式, 是否降序)
+    limit: Optional[int] = None
+    offset: int = 0
+
+    @property
+    def is_aggregate(self) -> bool:
+        return bool(self.group_by) or any(_contains_aggregate(item.expr) for item in self.items)
+
+
+AGGREGATE_FUNCS = ("COUNT", "SUM", "AVG", "MIN", "MAX")
+COMPARISON_OPS = ("=", "!=", "<", "<=", ">", ">=")
+
+
+def _contains_aggregate(expr) -> bool:
+    if isinstance(expr, Aggregate):
+        return True
+    return any(_contains_aggregate(child) for child in _children(expr))
+
+
+def _children(expr) -> Tuple[Any, ...]:
+    if isinstance(expr, BinaryOp):
+        return (expr.left, expr.right)
+    if isinstance(expr, BoolOp):
+        return expr.items
+    if isinstance(expr, (Not, InList, Like, IsNull)):
+        return (expr.expr,)
+    if isinstance(expr, Between):
+        return (expr.expr, expr.low, expr.high)
+    if isinstance(expr, Aggregate) and expr.arg is not None:
+        return (expr.arg,)
+    return ()
+
+
+def referenced_columns(expr) -> List[str]:
+    """表达式引用的列名"""
+    if isinstance(expr, Column):
+        return [expr.name]
+    names = []
+    for child in _children(expr):
+        names.extend(referenced_columns(child))
+    return names
+
+
+def render(expr) -> str:
+    """把表达式还原为 SQL 文本（也用作默认输出列名）"""
+    if isinstance(expr, Column):
+        return expr.name
+    if isinstance(expr, Literal):
+        if expr.value is None:
+            return "NULL"
+        if isinstance(expr.value, bool):
+            return "TRUE" if expr.value else "FALSE"
+        if isinstance(expr.value, str):
+            return "'" + expr.value.replace("'", "''") + "'"
+        return repr(expr.value)
+    if isinstance(expr, Aggregate):
+        arg = "*" if expr.arg is None else render(expr.arg)
+        return f"{expr.func.lower()}({'distinct ' if expr.distinct else ''}{arg})"
+    if isinstance(expr, BinaryOp):
+        return f"({render(expr.left)} {expr.op} {render(expr.right)})"
+    if isinstance(expr, BoolOp):
+        return "(" + f" {expr.op} ".join(render(item) for item in expr.items) + ")"
+    if isinstance(expr, Not):
+        return f"NOT {render(expr.expr)}"
+    if isinstance(expr, InList):
+        values = ", ".join(render(Literal(v)) for v in expr.values)
+        return f"{render(expr.expr)} {'NOT ' if expr.negated else ''}IN ({values})"
+    if isinstance(expr, Between):
+        return (f"{render(expr.expr)} {'NOT ' if expr.negated else ''}BETWEEN "
+                f"{render(expr.low)} AND {render(expr.high)}")
+    if isinstance(expr, Like):
+        return f"{render(expr.expr)} {'NOT ' if expr.negated else ''}LIKE {render(Literal(expr.pattern))}"
+    if isinstance(expr, IsNull):
+        return f"{render(expr.expr)} IS {'NOT ' if expr.negated else ''}NULL"
+    raise TypeError(f"未知表达式: {expr!r}")
+
+
+# ----------------------------------------------------------------------------
+# 解析
+# ----------------------------------------------------------------------------
+
+_TOKEN_RE = re.compile(r"""
+    \s*(?:
+        (?P<comment>--[^\n]*)
+      | (?P<number>(?:\d+\.\d*|\.\d+|\d+)(?:[eE][+-]?\d+)?)(?![A-Za-z_])
+      | '(?P<string>(?:[^']|'')*)'
+      | "(?P<qident>[^"]+)"
+      | `(?P<bident>[^`]+)`
+      | (?P<ident>[A-Za-z_][A-Za-z_0-9]*(?:\.[A-Za-z_][A-Za-z_0-9]*)*)
+      | (?P<op><=|>=|<>|!=|==|[=<>*,()+\-/%;])
+    )""", re.VERBOSE)
+
+_KEYWORDS = {
+    "SELECT", "FROM", "WHERE", "GROUP", "BY", "HAVING", "ORDER", "LIMIT", "OFFSET",
+    "AS", "AND", "OR", "NOT", "IN", "BETWEEN", "LIKE", "IS", "NULL", "TRUE", "FALSE",
+    "ASC", "DESC", "DISTINCT",
+}
+
+
+def tokenize(sql: str, strip_qualifiers: bool = True) -> List[Tuple[str, Any]]:
+    """
+    切分 SQL，返回 (类型, 值) 列表；类型为 kw / ident / number / string / op
+
+    strip_qualifiers 为 False 时保留标识符的表名前缀（t.id）
+    """
+    tokens = []
+    pos = 0
+    sql = sql.rstrip()
+    while pos < len(sql):
+        match = _TOKEN_RE.match(sql, pos)
+        if not match or match.end() == pos:
+            raise ValueError(f"SQL 语法错误 (syntax error): 无法识别 {sql[pos:pos + 20]!r}")
+        pos = match.end()
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == "comment":
+            continue
+        if kind == "number":
+            value = float(value) if any(c in value for c in ".eE") else int(value)
+        elif kind == "string":
+            value = value.replace("''", "'")
+        elif kind in ("qident", "bident"):
+            kind = "ident"
+        elif kind == "ident":
+            if value.upper() in _KEYWORDS:
+                kind, value = "kw", value.upper()
+            elif strip_qualifiers:
+                # 单表查询，去掉表名前缀
+                value = value.rsplit(".", 1)[-1]
+        elif kind == "op" and value == "<>":
+            value = "!="
+        elif kind == "op" and value == "==":
+            value = "="
+        tokens.append((kind, value))
+    return tokens
+
+
+class _Parser:
+    """递归下降解析器"""
+
+    def __init__(self, sql: str):
+        self.tokens = tokenize(sql)
+        self.pos = 0
+
+    def error(self, message: str):
+        near = self.tokens[self.pos][1] if self.pos < len(self.tokens) else "结尾"
+        return ValueError(f"SQL 语法错误 (syntax error): {message}，位置: {near!r}")
+
+    def peek(self, offset: int = 0) -> Tuple[str, Any]:
+        index = self.pos + offset
+        return self.tokens[index] if index < len(self.tokens) else ("eof", None)
+
+    def accept(self, kind: str, value: Any = None) -> bool:
+        token = self.peek()
+        if token[0] == kind and (value is None or token[1] == value):
+            self.pos += 1
+            return True
+        return False
+
+    def expect(self, kind: str, value: Any = None) -> Any:
+        token = self.peek()
+        if not self.accept(kind, value):
+            raise self.error(f"期望 {value or kind}")
+        return token[1]
+
+    def parse(self) -> Query:
+        self.expect("kw", "SELECT")
+        items = self.parse_select_list()
+        self.expect("kw", "FROM")
+        table = self.expect("ident")
+
+        where = having = None
+        group_by: Tuple[Any, ...] = ()
+        order_by: Tuple[Tuple[Any, bool], ...] = ()
+        limit = None
+        offset = 0
+
+        if self.accept("kw", "WHERE"):
+            where = self.parse_expr()
+        if self.accept("kw", "GROUP"):
+            self.expect("kw", "BY")
+            group_by = tuple(self.parse_list(lambda: self.parse_group_item(items)))
+        if self.accept("kw", "HAVING"):
+            having = self.parse_expr()
+        if self.accept("kw", "ORDER"):
+            self.expect("kw", "BY")
+            order_by = tuple(self.parse_list(self.parse_order_item))
+        if self.accept("kw", "LIMIT"):
+            limit = self.expect("number")
+            if self.accept("op", ","):
+                # MySQL 风格 LIMIT offset, count
+                offset, limit = limit, self.expect("number")
+        if self.accept("kw", "OFFSET"):
+            offset = self.expect("number")
+        self.accept("op", ";")
+        if self.peek()[0] != "eof":
+            raise self.error("多余的内容")
+        if not isinstance(limit, (int, type(None))) or not isinstance(offset, int):
+            raise self.error("LIMIT / OFFSET 必须是整数")
+
+        return Query(table, items, where, group_by, having, order_by, limit, offset)
+
+    def parse_list(self, parse_item) -> List[Any]:
+        items = [parse_item()]
+        while self.accept("op", ","):
+            items.append(parse_item())
+        return items
+
+    def parse_select_list(self) -> Tuple[SelectItem, ...]:
+        if self.accept("op", "*"):
+            return ()
+        return tuple(self.parse_list(self.parse_select_item))
+
+    def parse_select_item(self) -> SelectItem:
+        expr = self.parse_expr()
+        alias = None
+        if self.accept("kw", "AS"):
+            alias = self.expect("ident")
+        elif self.peek()[0] == "ident":
+            alias = self.expect("ident")
+        return SelectItem(expr, alias)
+
+    def parse_group_item(self, items: Tuple[SelectItem, ...]):
+        """GROUP BY 中的别名和序号在解析时替换为对应的 SELECT 表达式（与 ORDER BY 一致，别名优先）"""
+        expr = self.parse_expr()
+        if isinstance(expr, Literal) and isinstance(expr.value, int) and not isinstance(expr.value, bool):
+            if not 1 <= expr.value <= len(items):
+                raise self.error(f"GROUP BY 序号超出范围: {expr.value}")
+            expr = items[expr.value - 1].expr
+        else:
+            aliases = {item.alias: item.expr for item in items if item.alias}
+            if aliases:
+                expr = _substitute_aliases(expr, aliases)
+        if _contains_aggregate(expr):
+            raise self.error("GROUP BY 不能包含聚合函数")
+        return expr
+
+    def parse_order_item(self) -> Tuple[Any, bool]:
+        expr = self.parse_expr()
+        if self.accept("kw", "DESC"):
+            return expr, True
+        self.accept("kw", "ASC")
+        return expr, False
+
+    def parse_expr(self):
+        items = [self.parse_and()]
+        while self.accept("kw", "OR"):
+            items.append(self.parse_and())
+        return items[0] if len(items) == 1 else BoolOp("OR", tuple(items))
+
+    def parse_and(self):
+        items = [self.parse_not()]
+        while self.accept("kw", "AND"):
+            items.append(self.parse_not())
+        return items[0] if len(items) == 1 else BoolOp("AND", tuple(items))
+
+    def parse_not(self):
+        if self.accept("kw", "NOT"):
+            return Not(self.parse_not())
+        return self.parse_predicate()
+
+    def parse_predicate(self):
+        left = self.parse_additive()
+        token = self.peek()
+        if token[0] == "op" and token[1] in COMPARISON_OPS:
+            self.pos += 1
+            return BinaryOp(token[1], left, self.parse_additive())
+        if self.accept("kw", "IS"):
+            negated = self.accept("kw", "NOT")
+            self.expect("kw", "NULL")
+            return IsNull(left, negated)
+
+        negated = self.accept("kw", "NOT")
+        if self.accept("kw", "IN"):
+            self.expect("op", "(")
+            values = self.parse_list(self.parse_literal_value)
+            self.expect("op", ")")
+            return InList(left, tuple(values), negated)
+        if self.accept("kw", "BETWEEN"):
+            low = self.parse_additive()
+            self.expect("kw", "AND")
+            return Between(left, low, self.parse_additive(), negated)
+        if self.accept("kw", "LIKE"):
+            return Like(left, self.expect("string"), negated)
+        if negated:
+            raise self.error("NOT 之后期望 IN / BETWEEN / LIKE")
+        return left
+
+    def parse_literal_value(self) -> Any:
+        expr = self.parse_additive()
+        if not isinstance(expr, Literal):
+            raise self.error("IN 列表只支持常量")
+        return expr.value
+
+    def parse_additive(self):
+        expr = self.parse_term()
+        while self.peek()[0] == "op" and self.peek()[1] in ("+", "-"):
+            op = self.tokens[self.pos][1]
+            self.pos += 1
+            expr = BinaryOp(op, expr, self.parse_term())
+        return expr
+
+    def parse_term(self):
+        expr = self.parse_unary()
+        while self.peek()[0] == "op" and self.peek()[1] in ("*", "/", "%"):
+            op = self.tokens[self.pos][1]
+            self.pos += 1
+            expr = BinaryOp(op, expr, self.parse_unary())
+        return expr
+
+    def parse_unary(self):
+        if self.accept("op", "-"):
+            expr = self.parse_unary()
+            if isinstance(expr, Literal) and isinstance(expr.value, (int, float)):
+                return Literal(-expr.value)
+            return BinaryOp("-", Literal(0), expr)
+        return self.parse_primary()
+
+    def parse_primary(self):
+        kind, value = self.peek()
+        if kind in ("number", "string"):
+            self.pos += 1
+            return Literal(value)
+        if kind == "kw" and value in ("NULL", "TRUE", "FALSE"):
+            self.pos += 1
+            return Literal({"NULL": None, "TRUE": True, "FALSE": False}[value])
+        if self.accept("op", "("):
+            expr = self.parse_expr()
+            self.expect("op", ")")
+            return expr
+        if kind == "ident":
+            self.pos += 1
+            if value.upper() in AGGREGATE_FUNCS and self.accept("op", "("):
+                return self.parse_aggregate(value.upper())
+            return Column(value)
+        raise self.error("期望表达式")
+
+    def parse_aggregate(self, func: str) -> Aggregate:
+        distinct = self.accept("kw", "DISTINCT")
+        if self.accept("op", "*"):
+            if func != "COUNT" or distinct:
+                raise self.error(f"{func}(*) 不受支持")
+            arg = None
+        else:
+            arg = self.parse_expr()
+        self.expect("op", ")")
+        return Aggregate(func, arg, distinct)
+
+
+def parse_sql(sql: str) -> Query:
+    """
+    解析 SQL 子集
+
+    Raises:
+        ValueError: 语法错误或不支持的语法
+    """
+    return _Parser(sql).parse()
+
+
+# ----------------------------------------------------------------------------
+# 列数组
+# ----------------------------------------------------------------------------
+
+def _to_array(values: List[Any]) -> np.ndarray:
+    """把一列 Python 值转换为类型合适的 NumPy 数组（NULL 用 NaN / None 表示）"""
+    types = {type(v) for v in values}
+    has_null = type(None) in types
+    types.discard(type(None))
+
+    if types <= {int, float} and types:
+        if has_null or float in types:
+            return np.array([np.nan if v is None else v for v in values], dtype=np.float64)
+        try:
+            return np.array(values, dtype=np.int64)
+        except OverflowError:
+            return np.array(values, dtype=object)
+    if types == {str} and not has_null:
+        return np.array(values, dtype=str)
+    if types == {bool} and not has_null:
+        return np.array(values, dtype=bool)
+    if not types and has_null:
+        # 全部为 NULL：用 NaN 表示，比较结果为 False 而不是类型错误
+        return np.full(len(values), np.nan)
+
+    array = np.empty(len(values), dtype=object)
+    array[:] = values
+    return array
+
+
+def _block_column(block: ColumnBlock, name: str) -> np.ndarray:
+    """
+    列式页的一列转为 NumPy 数组
+
+    无 NULL 的数值列直接共享 array 的缓冲区（零拷贝），字符串列按字典解码；
+    结果与 _to_array 对同一列 Python 值的转换一致。
+    """
+    column = block.column(name)
+    if column is None:
+        return _to_array([None] * len(block))
+
+    kind = column.kind
+    if kind in ("int", "float"):
+        dtype = np.int64 if kind == "int" else np.float64
+        array = np.frombuffer(column.data, dtype=dtype)
+        if column.state is None:
+            return array
+        array = array.astype(np.float64)
+        array[np.frombuffer(column.state, dtype=np.uint8) != 0] = np.nan
+        return array
+    if column.state is None:
+        if kind == "bool":
+            return np.frombuffer(column.data, dtype=np.int8).astype(bool)
+        if kind == "str":
+            codes = np.frombuffer(column.data, dtype=f"u{column.data.itemsize}")
+            return np.array(column.dictionary, dtype=str)[codes]
+    return _to_array([None if value is ABSENT else value for value in column.to_list()])
+
+
+def _page_column(page, name: str) -> np.ndarray:
+    cache = page.columns
+    if cache is None:
+        cache = page.columns = {}
+    array = cache.get(name)
+    if array is None:
+        if type(page.rows) is ColumnBlock:
+            array = _block_column(page.rows, name)
+        else:
+            array = _to_array([row.get(name) for row in page.rows])
+        array.flags.writeable = False
+        cache[name] = array
+    return array
+
+
+def _segment_column(segment, name: str) -> np.ndarray:
+    """段（最多 32 页）的列数组；缓存在共享的段节点上"""
+    cache = segment.columns
+    if cache is None:
+        cache = segment.columns = {}
+    array = cache.get(name)
+    if array is None:
+        parts = [_page_column(page, name) for page in segment.children]
+        if len(parts) == 1:
+            array = parts[0]
+        elif not parts:
+            array = np.empty(0, dtype=object)
+        else:
+            array = _concat(parts)
+            array.flags.writeable = False
+        cache[name] = array
+    return array
+
+
+def _concat(parts: List[np.ndarray]) -> np.ndarray:
+    kinds = {part.dtype.kind for part in parts}
+    if len(kinds) > 1 and not kinds <= {"i", "f", "b"}:
+        # 类型不一致（例如某页出现 NULL 字符串），退化为 object
+        parts = [part.astype(object) for part in parts]
+    return np.concatenate(parts)
+
+
+# ----------------------------------------------------------------------------
+# 表达式求值
+# ----------------------------------------------------------------------------
+
+def _divide(left, right):
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.true_divide(left, right)
+
+
+def _modulo(left, right):
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.mod(left, right)
+
+
+_BINARY_OPS = {
+    "=": operator.eq,
+    "!=": operator.ne,
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+    "+": operator.add,
+    "-": operator.sub,
+    "*": operator.mul,
+    "/": _divide,
+    "%": _modulo,
+}
+
+
+def _is_null(values) -> Any:
+    if not isinstance(values, np.ndarray):
+        return values is None or (isinstance(values, float) and values != values)
+    if values.dtype.kind == "f":
+        return np.isnan(values)
+    if values.dtype.kind == "O":
+        return np.fromiter(
+            (v is None or (isinstance(v, float) and v != v) for v in values),
+            dtype=bool, count=len(values)
+        )
+    return np.zeros(len(values), dtype=bool)
+
+
+def _like_regex(pattern: str):
+    parts = []
+    for char in pattern:
+        if char == "%":
+            parts.append(".*")
+        elif char == "_":
+            parts.append(".")
+        else:
+            parts.append(re.escape(char))
+    return re.compile("".join(parts) + r"\Z", re.DOTALL)
+
+
+class _RowEnv:
+    """行级求值环境：列来自一个扫描段"""
+
+    def __init__(self, segment):
+        self.segment = segment
+
+    def resolve(self, expr):
+        return None
+
+    def column(self, name: str):
+        return _segment_column(self.segment, name)
+
+
+class _ListEnv:
+    """行级求值环境：列来自一组行（例如一次写入替换掉和写入的行）"""
+
+    def __init__(self, rows: List[Any]):
+        self.rows = rows
+
+    def resolve(self, expr):
+        return None
+
+    def column(self, name: str):
+        return _to_array([row.get(name) for row in self.rows])
+
+
+class _ArrayEnv:
+    """行级求值环境：列来自一批列数组（批量导入的 列名 -> list / NumPy 数组）"""
+
+    def __init__(self, columns: Dict[str, Any], length: int):
+        self.columns = columns
+        self.length = length
+
+    def resolve(self, expr):
+        return None
+
+    def column(self, name: str):
+        values = self.columns.get(name)
+        if values is None:
+            return _to_array([None] * self.length)
+        if isinstance(values, np.ndarray) and values.dtype.kind in "iufbU":
+            return values
+        return _to_array(values.tolist() if isinstance(values, np.ndarray) else list(values))
+
+
+class _GroupEnv:
+    """分组求值环境：分组键和聚合结果按组排列"""
+
+    def __init__(self, values: Dict[Any, np.ndarray]):
+        self.values = values
+
+    def resolve(self, expr):
+        return self.values.get(expr)
+
+    def column(self, name: str):
+        raise ValueError(f"列 {name} 必须出现在 GROUP BY 中或包含在聚合函数里")
+
+
+def _eval(expr, env):
+    value = env.resolve(expr)
+    if value is not None:
+        return value
+    if isinstance(expr, Column):
+        return env.column(expr.name)
+    if isinstance(expr, Literal):
+        return expr.value
+    if _is_predicate(expr):
+        return _predicate(expr, env)[0]
+    if isinstance(expr, BinaryOp):
+        left = _eval(expr.left, env)
+        right = _eval(expr.right, env)
+        try:
+            return _BINARY_OPS[expr.op](left, right)
+        except TypeError as e:
+            raise ValueError(f"类型不匹配: {render(expr)} ({e})")
+    if isinstance(expr, Aggregate):
+        raise ValueError(f"聚合函数不能用在这里: {render(expr)}")
+    raise TypeError(f"未知表达式: {expr!r}")
+
+
+def _is_predicate(expr) -> bool:
+    return isinstance(expr, (BoolOp, Not, InList, Between, Like, IsNull)) or (
+        isinstance(expr, BinaryOp) and expr.op in COMPARISON_OPS
+    )
+
+
+def _unknown(value) -> Any:
+    """NULL 掩码；没有 NULL 时为 None（后续的三值逻辑运算可以跳过 UNKNOWN 掩码）"""
+    if isinstance(value, np.ndarray) and value.dtype.kind in "iubU":
+        return None
+    null = _is_null(value)
+    return null if np.any(null) else None
+
+
+def _truth(value) -> Tuple[Any, Any]:
+    """把一个值当作条件：(为 TRUE, 为 UNKNOWN)"""
+    unknown = _unknown(value)
+    if not isinstance(value, np.ndarray):
+        return np.bool_(unknown is None and bool(value)), unknown
+    if value.dtype == bool:
+        return value, unknown
+    if value.dtype.kind == "O":
+        return np.fromiter((v is True or v is np.True_ for v in value), dtype=bool, count=len(value)), unknown
+    result = value != 0
+    return (result if unknown is None else result & ~unknown), unknown
+
+
+def _or_mask(a, b) -> Any:
+    if a is None:
+        return b
+    return a if b is None else np.logical_or(a, b)
+
+
+def _is_false(a: Tuple[Any, Any]) -> Any:
+    return np.logical_not(_or_mask(a[0], a[1]))
+
+
+def _and(a: Tuple[Any, Any], b: Tuple[Any, Any]) -> Tuple[Any, Any]:
+    result = np.logical_and(a[0], b[0])
+    unknown = _or_mask(a[1], b[1])
+    if unknown is not None:
+        # 任一侧为 FALSE 时结果为 FALSE，否则有 UNKNOWN 即为 UNKNOWN
+        unknown = np.logical_and(unknown, np.logical_not(np.logical_or(_is_false(a), _is_false(b))))
+    return result, unknown
+
+
+def _or(a: Tuple[Any, Any], b: Tuple[Any, Any]) -> Tuple[Any, Any]:
+    result = np.logical_or(a[0], b[0])
+    unknown = _or_mask(a[1], b[1])
+    if unknown is not None:
+        unknown = np.logical_and(unknown, np.logical_not(result))
+    return result, unknown
+
+
+def _not(a: Tuple[Any, Any]) -> Tuple[Any, Any]:
+    return _is_false(a), a[1]
+
+
+def _compare(op: str, left, right) -> Tuple[Any, Any]:
+    """比较运算，NULL 参与比较的结果为 UNKNOWN"""
+    unknown = _or_mask(_unknown(left), _unknown(right))
+    if unknown is None:
+        return _BINARY_OPS[op](left, right), None
+    if not isinstance(unknown, np.ndarray):
+        return np.False_, unknown
+    # 只比较非 NULL 的行（object 数组中的 None 不能与其他值比较）
+    known = ~unknown
+    result = np.zeros(len(unknown), dtype=bool)
+    if known.any():
+        result[known] = _BINARY_OPS[op](
+            left[known] if isinstance(left, np.ndarray) else left,
+            right[known] if isinstance(right, np.ndarray) else right
+        )
+    return result, unknown
+
+
+def _predicate(expr, env) -> Tuple[Any, Any]:
+    """
+    按 SQL 三值逻辑求条件：返回 (为 TRUE, 为 UNKNOWN) 两个掩码（或标量），没有 UNKNOWN 时后者为 None
+
+    NULL 参与的比较、IN、BETWEEN、LIKE 为 UNKNOWN，NOT UNKNOWN 仍为 UNKNOWN；
+    WHERE / HAVING 只保留为 TRUE 的行，所以 x != 'a'、NOT x = 'a' 都不会选出 x 为 NULL 的行。
+    """
+    value = env.resolve(expr)
+    if value is not None or not _is_predicate(expr):
+        return _truth(_eval(expr, env) if value is None else value)
+    try:
+        if isinstance(expr, BinaryOp):
+            return _compare(expr.op, _eval(expr.left, env), _eval(expr.right, env))
+        if isinstance(expr, Between):
+            values = _eval(expr.expr, env)
+            result = _and(
+                _compare(">=", values, _eval(expr.low, env)),
+                _compare("<=", values, _eval(expr.high, env))
+            )
+            return _not(result) if expr.negated else result
+    except TypeError as e:
+        raise ValueError(f"类型不匹配: {render(expr)} ({e})")
+    if isinstance(expr, BoolOp):
+        combine = _and if expr.op == "AND" else _or
+        result = _predicate(expr.items[0], env)
+        for item in expr.items[1:]:
+            result = combine(result, _predicate(item, env))
+        return result
+    if isinstance(expr, Not):
+        return _not(_predicate(expr.expr, env))
+    if isinstance(expr, InList):
+        values = _eval(expr.expr, env)
+        present = [v for v in expr.values if not _is_null(v)]
+        unknown = _unknown(values)
+        found = np.isin(values, present)
+        if unknown is not None:
+            found = np.logical_and(found, np.logical_not(unknown))
+        if len(present) < len(expr.values):
+            # 列表中有 NULL 时，没有匹配到的值结果为 UNKNOWN
+            unknown = _or_mask(unknown, np.logical_not(found))
+        result = (found, unknown)
+        return _not(result) if expr.negated else result
+    if isinstance(expr, Like):
+        regex = _like_regex(expr.pattern)
+        values = np.atleast_1d(_eval(expr.expr, env))
+        unknown = _unknown(values)
+        matched = np.fromiter(
+            (not _is_null(v) and regex.match(str(v)) is not None for v in values),
+            dtype=bool, count=len(values)
+        )
+        result = (matched, unknown)
+        return _not(result) if expr.negated else result
+    if isinstance(expr, IsNull):
+        null = _is_null(_eval(expr.expr, env))
+        return (np.logical_not(null) if expr.negated else null), None
+    raise TypeError(f"未知表达式: {expr!r}")
+
+
+def _as_array(value, length: int) -> np.ndarray:
+    """把标量结果广播为指定长度的数组"""
+    if isinstance(value, np.ndarray) and value.ndim == 1:
+        return value
+    if value is None:
+        return np.full(length, None, dtype=object)
+    return np.full(length, value)
+
+
+def _mask(expr, env, length: int) -> np.ndarray:
+    result = _eval(expr, env)
+    if isinstance(result, np.ndarray):
+        if result.dtype != bool:
+            # object 比较结果（含 NULL）按 SQL 语义视为 False
+            result = np.array([v is True or v is np.True_ for v in result], dtype=bool)
+        return result
+    return np.full(length, bool(result))
+
+
+# ----------------------------------------------------------------------------
+# 聚合
+# ----------------------------------------------------------------------------
+
+def _factorize(values: np.ndarray) -> Tuple[int, np.ndarray, np.ndarray]:
+    """返回 (不同值个数, 每行的编码, 每个编码首次出现的位置)"""
+    try:
+        _, first, inverse = np.unique(values, return_index=True, return_inverse=True)
+        return len(first), inverse.ravel(), first
+    except TypeError:
+        codes: Dict[Any, int] = {}
+        inverse = np.fromiter(
+            (codes.setdefault(v, len(codes)) for v in values),
+            dtype=np.intp, count=len(values)
+        )
+        first = np.full(len(codes), len(values), dtype=np.intp)
+        np.minimum.at(first, inverse, np.arange(len(values)))
+        return len(codes), inverse, first
+
+
+def _group(keys: List[np.ndarray], length: int) -> Tuple[int, np.ndarray, np.ndarray]:
+    """多列分组，返回 (组数, 每行组号, 每组代表行)"""
+    if not keys:
+        # 无 GROUP BY 的聚合：整体一组（即使没有行也输出一行）
+        return 1, np.zeros(length, dtype=np.intp), np.zeros(1, dtype=np.intp)
+    if len(keys) == 1:
+        return _factorize(keys[0])
+    codes = np.zeros(length, dtype=np.int64)
+    for key in keys:
+        count, inverse, _ = _factorize(key)
+        codes = codes * count + inverse
+    return _factorize(codes)
+
+
+def _aggregate(agg: Aggregate, values: Optional[np.ndarray], group_ids: np.ndarray, num_groups: int) -> np.ndarray:
+    if values is None:
+        return np.bincount(group_ids, minlength=num_groups)
+
+    valid = ~_is_null(values)
+    ids = group_ids[valid]
+    values = values[valid]
+
+    if agg.distinct and len(values):
+        num_values, codes, _ = _factorize(values)
+        _, keep = np.unique(ids.astype(np.int64) * num_values + codes, return_index=True)
+        ids, values = ids[keep], values[keep]
+
+    counts = np.bincount(ids, minlength=num_groups)
+    if agg.func == "COUNT":
+        return counts
+
+    empty = counts == 0
+    if agg.func in ("SUM", "AVG"):
+        if values.dtype.kind not in "biuf":
+            raise ValueError(f"{agg.func} 需要数值列: {render(agg.arg)}")
+        if values.dtype.kind in "biu" and agg.func == "SUM":
+            sums = np.zeros(num_groups, dtype=np.int64)
+            np.add.at(sums, ids, values)
+        else:
+            sums = np.bincount(ids, weights=values, minlength=num_groups)
+        result = sums if agg.func == "SUM" else _divide(sums, np.maximum(counts, 1))
+    else:
+        # MIN / MAX：按 (组, 值) 排序后取每组首 / 尾
+        order = np.lexsort((values, ids))
+        sorted_ids = ids[order]
+        starts = np.searchsorted(sorted_ids, np.arange(num_groups), side="left")
+        ends = np.searchsorted(sorted_ids, np.arange(num_groups), side="right") - 1
+        pick = starts if agg.func == "MIN" else ends
+        result = values[order][np.clip(pick, 0, max(len(values) - 1, 0))] if len(values) else \
+            np.empty(num_groups, dtype=object)
+
+    if empty.any():
+        result = result.astype(object)
+        result[empty] = None
+    return result
+
+
+def _collect_aggregates(expr, found: Dict[Aggregate, None]):
+    if isinstance(expr, Aggregate):
+        found.setdefault(expr, None)
+        return
+    for child in _children(expr):
+        _collect_aggregates(child, found)
+
+
+# ----------------------------------------------------------------------------
+# 执行
+# ----------------------------------------------------------------------------
+
+class QueryResult:
+    """查询结果"""
+
+    def __init__(self, columns: List[str], rows: List[Dict[str, Any]], rows_scanned: int):
+        self.columns = columns
+        self.rows = rows
+        self.rows_scanned = rows_scanned
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "data": self.rows,
+            "columns": self.columns,
+            "rows_returned": len(self.rows),
+            "rows_scanned": self.rows_scanned,
+        }
+
+
+def _to_python(values) -> List[Any]:
+    if not isinstance(values, np.ndarray):
+        return [values]
+    result = values.tolist()
+    if values.dtype.kind in "fO":
+        result = [None if isinstance(v, float) and v != v else v for v in result]
+    return result
+
+
+def _rank(values: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """返回 (按值排序的名次, NULL 标记)"""
+    nulls = _is_null(values)
+    codes = np.zeros(len(values), dtype=np.int64)
+    present = values[~nulls]
+    if len(present):
+        try:
+            _, inverse = np.unique(present, return_inverse=True)
+        except TypeError:
+            # 混合类型无法直接比较，按文本排序
+            _, inverse = np.unique(present.astype(str), return_inverse=True)
+        codes[~nulls] = inverse.ravel()
+    return codes, nulls
+
+
+def _sort_order(keys: List[Tuple[np.ndarray, bool]], length: int) -> np.ndarray:
+    """多键排序，NULL 排在最后"""
+    if not keys or not length:
+        return np.arange(length)
+    lex_keys = []
+    # np.lexsort 以最后一个键为主键
+    for values, descending in reversed(keys):
+        codes, nulls = _rank(values)
+        lex_keys.extend([-codes if descending else codes, nulls])
+    return np.lexsort(lex_keys)
+
+
+def _substitute_aliases(expr, aliases: Dict[str, Any]):
+    if isinstance(expr, Column):
+        return aliases.get(expr.name, expr)
+    if isinstance(expr, BinaryOp):
+        return BinaryOp(expr.op, _substitute_aliases(expr.left, aliases), _substitute_aliases(expr.right, aliases))
+    if isinstance(expr, BoolOp):
+        return BoolOp(expr.op, tuple(_substitute_aliases(item, aliases) for item in expr.items))
+    if isinstance(expr, (Not, InList, Like, IsNull)):
+        return replace(expr, expr=_substitute_aliases(expr.expr, aliases))
+    if isinstance(expr, Between):
+        return Between(
+            _substitute_aliases(expr.expr, aliases),
+            _substitute_aliases(expr.low, aliases),
+            _substitute_aliases(expr.high, aliases),
+            expr.negated
+        )
+    return expr
+
+
+def _resolve_aliases(expr, query: Query):
+    """ORDER BY / HAVING 中的别名和序号替换为对应的 SELECT 表达式"""
+    if isinstance(expr, Literal) and isinstance(expr.value, int) and not isinstance(expr.value, bool):
+        if not 1 <= expr.value <= len(query.items):
+            raise ValueError(f"ORDER BY 序号超出范围: {expr.value}")
+        return query.items[expr.value - 1].expr
+    aliases = {item.alias: item.expr for item in query.items if item.alias}
+    return _substitute_aliases(expr, aliases) if aliases else expr
+
+
+def _output_names(query: Query) -> List[str]:
+    return [item.alias or render(item.expr) for item in query.items]
+
+
+def _validate_columns(query: Query, rows: PersistentVector):
+    """检查引用的列存在（以首页和末页的行为准）"""
+    if not len(rows):
+        return
+    aliases = {item.alias for item in query.items if item.alias}
+    exprs = [item.expr for item in query.items] + list(query.group_by)
+    exprs += [expr for expr, _ in query.order_by]
+    if query.where is not None:
+        exprs.append(query.where)
+    if query.having is not None:
+        exprs.append(query.having)
+
+    known = set()
+    for row in (rows[0], rows[-1]):
+        known.update(row.keys())
+    for expr in exprs:
+        for name in referenced_columns(expr):
+            if name not in known and name not in aliases:
+                raise ValueError(f"列不存在: {name}")
+
+
+def execute_query(sql: str, snapshot: PersistentMap) -> QueryResult:
+    """
+    在分支快照上执行 SQL
+
+    Args:
+        sql: SQL 语句（见模块文档中的子集）
+        snapshot: 分支的 data_snapshot
+
+    Returns:
+        QueryResult: 查询结果
+    """
+    query = parse_sql(sql)
+    rows = snapshot.get(query.table)
+    if rows is None:
+        raise ValueError(f"表不存在: {query.table}")
+    _validate_columns(query, rows)
+
+    if query.is_aggregate:
+        return _execute_aggregate(query, rows)
+    return _execute_scan(query, rows)
+
+
+def _execute_scan(query: Query, rows: PersistentVector) -> QueryResult:
+    order_exprs = [(_resolve_aliases(expr, query), desc) for expr, desc in query.order_by]
+    item_exprs = [item.expr for item in query.items]
+    # 无 ORDER BY 时读够 LIMIT 行即可提前结束
+    wanted = None
+    if query.limit is not None and not order_exprs:
+        wanted = query.offset + query.limit
+
+    segments, positions, outputs, order_values = [], [], [], []
+    scanned = collected = 0
+    for segment in rows.segments():
+        length = sum(len(page.rows) for page in segment.children)
+        if not length:
+            continue
+        scanned += length
+        env = _RowEnv(segment)
+        selected = np.flatnonzero(_mask(query.where, env, length)) if query.where is not None \
+            else np.arange(length)
+        if not len(selected):
+            continue
+
+        segments.append(segment)
+        positions.append(selected)
+        outputs.append([_as_array(_eval(expr, env), length)[selected] for expr in item_exprs])
+        order_values.append([_as_array(_eval(expr, env), length)[selected] for expr, _ in order_exprs])
+        collected += len(selected)
+        if wanted is not None and collected >= wanted:
+            break
+
+    total = collected
+    segment_ids = np.concatenate([np.full(len(p), i) for i, p in enumerate(positions)]) \
+        if positions else np.zeros(0, dtype=np.intp)
+    local = np.concatenate(positions) if positions else np.zeros(0, dtype=np.intp)
+
+    order = _sort_order(
+        [(_concat([vals[k] for vals in order_values]), desc) for k, (_, desc) in enumerate(order_exprs)],
+        total
+    ) if order_exprs and total else np.arange(total)
+
+    stop = None if query.limit is None else query.offset + query.limit
+    order = order[query.offset:stop]
+
+    if not query.items:
+        # SELECT *：返回原始行（复制一份，避免调用方修改共享数据）
+        result_rows = []
+        for i in order:
+            segment = segments[segment_ids[i]]
+            position = int(local[i])
+            result_rows.append(dict(segment.children[position >> PAGE_BITS].rows[position & PAGE_MASK]))
+        columns = list(result_rows[0].keys()) if result_rows else []
+        return QueryResult(columns, result_rows, scanned)
+
+    names = _output_names(query)
+    columns = [
+        _to_python(_concat([vals[k] for vals in outputs])[order]) if outputs else []
+        for k in range(len(names))
+    ]
+    result_rows = [dict(zip(names, values)) for values in zip(*columns)]
+    return QueryResult(names, result_rows, scanned)
+
+
+def _execute_aggregate(query: Query, rows: PersistentVector) -> QueryResult:
+    aggregates = _query_aggregates(query)
+    keys, args, total, scanned = _scan_aggregate(query, rows, aggregates)
+
+    num_groups, group_ids, first = _group(keys, total)
+    if query.group_by and not total:
+        num_groups, first = 0, np.zeros(0, dtype=np.intp)
+
+    values: Dict[Any, np.ndarray] = {}
+    for expr, key in zip(query.group_by, keys):
+        values[expr] = key[first] if len(key) else key
+    for agg, arg_values in zip(aggregates, args):
+        values[agg] = _aggregate(agg, arg_values, group_ids, num_groups)
+    return _finish_aggregate(query, values, num_groups, scanned)
+
+
+def _query_aggregates(query: Query) -> List[Aggregate]:
+    """查询中用到的全部聚合（SELECT / ORDER BY / HAVING，去重）"""
+    if not query.items:
+        raise ValueError("SELECT * 不能与 GROUP BY 一起使用")
+    aggregates: Dict[Aggregate, None] = {}
+    exprs = [item.expr for item in query.items]
+    exprs += [_resolve_aliases(expr, query) for expr, _ in query.order_by]
+    if query.having is not None:
+        exprs.append(_resolve_aliases(query.having, query))
+    for expr in exprs:
+        _collect_aggregates(expr, aggregates)
+    return list(aggregates)
+
+
+def _scan_aggregate(
+    query: Query,
+    rows: PersistentVector,
+    aggregates: List[Aggregate]
+) -> Tuple[List[np.ndarray], List[Optional[np.ndarray]], int, int]:
+    """
+    逐段扫描：只收集分组键和聚合参数中被 WHERE 选中的部分
+
+    Returns:
+        (分组键列, 各聚合的参数列（COUNT(*) 为 None）, 选中行数, 扫描行数)
+    """
+    args = [agg.arg for agg in aggregates]
+    key_parts: List[List[np.ndarray]] = [[] for _ in query.group_by]
+    arg_parts: List[List[np.ndarray]] = [[] for _ in args]
+    scanned = total = 0
+    for segment in rows.segments():
+        length = sum(len(page.rows) for page in segment.children)
+        if not length:
+            continue
+        scanned += length
+        count, columns = _select_inputs(query, _RowEnv(segment), length, args)
+        for parts, column in zip(key_parts + arg_parts, columns):
+            if column is not None:
+                parts.append(column)
+        total += count
+
+    keys = [_concat(parts) if parts else np.zeros(0) for parts in key_parts]
+    arg_values = [
+        None if expr is None else (_concat(parts) if parts else np.zeros(0))
+        for expr, parts in zip(args, arg_parts)
+    ]
+    return keys, arg_values, total, scanned
+
+
+def _select_inputs(
+    query: Query,
+    env,
+    length: int,
+    args: List[Any]
+) -> Tuple[int, List[Optional[np.ndarray]]]:
+    """
+    一批行中被 WHERE 选中的分组键和聚合参数
+
+    Returns:
+        (选中行数, 分组键列 + 聚合参数列（参数为 None 时对应 None）)
+    """
+    mask = _mask(query.where, env, length) if query.where is not None else None
+    columns = []
+    for expr in list(query.group_by) + list(args):
+        if expr is None:
+            columns.append(None)
+            continue
+        column = _as_array(_eval(expr, env), length)
+        columns.append(column if mask is None else column[mask])
+    return (length if mask is None else int(mask.sum())), columns
+
+
+def _finish_aggregate(
+    query: Query,
+    values: Dict[Any, np.ndarray],
+    num_groups: int,
+    scanned: int
+) -> QueryResult:
+    """
+    聚合的收尾阶段：HAVING、ORDER BY、LIMIT 和投影
+
+    Args:
+        values: 分组键表达式 / 聚合 -> 按组排列的数组
+    """
+    having = _resolve_aliases(query.having, query) if query.having is not None else None
+    order_exprs = [(_resolve_aliases(expr, query), desc) for expr, desc in query.order_by]
+
+    env = _GroupEnv(values)
+    selected = np.arange(num_groups)
+    if having is not None:
+        selected = np.flatnonzero(_mask(having, env, num_groups))
+
+    order_keys = [(_as_array(_eval(expr, env), num_groups)[selected], desc) for expr, desc in order_exprs]
+    order = selected[_sort_order(order_keys, len(selected))] if order_keys else selected
+    stop = None if query.limit is None else query.offset + query.limit
+    order = order[query.offset:stop]
+
+    names = _output_names(query)
+    columns = [_to_python(_as_array(_eval(item.expr, env), num_groups)[order]) for item in query.items]
+    result_rows = [dict(zip(names, row)) for row in zip(*columns)]
+    return QueryResult(names, result_rows, scanned)
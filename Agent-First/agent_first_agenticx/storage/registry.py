@@ -0,0 +1,134 @@
+"""
+分片的分支注册表
+
+大量智能体并发分叉时，分支 ID 的分配和登记必须原子完成，查找也要保持 O(1)：
+
+- ID 由单独的锁分配（批量分叉一次分配一段连续编号），分配后立即登记，
+  中间不让出事件循环
+- 分支按 ID 的哈希分到多个分片，每个分片一把锁；写入只锁所在分片，
+  不同分片上的并发创建互不阻塞（无 GIL 的解释器上也成立）
+- 读取（查找、包含判断）不加锁：单个 dict 的读取本身是原子的；
+  遍历先在分片锁内复制该分片，得到的是每个分片各自一致的视图
+"""
+
+import threading
+from typing import Any, Dict, Iterator, List, Tuple
+
+
+class BranchRegistry:
+    """分支 ID -> 分支，线程安全，接口与 dict 的常用部分一致"""
+
+    def __init__(self, shards: int = 64):
+        """
+        Args:
+            shards: 分片数（2 的幂）
+        """
+        if shards < 1 or shards & (shards - 1):
+            raise ValueError(f"分片数必须是 2 的幂: {shards}")
+        self._mask = shards - 1
+        self._shards: List[Dict[str, Any]] = [{} for _ in range(shards)]
+        self._locks = [threading.Lock() for _ in range(shards)]
+        self._id_lock = threading.Lock()
+        # 已分配的最大编号
+        self.counter = 0
+
+    # ------------------------------------------------------------------
+    # ID 分配
+    # ------------------------------------------------------------------
+
+    def allocate(self, count: int = 1) -> int:
+        """
+        分配 count 个连续编号
+
+        Returns:
+            int: 第一个编号
+        """
+        with self._id_lock:
+            first = self.counter + 1
+            self.counter += count
+        return first
+
+    def advance(self, counter: int):
+        """保证之后分配的编号都大于 counter（恢复时使用）"""
+        with self._id_lock:
+            self.counter = max(self.counter, counter)
+
+    # ------------------------------------------------------------------
+    # 登记与查找
+    # ------------------------------------------------------------------
+
+    def _shard(self, branch_id: str) -> int:
+        return hash(branch_id) & self._mask
+
+    def add(self, branch_id: str, branch: Any):
+        """
+        登记分支
+
+        Raises:
+            ValueError: ID 已存在
+        """
+        index = self._shard(branch_id)
+        shard = self._shards[index]
+        with self._locks[index]:
+            if branch_id in shard:
+                raise ValueError(f"分支已存在: {branch_id}")
+            shard[branch_id] = branch
+
+    def add_many(self, branches: List[Tuple[str, Any]]):
+        """批量登记：按分片分组，每个分片只加一次锁"""
+        groups: Dict[int, List[Tuple[str, Any]]] = {}
+        for item in branches:
+            groups.setdefault(self._shard(item[0]), []).append(item)
+        for index, items in groups.items():
+            shard = self._shards[index]
+            with self._locks[index]:
+                for branch_id, _ in items:
+                    if branch_id in shard:
+                        raise ValueError(f"分支已存在: {branch_id}")
+                shard.update(items)
+
+    def pop(self, branch_id: str, default: Any = None) -> Any:
+        index = self._shard(branch_id)
+        with self._locks[index]:
+            return self._shards[index].pop(branch_id, default)
+
+    def get(self, branch_id: str, default: Any = None) -> Any:
+        return self._shards[hash(branch_id) & self._mask].get(branch_id, default)
+
+    def __getitem__(self, branch_id: str) -> Any:
+        return self._shards[hash(branch_id) & self._mask][branch_id]
+
+    def __contains__(self, branch_id: object) -> bool:
+        return branch_id in self._shards[hash(branch_id) & self._mask]
+
+    def __len__(self) -> int:
+        return sum(len(shard) for shard in self._shards)
+
+    # ------------------------------------------------------------------
+    # 遍历（逐分片复制，遍历期间可以并发增删）
+    # ------------------------------------------------------------------
+
+    def items(self) -> List[Tuple[str, Any]]:
+        result = []
+        for shard, lock in zip(self._shards, self._locks):
+            with lock:
+                result.extend(shard.items())
+        return result
+
+    def keys(self) -> List[str]:
+        return [branch_id for branch_id, _ in self.items()]
+
+    def values(self) -> List[Any]:
+        return [branch for _, branch in self.items()]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.keys())
+
+    def get_stats(self) -> Dict[str, Any]:
+        sizes = [len(shard) for shard in self._shards]
+        return {
+            "shards": len(sizes),
+            "branches": sum(sizes),
+            "max_shard_size": max(sizes),
+            "counter": self.counter,
+        }
@@ -0,0 +1,237 @@
+"""
+分支快照的共享内存导出
+
+把分支的表按页导出为内存映射的列式文件（默认放在 /dev/shm，即共享内存），
+其他进程挂载后直接在映射上读取，不做反序列化：
+
+- 每页一个文件，以页的 Merkle 摘要命名：内容相同的页（包括不同分支之间共享的页）
+  只导出一次；分支修改后重新导出，只有被复制的页会写出新文件
+- 文件格式：[魔数 8 字节][头部长度 4 字节][头部 pickle][按 8 字节对齐的列缓冲区]，
+  头部只描述列的类型和偏移（字符串列的页内字典、object 列的值也放在头部）
+- 挂载得到的是普通的 PersistentMap / PersistentVector，列数据是映射上的只读
+  memoryview，查询引擎用 np.frombuffer 零拷贝读取；在挂载的快照上写入时
+  照常路径复制，被修改的列复制为进程内的 array
+"""
+
+import mmap
+import os
+import pickle
+import shutil
+import struct
+import tempfile
+from typing import Any, Dict, List, Optional, Tuple
+
+from .columnar import Column, ColumnBlock
+from .persistent import PersistentMap, PersistentVector, _Page, _digest
+
+
+_CHUNK_MAGIC = b"AFPAGE01"
+_CHUNK_HEADER = struct.Struct("<8sI")
+_ALIGNMENT = 8
+_CHUNK_SUFFIX = ".page"
+
+
+def _aligned(offset: int) -> int:
+    return (offset + _ALIGNMENT - 1) & ~(_ALIGNMENT - 1)
+
+
+def _default_directory() -> str:
+    """优先使用 /dev/shm（tmpfs，页缓存即共享内存）"""
+    base = "/dev/shm" if os.path.isdir("/dev/shm") else None
+    return tempfile.mkdtemp(prefix="agenticx-branch-", dir=base)
+
+
+class SharedSnapshot:
+    """
+    导出结果（很小，可以 pickle 传给工作进程）
+
+    - directory: 页文件所在目录
+    - tables: 表名 -> (行数, 按顺序的页文件名)
+    """
+
+    def __init__(self, directory: str, tables: Dict[str, Tuple[int, List[str]]]):
+        self.directory = directory
+        self.tables = tables
+
+    def chunks(self) -> List[str]:
+        return [name for _, names in self.tables.values() for name in names]
+
+    def __repr__(self) -> str:
+        return f"SharedSnapshot(tables={list(self.tables)}, chunks={len(self.chunks())})"
+
+
+def _encode_page(page: _Page) -> Tuple[Dict[str, Any], List[Tuple[int, Any]]]:
+    """页的头部和 (偏移, 缓冲区) 列表；偏移相对于缓冲区起点"""
+    rows = page.rows
+    if type(rows) is not ColumnBlock:
+        # 非 Mapping 值的列表页：整体放进头部
+        return {"rows": list(rows)}, []
+
+    columns = []
+    buffers = []
+    offset = 0
+    for column in rows.columns:
+        if column.kind == "object":
+            columns.append({"kind": "object", "values": list(column.data)})
+            continue
+        spec = {
+            "kind": column.kind,
+            "format": column.data.format if type(column.data) is memoryview else column.data.typecode,
+            "dictionary": column.dictionary,
+        }
+        for field, buffer in (("data", column.data), ("state", column.state)):
+            if buffer is None:
+                continue
+            view = memoryview(buffer).cast("B")
+            offset = _aligned(offset)
+            spec[field] = (offset, len(view))
+            buffers.append((offset, view))
+            offset += len(view)
+        columns.append(spec)
+    return {"names": rows.names, "length": rows.length, "columns": columns}, buffers
+
+
+def _write_chunk(path: str, page: _Page):
+    header, buffers = _encode_page(page)
+    payload = pickle.dumps(header, protocol=pickle.HIGHEST_PROTOCOL)
+    start = _aligned(_CHUNK_HEADER.size + len(payload))
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(_CHUNK_HEADER.pack(_CHUNK_MAGIC, len(payload)))
+        f.write(payload)
+        position = _CHUNK_HEADER.size + len(payload)
+        for offset, view in buffers:
+            f.write(bytes(start + offset - position))
+            f.write(view)
+            position = start + offset + len(view)
+    os.replace(tmp_path, path)
+
+
+def _read_chunk(path: str) -> _Page:
+    """映射一个页文件；列数据为映射上的只读 memoryview"""
+    with open(path, "rb") as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    buffer = memoryview(mapped)
+    magic, length = _CHUNK_HEADER.unpack_from(buffer, 0)
+    if magic != _CHUNK_MAGIC:
+        raise ValueError(f"页文件格式错误: {path}")
+    header = pickle.loads(buffer[_CHUNK_HEADER.size:_CHUNK_HEADER.size + length])
+    if "rows" in header:
+        return _Page(header["rows"])
+
+    start = _aligned(_CHUNK_HEADER.size + length)
+    columns = []
+    for spec in header["columns"]:
+        if spec["kind"] == "object":
+            columns.append(Column("object", spec["values"]))
+            continue
+        offset, nbytes = spec["data"]
+        data = buffer[start + offset:start + offset + nbytes].cast(spec["format"])
+        state = None
+        if "state" in spec:
+            offset, nbytes = spec["state"]
+            state = buffer[start + offset:start + offset + nbytes]
+        columns.append(Column(spec["kind"], data, spec["dictionary"], state))
+    return _Page(ColumnBlock(header["names"], columns, header["length"]))
+
+
+class SnapshotExporter:
+    """
+    把快照导出到共享内存目录
+
+    页文件按引用计数管理：每次 export 对用到的页加一，release 减一，
+    归零时删除文件。同一分支修改后重新导出再释放旧结果，只有变化的页被重写和删除。
+    """
+
+    def __init__(self, directory: Optional[str] = None):
+        """
+        Args:
+            directory: 页文件目录，默认在 /dev/shm 下新建临时目录
+        """
+        self.directory = directory or _default_directory()
+        os.makedirs(self.directory, exist_ok=True)
+        # 页文件名 -> 引用计数
+        self.reference_counts: Dict[str, int] = {}
+        self.exported_bytes = 0
+        self.reused_chunks = 0
+
+    def export(self, snapshot: PersistentMap) -> SharedSnapshot:
+        """导出快照中的全部表；已导出过的页（摘要相同）直接复用"""
+        tables = {}
+        for table, rows in snapshot.items():
+            names = []
+            for page in rows.pages():
+                name = _digest(page).hex() + _CHUNK_SUFFIX
+                count = self.reference_counts.get(name, 0)
+                if count:
+                    self.reused_chunks += 1
+                else:
+                    path = os.path.join(self.directory, name)
+                    _write_chunk(path, page)
+                    self.exported_bytes += os.path.getsize(path)
+                self.reference_counts[name] = count + 1
+                names.append(name)
+            tables[table] = (len(rows), names)
+        return SharedSnapshot(self.directory, tables)
+
+    def release(self, shared: SharedSnapshot):
+        """释放一次导出；不再被引用的页文件被删除"""
+        for name in shared.chunks():
+            count = self.reference_counts.get(name)
+            if count is None:
+                continue
+            if count > 1:
+                self.reference_counts[name] = count - 1
+                continue
+            del self.reference_counts[name]
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+
+    def close(self):
+        """删除全部页文件和目录"""
+        self.reference_counts.clear()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "chunks": len(self.reference_counts),
+            "exported_bytes": self.exported_bytes,
+            "reused_chunks": self.reused_chunks,
+        }
+
+
+# 当前进程最近一次挂载的页（页文件名 -> 页）：重新导出的快照只映射新页，
+# 未变化的页连同其查询列缓存直接复用
+_attached: Dict[str, _Page] = {}
+
+
+def attach(shared: SharedSnapshot) -> PersistentMap:
+    """
+    在当前进程挂载导出的快照（只读映射，不反序列化列数据）
+
+    Returns:
+        PersistentMap: 表名 -> PersistentVector，可直接用于查询或作为分支快照
+    """
+    global _attached
+
+    pages: Dict[str, _Page] = {}
+    snapshot = PersistentMap()
+    for table, (count, names) in shared.tables.items():
+        table_pages = []
+        for name in names:
+            page = pages.get(name) or _attached.get(name)
+            if page is None:
+                page = _read_chunk(os.path.join(shared.directory, name))
+                # 文件名即摘要，挂载后无需重新哈希
+                page.digest = bytes.fromhex(name[:-len(_CHUNK_SUFFIX)])
+            pages[name] = page
+            table_pages.append(page)
+        rows = PersistentVector.from_pages(table_pages)
+        if len(rows) != count:
+            raise ValueError(f"导出的表行数不一致: {table}")
+        snapshot = snapshot.set(table, rows)
+    _attached = pages
+    return snapshot
@@ -0,0 +1,348 @@
+"""
+缓存结果的包含复用 - 新查询的结果可由已缓存的超集结果在本地算出时，不再访问数据库
+
+两个查询都先规范化（fingerprint.canonical_query），再判断新查询 N 能否由缓存查询 C 的结果行 R 得到：
+
+- 更严格的条件：N 的 WHERE 蕴含 C 的 WHERE（逐个合取项判断，例如 x > 10 蕴含 x > 5、
+  x IN (1) 蕴含 x IN (1, 2)），多出的条件在 R 上过滤
+- 更小的 LIMIT：C 带 LIMIT 且结果被截断时，只有条件、分组、排序和输出完全相同、
+  只是取更靠前的一段的 N 可以复用
+- 更粗的分组：N 的 GROUP BY 是 C 的 GROUP BY 的子集时在 R 上再聚合
+  （COUNT → SUM，SUM / MIN / MAX 不变，AVG → SUM(和) / SUM(计数)）
+
+R 中没有的列、带 DISTINCT 的再聚合、C 带 OFFSET 或 HAVING 的再聚合等情况一律不复用。
+判断成立时得到一条作用于 R 的查询，用分支查询引擎执行（derive_result）。
+"""
+
+from dataclasses import replace
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from .fingerprint import SQLFingerprint
+from .persistent import PersistentVector
+from .query_engine import (
+    Aggregate, Between, BinaryOp, BoolOp, Column, InList, IsNull, Like, Literal, Not, Query, QueryResult,
+    SelectItem, _execute_aggregate, _execute_scan, referenced_columns
+)
+
+
+class _NotDerivable(Exception):
+    """内部使用：表达式无法在缓存结果上计算"""
+
+
+# ----------------------------------------------------------------------------
+# 条件蕴含
+# ----------------------------------------------------------------------------
+
+def _conjuncts(expr) -> Tuple[Any, ...]:
+    if expr is None:
+        return ()
+    if isinstance(expr, BoolOp) and expr.op == "AND":
+        return expr.items
+    return (expr,)
+
+
+def _and(items: Sequence[Any]):
+    if not items:
+        return None
+    return items[0] if len(items) == 1 else BoolOp("AND", tuple(items))
+
+
+def _constraint(expr) -> Optional[Tuple[Any, tuple]]:
+    """
+    单列约束
+
+    Returns:
+        (被约束的表达式, ("set", 值集合) 或 ("range", 下界, 含下界, 上界, 含上界))；
+        不是单列常量约束时返回 None
+    """
+    if isinstance(expr, BinaryOp) and isinstance(expr.right, Literal) and expr.right.value is not None:
+        value = expr.right.value
+        if expr.op == "=":
+            return expr.left, ("set", frozenset((value,)))
+        if expr.op in (">", ">="):
+            return expr.left, ("range", value, expr.op == ">=", None, False)
+        if expr.op in ("<", "<="):
+            return expr.left, ("range", None, False, value, expr.op == "<=")
+    elif isinstance(expr, InList) and not expr.negated:
+        # x IN (NULL) 永远不成立
+        return expr.expr, ("set", frozenset(v for v in expr.values if v is not None))
+    elif isinstance(expr, Between) and not expr.negated \
+            and isinstance(expr.low, Literal) and isinstance(expr.high, Literal) \
+            and expr.low.value is not None and expr.high.value is not None:
+        return expr.expr, ("range", expr.low.value, True, expr.high.value, True)
+    return None
+
+
+def _in_range(value: Any, bounds: tuple) -> bool:
+    _, low, low_inclusive, high, high_inclusive = bounds
+    if low is not None and not (value > low or (low_inclusive and value == low)):
+        return False
+    if high is not None and not (value < high or (high_inclusive and value == high)):
+        return False
+    return True
+
+
+def _range_within(inner: tuple, outer: tuple) -> bool:
+    _, low, low_inclusive, high, high_inclusive = inner
+    _, outer_low, outer_low_inclusive, outer_high, outer_high_inclusive = outer
+    if outer_low is not None:
+        if low is None or low < outer_low:
+            return False
+        if low == outer_low and low_inclusive and not outer_low_inclusive:
+            return False
+    if outer_high is not None:
+        if high is None or high > outer_high:
+            return False
+        if high == outer_high and high_inclusive and not outer_high_inclusive:
+            return False
+    return True
+
+
+def _tighter(a: Any, a_inclusive: bool, b: Any, b_inclusive: bool, upper: bool) -> Tuple[Any, bool]:
+    """两个下界（upper 为 True 时上界）中更严格的一个"""
+    if a is None:
+        return b, b_inclusive
+    if b is None or a == b and not a_inclusive:
+        return a, a_inclusive
+    if a == b:
+        return b, b_inclusive
+    return (a, a_inclusive) if (a < b) == upper else (b, b_inclusive)
+
+
+def _merge(a: tuple, b: tuple) -> tuple:
+    """同一表达式上的两个约束同时成立时的约束"""
+    if a[0] == "set" and b[0] == "set":
+        return "set", a[1] & b[1]
+    if a[0] == "set":
+        return "set", frozenset(value for value in a[1] if _in_range(value, b))
+    if b[0] == "set":
+        return _merge(b, a)
+    low, low_inclusive = _tighter(a[1], a[2], b[1], b[2], upper=False)
+    high, high_inclusive = _tighter(a[3], a[4], b[3], b[4], upper=True)
+    return "range", low, low_inclusive, high, high_inclusive
+
+
+def _satisfies(subject: Any, values: tuple, weaker) -> bool:
+    """subject 满足约束 values 时 weaker 是否一定成立"""
+    try:
+        if isinstance(weaker, BinaryOp) and weaker.op == "!=" and isinstance(weaker.right, Literal):
+            return weaker.left == subject and values[0] == "set" and weaker.right.value not in values[1]
+        target = _constraint(weaker)
+        if target is None or target[0] != subject:
+            return False
+        bounds = target[1]
+        if bounds[0] == "set":
+            return values[0] == "set" and values[1] <= bounds[1]
+        if values[0] == "set":
+            return all(_in_range(value, bounds) for value in values[1])
+        return _range_within(values, bounds)
+    except TypeError:
+        # 不同类型的常量无法比较
+        return False
+
+
+def implies(stronger, weaker) -> bool:
+    """判断谓词 stronger 成立时 weaker 一定成立（保守：无法判断时返回 False）"""
+    if stronger == weaker:
+        return True
+    found = _constraint(stronger)
+    return found is not None and _satisfies(found[0], found[1], weaker)
+
+
+def _residual(new_where, cached_where) -> Optional[List[Any]]:
+    """
+    new_where 蕴含 cached_where 时，返回还需要在缓存结果上再过滤的合取项；否则返回 None
+
+    new_where 中同一表达式上的多个约束先合并（x > 20 AND x < 40 蕴含 x BETWEEN 10 AND 90）。
+    """
+    cached_items = _conjuncts(cached_where)
+    new_items = _conjuncts(new_where)
+    constraints: Dict[Any, tuple] = {}
+    for item in new_items:
+        found = _constraint(item)
+        if found is None:
+            continue
+        subject, values = found
+        try:
+            constraints[subject] = _merge(constraints[subject], values) if subject in constraints else values
+        except TypeError:
+            pass
+    for item in cached_items:
+        if item not in new_items and \
+                not any(_satisfies(subject, values, item) for subject, values in constraints.items()):
+            return None
+    return [item for item in new_items if item not in cached_items]
+
+
+# ----------------------------------------------------------------------------
+# 表达式改写：原表上的表达式 -> 缓存结果上的表达式
+# ----------------------------------------------------------------------------
+
+def _rewrite(expr, available: Dict[Any, str], aggregate: Optional[Callable[[Aggregate], Any]] = None):
+    """
+    Args:
+        available: 缓存结果中可直接读取的表达式 -> 列名
+        aggregate: 聚合的改写方式；为 None 时聚合只能直接读取
+    """
+    if expr is None or isinstance(expr, Literal):
+        return expr
+    if isinstance(expr, Aggregate) and aggregate is not None:
+        # 再聚合时即使缓存结果中有同名聚合列，也要按组合并而不是直接读取
+        return aggregate(expr)
+    name = available.get(expr)
+    if name is not None:
+        return Column(name)
+    if isinstance(expr, (Column, Aggregate)):
+        raise _NotDerivable(expr)
+    if isinstance(expr, BinaryOp):
+        return BinaryOp(expr.op, _rewrite(expr.left, available, aggregate), _rewrite(expr.right, available, aggregate))
+    if isinstance(expr, BoolOp):
+        return BoolOp(expr.op, tuple(_rewrite(item, available, aggregate) for item in expr.items))
+    if isinstance(expr, (Not, InList, Like, IsNull)):
+        return replace(expr, expr=_rewrite(expr.expr, available, aggregate))
+    if isinstance(expr, Between):
+        return Between(
+            _rewrite(expr.expr, available, aggregate),
+            _rewrite(expr.low, available, aggregate),
+            _rewrite(expr.high, available, aggregate),
+            expr.negated
+        )
+    raise _NotDerivable(expr)
+
+
+def _rollup(available: Dict[Any, str]) -> Callable[[Aggregate], Any]:
+    """按组的部分聚合结果再聚合"""
+    def rewrite(agg: Aggregate):
+        if agg.func in ("MIN", "MAX") and agg in available:
+            return Aggregate(agg.func, Column(available[agg]))
+        if agg.distinct:
+            raise _NotDerivable(agg)
+        if agg.func in ("COUNT", "SUM") and agg in available:
+            return Aggregate("SUM", Column(available[agg]))
+        if agg.func == "AVG":
+            total = available.get(Aggregate("SUM", agg.arg))
+            count = available.get(Aggregate("COUNT", agg.arg))
+            if total is not None and count is not None:
+                return BinaryOp("/", Aggregate("SUM", Column(total)), Aggregate("SUM", Column(count)))
+        raise _NotDerivable(agg)
+    return rewrite
+
+
+def _row_aggregate(agg: Aggregate, available: Dict[Any, str]):
+    """缓存结果是原表的行（未聚合）时，聚合直接在这些行上计算"""
+    if agg.arg is None:
+        return agg
+    return replace(agg, arg=_rewrite(agg.arg, available))
+
+
+# ----------------------------------------------------------------------------
+# 推导
+# ----------------------------------------------------------------------------
+
+def _available_columns(cached: SQLFingerprint, columns: Sequence[str]) -> Dict[Any, str]:
+    query = cached.query
+    if not query.items:
+        # SELECT *：结果行就是原表的行
+        return {Column(name): name for name in columns}
+    return {item.expr: name for item, name in zip(query.items, cached.outputs)}
+
+
+def _prefix_query(cached: SQLFingerprint, new: SQLFingerprint) -> Optional[Query]:
+    """缓存结果被 LIMIT 截断时，只能取其中更靠前的一段"""
+    old, query = cached.query, new.query
+    if (query.where, query.group_by, query.having, query.items) != (old.where, old.group_by, old.having, old.items):
+        return None
+    if not old.order_by or query.order_by != old.order_by:
+        # 没有 ORDER BY 时截断的是任意一段，不能假定与新查询取到的行相同
+        return None
+    if query.limit is None or query.offset + query.limit > old.limit:
+        return None
+    items = tuple(
+        SelectItem(Column(cached_name), new_name) for cached_name, new_name in zip(cached.outputs, new.outputs)
+    )
+    return Query("cached", items, limit=query.limit, offset=query.offset)
+
+
+def derive_query(
+    cached: SQLFingerprint,
+    new: SQLFingerprint,
+    cached_rows: int,
+    columns: Sequence[str]
+) -> Optional[Query]:
+    """
+    判断 new 的结果能否由 cached 的完整结果算出
+
+    Args:
+        cached: 缓存查询的指纹
+        new: 新查询的指纹
+        cached_rows: 缓存结果的行数
+        columns: 缓存结果的列名
+
+    Returns:
+        作用于缓存结果行的查询（输出列名与 new 一致）；不能复用时返回 None
+    """
+    old, query = cached.query, new.query
+    if old is None or query is None or old.table != query.table or old.offset:
+        return None
+    if old.limit is not None and cached_rows >= old.limit:
+        return _prefix_query(cached, new)
+
+    if not query.items and old.items:
+        # SELECT * 需要原表的全部列
+        return None
+
+    available = _available_columns(cached, columns)
+    try:
+        where = _residual(query.where, old.where)
+        if where is None:
+            return None
+
+        if not old.is_aggregate:
+            # 缓存的是原表的行：新查询（包括聚合）直接在这些行上执行
+            aggregate = lambda agg: _row_aggregate(agg, available)
+            group_by = tuple(_rewrite(expr, available) for expr in query.group_by)
+            having = _rewrite(query.having, available, aggregate)
+        elif not query.is_aggregate:
+            return None
+        elif set(query.group_by) == set(old.group_by):
+            # 分组相同：每组一行，聚合值直接读取，HAVING 变成对行的过滤
+            having_items = _residual(query.having, old.having)
+            if having_items is None:
+                return None
+            where = where + having_items
+            aggregate, group_by, having = None, (), None
+        elif set(query.group_by) < set(old.group_by) and old.having is None:
+            aggregate = _rollup(available)
+            group_by = tuple(_rewrite(expr, available) for expr in query.group_by)
+            having = _rewrite(query.having, available, aggregate)
+            if not group_by and not cached_rows:
+                # 空结果上 SUM(计数) 是 NULL 而不是 0
+                return None
+        else:
+            return None
+
+        where = _rewrite(_and(where), available)
+        items = tuple(
+            SelectItem(_rewrite(item.expr, available, aggregate), name)
+            for item, name in zip(query.items, new.outputs)
+        )
+        order_by = tuple((_rewrite(expr, available, aggregate), desc) for expr, desc in query.order_by)
+    except _NotDerivable:
+        return None
+
+    # 查询引擎会把 ORDER BY / HAVING 中与别名同名的列替换为别名对应的表达式，
+    # 引用的缓存结果列恰好是含义不同的别名时不复用
+    referenced = set(referenced_columns(having)) if having is not None else set()
+    for expr, _ in order_by:
+        referenced.update(referenced_columns(expr))
+    if any(item.alias in referenced and item.expr != Column(item.alias) for item in items):
+        return None
+    return Query("cached", items, where, group_by, having, order_by, query.limit, query.offset)
+
+
+def derive_result(query: Query, rows: Iterable[Dict[str, Any]]) -> QueryResult:
+    """在缓存结果行上执行 derive_query 得到的查询"""
+    vector = PersistentVector.from_iterable(rows)
+    if query.is_aggregate:
+        return _execute_aggregate(query, vector)
+    return _execute_scan(query, vector)
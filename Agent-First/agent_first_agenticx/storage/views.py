@@ -0,0 +1,431 @@
+"""
+分支上的增量物化视图
+
+视图是一条聚合查询（COUNT / SUM / AVG / MIN / MAX，可带 WHERE、GROUP BY、
+HAVING、ORDER BY、LIMIT）。按组保存的聚合状态放在 PersistentMap 中：
+
+- COUNT: 计数
+- SUM / AVG: (和, 非 NULL 计数)
+- MIN / MAX 以及 DISTINCT 聚合: (值 -> 出现次数 的 PersistentMap, 辅助值)，
+  辅助值为当前最值（MIN / MAX）或不同值之和（SUM / AVG DISTINCT）；
+  最值被撤回时只在该组的不同值中重新求
+
+每次写入把被替换的行撤回、把新行加入，代价与变化行数成正比。
+批量追加（Branch.update_many）不逐行处理：对新行向量化地算出各组的增量状态，
+再与已有状态合并（extend）。
+视图对象不可变，子分支分叉时直接共享父分支的视图（写时复制），
+之后各自写入只路径复制被修改的组。HAVING、ORDER BY、LIMIT 和投影在读取时
+对分组结果执行，与全表扫描走同一套代码（query_engine._finish_aggregate）。
+"""
+
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from .persistent import PersistentMap, PersistentVector
+from .query_engine import (
+    Aggregate,
+    Query,
+    QueryResult,
+    _ListEnv,
+    _aggregate,
+    _factorize,
+    _finish_aggregate,
+    _group,
+    _is_null,
+    _query_aggregates,
+    _scan_aggregate,
+    _select_inputs,
+    _to_array,
+    _to_python,
+    parse_sql,
+    render,
+)
+
+
+def _uses_multiset(agg: Aggregate) -> bool:
+    """需要保存每个值出现次数的聚合（最值撤回、DISTINCT 去重）"""
+    return agg.arg is not None and (agg.distinct or agg.func in ("MIN", "MAX"))
+
+
+def _empty_state(agg: Aggregate) -> Any:
+    if _uses_multiset(agg):
+        return (PersistentMap(), None)
+    if agg.arg is None or agg.func == "COUNT":
+        return 0
+    return (0, 0)
+
+
+def _clean(value: Any) -> Any:
+    """NumPy 标量转为 Python 值；NaN 视为 NULL"""
+    if isinstance(value, float) and value != value:
+        return None
+    return value
+
+
+def _update_state(agg: Aggregate, state: Any, value: Any, sign: int) -> Any:
+    """
+    把一个参数值加入（sign=1）或撤回（sign=-1）一组的聚合状态
+
+    COUNT(*) 的 value 恒为 None 但照常计数；其他聚合忽略 NULL。
+    """
+    if agg.arg is None:
+        return state + sign
+    if value is None:
+        return state
+    if agg.func in ("SUM", "AVG") and not isinstance(value, (int, float)):
+        raise ValueError(f"{agg.func} 需要数值列: {render(agg.arg)}")
+
+    if not _uses_multiset(agg):
+        if agg.func == "COUNT":
+            return state + sign
+        total, count = state
+        return (total + value if sign > 0 else total - value, count + sign)
+
+    values, aux = state
+    count = values.get(value, 0) + sign
+    values = values.set(value, count) if count else values.delete(value)
+    if agg.func == "MIN" or agg.func == "MAX":
+        pick = min if agg.func == "MIN" else max
+        if sign > 0:
+            aux = value if aux is None else pick(aux, value)
+        elif not count and value == aux:
+            aux = pick(values) if len(values) else None
+    elif agg.func in ("SUM", "AVG"):
+        if sign > 0 and count == 1:
+            aux = value if aux is None else aux + value
+        elif sign < 0 and not count:
+            aux = aux - value if len(values) else None
+    return (values, aux)
+
+
+def _merge_state(agg: Aggregate, state: Any, delta: Any) -> Any:
+    """把另一批行的聚合状态并入一组的状态"""
+    if not _uses_multiset(agg):
+        if agg.arg is None or agg.func == "COUNT":
+            return state + delta
+        return (state[0] + delta[0], state[1] + delta[1])
+
+    values, aux = state
+    new_values, new_aux = delta
+    if not len(values):
+        return delta
+    # 增量相对已有的值较多时整体重建，否则逐个路径复制
+    merged = dict(values.items()) if len(new_values) * 8 >= len(values) else None
+    for value, count in new_values.items():
+        if merged is not None:
+            previous = merged.get(value, 0)
+            merged[value] = previous + count
+        else:
+            previous = values.get(value, 0)
+            values = values.set(value, previous + count)
+        if not previous and agg.func in ("SUM", "AVG"):
+            aux = value if aux is None else aux + value
+    if merged is not None:
+        values = PersistentMap.from_dict(merged)
+    if agg.func == "MIN" or agg.func == "MAX":
+        pick = min if agg.func == "MIN" else max
+        if new_aux is not None:
+            aux = new_aux if aux is None else pick(aux, new_aux)
+    return (values, aux)
+
+
+def _state_value(agg: Aggregate, state: Any) -> Any:
+    """聚合状态对应的结果值（没有非 NULL 值时 SUM / AVG / MIN / MAX 为 NULL）"""
+    if not _uses_multiset(agg):
+        if agg.arg is None or agg.func == "COUNT":
+            return state
+        total, count = state
+        if not count:
+            return None
+        return total if agg.func == "SUM" else total / count
+    values, aux = state
+    if agg.func == "COUNT":
+        return len(values)
+    if agg.func == "AVG":
+        return aux / len(values) if len(values) else None
+    return aux
+
+
+def _group_array(values: List[Any]) -> np.ndarray:
+    """按组排列的一列结果；含 NULL 时与全表聚合一样使用 object 数组"""
+    if any(value is None for value in values):
+        array = np.empty(len(values), dtype=object)
+        array[:] = values
+        return array
+    return _to_array(values)
+
+
+def _sort_key(key: Tuple[Any, ...]) -> Tuple[Any, ...]:
+    return tuple((value is None, value) for value in key)
+
+
+class MaterializedView:
+    """
+    增量维护的聚合视图（不可变）
+
+    apply 返回应用了一批行变化的新视图，原视图不变，
+    因此同一个视图对象可以被多个分支共享。
+    """
+
+    __slots__ = ("name", "sql", "query", "aggregates", "groups", "_values")
+
+    def __init__(
+        self,
+        name: str,
+        sql: str,
+        query: Query,
+        aggregates: List[Aggregate],
+        groups: PersistentMap
+    ):
+        self.name = name
+        self.sql = sql
+        self.query = query
+        self.aggregates = aggregates
+        # 分组键元组 -> (行数, 各聚合的状态...)
+        self.groups = groups
+        # 读取时按组排列的结果数组，视图不可变，计算一次后缓存
+        self._values: Optional[Tuple[Dict[Any, np.ndarray], int]] = None
+
+    def __getstate__(self):
+        return {slot: getattr(self, slot) for slot in self.__slots__ if slot != "_values"}
+
+    def __setstate__(self, state):
+        for slot, value in state.items():
+            setattr(self, slot, value)
+        self._values = None
+
+    def __repr__(self) -> str:
+        return f"MaterializedView({self.name!r}, groups={len(self.groups)})"
+
+    @property
+    def table(self) -> str:
+        return self.query.table
+
+    @classmethod
+    def build(cls, name: str, sql: str, snapshot: PersistentMap) -> "MaterializedView":
+        """
+        解析 SQL 并在表的当前数据上一次性（向量化）计算初始状态
+
+        Args:
+            name: 视图名
+            sql: 聚合查询
+            snapshot: 分支的 data_snapshot（表可以尚不存在）
+
+        Raises:
+            ValueError: SQL 不是聚合查询，或包含不支持的语法
+        """
+        query = parse_sql(sql)
+        if not query.is_aggregate:
+            raise ValueError(f"物化视图必须是聚合查询: {sql}")
+        aggregates = _query_aggregates(query)
+        view = cls(name, sql, query, aggregates, PersistentMap())
+        rows = snapshot.get(query.table)
+        if rows is None or not len(rows):
+            return view
+
+        keys, args, total, _ = _scan_aggregate(query, rows, aggregates)
+        view.groups = view._merge_groups(view.groups, keys, args, total)
+        return view
+
+    def _merge_groups(
+        self,
+        groups: PersistentMap,
+        keys: List[np.ndarray],
+        args: List[Optional[np.ndarray]],
+        total: int
+    ) -> PersistentMap:
+        """
+        向量化地计算一批选中行的按组状态，并合并进 groups
+
+        Args:
+            groups: 已有的组状态
+            keys: 分组键列
+            args: 各聚合的参数列（COUNT(*) 为 None）
+            total: 选中行数
+        """
+        if not total:
+            return groups
+        num_groups, group_ids, first = _group(keys, total)
+        group_keys = list(zip(*(_to_python(key[first]) for key in keys))) if keys \
+            else [()]
+        columns = [np.bincount(group_ids, minlength=num_groups).tolist()]
+        for agg, values in zip(self.aggregates, args):
+            columns.append(self._initial_states(agg, values, group_ids, num_groups))
+
+        if not len(groups):
+            return PersistentMap.from_dict({
+                key: state for key, state in zip(group_keys, zip(*columns))
+            })
+        for key, delta in zip(group_keys, zip(*columns)):
+            state = groups.get(key)
+            if state is not None:
+                delta = (state[0] + delta[0], *(
+                    _merge_state(agg, old, new)
+                    for agg, old, new in zip(self.aggregates, state[1:], delta[1:])
+                ))
+            groups = groups.set(key, delta)
+        return groups
+
+    @staticmethod
+    def _initial_states(
+        agg: Aggregate,
+        values: Optional[np.ndarray],
+        group_ids: np.ndarray,
+        num_groups: int
+    ) -> List[Any]:
+        """按组计算一个聚合的初始状态"""
+        if values is None:
+            return np.bincount(group_ids, minlength=num_groups).tolist()
+
+        valid = ~_is_null(values)
+        counts = np.bincount(group_ids[valid], minlength=num_groups).tolist()
+        if agg.func in ("SUM", "AVG"):
+            # 同时校验参数列的类型
+            sums = _to_python(_aggregate(Aggregate("SUM", agg.arg, False), values, group_ids, num_groups))
+        if not _uses_multiset(agg):
+            if agg.func == "COUNT":
+                return counts
+            return [(total or 0, count) for total, count in zip(sums, counts)]
+
+        # (组, 值) 对去重计数，得到每组的值 -> 出现次数
+        ids = group_ids[valid]
+        present = values[valid]
+        multisets: List[Dict[Any, int]] = [{} for _ in range(num_groups)]
+        if len(present):
+            num_values, codes, first = _factorize(present)
+            distinct = _to_python(present[first])
+            pairs, pair_counts = np.unique(
+                ids.astype(np.int64) * num_values + codes, return_counts=True
+            )
+            for pair, count in zip(pairs.tolist(), pair_counts.tolist()):
+                group, code = divmod(pair, num_values)
+                multisets[group][distinct[code]] = count
+
+        states = []
+        for values_count in multisets:
+            aux = None
+            if values_count:
+                if agg.func == "MIN":
+                    aux = min(values_count)
+                elif agg.func == "MAX":
+                    aux = max(values_count)
+                elif agg.func in ("SUM", "AVG"):
+                    aux = sum(values_count)
+            states.append((PersistentMap.from_dict(values_count), aux))
+        return states
+
+    def apply(self, removed: List[Any], added: List[Any]) -> "MaterializedView":
+        """
+        撤回 removed 中的行、加入 added 中的行，返回新视图
+
+        Args:
+            removed: 被替换掉的旧行
+            added: 写入的新行
+        """
+        if not removed and not added:
+            return self
+        args = [agg.arg for agg in self.aggregates]
+        touched: Dict[Tuple[Any, ...], List[Any]] = {}
+        for rows, sign in ((removed, -1), (added, 1)):
+            if not rows:
+                continue
+            count, columns = _select_inputs(self.query, _ListEnv(rows), len(rows), args)
+            if not count:
+                continue
+            columns = [None if column is None else _to_python(column) for column in columns]
+            num_keys = len(self.query.group_by)
+            for i in range(count):
+                key = tuple(_clean(column[i]) for column in columns[:num_keys])
+                state = touched.get(key)
+                if state is None:
+                    state = self.groups.get(key)
+                    state = list(state) if state is not None else \
+                        [0] + [_empty_state(agg) for agg in self.aggregates]
+                    touched[key] = state
+                state[0] += sign
+                for k, (agg, column) in enumerate(zip(self.aggregates, columns[num_keys:]), 1):
+                    state[k] = _update_state(agg, state[k], None if column is None else _clean(column[i]), sign)
+
+        groups = self.groups
+        for key, state in touched.items():
+            groups = groups.set(key, tuple(state)) if state[0] > 0 else groups.delete(key)
+        return MaterializedView(self.name, self.sql, self.query, self.aggregates, groups)
+
+    def extend(self, env, length: int) -> "MaterializedView":
+        """
+        加入一批追加的行（向量化），返回新视图
+
+        Args:
+            env: 新行的求值环境（query_engine._ArrayEnv / _ListEnv）
+            length: 新行数
+        """
+        if not length:
+            return self
+        count, columns = _select_inputs(
+            self.query, env, length, [agg.arg for agg in self.aggregates]
+        )
+        num_keys = len(self.query.group_by)
+        groups = self._merge_groups(self.groups, columns[:num_keys], columns[num_keys:], count)
+        return MaterializedView(self.name, self.sql, self.query, self.aggregates, groups)
+
+    def _group_values(self) -> Tuple[Dict[Any, np.ndarray], int]:
+        """按组排列的分组键和聚合结果（与全表聚合的组顺序一致：按分组键排序）"""
+        if self._values is not None:
+            return self._values
+        query = self.query
+        items = list(self.groups.items())
+        if not query.group_by and not items:
+            # 无 GROUP BY 的聚合即使没有行也输出一行
+            items = [((), (0, *(_empty_state(agg) for agg in self.aggregates)))]
+        try:
+            items.sort(key=lambda item: _sort_key(item[0]))
+        except TypeError:
+            pass
+
+        values: Dict[Any, np.ndarray] = {}
+        for k, expr in enumerate(query.group_by):
+            values[expr] = _group_array([key[k] for key, _ in items])
+        for k, agg in enumerate(self.aggregates, 1):
+            values[agg] = _group_array([_state_value(agg, state[k]) for _, state in items])
+        self._values = (values, len(items))
+        return self._values
+
+    def result(self) -> QueryResult:
+        """读取视图（HAVING / ORDER BY / LIMIT 在分组结果上执行，不扫描表）"""
+        values, num_groups = self._group_values()
+        return _finish_aggregate(self.query, values, num_groups, 0)
+
+
+def match_view(views: Iterable[MaterializedView], sql: str) -> Optional[MaterializedView]:
+    """找到与 SQL 语义相同（语法树相同）的视图"""
+    try:
+        query = parse_sql(sql)
+    except ValueError:
+        return None
+    for view in views:
+        if view.query == query:
+            return view
+    return None
+
+
+def row_changes(rows: Optional[PersistentVector], updates: Dict[int, Any], appends: Iterable[Any]) -> Tuple[List[Any], List[Any]]:
+    """
+    一次写入替换掉的旧行和写入的新行
+
+    Args:
+        rows: 写入前的表
+        updates: 行号 -> 新行
+        appends: 追加的行
+    """
+    removed = []
+    added = []
+    length = len(rows) if rows is not None else 0
+    for index, row in updates.items():
+        if index < 0:
+            index += length
+        if 0 <= index < length:
+            removed.append(rows[index])
+        added.append(row)
+    added.extend(appends)
+    return removed, added
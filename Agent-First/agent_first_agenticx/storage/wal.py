@@ -0,0 +1,242 @@
+"""
+分支存储的持久化：追加写日志（WAL）+ 检查点
+
+- WAL 按段文件存放（wal-<起始序号>.log），每条记录为
+  [长度 4 字节][CRC32 4 字节][pickle 负载]，崩溃时写了一半的尾记录会被丢弃
+- 组提交（group commit）：同一时间窗口内的多条记录共用一次 write + fsync
+- 检查点：整个分支状态写入快照文件；恢复时用 mmap 映射检查点，
+  再只重放检查点之后的日志尾部
+"""
+
+import asyncio
+import mmap
+import os
+import pickle
+import struct
+import threading
+import zlib
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+
+_RECORD_HEADER = struct.Struct("<II")
+_CHECKPOINT_MAGIC = b"AFCKPT01"
+_CHECKPOINT_HEADER = struct.Struct("<8sQ")
+_SEGMENT_PREFIX = "wal-"
+_SEGMENT_SUFFIX = ".log"
+CHECKPOINT_FILE = "checkpoint.snap"
+
+
+def _encode(record: Dict[str, Any]) -> bytes:
+    payload = pickle.dumps(record, protocol=pickle.HIGHEST_PROTOCOL)
+    return _RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def _decode_segment(data) -> Tuple[List[Dict[str, Any]], int]:
+    """解析一个段文件，返回 (记录列表, 有效字节数)"""
+    records = []
+    pos = 0
+    while pos + _RECORD_HEADER.size <= len(data):
+        length, crc = _RECORD_HEADER.unpack_from(data, pos)
+        start = pos + _RECORD_HEADER.size
+        payload = data[start:start + length]
+        if len(payload) < length or zlib.crc32(payload) != crc:
+            break
+        records.append(pickle.loads(payload))
+        pos = start + length
+    return records, pos
+
+
+class WriteAheadLog:
+    """
+    追加写日志
+
+    append 是异步的：记录先进入缓冲区，由后台刷盘任务批量写入并 fsync，
+    调用方在记录落盘后返回。
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        commit_delay: float = 0.0,
+        fsync: bool = True
+    ):
+        """
+        Args:
+            directory: 日志目录
+            commit_delay: 组提交等待窗口（秒），0 表示只合并同一轮事件循环内的写入
+            fsync: 是否在每次组提交时 fsync
+        """
+        self.directory = directory
+        self.commit_delay = commit_delay
+        self.fsync = fsync
+        self.last_seq = 0
+
+        self._file = None
+        # 刷盘在线程池中进行，换段时需要互斥
+        self._file_lock = threading.Lock()
+        self._buffer: List[bytes] = []
+        self._waiters: List[asyncio.Future] = []
+        self._flusher: Optional[asyncio.Task] = None
+
+        os.makedirs(directory, exist_ok=True)
+
+    # ------------------------------------------------------------------
+    # 读取
+    # ------------------------------------------------------------------
+
+    def segments(self) -> List[Tuple[int, str]]:
+        """按起始序号排序的段文件列表"""
+        result = []
+        for name in os.listdir(self.directory):
+            if name.startswith(_SEGMENT_PREFIX) and name.endswith(_SEGMENT_SUFFIX):
+                start = int(name[len(_SEGMENT_PREFIX):-len(_SEGMENT_SUFFIX)])
+                result.append((start, os.path.join(self.directory, name)))
+        return sorted(result)
+
+    def read(self, after_seq: int = 0) -> Iterator[Dict[str, Any]]:
+        """按顺序读取序号大于 after_seq 的记录（损坏的尾部被截断）"""
+        segments = self.segments()
+        for i, (start, path) in enumerate(segments):
+            # 下一段的起始序号不大于 after_seq 时，本段全部已被检查点覆盖
+            if i + 1 < len(segments) and segments[i + 1][0] <= after_seq + 1:
+                continue
+            with open(path, "rb") as f:
+                data = f.read()
+            records, valid = _decode_segment(data)
+            if valid < len(data):
+                with open(path, "r+b") as f:
+                    f.truncate(valid)
+            for record in records:
+                self.last_seq = max(self.last_seq, record["seq"])
+                if record["seq"] > after_seq:
+                    yield record
+
+    # ------------------------------------------------------------------
+    # 写入
+    # ------------------------------------------------------------------
+
+    def rotate(self) -> int:
+        """
+        开启新的段文件，之后的记录都写入新段
+
+        Returns:
+            int: 旧段覆盖到的最大序号
+        """
+        name = f"{_SEGMENT_PREFIX}{self.last_seq + 1:016d}{_SEGMENT_SUFFIX}"
+        with self._file_lock:
+            if self._file is not None:
+                self._file.close()
+            self._file = open(os.path.join(self.directory, name), "ab")
+        return self.last_seq
+
+    def remove_segments_through(self, seq: int):
+        """删除所有记录序号都不大于 seq 的段文件"""
+        segments = self.segments()
+        for i, (start, path) in enumerate(segments):
+            if i + 1 < len(segments) and segments[i + 1][0] <= seq + 1:
+                os.remove(path)
+
+    def submit(self, record: Dict[str, Any]) -> asyncio.Future:
+        """
+        同步分配序号并放入缓冲区，返回记录落盘时完成的 Future
+
+        调用方在同一段同步代码中修改内存状态并提交记录，内存状态与日志顺序一致
+        （检查点捕获的状态不会包含序号晚于检查点的记录）；多条记录可以先全部提交，
+        再一起等待同一次组提交。
+        """
+        if self._file is None:
+            self.rotate()
+        self.last_seq += 1
+        record["seq"] = self.last_seq
+        self._buffer.append(_encode(record))
+
+        loop = asyncio.get_running_loop()
+        waiter = loop.create_future()
+        self._waiters.append(waiter)
+        if self._flusher is None or self._flusher.done():
+            self._flusher = loop.create_task(self._flush_loop())
+        return waiter
+
+    async def append(self, record: Dict[str, Any]) -> int:
+        """追加一条记录，落盘后返回其序号（序号在调用时同步分配，见 submit）"""
+        waiter = self.submit(record)
+        await asyncio.shield(waiter)
+        return record["seq"]
+
+    async def _flush_loop(self):
+        loop = asyncio.get_running_loop()
+        while self._buffer:
+            # 等待一个提交窗口，让并发写入进入同一批
+            await asyncio.sleep(self.commit_delay)
+            batch, waiters = self._buffer, self._waiters
+            self._buffer, self._waiters = [], []
+            try:
+                await loop.run_in_executor(None, self._write_batch, batch)
+            except Exception as e:
+                for waiter in waiters:
+                    if not waiter.done():
+                        waiter.set_exception(e)
+                continue
+            for waiter in waiters:
+                if not waiter.done():
+                    waiter.set_result(None)
+
+    def _write_batch(self, batch: List[bytes]):
+        with self._file_lock:
+            self._file.write(b"".join(batch))
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+
+    def close(self):
+        """同步写出缓冲区并关闭"""
+        if self._file is None:
+            return
+        if self._buffer:
+            self._write_batch(self._buffer)
+            self._buffer = []
+        for waiter in self._waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+        self._waiters = []
+        self._file.close()
+        self._file = None
+
+
+def write_checkpoint(directory: str, seq: int, state: Any):
+    """
+    原子地写入检查点（先写临时文件再 rename）
+
+    Args:
+        directory: 日志目录
+        seq: 检查点覆盖到的日志序号
+        state: 需要保存的状态（可 pickle）
+    """
+    path = os.path.join(directory, CHECKPOINT_FILE)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(_CHECKPOINT_HEADER.pack(_CHECKPOINT_MAGIC, seq))
+        pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def load_checkpoint(directory: str) -> Optional[Tuple[int, Any]]:
+    """
+    映射并加载检查点
+
+    Returns:
+        (seq, state)；不存在检查点时返回 None
+    """
+    path = os.path.join(directory, CHECKPOINT_FILE)
+    if not os.path.exists(path) or os.path.getsize(path) < _CHECKPOINT_HEADER.size:
+        return None
+    with open(path, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            magic, seq = _CHECKPOINT_HEADER.unpack_from(mapped, 0)
+            if magic != _CHECKPOINT_MAGIC:
+                raise ValueError(f"检查点文件格式错误: {path}")
+            with memoryview(mapped) as view, view[_CHECKPOINT_HEADER.size:] as payload:
+                state = pickle.loads(payload)
+    return seq, state
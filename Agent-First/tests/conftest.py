@@ -0,0 +1,6 @@
+import sys
+from pathlib import Path
+
+# 与 examples/ 相同，以顶层模块方式导入 storage / memory
+PACKAGE_DIR = Path(__file__).resolve().parent.parent / "agent_first_agenticx"
+sys.path.insert(0, str(PACKAGE_DIR))
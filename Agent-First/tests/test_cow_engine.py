@@ -0,0 +1,137 @@
+"""页级写时复制：写入只复制被修改的页；快照节点引用计数：释放后仍被持有的快照照常可读，回滚的分支占用的内存被回收"""
+
+import asyncio
+import gc
+import random
+import tracemalloc
+
+import pytest
+
+from storage.branch_manager import BranchManager
+from storage.cow_engine import CopyOnWriteEngine
+from storage.persistent import PAGE_SIZE, PersistentVector
+from storage.query_engine import execute_query
+
+
+async def _fill(branch, count):
+    await branch.update_many("t", [{"id": i, "v": i * 2} for i in range(count)])
+
+
+def test_held_snapshot_readable_after_rollback():
+    async def run():
+        manager = BranchManager()
+        branch = await manager.create_branch("main", "scratch")
+        await _fill(branch, 100)
+        await branch.update("t", {"id": 3, "v": -1}, row=3)
+        snapshot = branch.data_snapshot
+        old = branch.version_at(branch.version - 1)
+
+        await manager.rollback(branch.id)
+        assert manager.cow_engine.freed_bytes > 0
+
+        assert snapshot["t"][3] == {"id": 3, "v": -1}
+        assert old.snapshot["t"][3] == {"id": 3, "v": 6}
+        result = execute_query("SELECT SUM(v) AS s FROM t", snapshot)
+        assert result.to_dict()["data"] == [{"s": sum(i * 2 for i in range(100)) - 7}]
+
+    asyncio.run(run())
+
+
+def test_expired_version_readable():
+    async def run():
+        manager = BranchManager(max_versions=2)
+        main = manager.get_branch("main")
+        await _fill(main, 50)
+        first = main.version_at(main.version).snapshot
+        for i in range(5):
+            await main.update("t", {"id": i, "v": 0}, row=i)
+
+        # first 已超出保留范围，引擎不再持有它独占的页
+        assert first["t"][4] == {"id": 4, "v": 8}
+        result = execute_query("SELECT COUNT(*) AS n, SUM(v) AS s FROM t", first)
+        assert result.to_dict()["data"] == [{"n": 50, "s": sum(i * 2 for i in range(50))}]
+
+    asyncio.run(run())
+
+
+def test_rollback_reclaims_memory_of_held_branch():
+    async def run():
+        manager = BranchManager()
+        main = manager.get_branch("main")
+        await _fill(main, 100)
+        other = await manager.create_branch("main", "other")
+
+        tracemalloc.start()
+        try:
+            # 调用方持有分支对象；分支有历史版本和合并基准
+            branch = await manager.create_branch("main", "scratch")
+            await _fill(branch, 20000)
+            for i in range(5):
+                await branch.update("t", {"id": i, "v": -i}, row=i)
+            await manager.merge(branch.id, other.id)
+            assert branch.merge_bases
+            gc.collect()
+            tracked = manager.cow_engine.tracked_bytes
+            allocated = tracemalloc.get_traced_memory()[0]
+
+            await manager.rollback(branch.id)
+            gc.collect()
+            freed = tracked - manager.cow_engine.tracked_bytes
+            reclaimed = allocated - tracemalloc.get_traced_memory()[0]
+        finally:
+            tracemalloc.stop()
+
+        assert freed > 0
+        assert manager.cow_engine.freed_bytes >= freed
+        # 计入释放的数据确实被回收（按近似字节数估算，留出余量）
+        assert reclaimed > freed // 2
+        assert branch.versions == [] and branch.merge_bases == {}
+        assert (await main.query("SELECT COUNT(*) AS n FROM t"))["data"] == [{"n": 100}]
+        assert (await other.query("SELECT COUNT(*) AS n FROM t"))["data"] == [{"n": 20100}]
+
+    asyncio.run(run())
+
+
+@pytest.mark.parametrize("size", [0, 1, PAGE_SIZE - 1, PAGE_SIZE, PAGE_SIZE + 3, 33 * PAGE_SIZE])
+def test_transient_edits_match_list(size):
+    rnd = random.Random(size)
+    base = [{"i": i, "v": rnd.random()} for i in range(size)]
+    vector = PersistentVector.from_iterable(base)
+    transient = vector.transient()
+    model = list(base)
+    for _ in range(60):
+        op = rnd.random()
+        if op < 0.4 and model:
+            i = rnd.randrange(len(model))
+            model[i] = {"i": -i, "v": rnd.random()}
+            transient.set(i, model[i])
+        elif op < 0.7:
+            model.append({"i": len(model), "v": 0.5})
+            transient.append(model[-1])
+        elif op < 0.8:
+            rows = [{"i": k, "v": 1.0} for k in range(rnd.randrange(3 * PAGE_SIZE))]
+            transient.extend(rows)
+            model.extend(rows)
+        elif model:
+            i = rnd.randrange(len(model))
+            assert transient[i] == model[i]
+
+    assert transient.persistent().to_list() == model
+    # 原向量不受影响
+    assert vector.to_list() == base
+
+
+def test_materialized_write_copies_one_page():
+    async def run():
+        engine = CopyOnWriteEngine()
+        snapshot = await engine.copy_on_write({"t": [{"a": i} for i in range(20 * PAGE_SIZE)]})
+        work = engine.materialize(snapshot)
+        work["t"].set(5, {"a": -5})
+        new = await engine.copy_on_write(work)
+
+        assert new["t"][5] == {"a": -5} and snapshot["t"][5] == {"a": 5}
+        old_pages, new_pages = list(snapshot["t"].pages()), list(new["t"].pages())
+        assert len(old_pages) == len(new_pages) == 20
+        assert [a is b for a, b in zip(old_pages, new_pages)] == [False] + [True] * 19
+
+    asyncio.run(run())
@@ -0,0 +1,84 @@
+"""DependencyIndex：分支写入只失效读过被修改表的缓存条目"""
+
+import asyncio
+
+import pytest
+
+pytest.importorskip("agenticx")
+
+from memory.query_cache import QueryCache
+from storage.branch_manager import BranchManager
+
+
+async def _setup():
+    manager = BranchManager()
+    main = manager.get_branch("main")
+    await main.update_many("orders", [{"id": i, "amount": i} for i in range(10)])
+    await main.update_many("users", [{"id": i} for i in range(5)])
+    child = await manager.create_branch("main", "child")
+    cache = QueryCache(branch_manager=manager)
+    return manager, main, child, cache
+
+
+def _cache_reads(cache, branch, reads):
+    for key, tables in reads.items():
+        assert cache.set(key, key, reads=(branch.id, branch.version, tables))
+
+
+def test_write_drops_only_readers_of_written_table():
+    async def run():
+        manager, main, child, cache = await _setup()
+        _cache_reads(cache, main, {"orders": ["orders"], "users": ["users"], "both": ["orders", "users"]})
+        _cache_reads(cache, child, {"child_orders": ["orders"]})
+
+        await main.update("orders", {"id": 0, "amount": -1}, row=0)
+        assert set(cache.cache) == {"users", "child_orders"}
+        assert cache.dependencies.invalidations == 2
+
+        # 子分支的写入不影响父分支的条目
+        await child.update("users", {"id": 99})
+        assert set(cache.cache) == {"users", "child_orders"}
+        await child.update("orders", {"id": 99})
+        assert set(cache.cache) == {"users"}
+
+    asyncio.run(run())
+
+
+def test_merge_revert_and_rollback_invalidate():
+    async def run():
+        manager, main, child, cache = await _setup()
+        await child.update("orders", {"id": 10, "amount": 10})
+        _cache_reads(cache, main, {"orders": ["orders"], "users": ["users"]})
+        _cache_reads(cache, child, {"child_users": ["users"]})
+
+        await manager.merge(child.id, "main")
+        assert set(cache.cache) == {"users", "child_users"}
+
+        _cache_reads(cache, main, {"orders": ["orders"]})
+        await main.revert(main.version - 1)
+        assert set(cache.cache) == {"users", "child_users"}
+
+        # 分支删除后其上的条目全部失效
+        await manager.rollback(child.id)
+        assert set(cache.cache) == {"users"}
+
+    asyncio.run(run())
+
+
+def test_entry_computed_before_a_write_is_rejected():
+    async def run():
+        manager, main, child, cache = await _setup()
+        version = main.version
+        await main.update("orders", {"id": 11, "amount": 11})
+
+        # 结果在写入之前读取，写入之后才放入缓存
+        assert not cache.set("stale", 1, reads=("main", version, ["orders"]))
+        assert "stale" not in cache and cache.dependencies.rejected == 1
+        # 读取的表在之后没有被修改
+        assert cache.set("fresh", 1, reads=("main", version, ["users"]))
+        assert "fresh" in cache
+
+        cache.delete("fresh")
+        assert len(cache.dependencies) == 0
+
+    asyncio.run(run())
@@ -0,0 +1,69 @@
+"""BranchManager.diff：按 Merkle 摘要跳过未变化的页"""
+
+import asyncio
+
+from storage.branch_manager import BranchManager
+from storage.persistent import PersistentVector, diff_vectors
+
+
+ROWS = [{"id": i, "v": 0} for i in range(20000)]
+
+
+async def _manager():
+    manager = BranchManager()
+    main = manager.get_branch("main")
+    main.data_snapshot = await manager.cow_engine.copy_on_write({"t": ROWS, "u": [{"k": 1}]})
+    return manager
+
+
+def test_diff_reports_changed_rows_only():
+    async def run():
+        manager = await _manager()
+        a = await manager.create_branch("main")
+        b = await manager.create_branch("main")
+        for i in (5, 10000, 19999):
+            await a.update("t", {"id": i, "v": 1}, row=i)
+        await b.update("t", {"id": 5, "v": 2}, row=5)
+        await b.update("t", {"x": 1})
+        await b.update("new", {"x": 1})
+
+        result = manager.diff(a.id, b.id)
+        rows = {table: [(c["row"], c["a"], c["b"]) for c in changes] for table, changes in result["tables"].items()}
+        assert rows == {
+            "t": [
+                (5, {"id": 5, "v": 1}, {"id": 5, "v": 2}),
+                (10000, {"id": 10000, "v": 1}, {"id": 10000, "v": 0}),
+                (19999, {"id": 19999, "v": 1}, {"id": 19999, "v": 0}),
+                (20000, None, {"x": 1}),
+            ],
+            "new": [(0, None, {"x": 1})],
+        }
+        assert result["changed_rows"] == 5
+
+        # 同一分支的两个版本
+        assert manager.diff(a.id, a.id, a_as_of=1)["changed_rows"] == 2
+
+    asyncio.run(run())
+
+
+def test_equal_content_built_independently_has_no_diff():
+    async def run():
+        manager = await _manager()
+        copy = await manager.create_branch("main")
+        copy.data_snapshot = await manager.cow_engine.copy_on_write({"t": [dict(r) for r in ROWS], "u": [{"k": 1}]})
+        assert copy.data_snapshot["t"] is not manager.get_branch("main").data_snapshot["t"]
+        assert copy.table_digests() == manager.get_branch("main").table_digests()
+        assert manager.diff("main", copy.id) == {"tables": {}, "changed_rows": 0}
+
+        await copy.update("t", {"id": 7, "v": 9}, row=7)
+        assert [c["row"] for c in manager.diff("main", copy.id)["tables"]["t"]] == [7]
+
+    asyncio.run(run())
+
+
+def test_diff_vectors_matches_brute_force():
+    old = PersistentVector.from_iterable(ROWS)
+    new = old.update_many({3: {"id": 3, "v": 1}, 12345: {"id": 0, "v": 0}}, [{"id": -1}])
+    changed = [index for index, _, _ in diff_vectors(old, new)]
+    brute = [i for i in range(len(new)) if i >= len(old) or old[i] != new[i]]
+    assert changed == brute == [3, 12345, 20000]
@@ -0,0 +1,114 @@
+"""DiskCache：读写往返、热度排序、过期与限额、预热；写入队列、命中计数"""
+
+import os
+import time
+
+import pytest
+
+pytest.importorskip("agenticx")
+
+from memory.disk_tier import DiskCache, decode_value, encode_value
+from memory.eviction import approximate_size
+from memory.query_cache import QueryCache
+
+
+def _hits(l2, key):
+    return next(entry.hits for entry in l2.hottest() if entry.key == key)
+
+
+def test_membership_check_does_not_count_hit(tmp_path):
+    l2 = DiskCache(str(tmp_path / "cache.db"))
+    QueryCache(l2=l2, warm_start_seconds=0).set("a", [1, 2, 3])
+    QueryCache(l2=l2, warm_start_seconds=0).set("b", [4, 5, 6])
+
+    # 内存层为空，两个键都只在磁盘层
+    cache = QueryCache(l2=l2, warm_start_seconds=0)
+    for _ in range(5):
+        assert "a" in cache
+    assert cache.get("b") == [4, 5, 6]
+    assert (cache.hits, cache.l2_hits, cache.misses) == (1, 1, 0)
+    assert _hits(l2, "a") == 0
+    assert _hits(l2, "b") == 1
+    cache.close()
+
+
+def test_queued_writes_are_visible_and_persist(tmp_path):
+    path = str(tmp_path / "cache.db")
+    l2 = DiskCache(path)
+    for i in range(100):
+        l2.put(("q", i), {"data": [{"id": i, "v": i * 2}] * 3})
+    l2.delete(("q", 0))
+
+    # 写线程提交之前读取同样可见
+    assert ("q", 0) not in l2
+    assert l2.get(("q", 1)).value == {"data": [{"id": 1, "v": 2}] * 3}
+    l2.close()
+
+    reopened = DiskCache(path)
+    assert len(reopened) == 99
+    assert reopened.get(("q", 99)).value["data"][0] == {"id": 99, "v": 198}
+    reopened.close()
+
+
+@pytest.mark.parametrize("value", [
+    {"data": [{"id": i, "name": f"n{i}", "price": i * 0.5, "ok": i % 2 == 0} for i in range(100)]},
+    # 键不一致的行、NULL、嵌套值
+    {"data": [{"id": 1, "x": None}, {"id": 2}, {"id": 3, "x": [1, {"y": 2}]}], "meta": ("t", 1)},
+    [{"a": 1}] * 3,
+    "text",
+    None,
+])
+def test_encode_round_trip(value):
+    assert decode_value(encode_value(value)) == value
+
+
+def test_hottest_orders_by_hits_and_skips_expired(tmp_path):
+    l2 = DiskCache(str(tmp_path / "cache.db"))
+    for key in "abcd":
+        l2.put(key, {"data": [key]}, metadata={"sql": key})
+    l2.put("old", 1, expires_at=time.time() - 1)
+    for key, hits in (("c", 3), ("a", 2), ("d", 1)):
+        for _ in range(hits):
+            l2.touch(key)
+
+    entries = list(l2.hottest())
+    assert [entry.key for entry in entries] == ["c", "a", "d", "b"]
+    assert [entry.hits for entry in entries] == [3, 2, 1, 0]
+    assert entries[0].metadata == {"sql": "c"} and entries[0].value == {"data": ["c"]}
+    assert [entry.key for entry in l2.hottest(limit=2)] == ["c", "a"]
+    assert l2.get("old") is None and len(l2) == 4
+    l2.close()
+
+
+def test_shrinks_coldest_entries_over_limit(tmp_path):
+    l2 = DiskCache(str(tmp_path / "cache.db"), max_bytes=20000)
+    # 值会被压缩，用随机内容保证每个条目约 2KB
+    l2.put("hot", os.urandom(1000).hex())
+    l2.touch("hot")
+    for i in range(100):
+        l2.put(i, os.urandom(1000).hex())
+    l2.flush()
+    assert l2.total_bytes <= 20000 and l2.evictions > 0
+    assert "hot" in l2 and 99 in l2 and 0 not in l2
+    assert l2.total_bytes == sum(entry.size for entry in l2.hottest())
+    l2.close()
+
+
+def test_warm_start_loads_hottest_within_budget(tmp_path):
+    path = str(tmp_path / "cache.db")
+    value = {"data": [{"id": i} for i in range(50)]}
+    cache = QueryCache(l2=DiskCache(path), warm_start_seconds=0)
+    for i in range(20):
+        cache.set(i, value)
+    for i in range(10, 20):
+        for _ in range(i):
+            cache.get(i)
+    cache.close()
+
+    # 内存层只放得下 5 个条目：重启后预热最热的 5 个
+    warmed = QueryCache(l2=DiskCache(path), max_bytes=approximate_size(value) * 5 + 10)
+    assert warmed.warmed == 5
+    assert set(warmed.cache) == {15, 16, 17, 18, 19}
+    # 没有预热的键仍然可以从磁盘层读取
+    assert warmed.get(0) == value and warmed.l2_hits == 1
+    warmed.close()
@@ -0,0 +1,88 @@
+"""EmbeddingPipeline：内容哈希缓存、并发请求微批、后端错误传播"""
+
+import asyncio
+
+import numpy as np
+import pytest
+
+pytest.importorskip("agenticx")
+
+from memory.embedding import EmbeddingPipeline, HashingEmbedder
+
+
+class RecordingBackend:
+    """记录每次 embed_batch 收到的文本"""
+
+    def __init__(self, fail=False):
+        self.embedder = HashingEmbedder(dim=16)
+        self.batches = []
+        self.fail = fail
+
+    async def embed_batch(self, texts):
+        self.batches.append(list(texts))
+        await asyncio.sleep(0)
+        if self.fail:
+            raise RuntimeError("backend down")
+        return self.embedder.embed_batch(texts)
+
+
+def test_concurrent_requests_share_batches():
+    async def run():
+        backend = RecordingBackend()
+        pipeline = EmbeddingPipeline(backend, max_batch=8, max_delay=0.01)
+        texts = [f"show orders {i % 20}" for i in range(50)]
+        vectors = await pipeline.embed_many(texts)
+
+        # 20 个不同文本，每批最多 8 个
+        assert [len(batch) for batch in backend.batches] == [8, 8, 4]
+        assert sorted(text for batch in backend.batches for text in batch) == sorted(set(texts))
+        for text, vector in zip(texts, vectors):
+            np.testing.assert_allclose(vector, backend.embedder.embed(text), rtol=1e-6)
+        stats = pipeline.get_stats()
+        assert (stats["requests"], stats["coalesced"], stats["embedded"]) == (50, 30, 20)
+
+    asyncio.run(run())
+
+
+def test_cache_hits_skip_backend():
+    async def run():
+        backend = RecordingBackend()
+        pipeline = EmbeddingPipeline(backend, cache_size=2, max_delay=0)
+        first = await pipeline("Total  Sales by Region")
+        # 规范化后相同的文本命中缓存
+        assert await pipeline("total sales by region") is first
+        assert len(backend.batches) == 1 and pipeline.cache_hits == 1
+
+        await pipeline("a")
+        await pipeline("b")
+        # 缓存只保留最近的 2 个
+        await pipeline("total sales by region")
+        assert len(backend.batches) == 4
+
+    asyncio.run(run())
+
+
+def test_backend_error_reaches_every_waiter():
+    async def run():
+        backend = RecordingBackend(fail=True)
+        pipeline = EmbeddingPipeline(backend, max_delay=0.01)
+        results = await asyncio.gather(*(pipeline(text) for text in ["x", "y", "x"]), return_exceptions=True)
+        assert all(isinstance(error, RuntimeError) for error in results)
+        assert len(backend.batches) == 1
+
+        # 失败的结果不进入缓存，之后的请求重新调用后端
+        backend.fail = False
+        assert (await pipeline("x")).shape == (16,)
+        assert len(backend.batches) == 2
+
+    asyncio.run(run())
+
+
+def test_hashing_embedder_similarity():
+    embedder = HashingEmbedder()
+    a = embedder.embed("count orders by region last week")
+    b = embedder.embed("count orders by region last month")
+    c = embedder.embed("average user session length")
+    assert float(np.linalg.norm(a)) == pytest.approx(1.0, rel=1e-5)
+    assert float(a @ b) > float(a @ c)
+    assert embedder.embed_batch([]).shape == (0, 256)
@@ -0,0 +1,134 @@
+"""QueryCache：按字节限额淘汰（LRU / LFU / ARC），时间轮过期"""
+
+import random
+
+import pytest
+
+pytest.importorskip("agenticx")
+
+from memory.eviction import TimerWheel, approximate_size
+from memory.query_cache import QueryCache
+
+
+VALUE = "x" * 100
+SIZE = approximate_size(VALUE)
+
+
+class Clock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.mark.parametrize("policy", ["lru", "lfu", "arc"])
+def test_total_bytes_stay_within_limit(policy):
+    rnd = random.Random(1)
+    clock = Clock()
+    cache = QueryCache(ttl_seconds=50, max_bytes=5000, policy=policy, clock=clock)
+    for _ in range(5000):
+        key = rnd.randrange(200)
+        if rnd.random() < 0.5:
+            cache.set(key, "y" * rnd.randrange(1, 400))
+        else:
+            cache.get(key)
+        clock.now += rnd.random()
+        assert cache.total_bytes <= 5000
+        assert cache.total_bytes == sum(entry.size for entry in cache.cache.values())
+    assert cache.evictions > 0
+
+
+def test_lru_evicts_least_recent():
+    cache = QueryCache(max_bytes=SIZE * 3, clock=Clock())
+    for key in "abc":
+        cache.set(key, VALUE)
+    cache.get("a")
+    cache.set("d", VALUE)
+    assert set(cache.cache) == {"a", "c", "d"} and cache.evictions == 1
+
+
+def test_lfu_evicts_least_frequent():
+    cache = QueryCache(max_bytes=SIZE * 3, policy="lfu", clock=Clock())
+    for key in "abc":
+        cache.set(key, VALUE)
+    cache.get("a")
+    cache.get("a")
+    cache.get("b")
+    cache.set("d", VALUE)
+    assert set(cache.cache) == {"a", "b", "d"}
+    # 频次相同时淘汰最久未用的
+    cache.set("e", VALUE)
+    assert set(cache.cache) == {"a", "b", "e"}
+
+
+def test_arc_resists_scans():
+    cache = QueryCache(ttl_seconds=100, max_bytes=SIZE * 10, policy="arc", clock=Clock())
+    for k in range(5):
+        cache.set(("hot", k), VALUE)
+    for _ in range(3):
+        for k in range(5):
+            assert cache.get(("hot", k)) == VALUE
+    # 只访问一次的大量新键不会挤掉常用键
+    for k in range(100):
+        cache.set(("scan", k), VALUE)
+    assert all(("hot", k) in cache for k in range(5))
+
+
+def test_oversized_value_rejected_and_overwrite_accounted():
+    cache = QueryCache(max_bytes=100, clock=Clock())
+    assert cache.set("k", "x" * 1000) is False
+    assert cache.get_stats()["rejections"] == 1 and len(cache) == 0
+
+    cache = QueryCache(clock=Clock())
+    cache.set("k", "x" * 10)
+    cache.set("k", "x" * 1000)
+    assert cache.total_bytes == approximate_size("x" * 1000)
+    cache.delete("k")
+    assert cache.total_bytes == 0 and len(cache) == 0
+
+
+def test_expired_entries_removed_without_reading_them():
+    clock = Clock()
+    cache = QueryCache(ttl_seconds=10, clock=clock)
+    for i in range(1000):
+        cache.set(i, i)
+    cache.set("long", 1, ttl_seconds=100)
+
+    # 之后任意一次写入都会推进时间轮，过期条目不必被读取
+    clock.now += 11
+    cache.set("new", 1)
+    assert set(cache.cache) == {"long", "new"}
+    assert cache.expirations == 1000
+    assert cache.total_bytes == approximate_size(1) * 2
+
+    clock.now += 5000
+    assert cache.get("long") is None
+    assert len(cache) == 0 and cache.total_bytes == 0
+
+
+def test_timer_wheel_matches_deadlines():
+    rnd = random.Random(3)
+    wheel = TimerWheel(tick=0.5, slots=16)
+    deadlines = {}
+    now = 0.0
+    for _ in range(2000):
+        op = rnd.random()
+        if op < 0.5:
+            key = rnd.randrange(300)
+            # 到期时刻可能超过一圈（16 * 0.5 秒）
+            deadlines[key] = now + rnd.random() * 20
+            wheel.schedule(key, deadlines[key])
+        elif op < 0.6:
+            key = rnd.randrange(300)
+            deadlines.pop(key, None)
+            wheel.cancel(key)
+        else:
+            now += rnd.random() * (30 if rnd.random() < 0.05 else 1)
+            expired = set(wheel.advance(now))
+            # 精度为一格：不早于到期时刻，也不晚于到期后的一格
+            assert all(deadlines[key] <= now for key in expired)
+            assert not {key for key, at in deadlines.items() if at <= now - wheel.tick} - expired
+            for key in expired:
+                del deadlines[key]
+        assert len(wheel) == len(deadlines)
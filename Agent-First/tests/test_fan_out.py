@@ -0,0 +1,69 @@
+"""BranchManager.fork_many / map：并行场景与顺序执行结果一致"""
+
+import asyncio
+
+import pytest
+
+from storage.branch_manager import BranchManager
+
+
+async def _discount(branch, rate):
+    if rate < 0:
+        raise ValueError("折扣不能为负")
+    rows = branch.data_snapshot["orders"]
+    for i in range(0, 20):
+        row = rows[i]
+        await branch.update("orders", {**row, "price": row["price"] * (1 - rate)}, row=i)
+    result = await branch.query("SELECT SUM(price * qty) AS revenue FROM orders")
+    return result["data"][0]["revenue"]
+
+
+async def _manager():
+    manager = BranchManager()
+    await manager.get_branch("main").update_many(
+        "orders", [{"id": i, "price": 10.0, "qty": 1 + i % 3} for i in range(500)]
+    )
+    return manager
+
+
+def test_fork_many_shares_parent_snapshot():
+    async def run():
+        manager = await _manager()
+        main = manager.get_branch("main")
+        branches = await manager.fork_many("main", names=["a", "b", "c"])
+        assert [branch.name for branch in branches] == ["a", "b", "c"]
+        assert len({branch.id for branch in branches}) == 3
+        assert all(branch.data_snapshot is main.data_snapshot for branch in branches)
+        assert all(manager.get_branch(branch.id) is branch for branch in branches)
+
+    asyncio.run(run())
+
+
+@pytest.mark.parametrize("processes", [1, 2])
+def test_map_matches_sequential_execution(processes):
+    scenarios = [0.1, 0.2, -1, 0.3]
+
+    async def run():
+        manager = await _manager()
+        expected = []
+        for rate in scenarios:
+            branch = await manager.create_branch("main")
+            try:
+                expected.append(await _discount(branch, rate))
+            except ValueError:
+                expected.append(None)
+            finally:
+                await manager.rollback(branch.id)
+
+        results = await manager.map(_discount, scenarios, processes=processes)
+        assert [result["success"] for result in results] == [rate >= 0 for rate in scenarios]
+        assert [result.get("result") for result in results] == expected
+        assert "折扣不能为负" in results[2]["error"] and results[2]["branch_id"] is None
+
+        # 成功场景的修改保留为分支，父分支不变
+        kept = manager.get_branch(results[0]["branch_id"])
+        assert kept.data_snapshot["orders"][0]["price"] == pytest.approx(9.0)
+        assert manager.get_branch("main").data_snapshot["orders"][0]["price"] == 10.0
+        assert (await kept.query("SELECT SUM(price * qty) AS r FROM orders"))["data"][0]["r"] == expected[0]
+
+    asyncio.run(run())
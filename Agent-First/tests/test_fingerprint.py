@@ -0,0 +1,61 @@
+"""SQL 指纹：规范化后相同的查询得到相同的键"""
+
+import pytest
+
+from storage.fingerprint import fingerprint_sql
+
+
+def _digest(sql):
+    return fingerprint_sql(sql).digest
+
+
+def test_keyword_case_and_predicate_order_ignored():
+    assert _digest("SELECT a FROM t WHERE x = 1 AND y > 2") == \
+        _digest("select a from t where 2 < y and x=1")
+
+
+def test_identifier_case_preserved():
+    # 查询引擎区分大小写：Price 与 price 是不同的列，T 与 t 是不同的表
+    assert _digest("SELECT id FROM t WHERE Price > 5") != _digest("SELECT id FROM t WHERE price > 5")
+    assert _digest("SELECT id FROM T") != _digest("SELECT id FROM t")
+    assert fingerprint_sql("SELECT Price FROM t ORDER BY Price").query.order_by[0][0].name == "Price"
+
+
+@pytest.mark.parametrize("a, b", [
+    ("SELECT a FROM t WHERE x = 1 AND (y > 2 OR z < 3)", "SELECT a FROM t WHERE (3 > z OR y > 2) AND 1 = x"),
+    ("SELECT a FROM t WHERE x IN (3, 1, 2, 1)", "SELECT a FROM t WHERE x IN (1, 2, 3)"),
+    ("SELECT a FROM t WHERE NOT NOT x = 1", "SELECT a FROM t WHERE x = 1"),
+    ("SELECT g, COUNT(*) AS n FROM t GROUP BY g ORDER BY n DESC", "SELECT g, count(*) AS n FROM t GROUP BY g ORDER BY 2 DESC"),
+    ("SELECT a FROM t WHERE x = 1", "  select   a\nfrom t where x = 1 ;"),
+])
+def test_equivalent_queries_share_digest(a, b):
+    assert _digest(a) == _digest(b)
+
+
+@pytest.mark.parametrize("a, b", [
+    ("SELECT a FROM t WHERE x = 1", "SELECT a FROM t WHERE x = 2"),
+    ("SELECT a FROM t WHERE x = 1", "SELECT a FROM t WHERE x = '1'"),
+    ("SELECT a FROM t WHERE name = 'Bob'", "SELECT a FROM t WHERE name = 'bob'"),
+    ("SELECT a FROM t LIMIT 5", "SELECT a FROM t LIMIT 6"),
+    ("SELECT a FROM t WHERE x > 1", "SELECT a FROM t WHERE x >= 1"),
+    # 输出列名不同，结果的键不同
+    ("SELECT a AS b FROM t", "SELECT a FROM t"),
+])
+def test_different_queries_differ(a, b):
+    assert _digest(a) != _digest(b)
+
+
+def test_literals_become_params():
+    a = fingerprint_sql("SELECT a FROM t WHERE x = 1 AND y = 'k' LIMIT 10")
+    b = fingerprint_sql("SELECT a FROM t WHERE y = 'z' AND x = 7 LIMIT 3")
+    assert a.template == b.template and "?" in a.template
+    assert sorted(map(repr, a.params)) == sorted(map(repr, (1, "k", 10)))
+
+
+def test_lexical_fallback():
+    # 子集之外的语法退化为词法规范化：关键字大小写、常量占位
+    a = fingerprint_sql("SELECT a FROM t JOIN u ON t.id = u.id WHERE u.x = 1")
+    b = fingerprint_sql("select a from t join u on t.id = u.id where u.x = 2")
+    assert a.query is None and a.template == b.template and a.params != b.params
+    # 退化时保留表名前缀
+    assert _digest("SELECT a FROM t JOIN u ON t.x = u.y") != _digest("SELECT a FROM t JOIN u ON u.x = t.y")
@@ -0,0 +1,151 @@
+"""BranchManager.merge：两个方向反复合并"""
+
+import asyncio
+
+from storage.branch_manager import BranchManager
+
+
+async def _ids(branch):
+    result = await branch.query("SELECT id FROM t")
+    return sorted(row["id"] for row in result["data"])
+
+
+def test_round_trip_merges_do_not_duplicate_rows():
+    async def run():
+        manager = BranchManager()
+        main = manager.get_branch("main")
+        await main.update("t", {"id": 1})
+        d = await manager.create_branch("main", "d")
+        await d.update("t", {"id": 2})
+        await main.update("t", {"id": 99})
+
+        for _ in range(3):
+            await manager.merge("main", d.id)
+            await manager.merge(d.id, "main")
+            assert await _ids(main) == [1, 2, 99]
+            assert await _ids(d) == [1, 2, 99]
+
+        # 两侧继续写入后再来回合并
+        await main.update("t", {"id": 3})
+        await d.update("t", {"id": 4})
+        await manager.merge(d.id, "main")
+        await manager.merge("main", d.id)
+        assert await _ids(main) == [1, 2, 3, 4, 99]
+        assert await _ids(d) == [1, 2, 3, 4, 99]
+
+    asyncio.run(run())
+
+
+def test_merge_back_after_reverse_merge_keeps_unmerged_rows():
+    async def run():
+        manager = BranchManager()
+        main = manager.get_branch("main")
+        await main.update("t", {"id": 1})
+        d = await manager.create_branch("main", "d")
+        await d.update("t", {"id": 2})
+        await main.update("t", {"id": 99})
+
+        # main 先合并到 d，d 自己的行还没有合并出去
+        await manager.merge("main", d.id)
+        result = await manager.merge(d.id, "main")
+        assert result["applied_rows"] == 1
+        assert await _ids(main) == [1, 2, 99]
+
+    asyncio.run(run())
+
+
+def test_child_of_merged_branch_merges_back_once():
+    async def run():
+        manager = BranchManager()
+        main = manager.get_branch("main")
+        await main.update("t", {"id": 1})
+        d = await manager.create_branch("main", "d")
+        await main.update("t", {"id": 99})
+        await manager.merge("main", d.id)
+
+        child = await manager.create_branch(d.id, "child")
+        await child.update("t", {"id": 5})
+        await child.update("t", {"id": 55}, row=0)
+        result = await manager.merge(child.id, "main")
+        assert result["conflicts"] == []
+        assert await _ids(main) == [5, 55, 99]
+
+        await main.update("t", {"id": 7})
+        await manager.merge("main", child.id)
+        await manager.merge(child.id, "main")
+        assert await _ids(main) == [5, 7, 55, 99]
+        assert await _ids(child) == [5, 7, 55, 99]
+
+    asyncio.run(run())
+
+
+def test_sibling_merge_uses_earlier_fork():
+    async def run():
+        manager = BranchManager()
+        main = manager.get_branch("main")
+        await main.update("t", {"id": 1})
+        early = await manager.create_branch("main", "early")
+        await main.update("t", {"id": 2})
+        late = await manager.create_branch("main", "late")
+
+        # late 分叉时 main 已有的行 2 不在 early 中
+        await manager.merge(late.id, early.id)
+        assert await _ids(early) == [1, 2]
+        await manager.merge(early.id, late.id)
+        assert await _ids(late) == [1, 2]
+
+    asyncio.run(run())
+
+
+def test_source_write_during_merge_is_not_lost(tmp_path):
+    async def run():
+        # 开启 WAL 且有组提交窗口：合并等待落盘期间源分支上的写入
+        manager = BranchManager(log_dir=str(tmp_path), commit_delay=0.01)
+        main = manager.get_branch("main")
+        await main.update_many("t", [{"id": i} for i in range(3)])
+        a = await manager.create_branch("main", "a")
+        await a.update("t", {"id": 10})
+
+        await asyncio.gather(manager.merge(a.id, "main"), a.update("t", {"id": 11}))
+        assert await _ids(main) == [0, 1, 2, 10]
+
+        result = await manager.merge(a.id, "main")
+        assert result["applied_rows"] == 1
+        assert await _ids(main) == [0, 1, 2, 10, 11]
+        manager.close()
+
+        # 恢复后的合并基准与运行时一致
+        recovered = BranchManager(log_dir=str(tmp_path))
+        assert (await recovered.merge(a.id, "main"))["applied_rows"] == 0
+        assert await _ids(recovered.get_branch("main")) == [0, 1, 2, 10, 11]
+        recovered.close()
+
+    asyncio.run(run())
+
+
+def test_merge_through_third_branch_does_not_duplicate_rows():
+    async def run():
+        manager = BranchManager()
+        main = manager.get_branch("main")
+        await main.update("t", {"id": 1})
+        b = await manager.create_branch("main", "b")
+        c = await manager.create_branch("main", "c")
+        await b.update("t", {"id": 100})
+
+        # b 的行经 c 到达 main 之后，b -> main 不再追加
+        await manager.merge(b.id, c.id)
+        await manager.merge(c.id, "main")
+        result = await manager.merge(b.id, "main")
+        assert result["applied_rows"] == 0
+        assert await _ids(main) == [1, 100]
+
+        # 之后 b 对这一行的修改落到 main 中同一行，反方向同样不重复
+        await b.update("t", {"id": 101}, row=1)
+        await main.update("t", {"id": 2})
+        await manager.merge(b.id, "main")
+        assert await _ids(main) == [1, 2, 101]
+        await manager.merge("main", c.id)
+        await manager.merge(c.id, b.id)
+        assert await _ids(b) == [1, 2, 101]
+
+    asyncio.run(run())
@@ -0,0 +1,236 @@
+"""WAL 重放与检查点恢复"""
+
+import asyncio
+import os
+import pickle
+import subprocess
+import sys
+from pathlib import Path
+
+from storage.branch_manager import BranchManager
+from storage.persistent import PersistentMap, PersistentVector
+from storage.wal import WriteAheadLog
+
+
+PACKAGE_DIR = str(Path(__file__).resolve().parent.parent / "agent_first_agenticx")
+
+WRITE = """
+import asyncio, sys
+from storage.branch_manager import BranchManager
+
+async def main():
+    manager = BranchManager(log_dir=sys.argv[1])
+    main = manager.get_branch("main")
+    for i in range(3):
+        await main.update("sales", {"id": i, "region": "east" if i % 2 else "west", "amount": i * 10})
+    await main.update_many("stock", [{"sku": f"s{i}", "qty": i} for i in range(5)])
+    await main.create_view("by_region", "SELECT region, SUM(amount) AS total FROM sales GROUP BY region")
+    child = await manager.create_branch("main", "what-if")
+    await manager.checkpoint()
+    # 检查点之后的写入只在日志中
+    await main.update("sales", {"id": 3, "region": "north", "amount": 30})
+    await main.update("sales", {"id": 0, "region": "west", "amount": 5}, row=0)
+    await child.update("stock", {"sku": "s9", "qty": 9})
+    manager.close()
+
+asyncio.run(main())
+"""
+
+READ = """
+import asyncio, json, sys
+from storage.branch_manager import BranchManager
+
+async def main():
+    manager = BranchManager(log_dir=sys.argv[1])
+    main = manager.get_branch("main")
+    child = [b["id"] for b in manager.list_branches() if b["name"] == "what-if"][0]
+    result = {
+        "sales": (await main.query("SELECT id, region, amount FROM sales ORDER BY id"))["data"],
+        "stock": (await main.query("SELECT COUNT(*) AS n FROM stock"))["data"],
+        "child_stock": (await manager.get_branch(child).query("SELECT COUNT(*) AS n FROM stock"))["data"],
+        "view": (await main.query("SELECT region, SUM(amount) AS total FROM sales GROUP BY region"))["data"],
+        "version": main.version,
+    }
+    print(json.dumps(result, sort_keys=True, default=str))
+    manager.close()
+
+asyncio.run(main())
+"""
+
+
+def _run(script, log_dir, seed):
+    env = dict(os.environ, PYTHONHASHSEED=str(seed), PYTHONPATH=PACKAGE_DIR)
+    completed = subprocess.run(
+        [sys.executable, "-c", script, log_dir],
+        env=env, cwd=PACKAGE_DIR, capture_output=True, text=True, check=True
+    )
+    return completed.stdout
+
+
+def test_recover_checkpoint_and_wal_tail_in_new_process(tmp_path):
+    log_dir = str(tmp_path / "wal")
+    _run(WRITE, log_dir, seed=1)
+    # 哈希种子不同，模拟真实的进程重启
+    restored = __import__("json").loads(_run(READ, log_dir, seed=2))
+
+    assert restored["sales"] == [
+        {"id": 0, "region": "west", "amount": 5},
+        {"id": 1, "region": "east", "amount": 10},
+        {"id": 2, "region": "west", "amount": 20},
+        {"id": 3, "region": "north", "amount": 30},
+    ]
+    assert restored["stock"] == [{"n": 5}]
+    assert restored["child_stock"] == [{"n": 6}]
+    assert sorted(restored["view"], key=lambda row: row["region"]) == [
+        {"region": "east", "total": 10},
+        {"region": "north", "total": 30},
+        {"region": "west", "total": 25},
+    ]
+    assert restored["version"] == 7
+
+
+def test_recover_wal_only(tmp_path):
+    async def write():
+        manager = BranchManager(log_dir=str(tmp_path))
+        main = manager.get_branch("main")
+        await main.update("t", {"x": 1})
+        await main.update("t", {"x": 2})
+        manager.close()
+
+    async def read():
+        manager = BranchManager(log_dir=str(tmp_path))
+        result = await manager.get_branch("main").query("SELECT SUM(x) AS s FROM t")
+        manager.close()
+        return result["data"]
+
+    asyncio.run(write())
+    assert asyncio.run(read()) == [{"s": 3}]
+
+
+def test_persistent_map_pickle_rebuilds_from_items():
+    data = PersistentMap.from_dict({f"k{i}": i for i in range(100)}).set(("a", 1), "tuple")
+    restored = pickle.loads(pickle.dumps(data))
+    assert len(restored) == 101
+    assert restored["k42"] == 42
+    assert restored[("a", 1)] == "tuple"
+
+
+def test_torn_tail_record_is_dropped(tmp_path):
+    async def write():
+        manager = BranchManager(log_dir=str(tmp_path))
+        main = manager.get_branch("main")
+        await main.update("t", {"x": 1})
+        await main.update("t", {"x": 2})
+        manager.close()
+
+    asyncio.run(write())
+    # 模拟写到一半崩溃：最后一条记录只落盘了一部分
+    segment = max(tmp_path.glob("wal-*.log"))
+    data = segment.read_bytes()
+    segment.write_bytes(data[:-5])
+
+    async def read():
+        manager = BranchManager(log_dir=str(tmp_path))
+        main = manager.get_branch("main")
+        before = (await main.query("SELECT SUM(x) AS s FROM t"))["data"]
+        # 截断后继续写入的记录可以正常恢复
+        await main.update("t", {"x": 10})
+        manager.close()
+        return before
+
+    assert asyncio.run(read()) == [{"s": 1}]
+
+    async def reread():
+        manager = BranchManager(log_dir=str(tmp_path))
+        result = (await manager.get_branch("main").query("SELECT SUM(x) AS s FROM t"))["data"]
+        manager.close()
+        return result
+
+    assert asyncio.run(reread()) == [{"s": 11}]
+
+
+def test_merge_bases_survive_restart(tmp_path):
+    async def write():
+        manager = BranchManager(log_dir=str(tmp_path))
+        main = manager.get_branch("main")
+        await main.update("t", {"id": 1})
+        d = await manager.create_branch("main", "d")
+        await d.update("t", {"id": 2})
+        await manager.merge(d.id, "main")
+        await manager.checkpoint()
+        await main.update("t", {"id": 3})
+        await manager.merge("main", d.id)
+        manager.close()
+        return d.id
+
+    async def read(d_id):
+        manager = BranchManager(log_dir=str(tmp_path))
+        # 重启后继续来回合并，不会重复应用已合并的行
+        await manager.merge(d_id, "main")
+        await manager.merge("main", d_id)
+        result = {}
+        for branch_id in ("main", d_id):
+            rows = (await manager.get_branch(branch_id).query("SELECT id FROM t"))["data"]
+            result[branch_id] = sorted(row["id"] for row in rows)
+        manager.close()
+        return result
+
+    d_id = asyncio.run(write())
+    assert asyncio.run(read(d_id)) == {"main": [1, 2, 3], d_id: [1, 2, 3]}
+
+
+def test_checkpoint_during_batched_writes_does_not_replay_twice(tmp_path):
+    async def run():
+        manager = BranchManager(log_dir=str(tmp_path), commit_delay=0.01)
+        main = manager.get_branch("main")
+        await main.update_many("t", [{"id": i} for i in range(3)])
+
+        # 检查点与 fork_many / apply_operations（map 写回结果的路径）同时进行
+        forks, _ = await asyncio.gather(manager.fork_many("main", 2), manager.checkpoint())
+        await forks[0].update("t", {"id": 7})
+        operations = [{"type": "update", "table": "t", "data": {"id": 99}}]
+        await asyncio.gather(forks[1].apply_operations(operations), manager.checkpoint())
+        live = {branch.id: await _ids(branch) for branch in forks}
+        manager.close()
+
+        recovered = BranchManager(log_dir=str(tmp_path))
+        restored = {branch.id: await _ids(recovered.get_branch(branch.id)) for branch in forks}
+        recovered.close()
+        return live, restored
+
+    live, restored = asyncio.run(run())
+    assert live == restored
+    assert sorted(live.values()) == [[0, 1, 2, 7], [0, 1, 2, 99]]
+
+
+def test_update_many_is_one_log_record(tmp_path):
+    rows = [{"id": i, "cat": "abcd"[i % 4], "price": i * 0.5, "ok": i % 3 == 0} for i in range(5000)]
+    columns = {key: [row[key] for row in rows[2000:]] for key in rows[0]}
+
+    async def write():
+        manager = BranchManager(log_dir=str(tmp_path))
+        main = manager.get_branch("main")
+        await main.update_many("t", rows[:2000])
+        # 按列传入的批量追加同样只有一条操作
+        await main.update_many("t", columns)
+        await main.update("t", {"id": -1}, row=7)
+        assert len(main.operations) == 3 and main.version == 3
+        digests = main.table_digests()
+        manager.close()
+        return digests
+
+    digests = asyncio.run(write())
+    records = [record for record in WriteAheadLog(str(tmp_path)).read() if record["kind"] == "operation"]
+    assert [record["operation"]["type"] for record in records] == ["bulk_append", "bulk_append", "update"]
+
+    expected = rows[:7] + [{"id": -1}] + rows[8:]
+    assert PersistentVector.from_iterable(expected).digest() == digests["t"]
+    recovered = BranchManager(log_dir=str(tmp_path))
+    main = recovered.get_branch("main")
+    assert main.table_digests() == digests
+    assert main.data_snapshot["t"].to_list() == expected
+    recovered.close()
+
+
+async def _ids(branch):
+    return [row["id"] for row in (await branch.query("SELECT id FROM t"))["data"]]
@@ -0,0 +1,74 @@
+"""查询引擎：NULL 的三值逻辑、GROUP BY 中的别名和序号"""
+
+import pytest
+
+from storage.persistent import PersistentMap, PersistentVector
+from storage.query_engine import execute_query
+
+
+ROWS = [
+    {"id": 1, "p": "a", "x": 1},
+    {"id": 2, "p": "b", "x": 3},
+    {"id": 3, "p": None, "x": None},
+    # 缺失的列同样视为 NULL
+    {"id": 4, "x": 2},
+]
+SNAPSHOT = PersistentMap().set("t", PersistentVector.from_iterable(ROWS))
+
+
+def _ids(where):
+    result = execute_query(f"SELECT id FROM t WHERE {where} ORDER BY id", SNAPSHOT)
+    return [row["id"] for row in result.to_dict()["data"]]
+
+
+@pytest.mark.parametrize("where, expected", [
+    ("p != 'a'", [2]),
+    ("NOT p = 'a'", [2]),
+    ("NOT x < 2", [2, 4]),
+    ("p NOT IN ('a')", [2]),
+    ("x NOT BETWEEN 1 AND 2", [2]),
+    ("p NOT LIKE 'a%'", [2]),
+    ("NOT p < 'b'", [2]),
+    ("NOT x = NULL", []),
+])
+def test_negated_predicates_exclude_null(where, expected):
+    assert _ids(where) == expected
+
+
+@pytest.mark.parametrize("where, expected", [
+    # UNKNOWN OR TRUE 为 TRUE，UNKNOWN AND FALSE 为 FALSE
+    ("NOT (p = 'a' OR x = 3)", []),
+    ("NOT (p = 'a' AND x = 3)", [1, 2, 4]),
+    ("NOT (x > 1 AND p = 'zz')", [1, 2]),
+    ("p = 'a' OR x IS NULL", [1, 3]),
+    # 列表中有 NULL：没有匹配的值为 UNKNOWN
+    ("p IN ('a', NULL)", [1]),
+    ("p NOT IN ('b', NULL)", []),
+    ("NOT p IS NULL", [1, 2]),
+])
+def test_three_valued_logic(where, expected):
+    assert _ids(where) == expected
+
+
+def test_having_negation():
+    result = execute_query("SELECT p, COUNT(*) AS n FROM t GROUP BY p HAVING NOT COUNT(*) > 1 ORDER BY p", SNAPSHOT)
+    assert result.to_dict()["data"] == [{"p": "a", "n": 1}, {"p": "b", "n": 1}]
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT x % 2 AS parity, COUNT(*) AS n FROM t WHERE x IS NOT NULL GROUP BY parity ORDER BY parity",
+    "SELECT x % 2 AS parity, COUNT(*) AS n FROM t WHERE x IS NOT NULL GROUP BY 1 ORDER BY 1",
+    "SELECT x % 2 AS parity, COUNT(*) AS n FROM t WHERE x IS NOT NULL GROUP BY x % 2 ORDER BY parity",
+])
+def test_group_by_alias_and_ordinal(sql):
+    result = execute_query(sql, SNAPSHOT)
+    assert result.to_dict()["data"] == [{"parity": 0, "n": 1}, {"parity": 1, "n": 2}]
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT p, COUNT(*) AS n FROM t GROUP BY 3",
+    "SELECT p, COUNT(*) AS n FROM t GROUP BY n",
+])
+def test_group_by_rejects_bad_reference(sql):
+    with pytest.raises(ValueError, match="GROUP BY"):
+        execute_query(sql, SNAPSHOT)
@@ -0,0 +1,153 @@
+"""RedundancyDetector：MinHash/LSH 候选与精确相似度的对比，滑动窗口冗余率"""
+
+import random
+from difflib import SequenceMatcher
+
+import pytest
+
+pytest.importorskip("agenticx")
+
+from memory.minhash import MinHashLSH, char_shingles, normalize, word_shingles
+from memory.redundancy import RedundancyDetector
+
+
+TABLES = ["users", "orders", "products", "events", "payments", "sessions", "inventory", "reviews"]
+COLUMNS = ["id", "name", "created_at", "amount", "status", "region", "price", "user_id", "country"]
+VERBS = ["show", "count", "list", "find", "get", "sum of", "average"]
+
+
+def _query(rnd):
+    if rnd.random() < 0.3:
+        return (f"统计{rnd.choice(['最近7天', '上个月', '今年', '昨天'])}{rnd.choice(['华东', '华北', '华南'])}"
+                f"区域{rnd.choice(['销售额', '订单数', '用户数', '退款率'])}的变化趋势")
+    return (f"{rnd.choice(VERBS)} {rnd.choice(COLUMNS)} from {rnd.choice(TABLES)} "
+            f"where {rnd.choice(COLUMNS)} > {rnd.randint(0, 100)} group by {rnd.choice(COLUMNS)}")
+
+
+def _mutate(rnd, text):
+    chars = list(text)
+    for _ in range(rnd.randint(0, 4)):
+        i = rnd.randrange(len(chars))
+        op = rnd.random()
+        if op < 0.4:
+            chars[i] = rnd.choice("abcdefghij ")
+        elif op < 0.7:
+            del chars[i]
+        else:
+            chars.insert(i, rnd.choice("xyz"))
+    return "".join(chars)
+
+
+def _jaccard(a, b):
+    return len(a & b) / len(a | b)
+
+
+def test_minhash_estimates_jaccard():
+    rnd = random.Random(1)
+    index = MinHashLSH(num_perm=128, bands=32)
+    errors = []
+    for i in range(200):
+        a = char_shingles(normalize(_query(rnd)))
+        b = char_shingles(normalize(_mutate(rnd, _query(rnd) if i % 2 else " ".join(sorted(a)))))
+        index.insert(i, b)
+        errors.append(abs(index.jaccard(a, i) - _jaccard(a, b)))
+    # 128 个哈希的估计标准差不超过 0.045
+    assert sum(errors) / len(errors) < 0.05
+
+
+def test_lsh_recall_against_exact_jaccard():
+    rnd = random.Random(2)
+    docs = [char_shingles(normalize(_mutate(rnd, _query(rnd)))) for _ in range(1000)]
+    index = MinHashLSH(num_perm=64, bands=32)
+    for i, shingles in enumerate(docs):
+        index.insert(i, shingles)
+
+    found = expected = 0
+    for _ in range(50):
+        probe = char_shingles(normalize(_mutate(rnd, _query(rnd))))
+        # 每段 2 行：Jaccard 0.5 成为候选的概率约 1 - (1 - 0.25)^32
+        exact = {i for i, shingles in enumerate(docs) if _jaccard(probe, shingles) >= 0.5}
+        candidates = index.query(probe)
+        found += len(exact & candidates)
+        expected += len(exact)
+    assert expected > 0
+    assert found / expected > 0.99
+
+    assert index.remove(0) and 0 not in index and not index.remove(0)
+    assert 0 not in index.query(docs[0])
+
+
+def test_find_similar_matches_brute_force():
+    rnd = random.Random(7)
+    base = [_query(rnd) for _ in range(200)]
+    history = [_mutate(rnd, rnd.choice(base)) if rnd.random() < 0.6 else rnd.choice(base) for _ in range(600)]
+    detector = RedundancyDetector(0.8)
+    for query in history:
+        detector.add_query(query)
+
+    found = expected = 0
+    for _ in range(30):
+        probe = _mutate(rnd, rnd.choice(base))
+        result = detector.find_similar(probe)
+        exact = {query for query in set(history)
+                 if SequenceMatcher(None, probe.lower(), query.lower()).ratio() >= 0.8}
+        # 只会漏掉，不会误报；出现多次的查询按次数列出
+        got = {query for query, _ in result}
+        assert got <= exact
+        assert len(result) == sum(history.count(query) for query in got)
+        assert [score for _, score in result] == sorted((score for _, score in result), reverse=True)
+        found += len(got)
+        expected += len(exact)
+    assert found / expected > 0.95
+
+
+def test_word_shingles_tolerate_reordering():
+    a = word_shingles(normalize("count orders by region last week"))
+    b = word_shingles(normalize("last week count orders by region"))
+    assert _jaccard(a, b) > 0.5
+    with pytest.raises(ValueError):
+        MinHashLSH(num_perm=64, bands=5)
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_windowed_rates_match_recount():
+    rnd = random.Random(1)
+    words = ["users", "orders", "count", "show", "sum", "region", "by", "from", "last", "week", "top"]
+    queries = [" ".join(rnd.choice(words) for _ in range(rnd.randint(2, 5))) for _ in range(400)]
+    queries = [query.upper() if rnd.random() < 0.1 else query for query in queries]
+    clock = Clock()
+    detector = RedundancyDetector(0.8, window_size=50, window_seconds=10, clock=clock)
+
+    flags = []
+    for i, query in enumerate(queries):
+        clock.now += 0.5
+        flags.append(detector.add_query(query))
+        if i % 37 == 0:
+            # 每次读取都与按定义重新统计的结果一致
+            assert detector.get_redundancy_rate() == pytest.approx(sum(flags) / len(flags))
+            recent = flags[-50:]
+            assert detector.get_redundancy_rate("count") == pytest.approx(sum(recent) / len(recent))
+            timed = flags[-20:]
+            assert detector.get_redundancy_rate("time") == pytest.approx(sum(timed) / len(timed))
+
+    # 判定与按历史精确比较的结果基本一致（LSH 可能漏掉极少数）
+    exact = [any(SequenceMatcher(None, query.lower(), other.lower()).ratio() >= 0.8 for other in queries[:i])
+             for i, query in enumerate(queries)]
+    assert sum(a != b for a, b in zip(flags, exact)) <= 2
+
+    stats = detector.get_stats()
+    assert (stats["total_queries"], stats["window_queries"], stats["recent_queries"]) == (400, 50, 20)
+
+    # 时间窗口内没有查询
+    clock.now += 100
+    assert detector.get_redundancy_rate("time") == 0.0
+    assert detector.get_redundancy_rate("count") == pytest.approx(sum(flags[-50:]) / 50)
+    with pytest.raises(ValueError):
+        detector.get_redundancy_rate("day")
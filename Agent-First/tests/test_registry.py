@@ -0,0 +1,101 @@
+"""分支注册表：多线程并发分叉时 ID 唯一、登记完整，恢复后继续编号"""
+
+import asyncio
+import sys
+import threading
+
+import pytest
+
+from storage.branch_manager import BranchManager
+from storage.registry import BranchRegistry
+
+
+@pytest.fixture
+def fast_switching():
+    # 频繁切换线程，放大竞争窗口
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    yield
+    sys.setswitchinterval(interval)
+
+
+def _run_threads(target, args_list):
+    threads = [threading.Thread(target=target, args=args) for args in args_list]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def test_concurrent_forks_from_threads(fast_switching):
+    manager = BranchManager()
+    asyncio.run(manager.get_branch("main").update_many("t", [{"a": i} for i in range(3000)]))
+    root = manager.get_branch("main").data_snapshot
+    base = manager.cow_engine.reference_counts[id(root)]
+    results = []
+
+    def fork(count):
+        async def run():
+            ids = []
+            for _ in range(count):
+                branch = await manager.create_branch("main")
+                assert manager.get_branch(branch.id) is branch
+                ids.append(branch.id)
+            ids += [branch.id for branch in await manager.fork_many("main", count)]
+            return ids
+        results.append(asyncio.run(run()))
+
+    _run_threads(fork, [(300,)] * 8)
+    ids = [branch_id for result in results for branch_id in result]
+    assert len(set(ids)) == len(ids) == 4800
+    assert len(manager.branches) == 4801 and manager.branch_counter == 4800
+    # 每个分支的基准快照和当前快照各持有一次
+    assert manager.cow_engine.reference_counts[id(root)] == base + 2 * 4800
+
+    def rollback(branch_ids):
+        async def run():
+            for branch_id in branch_ids:
+                await manager.rollback(branch_id)
+        asyncio.run(run())
+
+    _run_threads(rollback, [(ids[k::8],) for k in range(8)])
+    assert list(manager.branches) == ["main"]
+    assert manager.cow_engine.reference_counts[id(root)] == base
+
+
+def test_gathered_forks_get_distinct_ids():
+    async def run():
+        manager = BranchManager()
+        branches = await asyncio.gather(*(manager.create_branch() for _ in range(500)))
+        assert len({branch.id for branch in branches}) == 500
+
+    asyncio.run(run())
+
+
+def test_counter_survives_recovery(tmp_path):
+    async def run():
+        manager = BranchManager(log_dir=str(tmp_path))
+        await manager.fork_many("main", 5)
+        last = await manager.create_branch()
+        manager.close()
+
+        recovered = BranchManager(log_dir=str(tmp_path))
+        assert last.id in recovered.branches and recovered.branch_counter == 6
+        assert (await recovered.create_branch()).id == "branch_7"
+        recovered.close()
+
+    asyncio.run(run())
+
+
+def test_registry_validation():
+    with pytest.raises(ValueError):
+        BranchRegistry(3)
+    registry = BranchRegistry(4)
+    registry.add("x", 1)
+    with pytest.raises(ValueError):
+        registry.add("x", 2)
+    with pytest.raises(ValueError):
+        registry.add_many([("y", 1), ("x", 3)])
+    assert registry.allocate(3) == 1 and registry.allocate() == 4
+    registry.advance(10)
+    assert registry.allocate() == 11
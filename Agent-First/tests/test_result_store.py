@@ -0,0 +1,62 @@
+"""ResultStore：结果写入与读取往返、按块去重、惰性读取与回收"""
+
+import pytest
+
+pytest.importorskip("agenticx")
+
+from memory.result_store import ResultStore
+
+
+def _rows(count, offset=0):
+    return [{"id": i, "region": "abcd"[i % 4], "amount": i * 0.5, "note": None if i % 7 else "x"}
+            for i in range(offset, offset + count)]
+
+
+@pytest.mark.parametrize("rows", [
+    _rows(2500),
+    [],
+    # 键不一致的行、嵌套值
+    [{"id": 1}, {"id": 2, "tags": ["a", "b"]}, {"x": {"y": (1, 2)}}],
+])
+def test_put_open_round_trip(tmp_path, rows):
+    store = ResultStore(str(tmp_path), chunk_rows=1000)
+    ref = store.put(iter(rows))
+    result = store.open(ref)
+    assert len(result) == len(rows)
+    assert result.to_list() == rows
+    assert result.columns == (list(rows[0]) if rows else [])
+    # 新打开的存储读取同一目录
+    assert ResultStore(str(tmp_path)).open(ref).to_list() == rows
+
+
+def test_identical_content_stored_once(tmp_path):
+    store = ResultStore(str(tmp_path), chunk_rows=1000)
+    first = store.put(_rows(2500))
+    objects = store.get_stats()["objects"]
+
+    assert store.put(_rows(2500)) == first
+    assert store.get_stats()["objects"] == objects and store.deduplicated == 4
+
+    # 前两块相同，只写出新的末块和清单
+    second = store.put(_rows(2000) + _rows(10, offset=5000))
+    assert second != first
+    assert store.get_stats()["objects"] == objects + 2
+
+
+def test_head_reads_only_needed_chunks(tmp_path):
+    store = ResultStore(str(tmp_path), chunk_rows=100)
+    result = store.open(store.put(_rows(1000)))
+    reads = store.reads
+    assert result.head(150) == _rows(150)
+    assert store.reads - reads == 2
+
+
+def test_gc_keeps_live_results(tmp_path):
+    store = ResultStore(str(tmp_path), chunk_rows=1000)
+    live = store.put(_rows(2500))
+    dead = store.put(_rows(1500, offset=10000))
+    assert store.open("0" * 40) is None
+
+    assert store.gc([live]) == 3
+    assert store.open(dead) is None
+    assert store.open(live).to_list() == _rows(2500)
@@ -0,0 +1,91 @@
+"""共享内存导出：挂载的快照与原快照一致，重新导出只写出变化的页"""
+
+import asyncio
+import multiprocessing
+import os
+import random
+from concurrent.futures import ProcessPoolExecutor
+
+from storage import shared as shm
+from storage.branch_manager import BranchManager
+from storage.query_engine import execute_query
+
+
+SQL = "SELECT s, COUNT(*) AS n, SUM(p) AS sp, MIN(q) AS lo, MAX(b) AS hi FROM t WHERE q > 2 GROUP BY s ORDER BY s"
+
+
+def _query_attached(shared):
+    snapshot = shm.attach(shared)
+    return execute_query(SQL, snapshot).to_dict()["data"], snapshot["t"][7], len(snapshot["t"])
+
+
+async def _filled(manager):
+    rnd = random.Random(3)
+    rows = [{
+        "s": rnd.choice(["a", "b", "c", None]),
+        "p": rnd.random(),
+        "q": rnd.randrange(10),
+        "b": rnd.random() < 0.5,
+        "o": rnd.choice([None, 1, "x"]),
+    } for _ in range(20000)]
+    # 缺列的行
+    rows[7] = {"s": "a", "p": None}
+    main = manager.get_branch("main")
+    await main.apply_changes({"t": {"appends": rows}, "other": {"appends": [1, 2, 3]}})
+    return main
+
+
+def test_attached_snapshot_matches_branch():
+    async def run():
+        manager = BranchManager()
+        main = await _filled(manager)
+        shared = manager.export_branch("main")
+
+        snapshot = shm.attach(shared)
+        assert snapshot["t"].to_list() == main.data_snapshot["t"].to_list()
+        assert snapshot["other"].to_list() == [1, 2, 3]
+        assert snapshot["t"].digest() == main.data_snapshot["t"].digest()
+        assert execute_query(SQL, snapshot).to_dict() == execute_query(SQL, main.data_snapshot).to_dict()
+
+        # 在挂载的快照上写入照常路径复制，不影响映射的页
+        vector = snapshot["t"].set(3, {"s": "q"}).append({"s": "new"})
+        assert vector[3] == {"s": "q"} and vector[-1] == {"s": "new"}
+        assert snapshot["t"][3] == main.data_snapshot["t"][3]
+
+        # 以 spawn 启动的进程只拿到导出描述，挂载后读取
+        with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context("spawn")) as pool:
+            data, row, count = pool.submit(_query_attached, shared).result()
+        assert data == execute_query(SQL, main.data_snapshot).to_dict()["data"]
+        assert row == {"s": "a", "p": None}
+        assert count == 20000
+
+        directory = shared.directory
+        manager.close()
+        assert not os.path.exists(directory)
+
+    asyncio.run(run())
+
+
+def test_reexport_writes_only_changed_pages():
+    async def run():
+        manager = BranchManager()
+        main = await _filled(manager)
+        first = manager.export_branch("main")
+        exported = manager.get_stats()["shared_memory"]["exported_bytes"]
+
+        await main.update("t", {"s": "a", "p": 0.0, "q": 1}, row=12345)
+        second = manager.export_branch("main")
+        added = manager.get_stats()["shared_memory"]["exported_bytes"] - exported
+        assert 0 < added < exported // 4
+        changed = set(second.chunks()) - set(first.chunks())
+        assert len(changed) == 1
+
+        # 释放旧导出后只留下新导出引用的页文件
+        manager.release_export(first)
+        assert sorted(os.listdir(second.directory)) == sorted(set(second.chunks()))
+        snapshot = shm.attach(second)
+        assert snapshot["t"][12345] == {"s": "a", "p": 0.0, "q": 1}
+        assert snapshot["t"].to_list() == main.data_snapshot["t"].to_list()
+        manager.close()
+
+    asyncio.run(run())
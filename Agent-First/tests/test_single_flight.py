@@ -0,0 +1,101 @@
+"""SingleFlight：同一键的并发调用只执行一次，异常和取消的传播"""
+
+import asyncio
+
+import pytest
+
+pytest.importorskip("pydantic")
+pytest.importorskip("agenticx")
+
+from probes.single_flight import SingleFlight, probe_key
+
+
+def test_concurrent_callers_share_one_execution():
+    async def run():
+        flight = SingleFlight()
+        calls = []
+
+        async def work():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return {"rows": [1, 2, 3]}
+
+        results = await asyncio.gather(*(flight.do("k", work) for _ in range(50)))
+        assert len(calls) == 1
+        assert all(value == {"rows": [1, 2, 3]} for value, _ in results)
+        assert [shared for _, shared in results].count(False) == 1
+        assert flight.get_stats() == {"in_flight": 0, "executions": 1, "coalesced": 49}
+
+        # 执行结束后键被移除，之后的调用重新执行
+        await flight.do("k", work)
+        assert len(calls) == 2
+
+    asyncio.run(run())
+
+
+def test_distinct_keys_run_separately():
+    async def run():
+        flight = SingleFlight()
+
+        async def work(key):
+            await asyncio.sleep(0.01)
+            return key
+
+        results = await asyncio.gather(*(flight.do(i % 3, lambda i=i: work(i % 3)) for i in range(9)))
+        assert [value for value, _ in results] == [i % 3 for i in range(9)]
+        assert flight.executions == 3 and flight.coalesced == 6
+
+    asyncio.run(run())
+
+
+def test_error_propagates_to_every_caller():
+    async def run():
+        flight = SingleFlight()
+        calls = []
+
+        async def fail():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            raise ValueError("boom")
+
+        results = await asyncio.gather(*(flight.do("k", fail) for _ in range(10)), return_exceptions=True)
+        assert len(calls) == 1
+        assert all(isinstance(error, ValueError) and str(error) == "boom" for error in results)
+        assert len(flight) == 0
+
+    asyncio.run(run())
+
+
+def test_cancelled_caller_does_not_cancel_others():
+    async def run():
+        flight = SingleFlight()
+        started = asyncio.Event()
+
+        async def work():
+            started.set()
+            await asyncio.sleep(0.02)
+            return 42
+
+        first = asyncio.ensure_future(flight.do("k", work))
+        second = asyncio.ensure_future(flight.do("k", work))
+        await started.wait()
+        first.cancel()
+        assert await second == (42, True)
+        with pytest.raises(asyncio.CancelledError):
+            await first
+
+        # 所有调用方都取消后执行本身被取消，之后的调用重新执行
+        only = asyncio.ensure_future(flight.do("j", work))
+        await asyncio.sleep(0)
+        only.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await only
+        assert len(flight) == 0
+        assert await flight.do("j", work) == (42, False)
+
+    asyncio.run(run())
+
+
+def test_probe_key_normalizes_text_only():
+    assert probe_key("  Total  SALES ", "s", "p") == probe_key("total sales", "s", "p")
+    assert probe_key("total sales", "s", "p") != probe_key("total sales", "s", "q")
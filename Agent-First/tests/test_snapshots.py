@@ -0,0 +1,75 @@
+"""持久化快照：结构共享的向量 / 映射与分支隔离"""
+
+import asyncio
+import random
+
+from storage.branch_manager import BranchManager
+from storage.persistent import PersistentMap, PersistentVector
+
+
+def test_vector_matches_list_model_and_keeps_old_versions():
+    rnd = random.Random(1)
+    vector, model = PersistentVector(), []
+    versions = []
+    for i in range(5000):
+        if model and rnd.random() < 0.3:
+            j = rnd.randrange(len(model))
+            vector, model[j] = vector.set(j, i), i
+        else:
+            vector = vector.append(i)
+            model.append(i)
+        if i % 500 == 0:
+            versions.append((vector, list(model)))
+
+    assert list(vector) == model and len(vector) == len(model)
+    assert vector[-1] == model[-1] and vector[5:9] == model[5:9]
+    for old, expected in versions:
+        assert list(old) == expected
+
+
+def test_map_matches_dict_model_with_hash_collisions():
+    class Key:
+        def __init__(self, k):
+            self.k = k
+
+        def __hash__(self):
+            return self.k % 7
+
+        def __eq__(self, other):
+            return self.k == other.k
+
+    rnd = random.Random(2)
+    mapping, model = PersistentMap(), {}
+    for _ in range(3000):
+        key = Key(rnd.randrange(300))
+        if rnd.random() < 0.3:
+            mapping = mapping.delete(key)
+            model.pop(key, None)
+        else:
+            mapping = mapping.set(key, key.k * 2)
+            model[key] = key.k * 2
+        assert len(mapping) == len(model)
+    assert dict(mapping.items()) == model
+
+
+def test_branch_writes_are_isolated_and_share_untouched_pages():
+    async def run():
+        manager = BranchManager()
+        main = manager.get_branch("main")
+        await main.update_many("t", [{"id": i} for i in range(5000)])
+        child = await manager.create_branch("main", "child")
+        # 分叉只共享父分支的快照
+        assert child.data_snapshot is main.data_snapshot
+
+        await child.update("t", {"id": -1}, row=10)
+        await child.update("t", {"id": 5000})
+        assert len(main.data_snapshot["t"]) == 5000 and main.data_snapshot["t"][10] == {"id": 10}
+        assert child.data_snapshot["t"][10] == {"id": -1} and len(child.data_snapshot["t"]) == 5001
+
+        parent_pages = list(main.data_snapshot["t"].pages())
+        child_pages = list(child.data_snapshot["t"].pages())
+        shared = sum(a is b for a, b in zip(parent_pages, child_pages))
+        # 只有被写入的页和末页被复制
+        assert shared >= len(parent_pages) - 2
+
+    asyncio.run(run())
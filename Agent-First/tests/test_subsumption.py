@@ -0,0 +1,132 @@
+"""derive_query：能由缓存结果算出的查询与直接执行的结果一致，不能算出的返回 None"""
+
+import math
+import random
+
+import pytest
+
+from storage.fingerprint import fingerprint_sql
+from storage.persistent import PersistentMap, PersistentVector
+from storage.query_engine import execute_query
+from storage.subsumption import derive_query, derive_result
+
+
+_rnd = random.Random(0)
+ROWS = [{
+    "id": i,
+    "region": _rnd.choice("abcd"),
+    "product": _rnd.choice("xyz"),
+    "sales": _rnd.randint(1, 100),
+    "qty": _rnd.choice([None, 1, 2, 3]),
+} for i in range(3000)]
+SNAPSHOT = PersistentMap().set("orders", PersistentVector.from_iterable(ROWS))
+
+
+def _run(sql):
+    return execute_query(sql, SNAPSHOT).to_dict()["data"]
+
+
+def _derive(cached_sql, new_sql):
+    rows = _run(cached_sql)
+    query = derive_query(fingerprint_sql(cached_sql), fingerprint_sql(new_sql), len(rows), list(rows[0]) if rows else [])
+    return query, rows
+
+
+def _same(got, want):
+    # 再聚合的浮点和与直接计算的求和顺序不同
+    assert len(got) == len(want)
+    for a, b in zip(got, want):
+        assert a.keys() == b.keys()
+        for key in a:
+            if isinstance(a[key], float) or isinstance(b[key], float):
+                assert math.isclose(a[key], b[key], rel_tol=1e-9)
+            else:
+                assert a[key] == b[key]
+
+
+@pytest.mark.parametrize("cached_sql, new_sql", [
+    # 更严格的条件在缓存的行上过滤
+    ("SELECT * FROM orders WHERE sales > 10",
+     "SELECT id, region FROM orders WHERE sales > 50 AND product = 'x' ORDER BY id DESC LIMIT 7"),
+    ("SELECT * FROM orders WHERE sales BETWEEN 10 AND 90",
+     "SELECT id FROM orders WHERE sales > 20 AND sales < 40 AND qty IS NOT NULL ORDER BY id"),
+    ("SELECT * FROM orders WHERE product != 'z'", "SELECT id FROM orders WHERE product IN ('x', 'y') ORDER BY id"),
+    ("SELECT id, sales * 2 AS d FROM orders", "SELECT id, sales * 2 FROM orders WHERE sales * 2 > 100 ORDER BY id"),
+    # 分组相同：过滤缓存的组
+    ("SELECT region, SUM(sales) AS s FROM orders GROUP BY region",
+     "SELECT region, SUM(sales) FROM orders GROUP BY region HAVING SUM(sales) > 10000 ORDER BY 2 LIMIT 2"),
+    # 在缓存的行上聚合
+    ("SELECT * FROM orders WHERE region IN ('a', 'b')",
+     "SELECT region, COUNT(*) AS n, AVG(sales) AS a FROM orders WHERE region = 'a' GROUP BY region"),
+    # 更粗的分组：SUM / COUNT / AVG / MIN / MAX 再聚合
+    ("SELECT region, product, COUNT(*) AS n, SUM(sales) AS s, COUNT(sales) AS c, MIN(sales) AS lo, MAX(qty) AS hi "
+     "FROM orders GROUP BY region, product",
+     "SELECT region, COUNT(*) AS n, SUM(sales) AS total, AVG(sales) AS a, MIN(sales) AS lo, MAX(qty) AS hi "
+     "FROM orders GROUP BY region HAVING SUM(sales) > 10 ORDER BY total DESC"),
+    ("SELECT region, product, COUNT(*) AS n FROM orders GROUP BY region, product",
+     "SELECT COUNT(*) AS n FROM orders WHERE product = 'x'"),
+    # 截断的结果：排序相同时取更靠前的一段
+    ("SELECT id, sales FROM orders ORDER BY sales DESC, id LIMIT 100",
+     "SELECT id, sales FROM orders ORDER BY sales DESC, id LIMIT 10 OFFSET 5"),
+])
+def test_derived_result_matches_direct_execution(cached_sql, new_sql):
+    query, rows = _derive(cached_sql, new_sql)
+    assert query is not None
+    _same(derive_result(query, rows).to_dict()["data"], _run(new_sql))
+
+
+@pytest.mark.parametrize("cached_sql, new_sql", [
+    # 条件更宽
+    ("SELECT * FROM orders WHERE sales > 10", "SELECT * FROM orders WHERE sales >= 10"),
+    ("SELECT * FROM orders WHERE sales BETWEEN 10 AND 90", "SELECT id FROM orders WHERE sales > 5"),
+    # 多出的条件用到缓存结果中没有的列
+    ("SELECT id, region FROM orders WHERE sales > 10", "SELECT id, region FROM orders WHERE sales > 10 AND qty = 1"),
+    ("SELECT region, product, COUNT(*) AS n FROM orders GROUP BY region, product",
+     "SELECT product, COUNT(*) FROM orders WHERE sales > 5 GROUP BY product"),
+    # HAVING 与缓存的不一致
+    ("SELECT region, SUM(sales) AS s FROM orders GROUP BY region HAVING SUM(sales) > 10000",
+     "SELECT region, SUM(sales) AS s FROM orders GROUP BY region HAVING SUM(sales) > 100"),
+    ("SELECT region, product, SUM(sales) AS s FROM orders GROUP BY region, product HAVING SUM(sales) > 10",
+     "SELECT region, SUM(sales) AS s FROM orders GROUP BY region"),
+    # DISTINCT 聚合不能再聚合
+    ("SELECT region, product, COUNT(DISTINCT qty) AS n FROM orders GROUP BY region, product",
+     "SELECT region, COUNT(DISTINCT qty) FROM orders GROUP BY region"),
+    # 截断的结果：超出缓存的范围、没有排序、排序不同
+    ("SELECT id, sales FROM orders ORDER BY sales DESC, id LIMIT 100",
+     "SELECT id, sales FROM orders ORDER BY sales DESC, id LIMIT 200"),
+    ("SELECT id, sales FROM orders LIMIT 100", "SELECT id, sales FROM orders LIMIT 10"),
+    ("SELECT id, sales FROM orders ORDER BY sales DESC, id LIMIT 100",
+     "SELECT id, sales FROM orders WHERE sales > 50 ORDER BY sales DESC, id LIMIT 10"),
+    # 不同的表
+    ("SELECT * FROM orders", "SELECT * FROM Orders"),
+])
+def test_not_derivable(cached_sql, new_sql):
+    assert _derive(cached_sql, new_sql)[0] is None
+
+
+def test_random_range_predicates():
+    rnd = random.Random(1)
+    ops = [">", ">=", "<", "<=", "=", "!="]
+
+    def predicate():
+        k = rnd.random()
+        if k < 0.5:
+            return f"sales {rnd.choice(ops)} {rnd.randint(0, 100)}"
+        if k < 0.7:
+            low = rnd.randint(0, 100)
+            return f"sales BETWEEN {low} AND {low + rnd.randint(0, 50)}"
+        if k < 0.85:
+            return "sales IN (" + ", ".join(str(rnd.randint(0, 100)) for _ in range(rnd.randint(1, 5))) + ")"
+        return f"{rnd.randint(0, 100)} < sales"
+
+    derived = 0
+    for _ in range(300):
+        cached_sql = "SELECT * FROM orders WHERE " + " AND ".join(predicate() for _ in range(rnd.randint(1, 2)))
+        new_sql = "SELECT id FROM orders WHERE " + " AND ".join(predicate() for _ in range(rnd.randint(1, 3)))
+        query, rows = _derive(cached_sql, new_sql)
+        if query is None:
+            continue
+        derived += 1
+        got = sorted(row["id"] for row in derive_result(query, rows).to_dict()["data"])
+        assert got == sorted(row["id"] for row in _run(new_sql)), (cached_sql, new_sql)
+    assert derived > 30
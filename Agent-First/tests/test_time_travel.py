@@ -0,0 +1,97 @@
+"""时间旅行查询：按版本号或时间点读取历史快照，保留的版本数受 max_versions 限制"""
+
+import asyncio
+import random
+import time
+from datetime import datetime
+
+import pytest
+
+from storage.branch_manager import BranchManager
+
+
+SQL = "SELECT g, COUNT(*) AS n, SUM(v) AS s, MAX(v) AS m FROM t GROUP BY g ORDER BY g"
+
+
+async def _history(manager, updates):
+    """写入后记录每个版本的全表内容、聚合结果和写入之后的时间点"""
+    rnd = random.Random(0)
+    main = manager.get_branch("main")
+    await main.update_many("t", [{"g": i % 5, "v": i} for i in range(500)])
+    await main.create_view("v", SQL)
+    states = {main.version: ((await main.query("SELECT * FROM t"))["data"], (await main.query(SQL))["data"])}
+    times = {}
+    for _ in range(updates):
+        await main.update("t", {"g": rnd.randrange(7), "v": rnd.randrange(1000)}, row=rnd.randrange(500))
+        states[main.version] = ((await main.query("SELECT * FROM t"))["data"], (await main.query(SQL))["data"])
+        times[main.version] = datetime.now()
+        time.sleep(0.001)
+    return main, states, times
+
+
+def test_query_as_of_version_and_time():
+    async def run():
+        manager = BranchManager(max_versions=None)
+        main, states, times = await _history(manager, 30)
+
+        for seq, (rows, aggregated) in states.items():
+            result = await main.query("SELECT * FROM t", as_of=seq)
+            assert result["version"] == seq
+            assert result["data"] == rows
+            # 视图的历史状态与表一起保留
+            assert (await main.query(SQL, as_of=seq))["data"] == aggregated
+        for seq, moment in times.items():
+            assert (await main.query("SELECT COUNT(*) AS n FROM t", as_of=moment))["version"] == seq
+
+        # 恢复到旧版本记为新的版本，之后的版本仍可读取
+        latest = main.version
+        target = latest - 10
+        await manager.rollback("main", to=target)
+        assert main.version == latest + 1
+        assert (await main.query("SELECT * FROM t"))["data"] == states[target][0]
+        assert (await main.query("SELECT * FROM t", as_of=latest))["data"] == states[latest][0]
+
+    asyncio.run(run())
+
+
+def test_max_versions_caps_history():
+    async def run():
+        manager = BranchManager(max_versions=10)
+        main, states, _ = await _history(manager, 30)
+        latest = main.version
+        assert len(main.versions) == 10
+
+        # 保留 10 个历史版本，加上当前版本
+        oldest = latest - 10
+        assert (await main.query("SELECT * FROM t", as_of=oldest))["data"] == states[oldest][0]
+        result = await main.query("SELECT * FROM t", as_of=oldest - 1)
+        assert not result["success"]
+        with pytest.raises(ValueError):
+            main.version_at(oldest - 1)
+        with pytest.raises(ValueError):
+            await manager.rollback("main", to=oldest - 1)
+        with pytest.raises(ValueError):
+            main.version_at(datetime(2000, 1, 1))
+
+    asyncio.run(run())
+
+
+def test_history_survives_recovery(tmp_path):
+    async def run():
+        manager = BranchManager(log_dir=str(tmp_path), max_versions=20)
+        main, states, _ = await _history(manager, 15)
+        latest = main.version
+        manager.close()
+
+        for checkpoint in (False, True):
+            recovered = BranchManager(log_dir=str(tmp_path), max_versions=20)
+            branch = recovered.get_branch("main")
+            assert branch.version == latest
+            for seq in (latest, latest - 5):
+                assert (await branch.query("SELECT * FROM t", as_of=seq))["data"] == states[seq][0]
+            assert (await branch.query(SQL))["view"] == "v"
+            if checkpoint:
+                await recovered.checkpoint()
+            recovered.close()
+
+    asyncio.run(run())
@@ -0,0 +1,95 @@
+"""IVFFlatIndex：召回率、按租户过滤、删除、保存与加载"""
+
+import numpy as np
+import pytest
+
+pytest.importorskip("agenticx")
+
+from memory.vector_index import IVFFlatIndex
+
+
+DIM = 32
+
+
+def _clustered(rng, count, centers):
+    labels = rng.randint(0, len(centers), count)
+    return (centers[labels] + 0.6 * rng.randn(count, DIM)).astype(np.float32)
+
+
+def _exact_top(vectors, query, k):
+    normalized = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    return list(np.argsort(-(normalized @ (query / np.linalg.norm(query))))[:k])
+
+
+@pytest.fixture(scope="module")
+def data():
+    rng = np.random.RandomState(0)
+    centers = rng.randn(200, DIM).astype(np.float32)
+    vectors = _clustered(rng, 6000, centers)
+    queries = _clustered(rng, 100, centers)
+    index = IVFFlatIndex(DIM, train_threshold=2000)
+    for i, vector in enumerate(vectors):
+        index.add(f"k{i}", vector, tenant=f"t{i % 4}")
+    return vectors, queries, index
+
+
+def test_recall_against_exact_search(data):
+    vectors, queries, index = data
+    assert index.nlist > 1
+    recall = 0.0
+    for query in queries:
+        found = {key for key, _ in index.search(query, 5)}
+        recall += len(found & {f"k{i}" for i in _exact_top(vectors, query, 5)}) / 5
+    assert recall / len(queries) > 0.9
+
+    # 扫描全部列表时与精确检索一致
+    for query in queries[:10]:
+        result = index.search(query, 5, nprobe=index.nlist)
+        assert [key for key, _ in result] == [f"k{i}" for i in _exact_top(vectors, query, 5)]
+        assert [score for _, score in result] == sorted((score for _, score in result), reverse=True)
+
+
+def test_tenant_filter_and_min_score(data):
+    vectors, queries, index = data
+    for query in queries[:20]:
+        result = index.search(query, 5, tenant="t1")
+        assert len(result) == 5
+        assert all(int(key[1:]) % 4 == 1 for key, _ in result)
+    assert index.search(queries[0], 5, tenant="nobody") == []
+    assert all(score >= 0.9 for _, score in index.search(-vectors[1], 3, min_score=0.9))
+    with pytest.raises(ValueError):
+        index.search(np.ones(DIM + 1), 5)
+
+
+def test_remove_and_replace():
+    rng = np.random.RandomState(1)
+    vectors = rng.randn(3000, DIM).astype(np.float32)
+    index = IVFFlatIndex(DIM, train_threshold=1000)
+    for i, vector in enumerate(vectors):
+        index.add(i, vector)
+
+    for i in range(0, 3000, 2):
+        assert index.remove(i)
+    assert len(index) == 1500 and not index.remove(0) and 0 not in index
+    for i in (1, 501, 2999):
+        assert index.search(vectors[i], 1)[0][0] == i
+    assert all(key % 2 == 1 for key, _ in index.search(vectors[2], 20))
+
+    # 键已存在时替换向量
+    index.add(1, vectors[2])
+    assert len(index) == 1500
+    assert index.search(vectors[2], 1)[0][0] == 1
+
+
+def test_save_and_load(tmp_path, data):
+    vectors, queries, index = data
+    path = str(tmp_path / "index.pkl")
+    index.save(path)
+    loaded = IVFFlatIndex.load(path)
+
+    assert len(loaded) == len(index) and loaded.nlist == index.nlist
+    for query in queries[:20]:
+        assert loaded.search(query, 5) == index.search(query, 5)
+        assert loaded.search(query, 5, tenant="t2") == index.search(query, 5, tenant="t2")
+    loaded.add("new", -vectors[0])
+    assert loaded.search(-vectors[0], 1)[0][0] == "new"